@@ -0,0 +1,220 @@
+import hashlib
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, FloatField, Max, Q, Sum
+from django.db.models.functions import Cast, Coalesce, TruncDate
+
+from .grid import CORE_TEMP_MAX, CORE_TEMP_MIN
+from .models import ChecklistResponse, ProbeReading, ResponseItem
+from .sharding import each_deli_shard
+
+
+# (Temperature Analytics)
+# Core temperatures are stored one cell at a time in ResponseItem (and by the probes in
+# ProbeReading), which is fine for the grid but useless for spotting trends. Here every reading
+# in a date range is pulled in two queries per shard (just the day and the value, cast to a
+# float by the database), loaded into NumPy arrays, and the daily numbers are worked out for
+# all days at once with bincount, a single sort and cumulative sums instead of a Python loop
+# per day or per reading.
+# Reference: https://numpy.org/doc/stable/reference/generated/numpy.bincount.html
+
+# Bump this when the payload changes shape or meaning, so cached results from the old code are ignored
+ANALYTICS_FORMAT = 2
+
+# Longest range one request may ask for, and the rolling window limits
+MAX_RANGE_DAYS = 3 * 366
+MAX_WINDOW_DAYS = 90
+
+DAILY_FIELDS = [
+    "date", "count", "min", "max", "mean", "p50", "p95",
+    "out_of_range", "out_of_range_rate", "rolling_mean",
+]
+
+
+def _responses(deli_ids, start, end):
+    return ChecklistResponse.objects.filter(
+        deli_id__in=deli_ids,
+        completed_at__date__range=(start, end),
+        checklist__deleted_at__isnull=True,
+    )
+
+
+def _shard_readings(deli_ids, start, end, item_id, template_id):
+    # Every instance of a weekly or monthly checklist shares one response, so a reading is dated
+    # by the day its response was started (copied onto the cell as created_on) rather than through
+    # the instances, which would count it once per day of the period
+    readings = ResponseItem.objects.filter(
+        response__deli_id__in=deli_ids,
+        created_on__range=(start, end),
+        response__checklist__deleted_at__isnull=True,
+        template_field__name="core_temp",
+        template_field__field_type__in=("decimal", "number"),
+    ).filter(Q(answer_decimal__isnull=False) | Q(answer_number__isnull=False))
+    # Probe readings are mapped to the same cells, and count the day they were taken
+    probe_readings = ProbeReading.objects.filter(
+        deli_id__in=deli_ids,
+        taken_at__date__range=(start, end),
+        checklist_item__checklist__deleted_at__isnull=True,
+        template_field__name="core_temp",
+        template_field__field_type__in=("decimal", "number"),
+    )
+    if item_id is not None:
+        readings = readings.filter(checklist_item_id=item_id)
+        probe_readings = probe_readings.filter(checklist_item_id=item_id)
+    if template_id is not None:
+        readings = readings.filter(template_field__template_id=template_id)
+        probe_readings = probe_readings.filter(template_field__template_id=template_id)
+
+    return list(
+        readings.order_by()
+        .annotate(reading=Coalesce(Cast("answer_decimal", FloatField()), Cast("answer_number", FloatField())))
+        .values_list("created_on", "reading")
+    ) + list(
+        probe_readings.order_by()
+        .annotate(day=TruncDate("taken_at"), reading=Cast("value", FloatField()))
+        .values_list("day", "reading")
+    )
+
+
+# (Load Readings)
+# Returns two arrays of the same length: the day of each reading as a number of days after
+# `start`, and the reading itself.
+def load_readings(deli_ids, start, end, item_id=None, template_id=None):
+    days, values = [], []
+    first = start.toordinal()
+    for shard_deli_ids in each_deli_shard(deli_ids):
+        rows = _shard_readings(shard_deli_ids, start, end, item_id, template_id)
+        days.append(np.fromiter((day.toordinal() - first for day, _ in rows), dtype=np.int64, count=len(rows)))
+        values.append(np.fromiter((value for _, value in rows), dtype=np.float64, count=len(rows)))
+    if not days:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    return np.concatenate(days), np.concatenate(values)
+
+
+def _rounded(values, present):
+    # NaN isn't valid JSON, so days without readings get None
+    return [value if keep else None for value, keep in zip(np.round(values, 2).tolist(), present.tolist())]
+
+
+# (Daily Statistics)
+# Everything is computed over the whole range at once:
+#   - counts, sums and out-of-range counts per day with np.bincount,
+#   - min, max and percentiles from one sort by (day, value): each day is then a contiguous
+#     slice, so its min is the first value, its max the last, and a percentile is an index
+#     (with linear interpolation, like np.percentile) into that slice,
+#   - the rolling mean over `window` calendar days from cumulative sums of the daily sums and
+#     counts, so days with more readings weigh more and empty days don't drag it to zero.
+def daily_temperature_stats(days, values, start, end, window):
+    day_count = (end - start).days + 1
+    counts = np.bincount(days, minlength=day_count)
+    sums = np.bincount(days, weights=values, minlength=day_count)
+    out_of_range = (values < CORE_TEMP_MIN) | (values > CORE_TEMP_MAX)
+    out_counts = np.bincount(days, weights=out_of_range, minlength=day_count)
+
+    present = counts > 0
+    safe_counts = np.maximum(counts, 1)
+    order = np.lexsort((values, days))
+    ordered = values[order] if len(values) else np.zeros(1)
+    # Empty days point at a real position too (their values are replaced by None anyway)
+    firsts = np.minimum(np.concatenate(([0], np.cumsum(counts)[:-1])), len(ordered) - 1)
+    lasts = np.clip(firsts + counts - 1, 0, len(ordered) - 1)
+
+    def percentile(q):
+        position = firsts + q * (safe_counts - 1)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, lasts)
+        return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+    window_sums = np.concatenate(([0.0], np.cumsum(sums)))
+    window_counts = np.concatenate(([0], np.cumsum(counts)))
+    ends = np.arange(1, day_count + 1)
+    starts = np.maximum(ends - window, 0)
+    rolling_counts = window_counts[ends] - window_counts[starts]
+    rolling_mean = (window_sums[ends] - window_sums[starts]) / np.maximum(rolling_counts, 1)
+
+    dates = np.arange(np.datetime64(start, "D"), np.datetime64(end, "D") + 1).astype(str).tolist()
+    columns = [
+        dates,
+        counts.tolist(),
+        _rounded(ordered[firsts], present),
+        _rounded(ordered[lasts], present),
+        _rounded(sums / safe_counts, present),
+        _rounded(percentile(0.5), present),
+        _rounded(percentile(0.95), present),
+        out_counts.astype(np.int64).tolist(),
+        _rounded(out_counts / safe_counts, present),
+        _rounded(rolling_mean, rolling_counts > 0),
+    ]
+
+    summary = {"count": int(len(values)), "out_of_range": int(out_of_range.sum())}
+    if len(values):
+        p5, p50, p95 = np.percentile(values, [5, 50, 95]).round(2).tolist()
+        summary.update({
+            "min": round(float(values.min()), 2),
+            "max": round(float(values.max()), 2),
+            "mean": round(float(values.mean()), 2),
+            "p5": p5,
+            "p50": p50,
+            "p95": p95,
+            "out_of_range_rate": round(summary["out_of_range"] / len(values), 3),
+        })
+
+    return summary, [list(row) for row in zip(*columns)]
+
+
+def temperature_analytics_payload(deli_ids, start, end, item_id=None, template_id=None, window=7):
+    days, values = load_readings(deli_ids, start, end, item_id, template_id)
+    summary, rows = daily_temperature_stats(days, values, start, end, window)
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "window": window,
+        "safe_range": [CORE_TEMP_MIN, CORE_TEMP_MAX],
+        "summary": summary,
+        "fields": DAILY_FIELDS,
+        "rows": rows,
+    }
+
+
+# (Data Version)
+# Every saved cell bumps its response's version, so the sum of the versions of the responses
+# in the range (with how many there are and when one last changed) moves whenever a reading
+# in it could have. That is one aggregate over the responses, without touching ResponseItem.
+# Probe readings are only ever added or purged, so their count and latest arrival do the same.
+def readings_version(deli_ids, start, end):
+    parts = []
+    for shard_deli_ids in each_deli_shard(deli_ids):
+        stamp = _responses(shard_deli_ids, start, end).aggregate(
+            responses=Count("pk"),
+            versions=Sum("version"),
+            changed=Max("updated_at"),
+        )
+        probes = ProbeReading.objects.filter(
+            deli_id__in=shard_deli_ids, taken_at__date__range=(start, end),
+        ).aggregate(readings=Count("pk"), received=Max("received_at"))
+        parts.append((
+            stamp["responses"], stamp["versions"], stamp["changed"], probes["readings"], probes["received"],
+        ))
+    return repr(sorted(parts, key=repr))
+
+
+# (Cached Analytics)
+# The key is the filters plus the data version, so a new reading is seen on the next request
+# and the timeout only decides how long unused results stay in the cache.
+def cached_temperature_analytics(deli_ids, start, end, item_id=None, template_id=None, window=7):
+    timeout = settings.TEMPERATURE_ANALYTICS_CACHE_SECONDS
+    if timeout <= 0:
+        return temperature_analytics_payload(deli_ids, start, end, item_id, template_id, window)
+
+    filters = (ANALYTICS_FORMAT, sorted(deli_ids), start, end, item_id, template_id, window)
+    version = readings_version(deli_ids, start, end)
+    digest = hashlib.md5(repr((filters, version)).encode(), usedforsecurity=False).hexdigest()
+    key = f"temperature-analytics:{digest}"
+
+    payload = cache.get(key)
+    if payload is None:
+        payload = temperature_analytics_payload(deli_ids, start, end, item_id, template_id, window)
+        cache.set(key, payload, timeout)
+    return payload
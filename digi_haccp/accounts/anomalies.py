@@ -0,0 +1,235 @@
+import logging
+from datetime import date, timedelta
+
+import numpy as np
+from django.db.models import Avg, FloatField, Min, Q
+from django.db.models.functions import Cast, Coalesce, Least, TruncDate
+
+from .models import ChecklistInstance, ChecklistItem, Deli, ProbeReading, ReadingAnomaly, ResponseItem
+from .sharding import shard_atomic, using_deli_shard
+
+logger = logging.getLogger(__name__)
+
+
+# (Reading Anomalies)
+# Looks for fridges and hot-holds drifting before they fail an inspection. Every numeric
+# answer (decimal and whole number fields) belongs to a series: one item's field at one deli,
+# one reading per day (a probe's readings on that cell count as one, their daily mean). Each deli's readings are loaded with one query into NumPy arrays,
+# sorted so every series is a contiguous run, and scored for all series at once:
+#   - spike: the reading is Z_THRESHOLD standard deviations away from the series' previous
+#     WINDOW readings (a rolling z-score, from cumulative sums that restart at each series),
+#   - drift: an EWMA of the readings has moved away from an older baseline (the WINDOW readings
+#     before the last DRIFT_LAG) by more than EWMA_THRESHOLD times its own standard error (an
+#     EWMA control chart), which catches small shifts that last for days and never make a
+#     single reading stand out,
+#   - gap: GAP_DAYS or more days in a row with no reading, between two readings or up to
+#     yesterday for an item that is still in use.
+# Reference: https://www.itl.nist.gov/div898/handbook/pmc/section3/pmc324.htm
+#
+# It is incremental: Deli.anomalies_scanned_through is the last day whose instances are all
+# closed (so none of its readings can change). A run rescores the days after it, loading
+# LOOKBACK_DAYS before them as history, and replaces the anomalies it had stored for those days.
+
+WINDOW = 14            # previous readings the baseline is taken from
+MIN_READINGS = 5       # no score until a series has this many readings in its baseline
+MIN_STD = 0.5          # a very steady series doesn't turn a 0.1 degree change into a spike
+Z_THRESHOLD = 3.5
+EWMA_ALPHA = 0.3
+EWMA_THRESHOLD = 3.0
+DRIFT_LAG = 7          # the drift baseline ends this many readings back, so a shift isn't in it yet
+GAP_DAYS = 2
+LOOKBACK_DAYS = 60
+
+
+def _deli_readings(deli_id, start, end):
+    # One row per answer, dated by the day its response was started: the instances of a weekly
+    # or monthly checklist all share one response, and going through them would repeat the answer
+    # once per day of the period
+    rows = list(
+        ResponseItem.objects.filter(
+            response__deli_id=deli_id,
+            created_on__range=(start, end),
+            response__checklist__deleted_at__isnull=True,
+            template_field__field_type__in=("decimal", "number"),
+        )
+        .filter(Q(answer_decimal__isnull=False) | Q(answer_number__isnull=False))
+        .order_by()
+        .annotate(reading=Coalesce(Cast("answer_decimal", FloatField()), Cast("answer_number", FloatField())))
+        .values_list("checklist_item_id", "template_field_id", "created_on", "reading")
+    )
+    # A probe reports many times a day, so its cell gets the day's mean as its one reading,
+    # on the days nobody typed one in
+    typed = {row[:3] for row in rows}
+    rows += [
+        row for row in ProbeReading.objects.filter(
+            deli_id=deli_id,
+            taken_at__date__range=(start, end),
+            checklist_item__checklist__deleted_at__isnull=True,
+        )
+        .order_by()
+        .values_list("checklist_item_id", "template_field_id", TruncDate("taken_at"))
+        .annotate(reading=Avg(Cast("value", FloatField())))
+        if row[:3] not in typed
+    ]
+    count = len(rows)
+    items = np.fromiter((row[0] for row in rows), dtype=np.int64, count=count)
+    fields = np.fromiter((row[1] for row in rows), dtype=np.int64, count=count)
+    days = np.fromiter((row[2].toordinal() for row in rows), dtype=np.int64, count=count)
+    values = np.fromiter((row[3] for row in rows), dtype=np.float64, count=count)
+
+    order = np.lexsort((days, fields, items))
+    return items[order], fields[order], days[order], values[order]
+
+
+# (Series Starts)
+# For every reading, the index of the first reading of its series
+def _series_starts(items, fields):
+    index = np.arange(len(items))
+    first = np.ones(len(items), dtype=bool)
+    first[1:] = (items[1:] != items[:-1]) | (fields[1:] != fields[:-1])
+    return np.maximum.accumulate(np.where(first, index, 0)), first
+
+
+# (Baseline)
+# Mean and standard deviation of the WINDOW readings that end `lag` readings before each one,
+# in its own series, from running sums: sum(x) and sum(x²) over a slice are two subtractions.
+def _baseline(values, starts, lag=0):
+    index = np.arange(len(values))
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    squares = np.concatenate(([0.0], np.cumsum(values * values)))
+    high = np.maximum(starts, index - lag)
+    low = np.maximum(starts, high - WINDOW)
+    count = high - low
+
+    total = sums[high] - sums[low]
+    mean = total / np.maximum(count, 1)
+    variance = (squares[high] - squares[low] - total * mean) / np.maximum(count - 1, 1)
+    std = np.maximum(np.sqrt(np.maximum(variance, 0.0)), MIN_STD)
+    return mean, std, count >= MIN_READINGS
+
+
+# (EWMA)
+# An EWMA has to be worked out one step at a time, so the series are laid out as the rows of a
+# matrix (one column per position in the series) and the loop runs over the columns: each
+# step updates every series at once, and there are only as many steps as the longest series.
+def _ewma(values, starts, first):
+    position = np.arange(len(values)) - starts
+    row = np.cumsum(first) - 1
+    matrix = np.full((int(first.sum()), int(position.max()) + 1), np.nan)
+    matrix[row, position] = values
+
+    smoothed = np.empty_like(matrix)
+    smoothed[:, 0] = matrix[:, 0]
+    for column in range(1, matrix.shape[1]):
+        smoothed[:, column] = EWMA_ALPHA * matrix[:, column] + (1 - EWMA_ALPHA) * smoothed[:, column - 1]
+    return smoothed[row, position]
+
+
+def score_readings(items, fields, days, values, score_from, yesterday, active_items):
+    """Returns a list of ReadingAnomaly field dicts dated score_from or later."""
+    if not len(values):
+        return []
+
+    starts, first = _series_starts(items, fields)
+    in_range = days >= score_from
+
+    mean, std, enough = _baseline(values, starts)
+    spike = (values - mean) / std
+    is_spike = enough & (np.abs(spike) >= Z_THRESHOLD)
+    spikes = in_range & is_spike
+
+    # A one-off spike would drag the EWMA along for days, so it goes into the EWMA as the
+    # baseline instead, and only a run of off readings makes a drift
+    drift_mean, drift_std, drift_enough = _baseline(values, starts, DRIFT_LAG)
+    ewma = _ewma(np.where(is_spike, mean, values), starts, first)
+    drift = (ewma - drift_mean) / (drift_std * np.sqrt(EWMA_ALPHA / (2 - EWMA_ALPHA)))
+    drifts = in_range & drift_enough & (np.abs(drift) >= EWMA_THRESHOLD) & ~spikes
+
+    found = []
+    for kind, scores, expected, flagged in (
+        (ReadingAnomaly.KIND_SPIKE, spike, mean, spikes),
+        (ReadingAnomaly.KIND_DRIFT, drift, drift_mean, drifts),
+    ):
+        for at in np.flatnonzero(flagged).tolist():
+            found.append({
+                "checklist_item_id": int(items[at]), "template_field_id": int(fields[at]),
+                "date": date.fromordinal(int(days[at])), "kind": kind,
+                "value": float(values[at]), "expected": round(float(expected[at]), 2),
+                "score": round(float(scores[at]), 2),
+            })
+
+    # Gaps: the days between one reading and the next in the same series, and after the last
+    # reading of items that are still in use. A gap is dated the day it reached GAP_DAYS, so it
+    # keeps its date (and its row) whether it is still going or has since been closed.
+    last = np.ones(len(values), dtype=bool)
+    last[:-1] = first[1:]
+    next_day = np.where(last, yesterday + 1, np.roll(days, -1))
+    missing = next_day - days - 1
+    retired = last & ~np.isin(items, active_items)
+    flagged = (missing >= GAP_DAYS) & ~retired & (days + GAP_DAYS >= score_from)
+    for at in np.flatnonzero(flagged).tolist():
+        found.append({
+            "checklist_item_id": int(items[at]), "template_field_id": int(fields[at]),
+            "date": date.fromordinal(int(days[at]) + GAP_DAYS), "kind": ReadingAnomaly.KIND_GAP,
+            "value": None, "expected": None, "score": float(missing[at]),
+        })
+    return found
+
+
+# (Scan Deli)
+# Scores one deli's readings after its watermark, on its own shard, and moves the watermark
+# up to the last day that can't change any more. Safe to run again: the anomalies for the
+# rescored days are replaced, not added to.
+def scan_deli(deli_id, today=None, lookback_days=LOOKBACK_DAYS):
+    today = today or date.today()
+    yesterday = today - timedelta(days=1)
+    deli = Deli.objects.get(pk=deli_id)
+    scanned_through = deli.anomalies_scanned_through
+    score_from = scanned_through + timedelta(days=1) if scanned_through else today - timedelta(days=lookback_days)
+    if score_from > today:
+        return 0
+
+    with using_deli_shard(deli):
+        items, fields, days, values = _deli_readings(deli_id, score_from - timedelta(days=lookback_days), today)
+        active_items = list(ChecklistItem.objects.filter(
+            checklist__deli_id=deli_id, checklist__is_active=True, checklist__deleted_at__isnull=True,
+        ).values_list("pk", flat=True))
+        found = score_readings(
+            items, fields, days, values, score_from.toordinal(), yesterday.toordinal(), active_items,
+        )
+
+        with shard_atomic():
+            ReadingAnomaly.objects.filter(deli_id=deli_id, date__gte=score_from).delete()
+            ReadingAnomaly.objects.bulk_create([ReadingAnomaly(deli_id=deli_id, **anomaly) for anomaly in found])
+
+        # An open instance can still change the answers of its response, which are dated by the
+        # day the response was started, so that day counts as open too
+        first_open = ChecklistInstance.objects.filter(
+            deli_id=deli_id, is_locked=False, date__gte=score_from,
+        ).aggregate(first=Min(Least("date", Coalesce(TruncDate("response__completed_at"), "date"))))["first"]
+
+    # Days before the first open instance (and before today) are final
+    final = min(first_open - timedelta(days=1), yesterday) if first_open else yesterday
+    if scanned_through is None or final > scanned_through:
+        Deli.objects.filter(pk=deli_id).update(anomalies_scanned_through=final)
+
+    logger.info("Scored deli %s from %s: %s anomalies", deli_id, score_from, len(found))
+    return len(found)
+
+
+# Every deli (or the given ones), one after the other so only one deli's readings are in memory.
+# `on_progress(done, total)` is called after each deli.
+def scan_delis(deli_ids=None, rescan=False, lookback_days=LOOKBACK_DAYS, on_progress=None):
+    delis = Deli.objects.order_by("pk")
+    if deli_ids:
+        delis = delis.filter(pk__in=deli_ids)
+    deli_ids = list(delis.values_list("pk", flat=True))
+    if rescan:
+        Deli.objects.filter(pk__in=deli_ids).update(anomalies_scanned_through=None)
+
+    found = 0
+    for done, deli_id in enumerate(deli_ids, start=1):
+        found += scan_deli(deli_id, lookback_days=lookback_days)
+        if on_progress:
+            on_progress(done, len(deli_ids))
+    return {"delis": len(deli_ids), "anomalies": found}
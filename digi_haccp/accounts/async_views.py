@@ -0,0 +1,154 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404
+
+from .grid import (
+    CellValidationError,
+    checklist_preview_payload,
+    save_cell,
+)
+from .db_router import replica_reads
+from .fast_json import FastJsonResponse
+from .http_cache import checklist_preview_stamp, conditional_grid, instance_detail_stamp
+from .live_sync import achanges_since, aevent_stream, last_event_version
+from .offline import parse_edited_at, save_field_result
+from .sharding import keep_shard, row_shard_view
+from .throttle import rate_limit
+from .snapshots import instance_detail_payload, instance_response_queryset, snapshot_detail_payload
+from .models import (
+    Checklist,
+    ChecklistInstance,
+    ChecklistItem,
+    ChecklistResponse,
+    ResponseItem,
+    TemplateField,
+)
+
+
+# (Async Grid Endpoints)
+# These are async versions of the three hot JSON endpoints in views.py,
+# plus the live sync stream and delta endpoint the grids poll.
+# They are only wired up in urls.py when the app runs in ASGI mode (ASGI_MODE=True),
+# where a slow query only parks a coroutine instead of blocking a whole worker thread.
+# Every other view keeps running as a normal sync view through Django's sync adapter.
+# Reference: https://docs.djangoproject.com/en/5.2/topics/async/#queries-the-orm
+
+
+# Async version of api_get_checklist_data
+@conditional_grid(checklist_preview_stamp)
+async def api_get_checklist_data(request, pk):
+    checklist = await aget_object_or_404(Checklist.objects.select_related("template", "deli"), pk=pk)
+    template_fields = [field async for field in checklist.template.fields.order_by("order")]
+    items = [item async for item in checklist.items.order_by("order")]
+
+    return FastJsonResponse(checklist_preview_payload(checklist, template_fields, items))
+
+
+# Async version of api_save_field
+@login_required
+@rate_limit("save")
+@row_shard_view(ChecklistResponse, "response_id")
+async def api_save_field(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid method"}, status=405)
+
+    user = await request.auser()
+
+    response_id = request.POST.get("response_id")
+    item_id = request.POST.get("item_id")
+    field_name = request.POST.get("field")
+    value = request.POST.get("value")
+
+    response = await aget_object_or_404(ChecklistResponse.objects.select_related("checklist"), id=response_id)
+    item = await aget_object_or_404(ChecklistItem, id=item_id)
+    template_field = await aget_object_or_404(
+        TemplateField,
+        template_id=response.checklist.template_id,
+        name=field_name
+    )
+
+    answer = await ResponseItem.objects.aget(
+        response=response,
+        checklist_item=item,
+        template_field=template_field
+    )
+
+    # The write needs a transaction, which the async ORM can't do, so it is one sync hop
+    try:
+        status = await sync_to_async(save_cell)(
+            answer,
+            template_field,
+            response,
+            user,
+            value,
+            edited_at=parse_edited_at(request.POST.get("edited_at")),
+            idempotency_key=request.POST.get("idempotency_key") or None,
+        )
+    except CellValidationError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+
+    return JsonResponse(save_field_result(status, template_field, answer))
+
+
+# Async version of api_manager_instance_detail
+@login_required
+@replica_reads
+@row_shard_view(ChecklistInstance, "instance_id")
+@conditional_grid(instance_detail_stamp)
+async def api_manager_instance_detail(request, instance_id):
+    instance = await aget_object_or_404(
+        ChecklistInstance.objects.select_related("checklist__template"),
+        id=instance_id,
+        checklist__deleted_at__isnull=True,
+    )
+
+    # Closed instances never touch the answers table
+    if instance.is_locked and instance.snapshot is not None:
+        return FastJsonResponse(snapshot_detail_payload(instance.snapshot))
+
+    # The live payload is the same builder the sync view uses, in one sync hop
+    response = await instance_response_queryset(instance).afirst()
+    return FastJsonResponse(await sync_to_async(instance_detail_payload)(instance, response))
+
+
+# Async version of api_response_changes
+@login_required
+@row_shard_view(ChecklistResponse, "response_id")
+async def api_response_changes(request, response_id):
+    user = await request.auser()
+    response = await aget_object_or_404(ChecklistResponse, id=response_id)
+
+    if not await user.delis.filter(pk=response.deli_id).aexists():
+        return JsonResponse({"error": "Not allowed"}, status=403)
+
+    since = last_event_version(request)
+    if since is None:
+        return JsonResponse({"error": "Pass the version you already have as ?since=N"}, status=400)
+
+    if since >= response.version:
+        return HttpResponseNotModified()
+
+    return JsonResponse({
+        "version": response.version,
+        "changes": await achanges_since(response.id, since, detail=request.GET.get("grid") == "detail"),
+    })
+
+
+# Async version of api_response_events
+@login_required
+@row_shard_view(ChecklistResponse, "response_id")
+async def api_response_events(request, response_id):
+    user = await request.auser()
+    response = await aget_object_or_404(ChecklistResponse, id=response_id)
+
+    if not await user.delis.filter(pk=response.deli_id).aexists():
+        return JsonResponse({"error": "Not allowed"}, status=403)
+
+    stream = StreamingHttpResponse(
+        keep_shard(aevent_stream(response.id, last_event_version(request))),
+        content_type="text/event-stream",
+    )
+    stream["Cache-Control"] = "no-cache"
+    stream["X-Accel-Buffering"] = "no"
+    return stream
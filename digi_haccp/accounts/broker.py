@@ -0,0 +1,173 @@
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+# (Live Sync Brokers)
+# A broker passes small "this cell changed" messages from whoever saved a cell to every
+# open fill grid that is listening on the same ChecklistResponse.
+# The backend is chosen with the LIVE_SYNC_BROKER setting:
+#   - InProcessBroker: messages only reach listeners in the same process. Good for
+#     development and single-worker deployments.
+#   - PostgresBroker: messages go through PostgreSQL LISTEN/NOTIFY so every worker on
+#     every machine sees them, with no extra service to run.
+# Reference: https://www.postgresql.org/docs/current/sql-notify.html
+
+
+# (Subscription)
+# One open grid = one subscription. It works from normal threads (sync views) and from
+# an event loop (async views), because the broker delivers from whatever thread published.
+class Subscription:
+    def __init__(self, broker, channel, loop=None):
+        self.broker = broker
+        self.channel = channel
+        self.loop = loop
+        self.queue = asyncio.Queue() if loop else queue.Queue()
+
+    def deliver(self, message):
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, message)
+        else:
+            self.queue.put_nowait(message)
+
+    # Waits for the next message, or returns None after `timeout` seconds
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    async def aget(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, channel, loop=None):
+        subscription = Subscription(self, channel, loop=loop)
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            listeners = self._subscriptions.get(subscription.channel)
+            if listeners:
+                listeners.discard(subscription)
+                if not listeners:
+                    del self._subscriptions[subscription.channel]
+
+    def publish(self, channel, message):
+        self._deliver(channel, message)
+
+    def _deliver(self, channel, message):
+        with self._lock:
+            listeners = list(self._subscriptions.get(channel, ()))
+        for subscription in listeners:
+            subscription.deliver(message)
+
+
+class PostgresBroker(InProcessBroker):
+    # Every process LISTENs on one Postgres channel and fans messages out to its own
+    # subscribers, so I only need one extra database connection per worker process.
+    PG_CHANNEL = "digi_haccp_live_sync"
+
+    # NOTIFY payloads must be under 8000 bytes. Bigger messages are sent without the
+    # value and the listening grid reloads that change from the database instead.
+    MAX_PAYLOAD_BYTES = 7500
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+        self._listener_lock = threading.Lock()
+
+    def subscribe(self, channel, loop=None):
+        self._ensure_listener()
+        return super().subscribe(channel, loop=loop)
+
+    def publish(self, channel, message):
+        payload = json.dumps({"channel": channel, "message": message})
+        if len(payload.encode()) > self.MAX_PAYLOAD_BYTES:
+            trimmed = {key: value for key, value in message.items() if key != "value"}
+            payload = json.dumps({"channel": channel, "message": trimmed})
+
+        # The listener thread in this process receives its own notification too,
+        # so I don't deliver locally here.
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [self.PG_CHANNEL, payload])
+
+    def _ensure_listener(self):
+        with self._listener_lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen_forever, name="live-sync-listener", daemon=True)
+                self._listener.start()
+
+    def _listen_forever(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("Live sync listener lost its Postgres connection, reconnecting")
+                time.sleep(2)
+
+    def _listen(self):
+        import select
+
+        import psycopg2
+        from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+        db = settings.DATABASES["default"]
+        pg = psycopg2.connect(
+            dbname=db["NAME"],
+            user=db["USER"],
+            password=db["PASSWORD"],
+            host=db["HOST"],
+            port=db["PORT"],
+        )
+        try:
+            pg.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with pg.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.PG_CHANNEL}")
+
+            while True:
+                # select() lets me sleep until Postgres has something for me
+                if select.select([pg], [], [], 30) == ([], [], []):
+                    continue
+                pg.poll()
+                while pg.notifies:
+                    notify = pg.notifies.pop(0)
+                    data = json.loads(notify.payload)
+                    self._deliver(data["channel"], data["message"])
+        finally:
+            pg.close()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+# I keep one broker per process, created from the LIVE_SYNC_BROKER setting the first time it's needed
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.LIVE_SYNC_BROKER)()
+        return _broker
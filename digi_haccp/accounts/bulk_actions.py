@@ -0,0 +1,16 @@
+from .models import Checklist
+
+
+# (Bulk Checklist Actions)
+# The combined checklists page can act on many ticked checklists at once.
+# Access is part of the query itself: every statement only matches checklists whose deli
+# the manager is assigned to, so ids for other delis are silently left alone.
+
+
+def scoped_checklists(user, ids):
+    return Checklist.objects.filter(pk__in=ids, deli__users=user)
+
+
+# One UPDATE for the whole selection. Returns how many checklists changed.
+def set_checklists_active(user, ids, is_active):
+    return scoped_checklists(user, ids).exclude(is_active=is_active).update(is_active=is_active)
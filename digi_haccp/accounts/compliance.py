@@ -0,0 +1,223 @@
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.db.models import Count, F
+from django.utils.timezone import localdate
+
+from .grid import out_of_range_cells_q
+from .models import ChecklistInstance, ComplianceRollup, ResponseItem
+from .sharding import each_deli_shard, shard_atomic
+
+
+# (Compliance Rollups)
+# Weekly and monthly completion numbers per deli and template, kept in ComplianceRollup.
+# close_instance() adds every instance as it is locked (record_closed_instance), and the
+# rebuild_compliance command recomputes whole delis from the closed instances.
+# Both use instance_outcome() so they always agree on what "completed" and "late" mean.
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def period_starts(day):
+    return {
+        ComplianceRollup.PERIOD_WEEK: week_start(day),
+        ComplianceRollup.PERIOD_MONTH: month_start(day),
+    }
+
+
+def period_end(period, start):
+    if period == ComplianceRollup.PERIOD_WEEK:
+        return start + timedelta(days=6)
+    return month_start(start + timedelta(days=31)) - timedelta(days=1)
+
+
+# (Instance Outcome)
+# Completed: the response has cells and none of the required ones are empty.
+# Late: completed, but the last edit was made after the instance's day.
+def instance_outcome(instance_date, total_cells, required_missing, last_activity_at):
+    completed = bool(total_cells) and required_missing == 0
+    late = completed and last_activity_at is not None and localdate(last_activity_at) > instance_date
+    return completed, late
+
+
+def out_of_range_counts(response_ids):
+    return dict(
+        ResponseItem.objects.filter(response_id__in=response_ids)
+        .filter(out_of_range_cells_q())
+        .values("response_id")
+        .annotate(count=Count("id"))
+        .values_list("response_id", "count")
+    )
+
+
+# (Record Closed Instance)
+# Called inside close_instance's transaction, so the rollup moves together with the lock.
+# Every day's instance of a weekly or monthly checklist can share one response, so a
+# response's out-of-range cells are counted once per period: the period's count is taken
+# again from the distinct responses of its closed instances (this one included) instead of
+# being added to.
+def record_closed_instance(instance, response):
+    if response is None:
+        completed, late = False, False
+    else:
+        completed, late = instance_outcome(
+            instance.date, response.total_cells, response.required_missing, response.last_activity_at
+        )
+
+    for period, start in period_starts(instance.date).items():
+        rollup, _ = ComplianceRollup.objects.get_or_create(
+            deli_id=instance.deli_id,
+            template_id=instance.checklist.template_id,
+            period=period,
+            period_start=start,
+        )
+        # The row lock makes a second close job for the same period wait, so the count it
+        # takes below sees this instance
+        ComplianceRollup.objects.select_for_update().filter(pk=rollup.pk).first()
+        closed_responses = ChecklistInstance.objects.filter(
+            deli_id=instance.deli_id,
+            checklist__template_id=instance.checklist.template_id,
+            date__range=(start, period_end(period, start)),
+            is_locked=True,
+            response__isnull=False,
+        ).values("response_id")
+        out_of_range = ResponseItem.objects.filter(response_id__in=closed_responses).filter(out_of_range_cells_q()).count()
+
+        # F() so two close jobs adding to the same period don't overwrite each other
+        ComplianceRollup.objects.filter(pk=rollup.pk).update(
+            due=F("due") + 1,
+            completed=F("completed") + int(completed),
+            late=F("late") + int(late),
+            out_of_range=out_of_range,
+        )
+
+
+# (Rebuild Delis)
+# Recomputes every rollup row for the given delis from their closed instances, reading and
+# swapping them in one transaction per shard. The rebuild command runs several of these at once.
+def rebuild_delis(deli_ids):
+    return sum(_rebuild_shard_delis(shard_deli_ids) for shard_deli_ids in each_deli_shard(deli_ids))
+
+
+def _rebuild_shard_delis(deli_ids):
+    with shard_atomic():
+        # A close job running meanwhile holds its instance's row lock until it has added to the
+        # rollups. Taking the locks of the delis' open instances first waits for those closes to
+        # commit (so they are read below) and makes later ones wait until the new rows are in.
+        list(
+            ChecklistInstance.objects.select_for_update()
+            .filter(deli_id__in=deli_ids, is_locked=False).values_list("pk", flat=True)
+        )
+        instances = list(
+            ChecklistInstance.objects.filter(deli_id__in=deli_ids, is_locked=True).values(
+                "deli_id",
+                "date",
+                "response_id",
+                template_id=F("checklist__template_id"),
+                total_cells=F("response__total_cells"),
+                required_missing=F("response__required_missing"),
+                last_activity_at=F("response__last_activity_at"),
+            )
+        )
+        out_of_range = out_of_range_counts({row["response_id"] for row in instances if row["response_id"]})
+
+        totals = defaultdict(lambda: {"due": 0, "completed": 0, "late": 0, "out_of_range": 0})
+        counted = defaultdict(set)  # the responses whose out-of-range cells a period already has
+        for row in instances:
+            completed, late = instance_outcome(
+                row["date"], row["total_cells"], row["required_missing"] or 0, row["last_activity_at"]
+            )
+            for period, start in period_starts(row["date"]).items():
+                key = (row["deli_id"], row["template_id"], period, start)
+                counts = totals[key]
+                counts["due"] += 1
+                counts["completed"] += int(completed)
+                counts["late"] += int(late)
+                if row["response_id"] not in counted[key]:
+                    counted[key].add(row["response_id"])
+                    counts["out_of_range"] += out_of_range.get(row["response_id"], 0)
+
+        ComplianceRollup.objects.filter(deli_id__in=deli_ids).delete()
+        ComplianceRollup.objects.bulk_create([
+            ComplianceRollup(deli_id=deli_id, template_id=template_id, period=period, period_start=start, **counts)
+            for (deli_id, template_id, period, start), counts in totals.items()
+        ])
+
+    return len(totals)
+
+
+# (Heatmap Periods)
+# The starts of every week or month from `months` months ago up to today, oldest first.
+def heatmap_periods(period, months, today=None):
+    today = today or date.today()
+    first = month_start(today)
+    for _ in range(months - 1):
+        first = month_start(first - timedelta(days=1))
+
+    if period == ComplianceRollup.PERIOD_MONTH:
+        starts = []
+        while first <= today:
+            starts.append(first)
+            first = month_start(first + timedelta(days=31))
+        return starts
+
+    start = week_start(first)
+    return [start + timedelta(weeks=n) for n in range((today - start).days // 7 + 1)]
+
+
+# (Heatmap Payload)
+# One row per deli and template with a cell per period, read from the rollup table
+# in a single indexed query (one per shard when the delis are spread over several).
+def _heatmap_rollups(deli_ids, period, first_start, template_id):
+    for shard_deli_ids in each_deli_shard(deli_ids):
+        rollups = ComplianceRollup.objects.filter(
+            deli_id__in=shard_deli_ids,
+            period=period,
+            period_start__gte=first_start,
+        )
+        if template_id is not None:
+            rollups = rollups.filter(template_id=template_id)
+
+        yield from rollups.values(
+            "deli_id", "deli__deli_name", "template_id", "template__name",
+            "period_start", "due", "completed", "late", "out_of_range",
+        )
+
+
+def heatmap_payload(deli_ids, period, months, template_id=None):
+    periods = heatmap_periods(period, months)
+
+    column = {start: index for index, start in enumerate(periods)}
+    rows = {}
+    for rollup in _heatmap_rollups(deli_ids, period, periods[0], template_id):
+        key = (rollup["deli_id"], rollup["template_id"])
+        if key not in rows:
+            rows[key] = {
+                "deli_id": rollup["deli_id"],
+                "deli": rollup["deli__deli_name"],
+                "template_id": rollup["template_id"],
+                "template": rollup["template__name"],
+                "cells": [None] * len(periods),
+            }
+        index = column.get(rollup["period_start"])
+        if index is None:
+            continue
+        rows[key]["cells"][index] = {
+            "due": rollup["due"],
+            "completed": rollup["completed"],
+            "late": rollup["late"],
+            "out_of_range": rollup["out_of_range"],
+            "rate": round(rollup["completed"] / rollup["due"], 3) if rollup["due"] else None,
+        }
+
+    return {
+        "period": period,
+        "periods": [start.isoformat() for start in periods],
+        "rows": sorted(rows.values(), key=lambda row: (row["deli"], row["template"])),
+    }
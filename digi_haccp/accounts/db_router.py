@@ -0,0 +1,210 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from inspect import iscoroutinefunction
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+
+logger = logging.getLogger(__name__)
+
+
+# (Read Replica)
+# Staff cell saves and manager reporting share one PostgreSQL primary. When a `replica` database
+# is configured (DB_REPLICA_* settings), the read-only manager pages are sent to it instead:
+#   - views opt in with @replica_reads, every other query stays on the primary,
+#   - someone who has just saved something reads from the primary for REPLICA_PIN_SECONDS
+#     (read-your-writes, see ReplicaPinMiddleware),
+#   - if the replica can't be reached or is more than REPLICA_MAX_LAG_SECONDS behind,
+#     the pages quietly read from the primary until it recovers.
+# Reference: https://docs.djangoproject.com/en/5.2/topics/db/multi-db/#database-routers
+
+REPLICA_DB_ALIAS = "replica"
+PIN_COOKIE = "digihaccp_pin_primary"
+
+_use_replica = ContextVar("use_replica", default=False)
+_pinned = ContextVar("pinned_to_primary", default=False)
+
+_health_lock = threading.Lock()
+_health = {"checked_at": 0.0, "ok": False}
+
+
+def replica_configured():
+    return REPLICA_DB_ALIAS in settings.DATABASES
+
+
+# (Replica Health)
+# I check the replica at most every REPLICA_HEALTH_SECONDS per process and keep the answer,
+# so the router itself never has to touch the network.
+# On PostgreSQL the lag is how long ago the last replayed transaction was committed
+# (zero when the replica has replayed everything it received).
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+def replica_lag_seconds():
+    connection = connections[REPLICA_DB_ALIAS]
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(LAG_SQL)
+            return float(cursor.fetchone()[0] or 0)
+        # Anything else (a second local database while testing) has no lag to measure
+        cursor.execute("SELECT 1")
+        return 0.0
+
+
+def check_replica():
+    try:
+        lag = replica_lag_seconds()
+    except OperationalError as error:
+        logger.warning("Read replica unavailable, reading from the primary: %s", error)
+        connections[REPLICA_DB_ALIAS].close()
+        return False
+
+    if lag > settings.REPLICA_MAX_LAG_SECONDS:
+        logger.warning("Read replica is %.1fs behind, reading from the primary", lag)
+        return False
+    return True
+
+
+def replica_healthy(force=False):
+    if not replica_configured():
+        return False
+
+    with _health_lock:
+        if not force and time.monotonic() - _health["checked_at"] < settings.REPLICA_HEALTH_SECONDS:
+            return _health["ok"]
+        _health["checked_at"] = time.monotonic()
+
+    ok = check_replica()
+    _health["ok"] = ok
+    return ok
+
+
+def mark_replica_down():
+    with _health_lock:
+        _health["ok"] = False
+        _health["checked_at"] = time.monotonic()
+
+
+# (Router)
+# Listed in DATABASE_ROUTERS after the shard router, so it decides everything kept on the
+# primary. Writes, migrations and anything inside a transaction on the primary always use the
+# primary; a read only goes to the replica when the current view asked for it and nothing above
+# ruled it out. Other reads are sent to the primary by name, not left to follow a row that was
+# loaded from a shard.
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not _use_replica.get() or _pinned.get():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return REPLICA_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica is a copy of the primary, rows from either can point at each other
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+# (Replica Context)
+# For reads outside a view, like the PDF pack job: inside the block reads use the replica
+# when it's healthy. A failure part way through fails the job, and its retry re-checks.
+@contextmanager
+def replica_reads_block():
+    if not (replica_configured() and replica_healthy()):
+        yield
+        return
+
+    token = _use_replica.set(True)
+    try:
+        yield
+    except OperationalError:
+        mark_replica_down()
+        raise
+    finally:
+        _use_replica.reset(token)
+
+
+# (Replica Reads)
+# Decorator for read-only views. If the replica fails part way through (it went away after
+# the health check), the view is run again on the primary, which is safe because it only reads.
+def replica_reads(view):
+    def should_use_replica():
+        return replica_configured() and not _pinned.get() and replica_healthy()
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if not await sync_to_async(should_use_replica)():
+                return await view(request, *args, **kwargs)
+
+            token = _use_replica.set(True)
+            try:
+                return await view(request, *args, **kwargs)
+            except OperationalError:
+                mark_replica_down()
+                logger.warning("Read replica failed during %s, retrying on the primary", request.path)
+            finally:
+                _use_replica.reset(token)
+            return await view(request, *args, **kwargs)
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not should_use_replica():
+            return view(request, *args, **kwargs)
+
+        token = _use_replica.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        except OperationalError:
+            mark_replica_down()
+            logger.warning("Read replica failed during %s, retrying on the primary", request.path)
+        finally:
+            _use_replica.reset(token)
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+# (Read Your Writes)
+# After any POST/PUT/PATCH/DELETE the browser gets a short-lived cookie, and while it's there
+# that user's reads stay on the primary, so a manager who just changed something never sees the
+# old version from a replica that hasn't caught up yet. A cookie works across every gunicorn
+# worker without a shared cache or an extra write.
+class ReplicaPinMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _pinned.set(PIN_COOKIE in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            _pinned.reset(token)
+
+        if request.method not in ("GET", "HEAD", "OPTIONS", "TRACE") and replica_configured():
+            response.set_cookie(
+                PIN_COOKIE,
+                "1",
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
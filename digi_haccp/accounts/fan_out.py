@@ -0,0 +1,98 @@
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils.timezone import now
+
+from .models import Checklist, ChecklistItem
+
+
+# (Checklist Fan Out)
+# A chain runs the same checklist (say a Cleaning Record) in every deli. Instead of creating it
+# once per deli, one checklist is made and then copied to the other delis set-wise:
+# one bulk insert for the checklists and one for all of their items, in a single transaction.
+# Copies can stay linked to the checklist they came from (Checklist.master), and then
+# propagate_master_items() pushes later item edits on that master out to every copy.
+
+
+# (Create Copies)
+# Copies `master` (and its items) to each deli in `delis`. Delis that already have a linked
+# copy of this master, and the master's own deli, are skipped so a repeat clone adds nothing twice.
+# Returns the new checklists.
+def create_copies(master, delis, created_by, link=True, batch_size=1000):
+    existing_deli_ids = {master.deli_id}
+    if link:
+        existing_deli_ids.update(master.copies.values_list("deli_id", flat=True))
+    delis = [deli for deli in delis if deli.pk not in existing_deli_ids]
+    if not delis:
+        return []
+
+    master_items = list(master.items.order_by("order", "id"))
+
+    with transaction.atomic():
+        # bulk_create fills in the new primary keys on PostgreSQL (and SQLite 3.35+),
+        # which the item rows below need
+        copies = Checklist.objects.bulk_create([
+            Checklist(
+                template_id=master.template_id,
+                deli=deli,
+                created_by=created_by,
+                frequency=master.frequency,
+                title=master.title,
+                is_active=master.is_active,
+                master=master if link else None,
+            )
+            for deli in delis
+        ], batch_size=batch_size)
+
+        ChecklistItem.objects.bulk_create([
+            ChecklistItem(
+                checklist=copy,
+                name=item.name,
+                chemical_used=item.chemical_used,
+                order=item.order,
+                master_item=item if link else None,
+            )
+            for copy in copies
+            for item in master_items
+        ], batch_size=batch_size)
+
+    return copies
+
+
+# (Propagate Master Items)
+# Brings every linked copy in line with the master's items:
+#   - names, chemicals and order are copied over with one UPDATE per field set,
+#   - items added to the master since are bulk inserted into each copy.
+# Copy items whose master item is gone are left alone, their history still points at them.
+def propagate_master_items(master, batch_size=1000):
+    master_item = ChecklistItem.objects.filter(pk=OuterRef("master_item_id"))
+
+    with transaction.atomic():
+        updated = ChecklistItem.objects.filter(
+            checklist__master=master,
+            master_item__checklist=master,
+        ).update(
+            name=Subquery(master_item.values("name")[:1]),
+            chemical_used=Subquery(master_item.values("chemical_used")[:1]),
+            order=Subquery(master_item.values("order")[:1]),
+            updated_at=now(),  # update() skips auto_now
+        )
+
+        copy_ids = list(master.copies.values_list("id", flat=True))
+        linked = set(
+            ChecklistItem.objects.filter(checklist_id__in=copy_ids, master_item__isnull=False)
+            .values_list("checklist_id", "master_item_id")
+        )
+        added = ChecklistItem.objects.bulk_create([
+            ChecklistItem(
+                checklist_id=copy_id,
+                name=item.name,
+                chemical_used=item.chemical_used,
+                order=item.order,
+                master_item=item,
+            )
+            for item in master.items.all()
+            for copy_id in copy_ids
+            if (copy_id, item.pk) not in linked
+        ], batch_size=batch_size)
+
+    return {"copies": len(copy_ids), "updated": updated, "added": len(added)}
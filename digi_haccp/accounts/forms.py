@@ -1,6 +1,7 @@
 from django import forms
 from .models import Deli, User, ChecklistTemplate, Checklist, ChecklistItem
 from django.forms import inlineformset_factory
+from .item_import import IMPORT_EXTENSIONS
 
 
 # (Invite User To Deli Form)
@@ -71,10 +72,37 @@ class AssignDeliForm(forms.ModelForm):
             self.fields["delis"].queryset = Deli.objects.all().order_by("deli_name")
 
 
+# (Deli Fan Out Fields)
+# Shared by the create and clone forms: the extra delis a checklist should be copied to,
+# a shortcut for "all my delis", and whether the copies stay linked to the original.
+class DeliFanOutMixin(forms.Form):
+    copy_to_delis = forms.ModelMultipleChoiceField(
+        queryset=Deli.objects.none(),
+        required=False,
+        widget=forms.CheckboxSelectMultiple,
+    )
+    all_delis = forms.BooleanField(required=False, label="All my delis")
+    link_copies = forms.BooleanField(
+        required=False,
+        initial=True,
+        label="Keep copies linked, so item edits here update every deli",
+    )
+
+    def set_fan_out_delis(self, user):
+        if user and getattr(user, "role", None) == "manager":
+            self.fields["copy_to_delis"].queryset = user.delis.all().order_by("deli_name")
+
+    def fan_out_delis(self):
+        if self.cleaned_data.get("all_delis"):
+            return list(self.fields["copy_to_delis"].queryset)
+        return list(self.cleaned_data.get("copy_to_delis") or [])
+
+
 # (Checklist Form)
 # I created this form so managers can build a new checklist for a deli.
 # I added an extra field `items_bulk` so they can paste multiple checklist items at once.
-class ChecklistForm(forms.ModelForm):
+# The chosen deli gets the checklist itself, any delis ticked under copy_to_delis get copies.
+class ChecklistForm(DeliFanOutMixin, forms.ModelForm):
     items_bulk = forms.CharField(
         widget=forms.Textarea(attrs={
             "class": "textarea textarea-bordered w-full h-40",
@@ -84,6 +112,12 @@ class ChecklistForm(forms.ModelForm):
         help_text="Enter one item per line. Example: Chicken Fillet Tray 1"
     )
 
+    # A CSV/XLSX with name, chemical_used and order columns, for lists too long to paste
+    items_file = forms.FileField(
+        required=False,
+        widget=forms.ClearableFileInput(attrs={"accept": ".csv,.xlsx"}),
+    )
+
     class Meta:
         model = Checklist
         fields = ["template", "deli", "frequency", "title"]
@@ -96,6 +130,28 @@ class ChecklistForm(forms.ModelForm):
         # Restrict deli choices to manager-assigned delis
         if user and getattr(user, "role", None) == "manager":
             self.fields["deli"].queryset = user.delis.all().order_by("deli_name")
+        self.set_fan_out_delis(user)
+
+    def clean_items_file(self):
+        upload = self.cleaned_data.get("items_file")
+        if upload and not upload.name.lower().endswith(IMPORT_EXTENSIONS):
+            raise forms.ValidationError("Please upload a .csv or .xlsx file.")
+        return upload
+
+
+# (Clone Checklist Form)
+# Copies an existing checklist (with its items) to more delis.
+class CloneChecklistForm(DeliFanOutMixin):
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop("user", None)
+        super().__init__(*args, **kwargs)
+        self.set_fan_out_delis(user)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not self.errors and not self.fan_out_delis():
+            raise forms.ValidationError("Pick at least one deli to copy this checklist to.")
+        return cleaned_data
 
 
 # (Checklist Item Form)
@@ -104,9 +160,10 @@ class ChecklistForm(forms.ModelForm):
 class ChecklistItemForm(forms.ModelForm):
     class Meta:
         model = ChecklistItem
-        fields = ["name", "order"]
+        fields = ["name", "chemical_used", "order"]
         widgets = {
             "name": forms.TextInput(attrs={"class": "input input-bordered w-full"}),
+            "chemical_used": forms.TextInput(attrs={"class": "input input-bordered w-full"}),
             "order": forms.NumberInput(attrs={"class": "input input-bordered w-full"}),
         }
 
@@ -0,0 +1,404 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from django.utils.timezone import now, localdate
+
+from .models import ChecklistInstance, ChecklistResponse, ProcessedEdit, ResponseItem
+from .sharding import on_shard_commit, shard_atomic
+
+
+# This file holds the grid logic shared by the normal views and the async views.
+# Most helpers here don't decide *how* data is loaded, they only turn rows that were
+# already fetched into the JSON the AG Grid pages expect, or check a value a user typed.
+# The two that write (ensure_response_items and save_cell) are plain sync functions.
+
+
+# (Cell Validation Error)
+# I raise this when a value typed into the grid can't be saved. The message is shown to staff as is.
+class CellValidationError(Exception):
+    pass
+
+
+# Fields that are copied from the checklist item and can never be edited in the grid
+READ_ONLY_FIELDS = {"chemical_used"}
+
+
+# The safe range for a core temperature reading
+CORE_TEMP_MIN = 75
+CORE_TEMP_MAX = 100
+
+# The ResponseItem column each field type is stored in
+ANSWER_COLUMNS = {
+    "text": "answer_text",
+    "date": "answer_date",
+    "time": "answer_time",
+    "datetime": "answer_datetime",
+    "decimal": "answer_decimal",
+    "number": "answer_number",
+    "boolean": "answer_boolean",
+}
+
+
+# (Filled Cell)
+# A cell counts as filled once its answer column holds something (a ticked or unticked
+# checkbox counts, an empty text box doesn't). Read-only cells are never counted.
+def counts_towards_progress(field):
+    return field.name not in READ_ONLY_FIELDS and field.field_type in ANSWER_COLUMNS
+
+
+def is_filled_value(value):
+    return value is not None and value != ""
+
+
+def cell_is_filled(field, answer):
+    return is_filled_value(getattr(answer, ANSWER_COLUMNS[field.field_type]))
+
+
+# The same rule as a database filter, for rebuilding counters in bulk
+def filled_cells_q(prefix=""):
+    filled = Q()
+    for field_type, column in ANSWER_COLUMNS.items():
+        not_empty = Q(**{f"{prefix}{column}__isnull": False})
+        if field_type == "text":
+            not_empty &= ~Q(**{f"{prefix}{column}": ""})
+        filled |= Q(**{f"{prefix}template_field__field_type": field_type}) & not_empty
+    return filled
+
+
+# Cells holding a reading outside its safe range. The grid refuses these, but answers
+# that arrive another way (imports, older data) are still counted in compliance reports.
+def out_of_range_cells_q():
+    return Q(template_field__name="core_temp") & (
+        Q(answer_decimal__lt=CORE_TEMP_MIN) | Q(answer_decimal__gt=CORE_TEMP_MAX) |
+        Q(answer_number__lt=CORE_TEMP_MIN) | Q(answer_number__gt=CORE_TEMP_MAX)
+    )
+
+
+# (Answer JSON Value)
+# I convert a ResponseItem into a basic value that can be safely JSON-encoded for the fill page.
+def answer_json_value(field, answer):
+    value = None
+    if field.field_type == "text":
+        value = answer.answer_text
+    elif field.field_type == "date":
+        value = answer.answer_date.isoformat() if answer.answer_date else ""
+    elif field.field_type == "time":
+        value = answer.answer_time.strftime("%H:%M") if answer.answer_time else ""
+    elif field.field_type == "datetime":
+        value = answer.answer_datetime.isoformat() if answer.answer_datetime else ""
+    elif field.field_type == "decimal":
+        value = float(answer.answer_decimal) if answer.answer_decimal else ""
+    elif field.field_type == "number":
+        value = answer.answer_number if answer.answer_number is not None else ""
+    elif field.field_type == "boolean":
+        value = bool(answer.answer_boolean)
+    return value
+
+
+# (Fill Grid Value)
+# Read-only fields come from the checklist item, everything else from the answer.
+def fill_cell_value(field, item, answer):
+    if field.name == "chemical_used":
+        return item.chemical_used
+
+    if answer is None:
+        return ""
+
+    return answer_json_value(field, answer)
+
+
+# (Detail Grid Value)
+# For the manager detail grid I pick whichever of the answer fields is not None.
+# This works because only one of them should be used depending on field_type.
+def detail_cell_value(field, item, answer):
+    if field.name == "chemical_used":
+        return item.chemical_used
+
+    if answer is None:
+        return ""
+
+    return (
+        answer.answer_text or
+        answer.answer_date or
+        (answer.answer_time.strftime("%H:%M") if answer.answer_time else None) or
+        answer.answer_datetime or
+        answer.answer_decimal or
+        answer.answer_number or
+        answer.answer_boolean
+    )
+
+
+# (Fill Column Definitions)
+# A non-editable "Item" column first, then one column per template field that is
+# editable unless the instance is locked.
+def fill_column_defs(fields, locked):
+    col_defs = [{
+        "headerName": "Item",
+        "field": "item_name",
+        "editable": False,
+    }]
+    for field in fields:
+        col_defs.append({
+            "headerName": field.label,
+            "field": field.name,
+            "editable": not locked and field.name not in READ_ONLY_FIELDS,
+            "fieldType": field.field_type,
+        })
+    return col_defs
+
+
+# (Columnar Rows)
+# Grids go over the wire as the row field names once plus one list per row in that order,
+# instead of a dict per row that repeats every name (the layout closed-instance snapshots
+# already use). The pages turn the lists back into row objects (see grid_rows.html).
+def row_fields(fields):
+    return ["item_id", "item_name"] + [field.name for field in fields]
+
+
+def fill_rows(fields, items, answers):
+    """answers is a dict keyed by (checklist_item_id, template_field_id)."""
+    return [
+        [item.id, item.name] + [fill_cell_value(field, item, answers.get((item.id, field.id))) for field in fields]
+        for item in items
+    ]
+
+
+# (Detail Column Definitions)
+# One column for item name plus one read-only column for each template field.
+def detail_column_defs(fields):
+    col_defs = [{"headerName": "Item", "field": "item_name"}]
+    for field in fields:
+        col_defs.append({
+            "headerName": field.label,
+            "field": field.name,
+            "editable": False,
+        })
+    return col_defs
+
+
+def detail_rows(fields, items, answers):
+    return [
+        [item.id, item.name] + [detail_cell_value(field, item, answers.get((item.id, field.id))) for field in fields]
+        for item in items
+    ]
+
+
+# (Checklist Preview Data)
+# Column definitions plus one empty row per checklist item, used by api_get_checklist_data.
+def checklist_preview_payload(checklist, fields, items):
+    column_defs = [{"headerName": "Item Name", "field": "item_name"}]
+    for field in fields:
+        column_defs.append({
+            "headerName": field.label,
+            "field": field.name,
+        })
+
+    rows = [
+        [item.id, item.name] + [item.chemical_used if field.name == "chemical_used" else "" for field in fields]
+        for item in items
+    ]
+
+    return {
+        "title": checklist.title,
+        "template": checklist.template.name,
+        "deli": checklist.deli.deli_name,
+        "frequency": checklist.frequency,
+        "columnDefs": column_defs,
+        "fields": row_fields(fields),
+        "rows": rows,
+    }
+
+
+def answers_by_cell(answers):
+    return {(answer.checklist_item_id, answer.template_field_id): answer for answer in answers}
+
+
+# (Ensure Response Items)
+# I make sure there is always a ResponseItem row ready for saving for every item/field pair.
+# Instead of one get_or_create per cell I load what exists once and bulk create the gaps.
+def ensure_response_items(response, items, fields):
+    answers = answers_by_cell(ResponseItem.objects.filter(response=response))
+    # Cells added later (a new item) still go in the month the response was started
+    created_on = localdate(response.completed_at)
+    missing = [
+        ResponseItem(response=response, checklist_item=item, template_field=field, created_on=created_on)
+        for item in items
+        for field in fields
+        if (item.id, field.id) not in answers
+    ]
+    if missing:
+        ResponseItem.objects.bulk_create(missing)
+        answers.update(answers_by_cell(missing))
+
+        # New cells start empty, so they only add to the totals and the required-missing count
+        counted = [answer.template_field for answer in missing if counts_towards_progress(answer.template_field)]
+        if counted:
+            ChecklistResponse.objects.filter(pk=response.pk).update(
+                total_cells=F("total_cells") + len(counted),
+                required_missing=F("required_missing") + sum(1 for field in counted if field.required),
+            )
+    return answers
+
+
+# (Apply Cell Value)
+# I update the correct field on the ResponseItem based on the field type.
+# Anything that isn't valid raises CellValidationError with a message for the user.
+def apply_cell_value(answer, template_field, value):
+    if template_field.name in READ_ONLY_FIELDS:
+        raise CellValidationError("Chemical Used is read-only.")
+
+    if template_field.field_type == "text":
+        answer.answer_text = value
+    elif template_field.field_type == "date":
+        if value:
+            try:
+                parsed_date = datetime.strptime(value, "%Y-%m-%d").date()
+            except ValueError:
+                raise CellValidationError("Invalid date format. Use YYYY-MM-DD")
+
+            if template_field.name == "use_by_date" and parsed_date < localdate():
+                raise CellValidationError("Use-by date cannot be in the past.")
+
+            answer.answer_date = parsed_date
+        else:
+            answer.answer_date = None
+    elif template_field.field_type == "datetime":
+        answer.answer_datetime = value or None
+    elif template_field.field_type == "time":
+        # Expect "HH:MM" Reference: https://www.geeksforgeeks.org/python/convert-datetime-string-to-yyyy-mm-dd-hhmmss-format-in-python/
+        if value:
+            try:
+                answer.answer_time = datetime.strptime(value, "%H:%M").time()
+            except ValueError:
+                raise CellValidationError("Invalid time format. Use HH:MM")
+        else:
+            answer.answer_time = None
+    elif template_field.field_type == "decimal":
+        if value:
+            try:
+                decimal_value = Decimal(value)
+            except InvalidOperation:
+                raise CellValidationError("Please enter a valid number.")
+
+            if template_field.name == "core_temp":
+                if decimal_value < CORE_TEMP_MIN or decimal_value > CORE_TEMP_MAX:
+                    raise CellValidationError(f"Core temperature must be between {CORE_TEMP_MIN} and {CORE_TEMP_MAX}.")
+
+            answer.answer_decimal = decimal_value
+        else:
+            answer.answer_decimal = None
+    elif template_field.field_type == "number":
+        if value:
+            try:
+                number_value = int(value)
+            except ValueError:
+                raise CellValidationError("Please enter a whole number.")
+
+            if template_field.name == "core_temp":
+                if number_value < CORE_TEMP_MIN or number_value > CORE_TEMP_MAX:
+                    raise CellValidationError(f"Core temperature must be between {CORE_TEMP_MIN} and {CORE_TEMP_MAX}.")
+
+            answer.answer_number = number_value
+        else:
+            answer.answer_number = None
+    elif template_field.field_type == "boolean":
+        answer.answer_boolean = ((value or "").lower() == "true")
+
+
+# (Locked Response)
+# A daily response belongs to one day's instance. Once the close job has locked that
+# instance and taken its snapshot, the cells can't change any more.
+def response_is_locked(response):
+    if response.checklist.frequency != "daily":
+        return False
+    return ChecklistInstance.objects.filter(
+        checklist_id=response.checklist_id,
+        deli_id=response.deli_id,
+        date=localdate(response.completed_at),
+        is_locked=True,
+    ).exists()
+
+
+# (Save Outcomes)
+# save_cell tells the caller what happened, so queued edits can be cleared or corrected.
+SAVE_SAVED = "saved"
+SAVE_DUPLICATE = "duplicate"  # this idempotency key was already applied
+SAVE_STALE = "stale"  # someone saved this cell after the edit was made, their value wins
+
+
+# (Save Cell)
+# I save the edited answer and bump the response version together, so a half-saved edit
+# can never show up in the history and every change gets its own version number.
+# Once the transaction commits, the change is published to the other open grids.
+#
+# Edits replayed from a tablet's offline queue pass their idempotency key and the time the
+# edit was really made. A key that was already applied is skipped, and an edit older than
+# the cell's last_edited_at loses (last writer wins). In both cases `answer` is reloaded
+# so the caller can send the current value back.
+#
+# This stays a normal sync function because Django's async ORM can't run transactions;
+# the async views call it through a single sync_to_async hop.
+def save_cell(answer, template_field, response, user, value, edited_at=None, idempotency_key=None):
+    # Imported here because live_sync imports this module
+    from .live_sync import cell_change_message, publish_cell_change
+
+    apply_cell_value(answer, template_field, value)
+
+    # A tablet clock can run ahead, so an edit is never treated as newer than "now"
+    saved_at = now()
+    edited_at = min(edited_at, saved_at) if edited_at else saved_at
+
+    # On the deli's shard, which is just the primary unless sharding is set up
+    with shard_atomic():
+        if idempotency_key:
+            try:
+                # The savepoint keeps the outer transaction usable if the key already exists
+                with shard_atomic():
+                    ProcessedEdit.objects.create(key=idempotency_key, user=user, response=response)
+            except IntegrityError:
+                answer.refresh_from_db()
+                return SAVE_DUPLICATE
+
+        # I lock the cell so two replays of the same cell are compared one after the other,
+        # and read its stored value so the progress counters move by the right amount
+        current_edited_at, current_value = ResponseItem.objects.select_for_update().values_list(
+            "last_edited_at", ANSWER_COLUMNS[template_field.field_type]
+        ).get(pk=answer.pk)
+        if current_edited_at and edited_at < current_edited_at:
+            answer.refresh_from_db()
+            return SAVE_STALE
+
+        answer.last_edited_by = user
+        answer.last_edited_at = edited_at
+
+        # +1 when an empty cell gets a value, -1 when a value is cleared
+        filled_change = int(cell_is_filled(template_field, answer)) - int(is_filled_value(current_value))
+        required_change = -filled_change if template_field.required else 0
+
+        # The UPDATE locks the response row until commit, so two saves can't get the same version
+        ChecklistResponse.objects.filter(pk=response.pk).update(
+            version=F("version") + 1,
+            updated_at=saved_at,  # the "latest" timestamp
+            last_activity_at=saved_at,
+            # Greatest() keeps a drifted counter from going below zero
+            filled_cells=Greatest(F("filled_cells") + filled_change, 0),
+            required_missing=Greatest(F("required_missing") + required_change, 0),
+        )
+
+        # Checked after the UPDATE so a close job that holds the response row finishes first
+        if response_is_locked(response):
+            raise CellValidationError("This checklist has been closed and can't be edited.")
+
+        response.version = ChecklistResponse.objects.values_list("version", flat=True).get(pk=response.pk)
+        response.updated_at = saved_at
+
+        answer.version = response.version
+        answer.save()
+
+        message = cell_change_message(answer, template_field, user.email)
+        on_shard_commit(lambda: publish_cell_change(response.pk, message))
+
+    return SAVE_SAVED
@@ -0,0 +1,201 @@
+import hashlib
+from functools import wraps
+from inspect import iscoroutinefunction
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.http import HttpResponseNotModified
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .instances import shared_response_queryset
+from .models import Checklist, ChecklistInstance, ChecklistItem, TemplateField
+from .snapshots import instance_response_queryset
+
+
+# (Conditional GET)
+# The grid endpoints used to rebuild and resend the whole grid on every load, even when nothing
+# had changed. Now each one first works out a small "stamp" of everything its output depends on
+# (checklist, items, template fields and the response version) with one or two cheap queries,
+# and never touches ResponseItem for it. The stamp is sent as the ETag, and a browser that
+# already has that version gets a 304 with no body instead of the grid.
+# Reference: https://docs.djangoproject.com/en/5.2/topics/conditional-view-processing/
+
+# Bump this when the fill page or the grid JSON changes shape, so browsers drop their old copies
+GRID_FORMAT = 3
+
+
+def make_etag(*parts):
+    digest = hashlib.md5(repr((GRID_FORMAT,) + parts).encode(), usedforsecurity=False).hexdigest()
+    return f'"{digest}"'
+
+
+# Items are counted and their newest updated_at taken in subqueries, so adding, removing,
+# renaming or reordering an item changes the stamp. Template fields are only changed by the
+# app itself (see ChecklistTemplate), so their count and newest id are enough.
+def structure_stamp(checklist_ref, template_ref):
+    items = ChecklistItem.objects.filter(checklist_id=OuterRef(checklist_ref)).order_by().values("checklist_id")
+    fields = TemplateField.objects.filter(template_id=OuterRef(template_ref)).order_by().values("template_id")
+    return {
+        "item_count": Subquery(items.annotate(count=Count("pk")).values("count")),
+        "items_changed_at": Subquery(items.annotate(last=Max("updated_at")).values("last")),
+        "field_count": Subquery(fields.annotate(count=Count("pk")).values("count")),
+        "last_field_id": Subquery(fields.annotate(last=Max("pk")).values("last")),
+    }
+
+
+def _structure(row):
+    return row.item_count, row.items_changed_at, row.field_count, row.last_field_id
+
+
+def _latest(*moments):
+    moments = [moment for moment in moments if moment is not None]
+    return max(moments) if moments else None
+
+
+# (Grid Stamps)
+# Each returns (etag, last_modified) for a view's arguments, or None when the view should just
+# run (the row doesn't exist, or the view is about to create something).
+
+# api_get_checklist_data: the empty grid for a checklist. Checklist has no updated_at of its
+# own, so this one only gets an ETag.
+def checklist_preview_stamp(request, pk):
+    checklist = (
+        Checklist.objects.filter(pk=pk)
+        .select_related("template", "deli")
+        .annotate(**structure_stamp("pk", "template_id"))
+        .first()
+    )
+    if checklist is None:
+        return None
+    etag = make_etag(
+        "preview", checklist.pk, checklist.title, checklist.frequency,
+        checklist.template.name, checklist.deli.deli_name, *_structure(checklist),
+    )
+    return etag, None
+
+
+# api_manager_instance_detail: closed instances never change (the snapshot is written once),
+# open ones change with their response version.
+def instance_detail_stamp(request, instance_id):
+    instance = (
+        ChecklistInstance.objects.filter(pk=instance_id, checklist__deleted_at__isnull=True)
+        .defer("snapshot")
+        .annotate(**structure_stamp("checklist_id", "checklist__template_id"))
+        .first()
+    )
+    if instance is None:
+        return None
+    if instance.is_locked and instance.closed_at is not None:
+        return make_etag("closed", instance.pk, instance.closed_at), instance.closed_at
+
+    response = instance_response_queryset(instance).values_list(
+        "pk", "version", "updated_at", "completed_by__email"
+    ).first()
+    if response is None:
+        return make_etag("empty", instance.pk), None
+    etag = make_etag("detail", instance.pk, *response, *_structure(instance))
+    return etag, _latest(response[2], instance.items_changed_at)
+
+
+# fill_checklist_view: the page is per user (navigation, CSRF token), so the user and their
+# CSRF secret are part of the stamp. The first visit of the day creates the shared response
+# and its answer rows, so it always runs the view.
+def fill_page_stamp(request, instance_id):
+    instance = (
+        ChecklistInstance.objects.filter(pk=instance_id, deli__in=request.user.delis.values("pk"))
+        .select_related("checklist__template", "deli")
+        .defer("snapshot")
+        .annotate(**structure_stamp("checklist_id", "checklist__template_id"))
+        .first()
+    )
+    if instance is None or instance.response_id is None:
+        return None
+
+    response = shared_response_queryset(instance).values_list("pk", "version", "updated_at").first()
+    if response is None or response[0] != instance.response_id:
+        return None
+
+    etag = make_etag(
+        "fill", instance.pk, instance.is_locked, request.user.pk, request.META.get("CSRF_COOKIE"),
+        instance.checklist.title, instance.checklist.template.name, instance.deli.deli_name,
+        settings.LIVE_SYNC_ENABLED, settings.GRID_POLL_SECONDS, *response, *_structure(instance),
+    )
+    return etag, _latest(response[2], instance.items_changed_at)
+
+
+# (Conditional Grid)
+# Decorator for GET views: `stamp(request, *args, **kwargs)` gives the validators, a matching
+# If-None-Match (or If-Modified-Since) gets a 304, and every 200 carries the ETag and
+# Last-Modified. Cache-Control "private, no-cache" makes the browser keep the grid but check
+# it every time, so nobody is ever shown a stale grid. Put it below @row_shard_view and
+# @replica_reads so the stamp is read from the same database as the view.
+def conditional_grid(stamp):
+    def validators(request, args, kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return None
+        return stamp(request, *args, **kwargs)
+
+    def not_modified(request, found):
+        etag, last_modified = found
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=int(last_modified.timestamp()) if last_modified else None,
+        )
+        # It can also be a 412 for a failed If-Match, which goes back as it is
+        if response is not None and response.status_code == 304:
+            response = with_validators(HttpResponseNotModified(), found)
+        return response
+
+    def with_validators(response, found):
+        etag, last_modified = found
+        if response.status_code in (200, 304):
+            response.headers.setdefault("ETag", etag)
+            if last_modified is not None:
+                response.headers.setdefault("Last-Modified", http_date(last_modified.timestamp()))
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                found = await sync_to_async(validators)(request, args, kwargs)
+                if found is None:
+                    return await view(request, *args, **kwargs)
+                return not_modified(request, found) or with_validators(await view(request, *args, **kwargs), found)
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            found = validators(request, args, kwargs)
+            if found is None:
+                return view(request, *args, **kwargs)
+            return not_modified(request, found) or with_validators(view(request, *args, **kwargs), found)
+
+        return wrapper
+
+    return decorator
+
+
+# (Compression)
+# Django's GZipMiddleware, minus the responses it shouldn't touch:
+#   - server-sent events, which have to reach the browser one event at a time,
+#   - PDFs, ZIPs and images, which are compressed already,
+#   - bodies under COMPRESS_MIN_BYTES, where the gzip header costs more than it saves.
+# GZipMiddleware already pads its output against BREACH, so the CSRF token in pages is safe.
+SKIP_COMPRESSION = ("text/event-stream", "application/pdf", "application/zip", "image/")
+
+
+class CompressionMiddleware(GZipMiddleware):
+    def process_response(self, request, response):
+        content_type = response.get("Content-Type", "")
+        if content_type.startswith(SKIP_COMPRESSION):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESS_MIN_BYTES:
+            return response
+        return super().process_response(request, response)
@@ -0,0 +1,106 @@
+from datetime import date
+
+from django.utils.timezone import localdate
+
+from .models import Checklist, ChecklistInstance, ChecklistInstanceItem, ChecklistResponse
+from .sharding import each_deli_shard
+
+
+# This file holds the helpers that find or create the rows staff fill in:
+# today's ChecklistInstance for each active checklist, and the shared
+# ChecklistResponse that everyone at the deli writes their answers into.
+
+
+# (Today's Instances)
+# For every active checklist on the user's delis I either find or create a ChecklistInstance for today.
+# I used get_or_create here to avoid duplicates:
+# Reference: https://docs.djangoproject.com/en/5.2/ref/models/querysets/#get-or-create
+def todays_instances(user):
+    # I use Python's date.today() to know which day's instance to use
+    today = date.today()
+
+    checklists = list(Checklist.objects.filter(
+        deli__in=user.delis.all(),
+        is_active=True
+    ).select_related("template", "deli"))
+
+    # The instances live on each deli's shard (just the primary unless sharding is set up)
+    instances = {}
+    for shard_deli_ids in each_deli_shard({checklist.deli_id for checklist in checklists}):
+        shard_checklists = [checklist for checklist in checklists if checklist.deli_id in shard_deli_ids]
+        instances.update(_todays_shard_instances(shard_checklists, today))
+
+    return [instances[checklist.id] for checklist in checklists]
+
+
+def _todays_shard_instances(checklists, today):
+    # Instances that already exist for today are loaded in one query, with their response
+    # so the page can show progress without asking again per row
+    existing = {
+        instance.checklist_id: instance
+        for instance in ChecklistInstance.objects.filter(
+            checklist__in=checklists,
+            date=today,
+        ).select_related("response")
+    }
+
+    instances = {}
+    for checklist in checklists:
+        instance = existing.get(checklist.id)
+        if instance is None:
+            instance, created = ChecklistInstance.objects.get_or_create(
+                checklist=checklist,
+                deli=checklist.deli,
+                date=today,
+                defaults={"is_locked": False}
+            )
+
+            # If I just created this instance today I also create the row items in one insert
+            if created:
+                ChecklistInstanceItem.objects.bulk_create([
+                    ChecklistInstanceItem(instance=instance, checklist_item=item)
+                    for item in checklist.items.all()
+                ])
+
+        # The checklist and deli are already loaded, so I reuse them instead of fetching again
+        instance.checklist = checklist
+        instance.deli = checklist.deli
+        instances[checklist.id] = instance
+
+    return instances
+
+
+# (Shared Response)
+# All staff at a deli fill the same ChecklistResponse. I pick the most recently updated one,
+# and for daily checklists only today's. If nothing exists yet I create the first one.
+def shared_response_queryset(instance):
+    response_qs = ChecklistResponse.objects.filter(
+        checklist_id=instance.checklist_id,
+        deli_id=instance.deli_id,
+    )
+
+    # For daily checklists only use today's response set
+    if instance.checklist.frequency == "daily":
+        response_qs = response_qs.filter(completed_at__date=localdate())
+
+    # The most recently updated response comes first
+    return response_qs.order_by("-updated_at", "-completed_at")
+
+
+def shared_response_for(instance, user):
+    response = shared_response_queryset(instance).first()
+
+    # If nothing exists yet create the first shared response
+    if not response:
+        response = ChecklistResponse.objects.create(
+            checklist=instance.checklist,
+            deli=instance.deli,
+            completed_by=user,  # “created by” the first staff who opens it
+        )
+
+    # I remember which response this instance uses, so its progress can be shown in lists
+    if instance.response_id != response.id:
+        ChecklistInstance.objects.filter(pk=instance.pk).update(response=response)
+        instance.response = response
+
+    return response
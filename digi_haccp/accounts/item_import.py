@@ -0,0 +1,167 @@
+import csv
+import io
+from pathlib import Path
+
+from django.db import transaction
+
+from .models import ChecklistItem
+
+
+# (Checklist Item Import)
+# Managers can paste items into the textarea ("Name" or "Name | Chemical" per line) and/or
+# upload a CSV or XLSX with name, chemical_used and order columns.
+# Rows are read one at a time (csv reader / openpyxl read-only mode), so a big upload is never
+# loaded into memory as a whole. Every row is checked before anything is saved, and the items
+# are then written with one bulk insert inside the same transaction as the checklist.
+
+IMPORT_COLUMNS = ("name", "chemical_used", "order")
+IMPORT_EXTENSIONS = (".csv", ".xlsx")
+
+# I stop listing problems after this many, a file with thousands of bad rows is just the wrong file
+MAX_IMPORT_ERRORS = 50
+
+NAME_MAX_LENGTH = ChecklistItem._meta.get_field("name").max_length
+CHEMICAL_MAX_LENGTH = ChecklistItem._meta.get_field("chemical_used").max_length
+
+
+class ItemImportError(Exception):
+    """The uploaded file can't be read at all (wrong type, corrupt, missing openpyxl)."""
+
+
+# (Pasted Rows)
+# The textarea keeps its old format so nothing changes for managers who paste lists.
+def pasted_rows(text):
+    for line_number, line in enumerate((text or "").splitlines(), start=1):
+        name, _, chemical_used = line.partition("|")
+        yield f"Line {line_number}", {"name": name, "chemical_used": chemical_used, "order": ""}
+
+
+# (Header Row)
+# A first row naming the columns is optional. Without one the columns are taken in
+# the order name, chemical_used, order.
+def _column_positions(first_row):
+    headings = [str(cell or "").strip().lower().replace(" ", "_") for cell in first_row]
+    if "name" not in headings:
+        return None
+    return {column: headings.index(column) for column in IMPORT_COLUMNS if column in headings}
+
+
+def _table_rows(rows, label):
+    positions = None
+    for row_number, row in enumerate(rows, start=1):
+        row = list(row)
+        if row_number == 1:
+            positions = _column_positions(row)
+            if positions is not None:
+                continue
+        if positions is None:
+            positions = {column: index for index, column in enumerate(IMPORT_COLUMNS)}
+
+        values = {
+            column: row[index] if index < len(row) and row[index] is not None else ""
+            for column, index in positions.items()
+        }
+        yield f"{label} {row_number}", values
+
+
+def csv_rows(upload):
+    # utf-8-sig drops the byte order mark Excel puts at the start of "CSV UTF-8" files
+    text = io.TextIOWrapper(upload, encoding="utf-8-sig", newline="")
+    try:
+        yield from _table_rows(csv.reader(text), "Row")
+    except (UnicodeDecodeError, csv.Error) as error:
+        raise ItemImportError(f"The CSV file couldn't be read ({error}).") from error
+    finally:
+        text.detach()
+
+
+def xlsx_rows(upload):
+    try:
+        from openpyxl import load_workbook
+    except ImportError as error:
+        raise ItemImportError("XLSX uploads need openpyxl installed, please upload a CSV instead.") from error
+
+    try:
+        # read_only streams the sheet row by row instead of building the whole workbook
+        workbook = load_workbook(upload, read_only=True, data_only=True)
+    except Exception as error:
+        raise ItemImportError("The XLSX file couldn't be opened.") from error
+
+    try:
+        yield from _table_rows(workbook.active.iter_rows(values_only=True), "Row")
+    finally:
+        workbook.close()
+
+
+def file_rows(upload, filename=None):
+    extension = Path(filename or upload.name).suffix.lower()
+    if extension == ".csv":
+        return csv_rows(upload)
+    if extension == ".xlsx":
+        return xlsx_rows(upload)
+    raise ItemImportError("Please upload a .csv or .xlsx file.")
+
+
+# (Validate Rows)
+# Returns (items, errors). Items are unsaved ChecklistItems without a checklist yet,
+# errors are "Row 4: ..." messages. Blank rows are skipped, and rows without an order
+# follow on from the row before so the list keeps the order it was written in.
+def validate_rows(rows, on_row=None):
+    items = []
+    errors = []
+    error_count = 0
+    next_order = 1
+
+    for count, (label, values) in enumerate(rows, start=1):
+        if on_row:
+            on_row(count)
+
+        name = str(values.get("name", "")).strip()
+        chemical_used = str(values.get("chemical_used", "")).strip()
+        order = str(values.get("order", "")).strip()
+
+        if not name and not chemical_used and not order:
+            continue
+
+        problems = []
+        if not name:
+            problems.append("the name is missing")
+        elif len(name) > NAME_MAX_LENGTH:
+            problems.append(f"the name is longer than {NAME_MAX_LENGTH} characters")
+        if len(chemical_used) > CHEMICAL_MAX_LENGTH:
+            problems.append(f"the chemical is longer than {CHEMICAL_MAX_LENGTH} characters")
+
+        if order:
+            try:
+                # Spreadsheets hand whole numbers back as 3.0
+                parsed_order = float(order)
+                if parsed_order < 0 or not parsed_order.is_integer():
+                    raise ValueError
+                next_order = int(parsed_order)
+            except ValueError:
+                problems.append(f"the order \"{order}\" isn't a whole number")
+
+        if problems:
+            error_count += 1
+            if len(errors) < MAX_IMPORT_ERRORS:
+                errors.append(f"{label}: {', '.join(problems)}.")
+            continue
+
+        items.append(ChecklistItem(name=name, chemical_used=chemical_used, order=next_order))
+        next_order += 1
+
+    if error_count > len(errors):
+        errors.append(f"…and {error_count - len(errors)} more rows with problems.")
+
+    return items, errors
+
+
+# (Save Items)
+# One INSERT per batch instead of one per item. Callers run this in the same transaction
+# that creates the checklist, so a failed import never leaves a half-filled checklist.
+def create_items(checklist, items, batch_size=500):
+    for item in items:
+        item.checklist = checklist
+    with transaction.atomic():
+        ChecklistItem.objects.bulk_create(items, batch_size=batch_size)
+    return len(items)
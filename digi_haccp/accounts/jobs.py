@@ -0,0 +1,232 @@
+import logging
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils.timezone import now
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+# (Background Jobs)
+# A small job queue on top of the Job table:
+#   - enqueue() stores a job, optionally for later (run_at) and with a priority.
+#   - run_worker (management command) claims due jobs and runs the registered task.
+# On PostgreSQL a job is claimed with SELECT ... FOR UPDATE SKIP LOCKED, so many workers
+# can poll the same table without waiting on each other or running a job twice.
+# SQLite has no row locks, there the conditional UPDATE on status is what makes a claim safe.
+# Reference: https://www.postgresql.org/docs/current/sql-select.html#SQL-FOR-UPDATE-SHARE
+
+
+# Seconds before a failed job is tried again: 10s, 40s, 90s, ... (capped at an hour)
+RETRY_BASE_SECONDS = 10
+RETRY_MAX_SECONDS = 3600
+
+_tasks = {}
+
+
+# (Register Task)
+# Tasks are plain functions that take the Job first and the payload as keyword arguments:
+#
+#     @register_task("close_checklists")
+#     def close_checklists(job, before=None):
+#         ...
+#
+# Whatever the function returns (JSON-friendly) is stored as the job's result.
+def register_task(name, max_attempts=3):
+    def decorator(func):
+        func.job_name = name
+        func.max_attempts = max_attempts
+        _tasks[name] = func
+        return func
+    return decorator
+
+
+def get_task(name):
+    # Tasks register themselves when tasks.py is imported
+    from . import tasks  # noqa: F401
+    return _tasks.get(name)
+
+
+# (Enqueue)
+def enqueue(name, payload=None, priority=0, run_at=None, user=None, max_attempts=None):
+    task = get_task(name)
+    if task is None:
+        raise ValueError(f"Unknown job {name!r}")
+
+    return Job.objects.create(
+        name=name,
+        payload=payload or {},
+        priority=priority,
+        run_at=run_at or now(),
+        max_attempts=max_attempts or task.max_attempts,
+        created_by=user,
+    )
+
+
+# (Claim Job)
+# Takes the next due job and marks it running for this worker. Returns None if there is nothing to do.
+def claim_job(worker_name):
+    while True:
+        with transaction.atomic():
+            due = Job.objects.filter(
+                status=Job.STATUS_QUEUED,
+                run_at__lte=now(),
+            ).order_by("-priority", "run_at", "id")
+
+            if connection.features.has_select_for_update_skip_locked:
+                due = due.select_for_update(skip_locked=True)
+
+            job = due.first()
+            if job is None:
+                return None
+
+            claimed = Job.objects.filter(pk=job.pk, status=Job.STATUS_QUEUED).update(
+                status=Job.STATUS_RUNNING,
+                locked_by=worker_name,
+                started_at=now(),
+                heartbeat_at=now(),
+                attempts=F("attempts") + 1,
+            )
+
+        # Another worker got it between the SELECT and the UPDATE (only possible without SKIP LOCKED)
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(RETRY_BASE_SECONDS * attempts * attempts, RETRY_MAX_SECONDS))
+
+
+# (Run Job)
+# Runs a claimed job. A failure is retried later with a growing delay until max_attempts,
+# after that the job is marked failed with the traceback kept in last_error.
+def run_job(job):
+    task = get_task(job.name)
+    try:
+        if task is None:
+            raise LookupError(f"No task is registered as {job.name!r}")
+        result = task(job, **job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception("Job %s #%s failed (attempt %s of %s)", job.name, job.pk, job.attempts, job.max_attempts)
+
+        if task is not None and job.attempts < job.max_attempts:
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.STATUS_QUEUED,
+                run_at=now() + retry_delay(job.attempts),
+                last_error=error,
+                locked_by="",
+            )
+        else:
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.STATUS_FAILED,
+                last_error=error,
+                finished_at=now(),
+            )
+        return False
+
+    Job.objects.filter(pk=job.pk).update(
+        status=Job.STATUS_SUCCEEDED,
+        result=result,
+        finished_at=now(),
+    )
+    return True
+
+
+# (Progress)
+# Long tasks call this between batches. It is a single small UPDATE, so it's cheap enough to
+# call often, and it doesn't touch the rest of the row the worker is using. It counts as a
+# heartbeat too.
+def set_progress(job, done, total=None):
+    job.progress_done = done
+    fields = {"progress_done": done, "heartbeat_at": now()}
+    if total is not None:
+        job.progress_total = total
+        fields["progress_total"] = total
+    Job.objects.filter(pk=job.pk).update(**fields)
+
+
+# (Heartbeat)
+# A running job's heartbeat_at is refreshed by set_progress and by a timer the worker keeps
+# going while the job runs (keep_alive), so a task that goes a long time between progress
+# updates still looks alive. Only a job whose worker died stops beating.
+def heartbeat(job):
+    Job.objects.filter(pk=job.pk, status=Job.STATUS_RUNNING).update(heartbeat_at=now())
+
+
+@contextmanager
+def keep_alive(job, interval):
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                try:
+                    heartbeat(job)
+                except Exception:
+                    # A lost connection is opened again on the next beat
+                    logger.warning("Couldn't record the heartbeat of job %s #%s", job.name, job.pk, exc_info=True)
+                    connection.close()
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f"job-heartbeat-{job.pk}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+# (Stale Jobs)
+# A job left "running" by a worker that crashed or was killed stops beating and is put back
+# in the queue once its heartbeat is older than `older_than`, however long it has been running.
+# Its attempt still counts, so a job that kills its worker every time ends up failed.
+def requeue_stale_jobs(older_than):
+    cutoff = now() - older_than
+    stale = Job.objects.filter(status=Job.STATUS_RUNNING).filter(
+        # Jobs claimed before heartbeats were recorded only have their start time
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    )
+
+    requeued = stale.filter(attempts__lt=F("max_attempts")).update(
+        status=Job.STATUS_QUEUED,
+        run_at=now(),
+        locked_by="",
+        last_error="The worker running this job stopped before it finished.",
+    )
+    stale.update(
+        status=Job.STATUS_FAILED,
+        finished_at=now(),
+        last_error="The worker running this job stopped before it finished.",
+    )
+    return requeued
+
+
+# (Job Status)
+# What the UI polls while a job runs.
+def job_status_payload(job):
+    return {
+        "id": job.pk,
+        "name": job.name,
+        "status": job.status,
+        "done": job.status in (Job.STATUS_SUCCEEDED, Job.STATUS_FAILED),
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "progress": {"done": job.progress_done, "total": job.progress_total},
+        "result": job.result,
+        # Only the last line of the traceback, the full one is in the admin/database
+        "error": job.last_error.strip().splitlines()[-1] if job.last_error else None,
+        "run_at": job.run_at,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
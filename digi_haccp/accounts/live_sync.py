@@ -0,0 +1,154 @@
+import asyncio
+import json
+import time
+
+from django.conf import settings
+
+from .broker import get_broker
+from .grid import answer_json_value, detail_cell_value
+from .models import ChecklistResponse, ResponseItem
+
+
+# (Live Sync)
+# When several staff fill the same ChecklistResponse, every saved cell is pushed to the
+# other open grids as a server-sent event instead of them having to reload the page.
+# Each event only carries the changed cell: item, field, value, editor and version.
+# If a grid misses some versions (reconnect, out of order delivery, a message too big
+# for the broker) it catches up by reading the cells changed since the last version it saw.
+# Reference: https://developer.mozilla.org/en-US/docs/Web/API/Server-sent_events/Using_server-sent_events
+
+
+def response_channel(response_id):
+    return f"checklist_response_{response_id}"
+
+
+def cell_change_message(answer, field, editor_email, detail=False):
+    # The manager detail grid formats values differently from the fill grid
+    value = detail_cell_value(field, None, answer) if detail else answer_json_value(field, answer)
+    return {
+        "item": answer.checklist_item_id,
+        "field": field.name,
+        "value": value,
+        "editor": editor_email,
+        "version": answer.version,
+    }
+
+
+def publish_cell_change(response_id, message):
+    get_broker().publish(response_channel(response_id), message)
+
+
+def sse_event(message):
+    return f"id: {message['version']}\nevent: cell\ndata: {json.dumps(message)}\n\n"
+
+
+def _changes_queryset(response_id, since_version):
+    return ResponseItem.objects.filter(
+        response_id=response_id,
+        version__gt=since_version,
+    ).select_related("template_field", "last_edited_by").order_by("version")
+
+
+def _answer_message(answer, detail=False):
+    editor = answer.last_edited_by.email if answer.last_edited_by_id else None
+    return cell_change_message(answer, answer.template_field, editor, detail=detail)
+
+
+# (Changes Since)
+# Only the cells modified after `since_version`, oldest first. This is an index lookup on
+# (response, version), so it stays cheap no matter how big the grid is.
+def changes_since(response_id, since_version, detail=False):
+    return [
+        _answer_message(answer, detail=detail)
+        for answer in _changes_queryset(response_id, since_version)
+    ]
+
+
+async def achanges_since(response_id, since_version, detail=False):
+    return [
+        _answer_message(answer, detail=detail)
+        async for answer in _changes_queryset(response_id, since_version)
+    ]
+
+
+# EventSource sends the id of the last event it saw when it reconnects
+def last_event_version(request):
+    value = request.headers.get("Last-Event-ID") or request.GET.get("since")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _needs_catch_up(message, last_version):
+    return message["version"] > last_version + 1 or "value" not in message
+
+
+# (Sync Event Stream)
+# Used under WSGI. This holds a worker thread for the life of the stream,
+# which is why live sync is meant for ASGI mode (see LIVE_SYNC_ENABLED).
+def event_stream(response_id, since_version):
+    subscription = get_broker().subscribe(response_channel(response_id))
+    try:
+        yield f"retry: {settings.LIVE_SYNC_RETRY_MS}\n\n"
+
+        # I subscribe first and read the version second, so nothing saved in between is lost
+        if since_version is None:
+            last_version = ChecklistResponse.objects.values_list("version", flat=True).get(pk=response_id)
+        else:
+            last_version = since_version
+            for message in changes_since(response_id, last_version):
+                yield sse_event(message)
+                last_version = message["version"]
+
+        deadline = time.monotonic() + settings.LIVE_SYNC_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            message = subscription.get(timeout=settings.LIVE_SYNC_HEARTBEAT_SECONDS)
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+            if message["version"] <= last_version:
+                continue
+            if _needs_catch_up(message, last_version):
+                missed = changes_since(response_id, last_version)
+            else:
+                missed = [message]
+            for change in missed:
+                yield sse_event(change)
+                last_version = change["version"]
+    finally:
+        subscription.close()
+
+
+# (Async Event Stream)
+# Used in ASGI mode, where a waiting grid only costs a parked coroutine.
+async def aevent_stream(response_id, since_version):
+    subscription = get_broker().subscribe(response_channel(response_id), loop=asyncio.get_running_loop())
+    try:
+        yield f"retry: {settings.LIVE_SYNC_RETRY_MS}\n\n"
+
+        if since_version is None:
+            last_version = await ChecklistResponse.objects.values_list("version", flat=True).aget(pk=response_id)
+        else:
+            last_version = since_version
+            for message in await achanges_since(response_id, last_version):
+                yield sse_event(message)
+                last_version = message["version"]
+
+        deadline = time.monotonic() + settings.LIVE_SYNC_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            message = await subscription.aget(timeout=settings.LIVE_SYNC_HEARTBEAT_SECONDS)
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+            if message["version"] <= last_version:
+                continue
+            if _needs_catch_up(message, last_version):
+                missed = await achanges_since(response_id, last_version)
+            else:
+                missed = [message]
+            for change in missed:
+                yield sse_event(change)
+                last_version = change["version"]
+    finally:
+        subscription.close()
@@ -0,0 +1,180 @@
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# The two deployment modes I compare. Both use the same gunicorn.conf.py,
+# only the app module and worker class change.
+MODES = {
+    "wsgi": {
+        "app": "digi_haccp.wsgi:application",
+        "env": {"GUNICORN_WORKER_CLASS": "gthread", "ASGI_MODE": "False"},
+    },
+    "asgi": {
+        "app": "digi_haccp.asgi:application",
+        "env": {"GUNICORN_WORKER_CLASS": "uvicorn_worker.UvicornWorker", "ASGI_MODE": "True"},
+    },
+}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        return 0
+
+
+def _worker_pids(master_pid):
+    # I find the gunicorn workers by scanning /proc for processes whose parent is the master
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == master_pid:
+            pids.append(int(entry))
+    return pids
+
+
+# (Concurrency Benchmark)
+# I use this to compare the normal WSGI (gthread) deployment against ASGI (uvicorn workers)
+# at the same memory budget. For each mode I first boot one worker to measure its memory,
+# work out how many workers fit in --memory-mb, then hammer --path with --concurrency clients.
+# Linux only, because worker memory is read from /proc.
+# Usage: python manage.py bench_concurrency --path /api/checklists/1/ --memory-mb 512 --concurrency 50
+class Command(BaseCommand):
+    help = "Compares WSGI and ASGI throughput and latency at an equal memory budget."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default="/login/", help="URL to load test.")
+        parser.add_argument("--memory-mb", type=int, default=512, help="Total worker memory budget per mode.")
+        parser.add_argument("--concurrency", type=int, default=50, help="Simultaneous clients.")
+        parser.add_argument("--requests", type=int, default=1000, help="Total requests per mode.")
+        parser.add_argument("--cookie", default="", help="Cookie header to send, e.g. sessionid=... for logged-in endpoints.")
+        parser.add_argument("--modes", default="wsgi,asgi", help="Comma separated list of modes to run.")
+
+    def handle(self, *args, **options):
+        if not os.path.isdir("/proc"):
+            raise CommandError("bench_concurrency reads worker memory from /proc and only runs on Linux.")
+
+        results = []
+        for mode in options["modes"].split(","):
+            if mode not in MODES:
+                raise CommandError(f"Unknown mode '{mode}'. Use wsgi and/or asgi.")
+
+            per_worker_kb = self._measure_worker_rss(mode, options)
+            workers = max(1, (options["memory_mb"] * 1024) // per_worker_kb)
+            self.stdout.write(f"{mode}: one worker uses {per_worker_kb // 1024}MB, running {workers} worker(s)")
+
+            with self._server(mode, workers) as (port, master_pid):
+                result = self._load(port, options)
+                result["rss_mb"] = sum(_rss_kb(pid) for pid in _worker_pids(master_pid)) // 1024
+            result.update(mode=mode, workers=workers)
+            results.append(result)
+
+        self.stdout.write("")
+        self.stdout.write(f"GET {options['path']} x{options['requests']}, {options['concurrency']} concurrent clients, "
+                          f"{options['memory_mb']}MB budget")
+        self.stdout.write(f"{'mode':<6}{'workers':>8}{'rss':>8}{'req/s':>9}{'p50':>9}{'p95':>9}{'errors':>8}")
+        for r in results:
+            self.stdout.write(
+                f"{r['mode']:<6}{r['workers']:>8}{r['rss_mb']:>6}MB{r['rps']:>9.1f}"
+                f"{r['p50_ms']:>7.1f}ms{r['p95_ms']:>7.1f}ms{r['errors']:>8}"
+            )
+
+    def _measure_worker_rss(self, mode, options):
+        with self._server(mode, 1) as (port, master_pid):
+            # A few requests so the worker has loaded everything the endpoint touches
+            for _ in range(20):
+                self._request(port, options["path"], options["cookie"])
+            pids = _worker_pids(master_pid)
+            return max(1, max(_rss_kb(pid) for pid in pids))
+
+    def _server(self, mode, workers):
+        command = self
+
+        class Server:
+            def __enter__(self):
+                self.port = _free_port()
+                env = dict(os.environ)
+                env.update(MODES[mode]["env"])
+                env.update(PORT=str(self.port), GUNICORN_WORKERS=str(workers), GUNICORN_LOG_LEVEL="warning")
+                self.process = subprocess.Popen(
+                    [sys.executable, "-m", "gunicorn", MODES[mode]["app"], "--config", "gunicorn.conf.py",
+                     "--access-logfile", "/dev/null"],
+                    cwd=settings.BASE_DIR,
+                    env=env,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+                command._wait_ready(self.port, self.process)
+                return self.port, self.process.pid
+
+            def __exit__(self, *exc):
+                self.process.send_signal(signal.SIGTERM)
+                self.process.wait(timeout=30)
+
+        return Server()
+
+    def _wait_ready(self, port, process):
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError("gunicorn exited during startup. Run it by hand to see the error.")
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError("gunicorn did not start listening within 30 seconds.")
+
+    def _request(self, port, path, cookie):
+        request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", headers={"Host": "localhost"})
+        if cookie:
+            request.add_header("Cookie", cookie)
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+                ok = response.status < 400
+        except (urllib.error.URLError, OSError):
+            ok = False
+        return (time.perf_counter() - started) * 1000, ok
+
+    def _load(self, port, options):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+            samples = list(pool.map(
+                lambda _: self._request(port, options["path"], options["cookie"]),
+                range(options["requests"]),
+            ))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(ms for ms, _ in samples)
+        return {
+            "rps": len(samples) / elapsed,
+            "p50_ms": statistics.median(latencies),
+            "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+            "errors": sum(1 for _, ok in samples if not ok),
+        }
@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+from accounts.models import ChecklistInstance, User
+
+
+def _wire_bytes(response):
+    # Status line, headers and body roughly as they go over HTTP/1.1
+    body = b"".join(response.streaming_content) if response.streaming else response.content
+    headers = sum(len(name) + len(value) + 4 for name, value in response.headers.items())
+    return len(body), headers + len(body) + 17
+
+
+# (Grid Bytes)
+# Shows what the grid endpoints cost on the wire for one checklist instance: a plain load,
+# the same load gzipped (CompressionMiddleware) and a reload the browser already has (304 from
+# the ETag, see http_cache.py). Requests go through the full middleware stack in this process.
+# Usage: python manage.py bench_grid_bytes --instance 42 --user staff@example.com
+class Command(BaseCommand):
+    help = "Measures bytes sent by the grid endpoints with and without compression and ETags."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--instance", type=int, help="Checklist instance to load (default: the newest).")
+        parser.add_argument("--user", help="Email of a user assigned to the instance's deli (default: the first one).")
+
+    def handle(self, *args, **options):
+        instances = ChecklistInstance.objects.select_related("checklist")
+        instance = (
+            instances.filter(pk=options["instance"]).first() if options["instance"]
+            else instances.order_by("-date", "-pk").first()
+        )
+        if instance is None:
+            raise CommandError("No checklist instance to measure, pass --instance.")
+
+        users = User.objects.filter(delis=instance.deli_id, is_active=True)
+        user = users.filter(email=options["user"]).first() if options["user"] else users.order_by("pk").first()
+        if user is None:
+            raise CommandError("No active user is assigned to that deli, pass --user.")
+
+        client = Client(HTTP_HOST="localhost")
+        client.force_login(user)
+        # The fill page creates the day's response on its first load, so the numbers are for later loads
+        client.get(reverse("fill_checklist", args=[instance.pk]))
+
+        endpoints = [
+            ("fill page", reverse("fill_checklist", args=[instance.pk])),
+            ("checklist data", reverse("api_get_checklist_data", args=[instance.checklist_id])),
+            ("instance detail", reverse("api_manager_instance_detail", args=[instance.pk])),
+        ]
+
+        self.stdout.write(f"Instance {instance.pk} ({instance.checklist}), as {user.email}")
+        self.stdout.write(f"{'endpoint':<17}{'plain':>10}{'gzip':>10}{'saved':>8}{'304':>8}  body bytes (wire bytes)")
+        try:
+            for name, url in endpoints:
+                plain = client.get(url)
+                if plain.status_code != 200:
+                    self.stdout.write(f"{name:<17}HTTP {plain.status_code}, skipped")
+                    continue
+                plain_body, plain_wire = _wire_bytes(plain)
+
+                gzipped = client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+                gzip_body, gzip_wire = _wire_bytes(gzipped)
+
+                etag = gzipped.get("ETag")
+                revalidated = client.get(url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=etag) if etag else None
+                if revalidated is not None and revalidated.status_code == 304:
+                    not_modified = f"{_wire_bytes(revalidated)[1]:>8}"
+                else:
+                    not_modified = f"{'-':>8}"
+
+                saved = 100 - gzip_wire * 100 // max(plain_wire, 1)
+                self.stdout.write(
+                    f"{name:<17}{plain_body:>10}{gzip_body:>10}{saved:>7}%{not_modified}"
+                    f"  ({plain_wire} -> {gzip_wire})"
+                )
+        finally:
+            client.logout()
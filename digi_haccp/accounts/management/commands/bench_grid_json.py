@@ -0,0 +1,79 @@
+import gzip
+import json
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import override_settings
+
+from accounts import fast_json
+
+
+# A made-up grid shaped like a busy Food Safety checklist: a mix of text, dates, times,
+# decimals and ticks, with some cells left empty like a half-filled day.
+def _grid(items, extra_fields):
+    field_names = ["food_name", "use_by_date", "prepared_time", "core_temp", "corrective_action", "checked"]
+    field_names += [f"extra_{number}" for number in range(extra_fields)]
+    today = date.today()
+    pick = random.Random(42)
+
+    def value(name, row):
+        if pick.random() < 0.3:
+            return ""
+        if name == "use_by_date":
+            return (today + timedelta(days=row % 5)).isoformat()
+        if name == "prepared_time":
+            return f"{8 + row % 10:02d}:{row % 60:02d}"
+        if name == "core_temp":
+            return Decimal(75 + pick.randint(0, 250) / 10).quantize(Decimal("0.1"))
+        if name == "checked":
+            return pick.random() < 0.5
+        return f"{name.replace('_', ' ').title()} {row}"
+
+    column_defs = [{"headerName": "Item", "field": "item_name", "editable": False}] + [
+        {"headerName": name.replace("_", " ").title(), "field": name, "editable": True, "fieldType": "text"}
+        for name in field_names
+    ]
+    fields = ["item_id", "item_name"] + field_names
+    rows = [[row, f"Item {row}"] + [value(name, row) for name in field_names] for row in range(1, items + 1)]
+    return column_defs, fields, rows
+
+
+# (Grid JSON Benchmark)
+# Compares the old grid payload (a dict per row, json.dumps) with the columnar one (names once,
+# rows as lists) under both encoders: time to encode, then bytes plain and gzipped.
+# Usage: python manage.py bench_grid_json --items 200 --repeat 200
+class Command(BaseCommand):
+    help = "Measures grid JSON encode time and size for the row-dict and columnar formats."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=200, help="Rows in the grid.")
+        parser.add_argument("--extra-fields", type=int, default=4, help="Columns on top of the six standard ones.")
+        parser.add_argument("--repeat", type=int, default=200, help="Encodes per measurement.")
+
+    def handle(self, *args, **options):
+        column_defs, fields, rows = _grid(options["items"], options["extra_fields"])
+        row_dicts = {"columnDefs": column_defs, "rowData": [dict(zip(fields, row)) for row in rows]}
+        columnar = {"columnDefs": column_defs, "fields": fields, "rows": rows}
+
+        # What the endpoints did before: JsonResponse's json.dumps over a dict per row
+        cases = [("row dicts, json", None, lambda: json.dumps(row_dicts, cls=DjangoJSONEncoder).encode())]
+        cases.append(("columnar, json", "stdlib", lambda: fast_json.dumps(columnar)))
+        if fast_json.orjson is not None:
+            cases.append(("columnar, orjson", "orjson", lambda: fast_json.dumps(columnar)))
+        else:
+            self.stdout.write("orjson isn't installed, only the standard library encoder is measured.")
+
+        self.stdout.write(f"{options['items']} rows x {len(fields)} fields, {options['repeat']} encodes each")
+        self.stdout.write(f"{'format':<20}{'ms/encode':>11}{'bytes':>10}{'gzipped':>10}")
+        for name, backend, encode in cases:
+            with override_settings(JSON_ENCODER=backend or "stdlib"):
+                body = encode()
+                started = time.perf_counter()
+                for _ in range(options["repeat"]):
+                    encode()
+                per_encode_ms = (time.perf_counter() - started) * 1000 / options["repeat"]
+            self.stdout.write(f"{name:<20}{per_encode_ms:>11.3f}{len(body):>10}{len(gzip.compress(body)):>10}")
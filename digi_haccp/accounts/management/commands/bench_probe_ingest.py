@@ -0,0 +1,131 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+
+from accounts import fast_json
+from accounts.models import ChecklistItem, Deli, Probe, ProbeReading, TemplateField
+from accounts.probes import new_gateway, reading_buffer
+from accounts.sharding import using_deli_shard
+
+
+# (Probe Ingest Benchmark)
+# Posts batches of made-up readings to /api/probes/readings/ from --clients threads for
+# --seconds, once writing each batch during the request and once through the buffer, and
+# reports the readings per second that actually reached the database (the buffered run only
+# stops its clock once the buffer is empty). It makes its own gateway and probes on one of
+# the deli's items and deletes them, with their readings, afterwards.
+# Usage: python manage.py bench_probe_ingest --deli 3 --probes 50 --batch 500 --seconds 10
+class Command(BaseCommand):
+    help = "Measures sustained probe readings per second, written per request and buffered."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--deli", type=int, help="Deli to add the probes to (the first one with a numeric field by default).")
+        parser.add_argument("--probes", type=int, default=50, help="Probes posting readings.")
+        parser.add_argument("--batch", type=int, default=500, help="Readings per request.")
+        parser.add_argument("--clients", type=int, default=4, help="Gateways posting at the same time.")
+        parser.add_argument("--seconds", type=float, default=10, help="How long each mode posts for.")
+        parser.add_argument("--modes", default="sync,buffered", help="Comma separated list of modes to run.")
+
+    def handle(self, *args, **options):
+        item, field = self._numeric_cell(options["deli"])
+        gateway, token = new_gateway(item.checklist.deli, "bench_probe_ingest")
+        probes = [
+            Probe.objects.create(
+                deli_id=gateway.deli_id, serial=f"bench-{gateway.pk}-{number}", checklist_item=item, template_field=field,
+            )
+            for number in range(options["probes"])
+        ]
+        self.stdout.write(
+            f"{len(probes)} probes on {item} / {field.label}, {options['clients']} clients, "
+            f"{options['batch']} readings per request, {options['seconds']:g}s per mode"
+        )
+
+        try:
+            self.stdout.write(f"{'mode':<10}{'requests':>10}{'readings':>11}{'stored':>10}{'ms/request':>12}{'readings/s':>12}")
+            for mode in options["modes"].split(","):
+                flush_seconds = 0 if mode == "sync" else 1
+                with override_settings(PROBE_FLUSH_SECONDS=flush_seconds):
+                    self._run(mode, token, probes, field, options)
+        finally:
+            with using_deli_shard(gateway.deli_id):
+                ProbeReading.objects.filter(probe__in=probes).delete()
+            Probe.objects.filter(pk__in=[probe.pk for probe in probes]).delete()
+            gateway.delete()
+
+    def _numeric_cell(self, deli_id):
+        delis = Deli.objects.filter(pk=deli_id) if deli_id else Deli.objects.order_by("pk")
+        for deli in delis:
+            for item in ChecklistItem.objects.filter(
+                checklist__deli=deli, checklist__deleted_at__isnull=True,
+            ).select_related("checklist__deli").order_by("pk"):
+                field = TemplateField.objects.filter(
+                    template_id=item.checklist.template_id, field_type__in=("decimal", "number"),
+                ).order_by("order", "pk").first()
+                if field is not None:
+                    return item, field
+        raise CommandError("No checklist item with a decimal or whole number field to put the probes on.")
+
+    def _run(self, mode, token, probes, field, options):
+        url = reverse("api_probe_readings")
+        with using_deli_shard(probes[0].deli_id):
+            stored_before = ProbeReading.objects.filter(probe__in=probes).count()
+        deadline = time.perf_counter() + options["seconds"]
+        lock = threading.Lock()
+        totals = {"requests": 0, "readings": 0, "request_seconds": 0.0}
+
+        def post_batches(seed):
+            pick = random.Random(seed)
+            client = Client(HTTP_HOST="localhost")
+            try:
+                while time.perf_counter() < deadline:
+                    taken_at = now() - timedelta(seconds=1)
+                    readings = [
+                        {
+                            "probe": pick.choice(probes).serial,
+                            "at": taken_at.isoformat(),
+                            # Whole numbers in the core temperature range are valid for every field
+                            "value": pick.randint(76, 99) if field.field_type == "number" else round(pick.uniform(76, 99), 1),
+                        }
+                        for _ in range(options["batch"])
+                    ]
+                    body = fast_json.dumps({"readings": readings})
+                    started = time.perf_counter()
+                    response = client.post(
+                        url, body, content_type="application/json", HTTP_AUTHORIZATION=f"Bearer {token}",
+                    )
+                    elapsed = time.perf_counter() - started
+                    if response.status_code == 503:
+                        time.sleep(float(response.get("Retry-After", "1")))
+                        continue
+                    if response.status_code not in (201, 202):
+                        raise CommandError(f"{url} answered {response.status_code}: {response.content[:200]!r}")
+                    with lock:
+                        totals["requests"] += 1
+                        totals["readings"] += fast_json.loads(response.content)["accepted"]
+                        totals["request_seconds"] += elapsed
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["clients"]) as pool:
+            for future in [pool.submit(post_batches, seed) for seed in range(options["clients"])]:
+                future.result()
+        # Buffered readings only count once they are in the database
+        reading_buffer.flush()
+        elapsed = time.perf_counter() - started
+
+        with using_deli_shard(probes[0].deli_id):
+            stored = ProbeReading.objects.filter(probe__in=probes).count() - stored_before
+        per_request_ms = totals["request_seconds"] * 1000 / max(totals["requests"], 1)
+        self.stdout.write(
+            f"{mode:<10}{totals['requests']:>10}{totals['readings']:>11}{stored:>10}"
+            f"{per_request_ms:>12.1f}{stored / elapsed:>12.0f}"
+        )
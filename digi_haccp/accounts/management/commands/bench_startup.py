@@ -0,0 +1,96 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+# This snippet runs inside a brand new Python process so every run starts cold,
+# exactly like a freshly forked gunicorn worker that has to import and set up Django.
+BOOT_SNIPPET = """
+import json, os, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+setup_ms = (time.perf_counter() - started) * 1000
+
+timings, errors = {}, {}
+if os.environ.get("BENCH_WARM_UP") == "True":
+    from digi_haccp.warmup import warm_up
+    timings, errors = warm_up()
+
+from django.test import Client
+client = Client(HTTP_HOST="localhost")
+t0 = time.perf_counter()
+status = client.get(sys.argv[1]).status_code
+first_ms = (time.perf_counter() - t0) * 1000
+t0 = time.perf_counter()
+client.get(sys.argv[1])
+second_ms = (time.perf_counter() - t0) * 1000
+
+print(json.dumps({
+    "setup_ms": setup_ms,
+    "warm_up": timings,
+    "errors": errors,
+    "status": status,
+    "first_request_ms": first_ms,
+    "second_request_ms": second_ms,
+}))
+"""
+
+
+# (Startup Benchmark)
+# I use this command to measure how long a fresh worker takes to boot and how slow its first request is,
+# with and without the warm-up that gunicorn.conf.py runs in post_worker_init.
+# Usage: python manage.py bench_startup --runs 5 --path /login/
+class Command(BaseCommand):
+    help = "Benchmarks worker boot time and first-request latency with and without warm-up."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5, help="Fresh processes to start per mode.")
+        parser.add_argument("--path", default="/login/", help="URL requested after boot.")
+
+    def handle(self, *args, **options):
+        runs = options["runs"]
+        path = options["path"]
+
+        results = {}
+        for mode, warm in (("cold", False), ("warm", True)):
+            samples = [self._boot_once(path, warm) for _ in range(runs)]
+            results[mode] = samples
+
+            for name, error in samples[-1]["errors"].items():
+                self.stderr.write(f"{mode}: warm-up phase {name} failed: {error}")
+
+        self.stdout.write(f"Startup benchmark ({runs} fresh processes per mode, GET {path})")
+        self.stdout.write(f"{'':<22}{'cold':>12}{'warm':>12}")
+        for key in ("setup_ms", "boot_ms", "first_request_ms", "second_request_ms"):
+            cold = statistics.median(sample[key] for sample in results["cold"])
+            warm = statistics.median(sample[key] for sample in results["warm"])
+            self.stdout.write(f"{key:<22}{cold:>10.1f}ms{warm:>10.1f}ms")
+
+        self.stdout.write("Warm-up phases (median):")
+        for phase in results["warm"][0]["warm_up"]:
+            median = statistics.median(sample["warm_up"][phase] for sample in results["warm"])
+            self.stdout.write(f"  {phase:<20}{median:>10.1f}ms")
+
+    def _boot_once(self, path, warm):
+        env = dict(os.environ)
+        env["DJANGO_SETTINGS_MODULE"] = os.environ.get("DJANGO_SETTINGS_MODULE", "digi_haccp.settings")
+        env["BENCH_WARM_UP"] = "True" if warm else "False"
+
+        completed = subprocess.run(
+            [sys.executable, "-c", BOOT_SNIPPET, path],
+            cwd=settings.BASE_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        sample = json.loads(completed.stdout.strip().splitlines()[-1])
+        # boot_ms is what a worker spends before it can accept traffic
+        sample["boot_ms"] = sample["setup_ms"] + sum(sample["warm_up"].values())
+        return sample
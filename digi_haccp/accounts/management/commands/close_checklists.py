@@ -0,0 +1,38 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+
+from accounts.sharding import using_shard
+from accounts.snapshots import close_instance, due_instances_by_shard
+
+
+# (Close Checklists)
+# The end-of-day job: every unlocked instance from before --before (default today) is locked
+# and its final grid is stored as a snapshot. Run it from cron shortly after midnight.
+# It is safe to run again or in parallel, an instance that is already closed is skipped.
+class Command(BaseCommand):
+    help = "Locks checklist instances whose day is over and stores a snapshot of their final grid."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--before", type=date.fromisoformat, default=None,
+                            help="Close instances dated before this day (YYYY-MM-DD). Defaults to today.")
+        parser.add_argument("--grace-days", type=int, default=0,
+                            help="Leave instances open for this many extra days.")
+        parser.add_argument("--limit", type=int, default=None,
+                            help="Close at most this many instances in one run.")
+
+    def handle(self, *args, **options):
+        before = (options["before"] or date.today()) - timedelta(days=options["grace_days"])
+
+        due = due_instances_by_shard(before, options["limit"])
+
+        closed = 0
+        for alias, instance_ids in due:
+            with using_shard(alias):
+                for instance_id in instance_ids:
+                    # Each instance is its own transaction, so a long run never holds many locks
+                    if close_instance(instance_id):
+                        closed += 1
+
+        total = sum(len(instance_ids) for _, instance_ids in due)
+        self.stdout.write(f"Closed {closed} of {total} instances dated before {before}.")
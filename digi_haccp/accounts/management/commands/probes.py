@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import ChecklistItem, Deli, Probe, ProbeGateway, TemplateField
+from accounts.probes import new_gateway
+
+
+# (Probes)
+# Sets up a deli's temperature probes (see probes.py): a gateway token for the box that posts
+# the readings, and which checklist cell each probe serial reports into.
+# Usage:
+#   python manage.py probes token --deli 3 --name "Back kitchen"     # prints the token once
+#   python manage.py probes map --deli 3 --serial A1B2 --item 41 --field core_temp
+#   python manage.py probes list --deli 3
+class Command(BaseCommand):
+    help = "Creates probe gateway tokens and maps probe serials to checklist cells."
+
+    def add_arguments(self, parser):
+        commands = parser.add_subparsers(dest="command", required=True)
+
+        token = commands.add_parser("token", help="Create a gateway and print its token.")
+        token.add_argument("--deli", type=int, required=True)
+        token.add_argument("--name", required=True, help="Where the gateway is, to tell them apart later.")
+
+        mapping = commands.add_parser("map", help="Point a probe serial at an item's field (creates the probe).")
+        mapping.add_argument("--deli", type=int, required=True)
+        mapping.add_argument("--serial", required=True)
+        mapping.add_argument("--item", type=int, required=True, help="Checklist item id.")
+        mapping.add_argument("--field", required=True, help="Template field name, e.g. core_temp.")
+
+        listing = commands.add_parser("list", help="Show a deli's gateways and probes.")
+        listing.add_argument("--deli", type=int, required=True)
+
+    def handle(self, *args, **options):
+        try:
+            deli = Deli.objects.get(pk=options["deli"])
+        except Deli.DoesNotExist:
+            raise CommandError(f"There is no deli {options['deli']}.")
+        getattr(self, f"_{options['command']}")(deli, options)
+
+    def _token(self, deli, options):
+        gateway, token = new_gateway(deli, options["name"])
+        self.stdout.write(f"Gateway #{gateway.pk} for {deli}. Its token is only shown now:")
+        self.stdout.write(token)
+
+    def _map(self, deli, options):
+        item = ChecklistItem.objects.filter(
+            pk=options["item"], checklist__deli=deli, checklist__deleted_at__isnull=True,
+        ).select_related("checklist").first()
+        if item is None:
+            raise CommandError(f"Item {options['item']} isn't on one of {deli}'s checklists.")
+        field = TemplateField.objects.filter(template_id=item.checklist.template_id, name=options["field"]).first()
+        if field is None or field.field_type not in ("decimal", "number"):
+            raise CommandError(f"{options['field']!r} isn't a decimal or whole number field of this checklist.")
+
+        probe, created = Probe.objects.update_or_create(
+            deli=deli, serial=options["serial"],
+            defaults={"checklist_item": item, "template_field": field, "is_active": True},
+        )
+        self.stdout.write(f"{'Added' if created else 'Moved'} probe {probe}.")
+
+    def _list(self, deli, options):
+        for gateway in ProbeGateway.objects.filter(deli=deli).order_by("pk"):
+            state = "" if gateway.is_active else " (inactive)"
+            self.stdout.write(f"gateway #{gateway.pk} {gateway.name}{state}")
+        probes = Probe.objects.filter(deli=deli).select_related("checklist_item", "template_field").order_by("serial")
+        for probe in probes:
+            state = "" if probe.is_active else " (inactive)"
+            self.stdout.write(f"probe {probe}{state}")
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from accounts.models import ProcessedEdit
+from accounts.sharding import each_shard
+
+
+# Edit keys only need to live as long as a tablet might still replay its queue.
+# After that they are just rows, so this command deletes the old ones (run it daily from cron).
+class Command(BaseCommand):
+    help = "Deletes idempotency keys of offline edits older than --days (default 7)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7)
+
+    def handle(self, *args, **options):
+        cutoff = now() - timedelta(days=options["days"])
+        deleted = 0
+        for _ in each_shard():
+            deleted += ProcessedEdit.objects.filter(created_at__lt=cutoff).delete()[0]
+        self.stdout.write(f"Deleted {deleted} edit keys older than {options['days']} days.")
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from accounts.jobs import enqueue
+from accounts.models import Job
+from accounts.purge import pending_purges, purge
+
+
+# Finishes purging everything that is still soft-deleted. The purge job normally does this,
+# the command is for picking up purges that failed or were interrupted, either here
+# (with progress on the console) or by queueing them for the worker again (--enqueue).
+class Command(BaseCommand):
+    help = "Purges soft-deleted delis, users and checklists in batches, resuming any unfinished purge."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None, help="Rows per transaction (default PURGE_BATCH_SIZE).")
+        parser.add_argument("--enqueue", action="store_true", help="Queue purge jobs for the worker instead of purging here.")
+
+    def handle(self, *args, **options):
+        # A purge already queued or running will finish these, so they are left to it
+        busy = {
+            (job.payload.get("kind"), pk)
+            for job in Job.objects.filter(name="purge", status__in=[Job.STATUS_QUEUED, Job.STATUS_RUNNING])
+            for pk in job.payload.get("ids", [])
+        }
+
+        for kind, ids in pending_purges().items():
+            ids = [pk for pk in ids if (kind, pk) not in busy]
+            if not ids:
+                continue
+
+            if options["enqueue"]:
+                job = enqueue("purge", {"kind": kind, "ids": ids})
+                self.stdout.write(f"Queued purge of {len(ids)} {kind}(s) as job #{job.pk}.")
+                continue
+
+            def report(done, total):
+                self.stdout.write(f"\r{kind}: {done}/{total} rows", ending="")
+                self.stdout.flush()
+
+            result = purge(kind, ids, batch_size=options["batch_size"], on_progress=report)
+            self.stdout.write(f"\nPurged {len(ids)} {kind}(s), {result['rows']} rows.")
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import Deli
+from accounts.shard_moves import ShardMoveError, deli_sizes, move_deli, rebalance_plan, remove_leftovers
+from accounts.sharding import sharding_enabled
+
+
+# Shows how the checklist history is spread over the shards and moves delis between them.
+#   rebalance_shards                       -> answer rows and delis per shard
+#   rebalance_shards --deli 12 --to shard_2 -> move one deli
+#   rebalance_shards --auto [--dry-run]    -> move delis until the shards are within --tolerance
+#   rebalance_shards --resume              -> finish moves that were interrupted
+# Each move copies in batches and can be run again if it stops (see shard_moves.py).
+class Command(BaseCommand):
+    help = "Moves delis' checklist history between shards in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--deli", type=int, help="The deli to move.")
+        parser.add_argument("--to", help="The shard to move it to (default, shard_1, ...).")
+        parser.add_argument("--auto", action="store_true", help="Plan and run moves that even out the shards.")
+        parser.add_argument("--tolerance", type=float, default=0.1,
+                            help="With --auto, stop once the shards are this close (share of the average).")
+        parser.add_argument("--dry-run", action="store_true", help="With --auto, only print the plan.")
+        parser.add_argument("--resume", action="store_true", help="Finish moves that were interrupted.")
+        parser.add_argument("--cleanup", action="store_true", help="Delete rows left on shards a deli has moved off.")
+        parser.add_argument("--batch-size", type=int, default=None, help="Rows per batch (default SHARD_MOVE_BATCH_SIZE).")
+        parser.add_argument("--wait", type=float, default=5,
+                            help="Seconds to let running saves finish after a deli is marked as moving.")
+
+    def handle(self, *args, **options):
+        if not sharding_enabled():
+            raise CommandError("No shards are configured, set DB_SHARD_NAMES first.")
+
+        moves = []
+        if options["deli"] is not None:
+            if not options["to"]:
+                raise CommandError("Say where to move the deli with --to.")
+            moves.append((options["deli"], options["to"]))
+        elif options["resume"]:
+            moves.extend(Deli.all_objects.exclude(shard_moving_to="").values_list("pk", "shard_moving_to"))
+        elif options["cleanup"]:
+            for deli_id in Deli.all_objects.values_list("pk", flat=True):
+                deleted = remove_leftovers(deli_id, batch_size=options["batch_size"])
+                if deleted:
+                    self.stdout.write(f"Deli {deli_id}: deleted {deleted} leftover rows.")
+            return
+        elif options["auto"]:
+            for deli_id, source, target, rows in rebalance_plan(deli_sizes(), options["tolerance"]):
+                self.stdout.write(f"Deli {deli_id}: {source} -> {target} ({rows} answer rows)")
+                moves.append((deli_id, target))
+            if options["dry_run"] or not moves:
+                return
+        else:
+            for alias, delis in deli_sizes().items():
+                self.stdout.write(f"{alias}: {len(delis)} delis, {sum(delis.values())} answer rows")
+            return
+
+        for deli_id, target in moves:
+            def report(done, total):
+                self.stdout.write(f"\rDeli {deli_id} -> {target}: {done}/{total} rows", ending="")
+                self.stdout.flush()
+
+            try:
+                result = move_deli(deli_id, target, batch_size=options["batch_size"],
+                                   wait_seconds=options["wait"], on_progress=report)
+            except (ShardMoveError, Deli.DoesNotExist) as error:
+                raise CommandError(f"Deli {deli_id}: {error}")
+            self.stdout.write(f"\nDeli {deli_id} moved from {result['from']} to {result['to']}, {result['rows']} rows.")
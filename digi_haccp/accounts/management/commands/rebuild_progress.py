@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import ChecklistResponse
+from accounts.progress import link_instance_responses, recount_responses
+from accounts.sharding import each_shard
+
+
+# Recounts the progress counters of every response from its answers, in batches,
+# and links instances to their response. Run it once after migrating and whenever
+# the counters look wrong.
+class Command(BaseCommand):
+    help = "Recounts filled/required-missing cells for checklist responses and links instances to them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--deli", type=int, default=None, help="Only rebuild responses for this deli id.")
+
+    def handle(self, *args, **options):
+        linked = 0
+        rebuilt = 0
+        # Once per shard when sharding is set up, otherwise just the primary
+        for _ in each_shard():
+            linked += link_instance_responses()
+
+            response_ids = ChecklistResponse.objects.order_by("pk").values_list("pk", flat=True)
+            if options["deli"] is not None:
+                response_ids = response_ids.filter(deli_id=options["deli"])
+            response_ids = list(response_ids)
+
+            batch_size = options["batch_size"]
+            for start in range(0, len(response_ids), batch_size):
+                rebuilt += recount_responses(response_ids[start:start + batch_size])
+
+        self.stdout.write(f"Rebuilt progress for {rebuilt} responses, linked {linked} instances.")
@@ -0,0 +1,68 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from accounts.partitions import (
+    archive_partition, default_partition_rows, detached_partitions, ensure_partitions, expired_partitions,
+    is_partitioned, partitions,
+)
+from accounts.sharding import each_shard
+
+
+# (Answer Partitions)
+# Creates the partitions for the coming months on every shard and lists what is there. With
+# --archive it also detaches the months past RESPONSE_ITEM_RETENTION_MONTHS, writes each one
+# to <archive dir>/<database>/<partition>.csv.gz with a manifest and drops it (run it monthly
+# from cron). Databases that aren't partitioned are skipped.
+# Usage: python manage.py response_item_partitions
+#        python manage.py response_item_partitions --archive --dry-run
+#        python manage.py response_item_partitions --archive --keep
+class Command(BaseCommand):
+    help = "Creates upcoming monthly answer partitions and archives the ones past the retention window."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--months-ahead", type=int, default=settings.RESPONSE_ITEM_PARTITION_MONTHS_AHEAD)
+        parser.add_argument("--archive", action="store_true", help="Archive and drop months past the retention window.")
+        parser.add_argument("--retention-months", type=int, default=settings.RESPONSE_ITEM_RETENTION_MONTHS)
+        parser.add_argument("--archive-dir", default=settings.RESPONSE_ITEM_ARCHIVE_DIR)
+        parser.add_argument("--keep", action="store_true", help="Leave archived months as detached tables.")
+        parser.add_argument("--dry-run", action="store_true", help="Only list what would be created and archived.")
+
+    def handle(self, *args, **options):
+        for alias in each_shard():
+            connection = connections[alias]
+            if not is_partitioned(connection):
+                self.stdout.write(f"{alias}: not partitioned (set RESPONSE_ITEM_PARTITIONING=True and migrate)")
+                continue
+
+            if options["dry_run"]:
+                created = []
+            else:
+                created = ensure_partitions(connection, options["months_ahead"])
+            attached = partitions(connection)
+            self.stdout.write(
+                f"{alias}: {len(attached)} monthly partitions ({attached[0][1]:%Y-%m} to {attached[-1][1]:%Y-%m}), "
+                f"{default_partition_rows(connection)} rows in the default partition"
+                + (f", created {', '.join(created)}" if created else "")
+                if attached else f"{alias}: no monthly partitions"
+            )
+            if not options["archive"]:
+                continue
+
+            # Months a previous run detached but didn't finish come first (with --keep, months
+            # that are already in the archive are left as they are)
+            directory = Path(options["archive_dir"]) / alias
+            names = [
+                name for name in detached_partitions(connection)
+                if not (options["keep"] and (directory / f"{name}.csv.gz").exists())
+            ] + [name for name, _, _ in expired_partitions(connection, options["retention_months"])]
+            for name in names:
+                if options["dry_run"]:
+                    self.stdout.write(f"  would archive {name} to {directory}")
+                    continue
+                archived = archive_partition(connection, name, directory, drop=not options["keep"])
+                self.stdout.write(f"  archived {name}: {archived['rows']} rows to {archived['file']}")
+            if not names:
+                self.stdout.write(f"  nothing older than {options['retention_months']} months")
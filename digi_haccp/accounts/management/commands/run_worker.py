@@ -0,0 +1,103 @@
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+
+from accounts.jobs import claim_job, keep_alive, requeue_stale_jobs, run_job
+
+logger = logging.getLogger(__name__)
+
+
+# (Job Worker)
+# Runs queued background jobs. Each of the --concurrency threads claims one job at a time,
+# so several workers (on one machine or many) can share the queue safely.
+# When there is nothing to do a thread sleeps for --poll-interval seconds.
+# A running job's heartbeat is refreshed every --heartbeat-interval seconds, and every worker
+# looks for jobs that stopped beating for --stale-after seconds (their worker died) as often,
+# so they are requeued without waiting for a worker to restart.
+# SIGTERM/SIGINT lets running jobs finish before the worker exits.
+class Command(BaseCommand):
+    help = "Runs background jobs from the database queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=2, help="Jobs run at the same time.")
+        parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument("--heartbeat-interval", type=float, default=30.0,
+                            help="Seconds between the heartbeats of a running job.")
+        parser.add_argument("--stale-after", type=int, default=300,
+                            help="Seconds without a heartbeat after which a running job is assumed lost and requeued.")
+        parser.add_argument("--burst", action="store_true", help="Exit once the queue is empty.")
+
+    def handle(self, *args, **options):
+        heartbeat_interval = options["heartbeat_interval"]
+        stale_after = timedelta(seconds=options["stale_after"])
+        # A slow heartbeat or two must not make a healthy job look lost
+        if heartbeat_interval <= 0 or stale_after.total_seconds() < 3 * heartbeat_interval:
+            raise CommandError("--stale-after must be at least three times --heartbeat-interval.")
+
+        self.stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: self.stop.set())
+        signal.signal(signal.SIGINT, lambda *_: self.stop.set())
+
+        self.requeue_stale(stale_after)
+        next_check = time.monotonic() + heartbeat_interval
+
+        base_name = f"{socket.gethostname()}:{os.getpid()}"
+        threads = [
+            threading.Thread(
+                target=self.work,
+                args=(f"{base_name}:{number}", options["poll_interval"], options["burst"], heartbeat_interval),
+                name=f"job-worker-{number}",
+            )
+            for number in range(max(1, options["concurrency"]))
+        ]
+        for thread in threads:
+            thread.start()
+
+        # join() with a timeout keeps the main thread able to receive signals
+        try:
+            while any(thread.is_alive() for thread in threads):
+                if time.monotonic() >= next_check:
+                    self.requeue_stale(stale_after)
+                    next_check = time.monotonic() + heartbeat_interval
+                for thread in threads:
+                    thread.join(timeout=0.5)
+        finally:
+            connection.close()
+
+        self.stdout.write("Worker stopped.")
+
+    def requeue_stale(self, stale_after):
+        try:
+            close_old_connections()
+            requeued = requeue_stale_jobs(stale_after)
+        except Exception:
+            # The next check tries again, the running jobs carry on meanwhile
+            logger.exception("Couldn't look for jobs left running by a stopped worker")
+            connection.close()
+            return
+        if requeued:
+            logger.warning("Requeued %s jobs left running by a stopped worker", requeued)
+
+    def work(self, worker_name, poll_interval, burst, heartbeat_interval):
+        try:
+            while not self.stop.is_set():
+                close_old_connections()
+                job = claim_job(worker_name)
+                if job is None:
+                    if burst:
+                        return
+                    self.stop.wait(poll_interval)
+                    continue
+
+                logger.info("Running job %s #%s on %s", job.name, job.pk, worker_name)
+                with keep_alive(job, heartbeat_interval):
+                    run_job(job)
+        finally:
+            connection.close()
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from accounts.anomalies import LOOKBACK_DAYS, scan_delis
+from accounts.jobs import enqueue
+
+
+# (Score Anomalies)
+# Flags unusual numeric readings (spikes, slow drifts, days with no reading) into
+# ReadingAnomaly, see anomalies.py. Each run only scores the days after the last one that was
+# final, so it's cheap to run from cron after close_checklists.
+# Usage:
+#   python manage.py score_anomalies                 # every deli, new readings only
+#   python manage.py score_anomalies --deli 3 --rescan
+#   python manage.py score_anomalies --enqueue       # hand it to the background worker
+class Command(BaseCommand):
+    help = "Scores new numeric readings for spikes, drifts and missing days."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--deli", type=int, action="append", dest="delis", help="Only this deli (repeatable).")
+        parser.add_argument("--rescan", action="store_true",
+                            help="Forget what was scored before and score the last --lookback-days again.")
+        parser.add_argument("--lookback-days", type=int, default=LOOKBACK_DAYS,
+                            help="Days of earlier readings each series is compared with.")
+        parser.add_argument("--enqueue", action="store_true", help="Queue a job for the worker instead.")
+
+    def handle(self, *args, **options):
+        if options["enqueue"]:
+            job = enqueue("score_anomalies", {
+                "deli_ids": options["delis"],
+                "rescan": options["rescan"],
+                "lookback_days": options["lookback_days"],
+            })
+            self.stdout.write(f"Queued anomaly scoring as job #{job.pk}.")
+            return
+
+        def report(done, total):
+            self.stdout.write(f"\r{done}/{total} delis", ending="")
+            self.stdout.flush()
+
+        result = scan_delis(
+            options["delis"], rescan=options["rescan"], lookback_days=options["lookback_days"], on_progress=report,
+        )
+        self.stdout.write(f"\nScored {result['delis']} delis, {result['anomalies']} anomalies in the rescored days.")
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from accounts.shard_moves import (
+    ShardMoveError, prepare_shard_sequences, replicate_global_tables, replication_problems, subscription_state,
+)
+from accounts.sharding import shard_aliases, sharding_enabled
+
+
+# Gets the shards from DB_SHARD_NAMES ready: creates their tables, gives each one its own id
+# range and subscribes it to the primary's global tables (PostgreSQL logical replication, the
+# primary needs wal_level = logical). It then checks that every shard is subscribed. Safe to
+# run again after adding a shard or a global table.
+# Usage: python manage.py setup_shards
+#        python manage.py setup_shards --check
+class Command(BaseCommand):
+    help = "Migrates every shard, sets its id range and subscribes it to the global tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true", help="Only check that the global tables are replicated.")
+        parser.add_argument("--wait", type=int, default=600, help="Seconds to wait for a new shard's first copy.")
+
+    def handle(self, *args, **options):
+        if not sharding_enabled():
+            raise CommandError("No shards are configured, set DB_SHARD_NAMES first.")
+
+        if not options["check"]:
+            for alias in shard_aliases():
+                if alias == DEFAULT_DB_ALIAS:
+                    continue
+                call_command("migrate", database=alias, verbosity=0)
+                prepare_shard_sequences(alias)
+                try:
+                    replicate_global_tables(alias)
+                except ShardMoveError as error:
+                    raise CommandError(str(error))
+                self.stdout.write(
+                    f"{alias}: migrated, ids start above {shard_aliases().index(alias)} x 2^40, subscribed to the global tables."
+                )
+
+                # A new subscription first copies the tables as they are
+                deadline = time.monotonic() + options["wait"]
+                while (subscription_state(alias) or (True, 0))[1] and time.monotonic() < deadline:
+                    time.sleep(1)
+
+        problems = replication_problems()
+        if problems:
+            raise CommandError("\n".join(problems))
+        self.stdout.write("Every shard is subscribed to the global tables and has copied them.")
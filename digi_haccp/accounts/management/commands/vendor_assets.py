@@ -0,0 +1,88 @@
+import hashlib
+import json
+import urllib.request
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.vendor import LOCK_FILE, VENDOR_ASSETS, VENDOR_DIR, read_lock
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# Usage:
+#   python manage.py vendor_assets            # download anything missing, check the rest
+#   python manage.py vendor_assets --check    # only check, fails if a locked file is missing or changed
+#   python manage.py vendor_assets --check --strict  # ...or if any page would still load a file from the CDN
+#   python manage.py vendor_assets --update   # download everything again after changing a version
+class Command(BaseCommand):
+    help = "Downloads the pinned third-party CSS/JS into static/vendor and checks them against the lock file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true", help="Don't download, only check the files.")
+        parser.add_argument("--update", action="store_true", help="Download every file again and rewrite the lock.")
+        parser.add_argument("--strict", action="store_true",
+                            help="With --check, also fail when a pinned file isn't vendored yet.")
+        parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for each download.")
+
+    def handle(self, *args, **options):
+        lock = read_lock()
+        problems = []
+        from_cdn = []
+
+        for path, url in VENDOR_ASSETS.items():
+            target = VENDOR_DIR / path
+            pinned = lock.get(path)
+            # The lock remembers the URL too, so changing a version without --update is caught
+            if pinned is not None and pinned["url"] != url and not options["update"]:
+                problems.append(f"{path}: pinned from {pinned['url']}, run with --update to move to {url}")
+                continue
+
+            if target.exists() and not options["update"]:
+                digest = _sha256(target.read_bytes())
+                if pinned is not None and digest != pinned["sha256"]:
+                    problems.append(f"{path}: contents don't match the lock file")
+                elif pinned is None and options["check"]:
+                    # The pages only use our copy once it is in the lock file
+                    from_cdn.append(path)
+                elif pinned is None:
+                    lock[path] = {"url": url, "sha256": digest}
+                continue
+
+            if options["check"]:
+                # A file that was never locked is still loaded from its pinned CDN URL, which is
+                # fine. One that is in the lock but not on disk means a broken checkout.
+                if pinned is None:
+                    from_cdn.append(path)
+                else:
+                    problems.append(f"{path}: in the lock file but missing, run python manage.py vendor_assets")
+                continue
+
+            self.stdout.write(f"Downloading {url}")
+            try:
+                with urllib.request.urlopen(url, timeout=options["timeout"]) as response:
+                    data = response.read()
+            except OSError as error:
+                raise CommandError(f"Couldn't download {url}: {error}")
+
+            digest = _sha256(data)
+            if pinned is not None and pinned["url"] == url and digest != pinned["sha256"]:
+                problems.append(f"{path}: {url} no longer matches the lock file, not saved")
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(data)
+            lock[path] = {"url": url, "sha256": digest}
+
+        if not options["check"]:
+            VENDOR_DIR.mkdir(parents=True, exist_ok=True)
+            LOCK_FILE.write_text(json.dumps(lock, indent=2, sort_keys=True) + "\n")
+
+        if options["strict"]:
+            problems += [f"{path}: not vendored, run python manage.py vendor_assets and commit static/vendor" for path in from_cdn]
+        if problems:
+            raise CommandError("\n".join(problems))
+        for path in from_cdn:
+            self.stdout.write(f"{path}: not vendored yet, the pages load it from {VENDOR_ASSETS[path]}")
+        vendored = len(VENDOR_ASSETS) - len(from_cdn)
+        self.stdout.write(self.style.SUCCESS(f"{vendored} of {len(VENDOR_ASSETS)} pinned files are vendored and match the lock."))
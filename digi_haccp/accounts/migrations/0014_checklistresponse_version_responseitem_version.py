@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 00:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0013_delijoinrequest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checklistresponse',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='responseitem',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
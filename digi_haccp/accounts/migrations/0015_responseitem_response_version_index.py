@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-19 00:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0014_checklistresponse_version_responseitem_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='responseitem',
+            index=models.Index(fields=['response', 'version'], name='responseitem_resp_version_idx'),
+        ),
+    ]
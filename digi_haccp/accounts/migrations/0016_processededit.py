@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-19 00:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0015_responseitem_response_version_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedEdit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('response', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='processed_edits', to='accounts.checklistresponse')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='processed_edits', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-19 00:31
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0016_processededit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checklistinstance',
+            name='closed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='checklistinstance',
+            name='snapshot',
+            field=models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+    ]
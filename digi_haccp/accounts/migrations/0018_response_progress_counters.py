@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-19 00:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0017_checklistinstance_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checklistinstance',
+            name='response',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='instances', to='accounts.checklistresponse'),
+        ),
+        migrations.AddField(
+            model_name='checklistresponse',
+            name='filled_cells',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='checklistresponse',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='checklistresponse',
+            name='required_missing',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='checklistresponse',
+            name='total_cells',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
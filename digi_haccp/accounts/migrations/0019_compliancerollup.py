@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-19 00:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0018_response_progress_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ComplianceRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('week', 'Week'), ('month', 'Month')], max_length=10)),
+                ('period_start', models.DateField()),
+                ('due', models.PositiveIntegerField(default=0)),
+                ('completed', models.PositiveIntegerField(default=0)),
+                ('late', models.PositiveIntegerField(default=0)),
+                ('out_of_range', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('deli', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='compliance_rollups', to='accounts.deli')),
+                ('template', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='compliance_rollups', to='accounts.checklisttemplate')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'period_start'], name='rollup_period_start_idx')],
+                'constraints': [models.UniqueConstraint(fields=('deli', 'template', 'period', 'period_start'), name='unique_compliance_rollup_period')],
+            },
+        ),
+    ]
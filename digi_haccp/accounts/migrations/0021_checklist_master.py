@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-19 00:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0020_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checklist',
+            name='master',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='copies', to='accounts.checklist'),
+        ),
+        migrations.AddField(
+            model_name='checklistitem',
+            name='master_item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='copies', to='accounts.checklistitem'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0022_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deli',
+            name='shard',
+            field=models.CharField(db_index=True, default='default', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='deli',
+            name='shard_moving_to',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+    ]
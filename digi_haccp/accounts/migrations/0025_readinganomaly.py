@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0024_checklistitem_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deli',
+            name='anomalies_scanned_through',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ReadingAnomaly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('kind', models.CharField(choices=[('spike', 'Spike'), ('drift', 'Drift'), ('gap', 'Missing readings')], max_length=10)),
+                ('value', models.FloatField(blank=True, null=True)),
+                ('expected', models.FloatField(blank=True, null=True)),
+                ('score', models.FloatField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('checklist_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reading_anomalies', to='accounts.checklistitem')),
+                ('deli', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reading_anomalies', to='accounts.deli')),
+                ('template_field', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='reading_anomalies', to='accounts.templatefield')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['deli', 'date'], name='anomaly_deli_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('checklist_item', 'template_field', 'date', 'kind'), name='unique_reading_anomaly')],
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0025_readinganomaly'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Probe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('serial', models.CharField(max_length=64)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('checklist_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='probes', to='accounts.checklistitem')),
+                ('deli', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='probes', to='accounts.deli')),
+                ('template_field', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='probes', to='accounts.templatefield')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProbeGateway',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('token_hash', models.CharField(max_length=64, unique=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('deli', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='probe_gateways', to='accounts.deli')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProbeReading',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField()),
+                ('value', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('received_at', models.DateTimeField()),
+                ('checklist_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='probe_readings', to='accounts.checklistitem')),
+                ('deli', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='probe_readings', to='accounts.deli')),
+                ('probe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='readings', to='accounts.probe')),
+                ('template_field', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='probe_readings', to='accounts.templatefield')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='probe',
+            constraint=models.UniqueConstraint(fields=('deli', 'serial'), name='unique_probe_serial_per_deli'),
+        ),
+        migrations.AddIndex(
+            model_name='probereading',
+            index=models.Index(fields=['checklist_item', 'template_field', 'taken_at'], name='probereading_cell_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='probereading',
+            index=models.Index(fields=['deli', 'taken_at'], name='probereading_deli_time_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:45
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import TruncDate
+
+BATCH_SIZE = 10000
+
+
+# Existing answers get the day their response was started, a batch of ids per transaction
+# so a big table isn't locked or rewritten in one go
+def copy_response_dates(apps, schema_editor):
+    ChecklistResponse = apps.get_model("accounts", "ChecklistResponse")
+    ResponseItem = apps.get_model("accounts", "ResponseItem")
+    alias = schema_editor.connection.alias
+
+    started_on = Subquery(
+        ChecklistResponse.objects.filter(pk=OuterRef("response_id"))
+        .annotate(day=TruncDate("completed_at")).values("day")[:1]
+    )
+    last_pk = 0
+    while True:
+        batch = list(
+            ResponseItem.objects.using(alias).filter(pk__gt=last_pk)
+            .order_by("pk").values_list("pk", flat=True)[:BATCH_SIZE]
+        )
+        if not batch:
+            return
+        ResponseItem.objects.using(alias).filter(pk__gte=batch[0], pk__lte=batch[-1]).update(created_on=started_on)
+        last_pk = batch[-1]
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('accounts', '0026_probes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='responseitem',
+            name='created_on',
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+        migrations.RunPython(copy_response_dates, migrations.RunPython.noop),
+    ]
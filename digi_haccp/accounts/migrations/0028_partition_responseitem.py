@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.db import migrations
+
+
+# Opt-in: only runs on PostgreSQL with RESPONSE_ITEM_PARTITIONING=True. A database migrated
+# without it can opt in later with `migrate accounts 0027` followed by `migrate`, and going back
+# to 0027 turns a partitioned table back into a plain one. Both rebuild the table under an
+# exclusive lock, see accounts/partitions.py.
+def partition_response_items(apps, schema_editor):
+    from accounts.partitions import convert_to_partitioned
+
+    if schema_editor.connection.vendor == "postgresql" and settings.RESPONSE_ITEM_PARTITIONING:
+        convert_to_partitioned(schema_editor.connection, settings.RESPONSE_ITEM_PARTITION_MONTHS_AHEAD)
+
+
+def unpartition_response_items(apps, schema_editor):
+    from accounts.partitions import convert_to_plain
+
+    if schema_editor.connection.vendor == "postgresql":
+        convert_to_plain(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0027_responseitem_created_on'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_response_items, unpartition_response_items),
+    ]
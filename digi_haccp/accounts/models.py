@@ -1,5 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.timezone import localdate
 
 # (Custom User Manager)
 # I created my own user manager to handle user creation logic instead of using Django’s default.
@@ -22,6 +24,16 @@ class UserManager(BaseUserManager):
         return user
 
 
+# (Soft Delete Manager)
+# Delis and checklists are deleted in two steps: they are hidden straight away by setting
+# deleted_at, then the purge job removes them and their history in batches (see purge.py).
+# This manager is the default one, so every normal query already leaves out deleted rows.
+# `all_objects` still sees them, it's what the purge uses.
+class SoftDeleteManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 # (Deli model)
 # This model represents a Deli store. Each deli has an ID, name, address, and phone number.
 class Deli(models.Model):
@@ -29,6 +41,16 @@ class Deli(models.Model):
     deli_name = models.CharField(max_length=100)  # Name of the deli
     address = models.CharField(max_length=255)  # Address field for location info
     phone_number = models.IntegerField()  # Stores the deli’s contact number
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)  # Set when the deli is waiting to be purged
+    # Which database holds this deli's checklist history (see sharding.py), and where it's
+    # being moved to while rebalance_shards copies it
+    shard = models.CharField(max_length=50, default="default", db_index=True)
+    shard_moving_to = models.CharField(max_length=50, blank=True, default="")
+    # Every day up to this one has been checked for unusual readings and can't change any more (see anomalies.py)
+    anomalies_scanned_through = models.DateField(null=True, blank=True)
+
+    objects = SoftDeleteManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return self.deli_name  # This helps display the deli name in the admin panel
@@ -50,6 +72,7 @@ class User(AbstractBaseUser):
 
     is_active = models.BooleanField(default=True)  # Whether the account is active
     is_admin = models.BooleanField(default=False)  # Whether the user is an admin
+    deleted_at = models.DateTimeField(null=True, blank=True)  # Set when the user is waiting to be purged
 
     objects = UserManager()  # This connects the custom manager I made above
 
@@ -178,6 +201,18 @@ class Checklist(models.Model):
     title = models.CharField(max_length=255, blank=True)
     is_active = models.BooleanField(default=True)
 
+    # When one checklist is rolled out to many delis, the copies point back at the checklist
+    # they were made from, so item edits on that master can be pushed to all of them at once
+    master = models.ForeignKey(
+        "self", null=True, blank=True, on_delete=models.SET_NULL, related_name="copies"
+    )
+
+    # Set when the checklist is waiting to be purged (see SoftDeleteManager)
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    objects = SoftDeleteManager()
+    all_objects = models.Manager()
+
     def __str__(self):
         return self.title or f"{self.template.name} - {self.deli.deli_name} ({self.frequency})"
 
@@ -190,6 +225,13 @@ class ChecklistItem(models.Model):
     name = models.CharField(max_length=255)
     chemical_used = models.CharField(max_length=255, blank=True)
     order = models.PositiveIntegerField(default=0)
+    # Changes with every edit, so grids can tell whether the items changed (see http_cache.py)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # The master checklist's item this one was copied from (see Checklist.master)
+    master_item = models.ForeignKey(
+        "self", null=True, blank=True, on_delete=models.SET_NULL, related_name="copies"
+    )
 
     def __str__(self):
         return f"{self.name} ({self.checklist})"
@@ -204,6 +246,18 @@ class ChecklistResponse(models.Model):
     completed_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="checklist_responses")
     completed_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True) 
+    # I bump this every time any cell is saved, so each change gets its own number.
+    # Open grids use it to know which edits they have already seen.
+    version = models.PositiveBigIntegerField(default=0)
+
+    # (Progress Counters)
+    # Kept up to date by save_cell and ensure_response_items (see grid.py), so list pages can
+    # show "12/40 cells, 2 required missing" without reading the answers.
+    # Read-only cells (like chemical_used) are not counted. rebuild_progress fixes any drift.
+    total_cells = models.PositiveIntegerField(default=0)
+    filled_cells = models.PositiveIntegerField(default=0)
+    required_missing = models.PositiveIntegerField(default=0)
+    last_activity_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f"Response to {self.checklist} by {self.completed_by.email}"
@@ -252,6 +306,18 @@ class ResponseItem(models.Model):
         related_name="edited_response_items"
     )
     last_edited_at = models.DateTimeField(null=True, blank=True)
+    # The response version this cell was last changed at (0 means never edited)
+    version = models.PositiveBigIntegerField(default=0)
+    # The day the response was started, copied onto every one of its cells. On PostgreSQL the
+    # table can be split into one partition per month of this date (see partitions.py).
+    created_on = models.DateField(default=localdate)
+
+    class Meta:
+        indexes = [
+            # "Which cells changed since version N" has to be an index lookup,
+            # because tablets ask it every few seconds.
+            models.Index(fields=["response", "version"], name="responseitem_resp_version_idx"),
+        ]
 
     def __str__(self):
         return f"{self.checklist_item} — {self.template_field.label}"
@@ -267,6 +333,17 @@ class ChecklistInstance(models.Model):
     is_locked = models.BooleanField(default=False)  # I lock an instance after staff complete it
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Filled by the close job (see snapshots.py): the final grid, frozen when the instance is locked
+    # DjangoJSONEncoder writes decimals and dates the same way JsonResponse does
+    snapshot = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    closed_at = models.DateTimeField(null=True, blank=True)
+
+    # The shared response staff fill for this instance, so list pages can show its progress
+    # with a join. Set when the response is picked (see instances.py).
+    response = models.ForeignKey(
+        ChecklistResponse, null=True, blank=True, on_delete=models.SET_NULL, related_name="instances"
+    )
+
     class Meta:
         unique_together = ('checklist', 'deli', 'date')  # Prevent duplicates
 
@@ -286,3 +363,208 @@ class ChecklistInstanceItem(models.Model):
 
     def __str__(self):
         return f"{self.instance} — {self.checklist_item}"
+
+
+# (Processed Edit)
+# Tablets replay queued edits when their connection comes back, and a retry can send the
+# same edit twice. Each edit carries a key made by the browser, and I store every key I
+# have applied so a repeated edit is recognised and not applied a second time.
+class ProcessedEdit(models.Model):
+    key = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="processed_edits")
+    response = models.ForeignKey(ChecklistResponse, on_delete=models.CASCADE, related_name="processed_edits")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.key} ({self.user.email})"
+
+
+# (Compliance Rollup)
+# One row per deli, template and week or month with how many instances were due, how many
+# were completed (every required cell filled), how many of those were finished after their
+# day and how many cells were out of range. The close job adds each instance as it closes,
+# so trend reports read a few hundred rows instead of the whole answer history.
+class ComplianceRollup(models.Model):
+    PERIOD_WEEK = 'week'
+    PERIOD_MONTH = 'month'
+
+    PERIOD_CHOICES = [
+        (PERIOD_WEEK, 'Week'),
+        (PERIOD_MONTH, 'Month'),
+    ]
+
+    deli = models.ForeignKey(Deli, on_delete=models.CASCADE, related_name='compliance_rollups')
+    template = models.ForeignKey(ChecklistTemplate, on_delete=models.CASCADE, related_name='compliance_rollups')
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    period_start = models.DateField()  # Monday of the week or 1st of the month
+
+    due = models.PositiveIntegerField(default=0)
+    completed = models.PositiveIntegerField(default=0)
+    late = models.PositiveIntegerField(default=0)
+    out_of_range = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['deli', 'template', 'period', 'period_start'],
+                name='unique_compliance_rollup_period',
+            )
+        ]
+        indexes = [
+            # The heatmap reads one period type over a date range
+            models.Index(fields=['period', 'period_start'], name='rollup_period_start_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.deli} — {self.template.name} — {self.period} of {self.period_start}"
+
+
+# (Reading Anomaly)
+# A numeric reading (or a run of missing readings) that stands out from the same item's recent
+# history: a sudden spike, a slow drift, or days with nothing recorded. Written by the
+# score_anomalies job (see anomalies.py) and counted on the manager overview.
+class ReadingAnomaly(models.Model):
+    KIND_SPIKE = 'spike'
+    KIND_DRIFT = 'drift'
+    KIND_GAP = 'gap'
+
+    KIND_CHOICES = [
+        (KIND_SPIKE, 'Spike'),
+        (KIND_DRIFT, 'Drift'),
+        (KIND_GAP, 'Missing readings'),
+    ]
+
+    deli = models.ForeignKey(Deli, on_delete=models.CASCADE, related_name='reading_anomalies')
+    checklist_item = models.ForeignKey(ChecklistItem, on_delete=models.CASCADE, related_name='reading_anomalies')
+    template_field = models.ForeignKey(TemplateField, on_delete=models.PROTECT, related_name='reading_anomalies')
+    date = models.DateField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    value = models.FloatField(null=True, blank=True)     # the reading (empty for gaps)
+    expected = models.FloatField(null=True, blank=True)  # the recent average it was compared with
+    score = models.FloatField()                          # standard deviations away, or days missing for gaps
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['checklist_item', 'template_field', 'date', 'kind'],
+                name='unique_reading_anomaly',
+            )
+        ]
+        indexes = [
+            # The overview counts each deli's anomalies over the last few days
+            models.Index(fields=['deli', 'date'], name='anomaly_deli_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.checklist_item} — {self.template_field.label} — {self.get_kind_display()} on {self.date}"
+
+
+# (Probe Gateway)
+# A deli's wireless probes report through a gateway that posts batches of readings to
+# /api/probes/readings/ with its token. Only a SHA-256 of the token is stored, the token
+# itself is shown once by `manage.py probes token`.
+class ProbeGateway(models.Model):
+    deli = models.ForeignKey(Deli, on_delete=models.CASCADE, related_name='probe_gateways')
+    name = models.CharField(max_length=100)
+    token_hash = models.CharField(max_length=64, unique=True)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.deli})"
+
+
+# (Probe)
+# One physical probe, by the serial its gateway reports, and the checklist cell its readings
+# belong to (a decimal or whole number field of one of the deli's checklist items).
+class Probe(models.Model):
+    deli = models.ForeignKey(Deli, on_delete=models.CASCADE, related_name='probes')
+    serial = models.CharField(max_length=64)
+    checklist_item = models.ForeignKey(ChecklistItem, on_delete=models.CASCADE, related_name='probes')
+    template_field = models.ForeignKey(TemplateField, on_delete=models.PROTECT, related_name='probes')
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['deli', 'serial'], name='unique_probe_serial_per_deli'),
+        ]
+
+    def __str__(self):
+        return f"{self.serial} → {self.checklist_item} / {self.template_field.label}"
+
+
+# (Probe Reading)
+# One reading from a probe. The item and field are copied from the probe when it arrives,
+# so moving a probe to another fridge doesn't rewrite its history. Written in bulk by the
+# ingest buffer (see probes.py).
+class ProbeReading(models.Model):
+    deli = models.ForeignKey(Deli, on_delete=models.CASCADE, related_name='probe_readings')
+    probe = models.ForeignKey(Probe, on_delete=models.CASCADE, related_name='readings')
+    checklist_item = models.ForeignKey(ChecklistItem, on_delete=models.CASCADE, related_name='probe_readings')
+    template_field = models.ForeignKey(TemplateField, on_delete=models.PROTECT, related_name='probe_readings')
+    taken_at = models.DateTimeField()
+    value = models.DecimalField(max_digits=10, decimal_places=2)
+    received_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # Readings are read back as one cell's series over a time range
+            models.Index(fields=['checklist_item', 'template_field', 'taken_at'], name='probereading_cell_time_idx'),
+            models.Index(fields=['deli', 'taken_at'], name='probereading_deli_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.probe.serial} {self.value} at {self.taken_at}"
+
+
+# (Background Job)
+# Work that is too slow for a web request (big deletes, exports, imports) is stored here
+# and picked up by `python manage.py run_worker`. The queue lives in the same database,
+# so there is no extra service to run. See jobs.py for how jobs are claimed and retried.
+class Job(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)  # the registered task to run
+    payload = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    priority = models.IntegerField(default=0)  # higher runs first
+    run_at = models.DateTimeField()  # not picked up before this time
+
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    last_error = models.TextField(blank=True)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+
+    # Long jobs report how far they are, so the page that started them can show a progress bar
+    progress_done = models.PositiveIntegerField(default=0)
+    progress_total = models.PositiveIntegerField(null=True, blank=True)
+
+    created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='jobs')
+    locked_by = models.CharField(max_length=100, blank=True)  # the worker running it
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Refreshed while the job runs, so a job whose worker died can be told from a long one
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers look for the next queued job that is due, highest priority first
+            models.Index(fields=['status', '-priority', 'run_at'], name='job_dequeue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
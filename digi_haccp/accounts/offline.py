@@ -0,0 +1,248 @@
+from datetime import date, timezone as dt_timezone
+
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware
+
+from .grid import (
+    SAVE_SAVED,
+    CellValidationError,
+    answer_json_value,
+    ensure_response_items,
+    fill_column_defs,
+    fill_rows,
+    row_fields,
+    save_cell,
+)
+from .instances import shared_response_for, todays_instances
+from .models import ChecklistResponse, ProcessedEdit, ResponseItem, TemplateField
+from .sharding import each_deli_shard
+
+
+# (Offline Support)
+# Deli back rooms have patchy Wi-Fi, so the fill grid queues edits in the browser and
+# replays them in batches once the connection is back. This file applies those batches,
+# and builds the "today's work" payload a tablet downloads while it is still online.
+
+# I cap batches so one replay can't hold a worker for too long
+MAX_BATCH_EDITS = 200
+
+
+# (Parse Edit Time)
+# Browsers send ISO 8601 timestamps. Anything without a timezone is treated as UTC.
+def parse_edited_at(value):
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(str(value))
+    except ValueError:
+        return None
+    if parsed is not None and is_naive(parsed):
+        parsed = make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+
+def _clean_key(value):
+    key = str(value or "").strip()
+    return key[:64] or None
+
+
+def _clean_id(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value if value > 0 else None
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+
+# (Clean Edit)
+# Edits come straight from the browser's queue, so every part is checked for its type before
+# it is used. Returns the edit with its ids as numbers and its key trimmed, or an error message.
+def _clean_edit(edit):
+    key = edit.get("key")
+    if key is not None and not isinstance(key, str):
+        return None, "key must be text."
+    response_id = _clean_id(edit.get("response_id"))
+    if response_id is None:
+        return None, "response_id must be a whole number."
+    item_id = _clean_id(edit.get("item_id"))
+    if item_id is None:
+        return None, "item_id must be a whole number."
+    field = edit.get("field")
+    if not isinstance(field, str):
+        return None, "field must be text."
+    value = edit.get("value")
+    if value is not None and not isinstance(value, (str, int, float)):
+        return None, "value must be text, a number or true/false."
+    edited_at = edit.get("edited_at")
+    if edited_at is not None and not isinstance(edited_at, str):
+        return None, "edited_at must be an ISO 8601 time."
+
+    return {
+        "key": _clean_key(key), "response_id": response_id, "item_id": item_id,
+        "field": field, "value": value, "edited_at": edited_at,
+    }, None
+
+
+# (Save Result)
+# What a single save returns to the grid. When the edit was a duplicate or lost to a newer
+# edit I include the value that was kept, so the cell can show it.
+def save_field_result(status, template_field, answer):
+    result = {"success": True, "status": status, "version": answer.version}
+    if status != SAVE_SAVED:
+        result["value"] = answer_json_value(template_field, answer)
+    return result
+
+
+# (Apply Edit Batch)
+# Each edit is {key, response_id, item_id, field, value, edited_at}. One that doesn't have
+# the right types is refused on its own, before anything is looked up.
+# I load everything the batch touches in a handful of queries, then save each edit in its
+# own transaction so one bad value doesn't throw away the rest of the queue.
+# The result for every edit says whether it was saved, already applied (duplicate),
+# beaten by a newer edit (stale) or rejected (error). For anything but "saved" the
+# current server value is included so the grid can show it.
+def apply_edit_batch(user, edits):
+    allowed_deli_ids = set(user.delis.values_list("pk", flat=True))
+    cleaned, results = [], []
+    for edit in edits:
+        edit, error = _clean_edit(edit)
+        cleaned.append(edit)
+        if edit is None:
+            results.append({"key": None, "item": None, "field": None, "status": "error", "error": error})
+        else:
+            results.append({"key": edit["key"], "item": edit["item_id"], "field": edit["field"]})
+    edits = cleaned
+
+    # A response lives on its deli's shard, so each shard applies the edits for its own responses
+    for shard_deli_ids in each_deli_shard(allowed_deli_ids):
+        _apply_shard_edits(user, edits, results, shard_deli_ids)
+
+    for result in results:
+        if "status" not in result:
+            result.update(status="error", error="Checklist not found.")
+    return results
+
+
+def _apply_shard_edits(user, edits, results, deli_ids):
+    edits = [(edit, result) for edit, result in zip(edits, results) if edit is not None]
+    responses = ChecklistResponse.objects.filter(deli_id__in=deli_ids).select_related("checklist").in_bulk(
+        {edit["response_id"] for edit, _ in edits}
+    )
+
+    template_ids = {response.checklist.template_id for response in responses.values()}
+    fields = {
+        (field.template_id, field.name): field
+        for field in TemplateField.objects.filter(template_id__in=template_ids)
+    }
+
+    answers = {
+        (answer.response_id, answer.checklist_item_id, answer.template_field_id): answer
+        for answer in ResponseItem.objects.filter(response_id__in=responses.keys())
+    }
+
+    # Keys that were applied by an earlier replay don't need to touch the cells at all
+    keys = {edit["key"] for edit, _ in edits} - {None}
+    already_applied = set(ProcessedEdit.objects.filter(key__in=keys).values_list("key", flat=True))
+
+    for edit, result in edits:
+        key = edit["key"]
+
+        # Responses from the user's other shards (or none at all) are left for later
+        response = responses.get(edit["response_id"])
+        if response is None:
+            continue
+
+        template_field = fields.get((response.checklist.template_id, edit["field"]))
+        answer = None
+        if template_field is not None:
+            answer = answers.get((response.id, edit["item_id"], template_field.id))
+        if answer is None:
+            result.update(status="error", error="Cell not found.")
+            continue
+
+        if key in already_applied:
+            result.update(status="duplicate", value=answer_json_value(template_field, answer), version=answer.version)
+            continue
+
+        value = edit["value"]
+        try:
+            status = save_cell(
+                answer,
+                template_field,
+                response,
+                user,
+                "" if value is None else str(value),
+                edited_at=parse_edited_at(edit["edited_at"]),
+                idempotency_key=key,
+            )
+        except CellValidationError as error:
+            answer.refresh_from_db()
+            result.update(status="error", error=str(error))
+            status = None
+
+        if status:
+            result["status"] = status
+        if status != SAVE_SAVED:
+            result["value"] = answer_json_value(template_field, answer)
+        result["version"] = answer.version
+
+
+# (Batch Results Payload)
+# The results go back in the same columnar form as the grids: the names once, then one list
+# per edit. Names an edit's result doesn't have are left off the end of its list, so "value"
+# (last) is only there when the server sends the cell's kept value back.
+BATCH_RESULT_FIELDS = ["key", "item", "field", "status", "version", "error", "value"]
+
+
+def batch_results_payload(results):
+    rows = []
+    for result in results:
+        row = [result.get(name) for name in BATCH_RESULT_FIELDS]
+        while row and BATCH_RESULT_FIELDS[len(row) - 1] not in result:
+            row.pop()
+        rows.append(row)
+    return {"fields": BATCH_RESULT_FIELDS, "results": rows}
+
+
+# (Today's Work)
+# Everything a staff member needs for today in one payload: each instance with its grid
+# columns, rows and the response/version the grid writes to. The tablet keeps this so the
+# checklists can still be shown and queued into while the connection is down.
+def todays_work_payload(user):
+    instances = todays_instances(user)
+
+    fields_by_template = {}
+    payload = {}
+    for shard_deli_ids in each_deli_shard({instance.deli_id for instance in instances}):
+        for instance in instances:
+            if instance.deli_id in shard_deli_ids:
+                payload[instance.id] = _instance_work(instance, user, fields_by_template)
+
+    return {
+        "date": date.today().isoformat(),
+        "instances": [payload[instance.id] for instance in instances],
+    }
+
+
+def _instance_work(instance, user, fields_by_template):
+    checklist = instance.checklist
+    if checklist.template_id not in fields_by_template:
+        fields_by_template[checklist.template_id] = list(checklist.template.fields.order_by("order"))
+    fields = fields_by_template[checklist.template_id]
+    items = list(checklist.items.order_by("order"))
+
+    response = shared_response_for(instance, user)
+    answers = ensure_response_items(response, items, fields)
+
+    return {
+        "instance_id": instance.id,
+        "checklist": checklist.title or checklist.template.name,
+        "deli": instance.deli.deli_name,
+        "date": instance.date.isoformat(),
+        "locked": instance.is_locked,
+        "response_id": response.id,
+        "version": response.version,
+        "columnDefs": fill_column_defs(fields, instance.is_locked),
+        "fields": row_fields(fields),
+        "rows": fill_rows(fields, items, answers),
+    }
@@ -0,0 +1,128 @@
+import hashlib
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Q, Sum
+
+from .grid import out_of_range_cells_q
+from .models import Checklist, ChecklistInstance, Deli, ReadingAnomaly, ResponseItem
+from .sharding import each_deli_shard
+
+
+# (Manager Overview)
+# Today's status for every deli a manager has, in a fixed number of grouped queries
+# (delis, due checklists, today's instances, out-of-range readings, anomalies) no matter how many
+# delis there are. The progress numbers come from the counters on ChecklistResponse.
+
+
+def _by_deli(rows):
+    return {row.pop("deli_id"): row for row in rows}
+
+
+def _progress_by_deli(deli_ids, today):
+    completed = Q(response__total_cells__gt=0, response__required_missing=0)
+    return _by_deli(
+        ChecklistInstance.objects.filter(deli_id__in=deli_ids, date=today, checklist__is_active=True)
+        .values("deli_id")
+        .annotate(
+            started=Count("id", filter=Q(response__isnull=False)),
+            completed=Count("id", filter=completed),
+            filled_cells=Sum("response__filled_cells"),
+            total_cells=Sum("response__total_cells"),
+            required_missing=Sum("response__required_missing"),
+            last_activity=Max("response__last_activity_at"),
+        )
+    )
+
+
+def _out_of_range_by_deli(deli_ids, today):
+    return dict(
+        ResponseItem.objects.filter(
+            response__instances__deli_id__in=deli_ids,
+            response__instances__date=today,
+            response__checklist__deleted_at__isnull=True,
+        )
+        .filter(out_of_range_cells_q())
+        .values("response__deli_id")
+        .annotate(count=Count("id", distinct=True))
+        .values_list("response__deli_id", "count")
+    )
+
+
+# Anomalies found by score_anomalies over the last ANOMALY_DAYS days (today included)
+ANOMALY_DAYS = 7
+
+
+def _anomalies_by_deli(deli_ids, today):
+    return dict(
+        ReadingAnomaly.objects.filter(deli_id__in=deli_ids, date__gt=today - timedelta(days=ANOMALY_DAYS))
+        .values("deli_id")
+        .annotate(count=Count("id"))
+        .values_list("deli_id", "count")
+    )
+
+
+def overview_payload(deli_ids, today=None):
+    today = today or date.today()
+
+    delis = Deli.objects.filter(pk__in=deli_ids).order_by("deli_name").values("deli_ID", "deli_name")
+
+    # Every active checklist is due each day (todays_instances creates one instance per day)
+    due = _by_deli(
+        Checklist.objects.filter(deli_id__in=deli_ids, is_active=True)
+        .values("deli_id")
+        .annotate(due=Count("id"))
+    )
+
+    # The history queries run once per shard when the delis are spread over several
+    progress = {}
+    out_of_range = {}
+    anomalies = {}
+    for shard_deli_ids in each_deli_shard(deli_ids):
+        progress.update(_progress_by_deli(shard_deli_ids, today))
+        out_of_range.update(_out_of_range_by_deli(shard_deli_ids, today))
+        anomalies.update(_anomalies_by_deli(shard_deli_ids, today))
+
+    rows = []
+    for deli in delis:
+        deli_id = deli["deli_ID"]
+        counts = progress.get(deli_id, {})
+        due_today = due.get(deli_id, {}).get("due", 0)
+        done = counts.get("completed", 0)
+        rows.append({
+            "deli_id": deli_id,
+            "deli": deli["deli_name"],
+            "due": due_today,
+            "started": counts.get("started", 0),
+            "completed": done,
+            "not_started": max(due_today - counts.get("started", 0), 0),
+            "filled_cells": counts.get("filled_cells") or 0,
+            "total_cells": counts.get("total_cells") or 0,
+            "required_missing": counts.get("required_missing") or 0,
+            "last_activity": counts["last_activity"].isoformat() if counts.get("last_activity") else None,
+            "out_of_range": out_of_range.get(deli_id, 0),
+            "anomalies": anomalies.get(deli_id, 0),
+            "all_done": due_today > 0 and done >= due_today,
+        })
+
+    return {"date": today.isoformat(), "delis": rows}
+
+
+# (Cached Overview)
+# Managers with the same delis share one cache entry. The key includes the date so
+# the cache never serves yesterday's numbers after midnight.
+def cached_overview_payload(deli_ids):
+    timeout = settings.MANAGER_OVERVIEW_CACHE_SECONDS
+    if timeout <= 0:
+        return overview_payload(deli_ids)
+
+    today = date.today()
+    delis_key = hashlib.md5(",".join(map(str, sorted(deli_ids))).encode()).hexdigest()
+    key = f"manager-overview:{today.isoformat()}:{delis_key}"
+
+    payload = cache.get(key)
+    if payload is None:
+        payload = overview_payload(deli_ids, today)
+        cache.set(key, payload, timeout)
+    return payload
@@ -0,0 +1,282 @@
+import csv
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+from datetime import date
+from pathlib import Path
+
+from django.db import transaction
+from django.utils.timezone import localdate, now
+
+from .models import ResponseItem
+
+logger = logging.getLogger(__name__)
+
+
+# (Answer Partitions)
+# ResponseItem only ever grows, and most of it is years old and never read again, yet vacuum,
+# index upkeep and backups go over all of it. On PostgreSQL the table can be turned into a
+# partitioned table with one partition per month of created_on (the day the response was
+# started), plus a default partition that catches anything without a month of its own:
+#   - RESPONSE_ITEM_PARTITIONING=True and `migrate` converts an existing table (0028),
+#   - `response_item_partitions` creates the coming months ahead of time,
+#   - `response_item_partitions --archive` detaches the months past the retention window,
+#     writes each one to a gzipped CSV with a manifest and drops it.
+# The views don't change. Django still sees one table called accounts_responseitem, and the
+# primary key is (id, created_on) only because PostgreSQL wants the partition key in it.
+# Closed days keep their snapshot (see close_checklists), so their history pages still work
+# once their answers are archived.
+# Reference: https://www.postgresql.org/docs/current/ddl-partitioning.html
+
+TABLE = ResponseItem._meta.db_table
+DEFAULT_PARTITION = f"{TABLE}_default"
+PARTITION_NAME = re.compile(rf"^{TABLE}_p(\d{{4}})_(\d{{2}})$")
+BOUNDS = re.compile(r"FROM \('(\d{4}-\d{2}-\d{2})'\) TO \('(\d{4}-\d{2}-\d{2})'\)")
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{TABLE}_p{month:%Y_%m}"
+
+
+def is_partitioned(connection):
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == "p"
+
+
+# (Partition List)
+# The months attached right now, as (name, first day, first day of the next month)
+def partitions(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = to_regclass(%s) ORDER BY child.relname",
+            [TABLE],
+        )
+        rows = cursor.fetchall()
+    found = []
+    for name, bounds in rows:
+        match = BOUNDS.search(bounds)
+        if match:
+            found.append((name, date.fromisoformat(match[1]), date.fromisoformat(match[2])))
+    return found
+
+
+# Month tables that exist but aren't attached: an archive that stopped after the detach
+def detached_partitions(connection):
+    attached = {name for name, _, _ in partitions(connection)}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT tablename FROM pg_tables WHERE schemaname = current_schema() AND tablename LIKE %s",
+            [f"{TABLE}\\_p%"],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    return sorted(name for name in names if PARTITION_NAME.match(name) and name not in attached)
+
+
+def default_partition_rows(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM {connection.ops.quote_name(DEFAULT_PARTITION)}")
+        return cursor.fetchone()[0]
+
+
+# (Convert)
+# Rebuilds the table as a partitioned (or, going back, a plain) table under the same name,
+# with the same indexes, foreign keys and checks and an id sequence that carries on where the
+# old one was (so a shard keeps its id range). It holds an exclusive lock and copies every row,
+# so run it when the shops are closed. Called from migration 0028 in both directions.
+def _definition(cursor):
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s "
+        "AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'p')",
+        [TABLE, TABLE],
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = to_regclass(%s) AND contype IN ('p', 'f', 'c') ORDER BY conname",
+        [TABLE],
+    )
+    constraints = cursor.fetchall()
+    return indexes, constraints
+
+
+def _rebuild(connection, partitioned, months_ahead=3):
+    quote = connection.ops.quote_name
+    old = f"{TABLE}_old"
+    sequence = f"{TABLE}_id_seq"
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {quote(TABLE)} IN ACCESS EXCLUSIVE MODE")
+        indexes, constraints = _definition(cursor)
+        cursor.execute(
+            f"SELECT GREATEST(COALESCE(MAX(id), 0), "
+            f"COALESCE(pg_sequence_last_value(pg_get_serial_sequence(%s, 'id')::regclass), 0)) + 1, "
+            f"MIN(created_on) FROM {quote(TABLE)}",
+            [TABLE],
+        )
+        next_id, first_day = cursor.fetchone()
+
+        # The old table keeps its name until its rows are copied, so its primary key steps aside
+        for name, kind, _ in constraints:
+            if kind == "p":
+                cursor.execute(f"ALTER TABLE {quote(TABLE)} RENAME CONSTRAINT {quote(name)} TO {quote(old + '_pkey')}")
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} RENAME TO {quote(old)}")
+
+        partition_by = " PARTITION BY RANGE (created_on)" if partitioned else ""
+        cursor.execute(f"CREATE TABLE {quote(TABLE)} (LIKE {quote(old)}){partition_by}")
+        cursor.execute(f"CREATE SEQUENCE {quote(sequence + '_new')} START WITH {int(next_id)}")
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} ALTER COLUMN id SET DEFAULT nextval(%s::regclass)", [sequence + "_new"])
+        cursor.execute(f"ALTER SEQUENCE {quote(sequence + '_new')} OWNED BY {quote(TABLE)}.id")
+        key = "id, created_on" if partitioned else "id"
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} ADD CONSTRAINT {quote(TABLE + '_pkey')} PRIMARY KEY ({key})")
+
+        if partitioned:
+            cursor.execute(f"CREATE TABLE {quote(DEFAULT_PARTITION)} PARTITION OF {quote(TABLE)} DEFAULT")
+            month = month_start(first_day or localdate())
+            last = add_months(month_start(localdate()), months_ahead)
+            while month <= last:
+                cursor.execute(
+                    f"CREATE TABLE {quote(partition_name(month))} PARTITION OF {quote(TABLE)} "
+                    f"FOR VALUES FROM (%s) TO (%s)",
+                    [month, add_months(month, 1)],
+                )
+                month = add_months(month, 1)
+
+        cursor.execute(f"INSERT INTO {quote(TABLE)} SELECT * FROM {quote(old)}")
+        # Dropping the old table drops its sequence too, which frees the usual name
+        cursor.execute(f"DROP TABLE {quote(old)} CASCADE")
+        cursor.execute(f"ALTER SEQUENCE {quote(sequence + '_new')} RENAME TO {quote(sequence)}")
+
+        for definition in indexes:
+            cursor.execute(definition)
+        for name, kind, definition in constraints:
+            if kind != "p":
+                cursor.execute(f"ALTER TABLE {quote(TABLE)} ADD CONSTRAINT {quote(name)} {definition}")
+
+
+def convert_to_partitioned(connection, months_ahead=3):
+    if connection.vendor == "postgresql" and not is_partitioned(connection):
+        _rebuild(connection, partitioned=True, months_ahead=months_ahead)
+        logger.info("%s on %s is now partitioned by month", TABLE, connection.alias)
+
+
+def convert_to_plain(connection):
+    if is_partitioned(connection):
+        _rebuild(connection, partitioned=False)
+        logger.info("%s on %s is a plain table again", TABLE, connection.alias)
+
+
+# (Upcoming Months)
+# A month's partition is made as a plain table and attached, after moving any of its rows that
+# landed in the default partition meanwhile (the attach would fail while they are there).
+# Returns the names of the partitions it created.
+def ensure_partitions(connection, months_ahead=3):
+    quote = connection.ops.quote_name
+    existing = {start for _, start, _ in partitions(connection)}
+    created = []
+    month = month_start(localdate())
+    for _ in range(months_ahead + 1):
+        if month not in existing:
+            name, end = partition_name(month), add_months(month, 1)
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                cursor.execute(f"CREATE TABLE {quote(name)} (LIKE {quote(TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+                cursor.execute(
+                    f"WITH moved AS (DELETE FROM {quote(DEFAULT_PARTITION)} "
+                    f"WHERE created_on >= %s AND created_on < %s RETURNING *) "
+                    f"INSERT INTO {quote(name)} SELECT * FROM moved",
+                    [month, end],
+                )
+                cursor.execute(
+                    f"ALTER TABLE {quote(TABLE)} ATTACH PARTITION {quote(name)} FOR VALUES FROM (%s) TO (%s)",
+                    [month, end],
+                )
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+# (Retention)
+# Months that ended before the retention window: the current month plus `retention_months`
+# whole months before it are kept.
+def expired_partitions(connection, retention_months, today=None):
+    cutoff = add_months(month_start(today or localdate()), -retention_months)
+    return [(name, start, end) for name, start, end in partitions(connection) if end <= cutoff]
+
+
+# (Archive)
+# Detaches a month (if it still is attached), copies it to <directory>/<name>.csv.gz with a
+# <name>.json manifest next to it (rows, columns, bounds, SHA-256 of the file) and drops it once
+# the file holds every row. The file is written under a temporary name first, so a file with
+# the final name is always complete, and a run that stopped half way is finished by the next.
+def archive_partition(connection, name, directory, drop=True):
+    quote = connection.ops.quote_name
+    bounds = {partition: (start, end) for partition, start, end in partitions(connection)}
+    if name in bounds:
+        with connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {quote(TABLE)} DETACH PARTITION {quote(name)}")
+        start, end = bounds[name]
+    else:
+        match = PARTITION_NAME.match(name)
+        start = date(int(match[1]), int(match[2]), 1)
+        end = add_months(start, 1)
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    target = directory / f"{name}.csv.gz"
+    partial = directory / f"{name}.csv.gz.partial"
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM {quote(name)}")
+        rows = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = %s ORDER BY ordinal_position",
+            [name],
+        )
+        columns = [row[0] for row in cursor.fetchall()]
+        with gzip.open(partial, "wt", encoding="utf-8", newline="") as archive:
+            cursor.copy_expert(f"COPY {quote(name)} TO STDOUT WITH (FORMAT csv, HEADER)", archive)
+
+    # The header line is the only line that isn't a row (answers can hold newlines, so the
+    # CSV is read back properly rather than counting lines)
+    with gzip.open(partial, "rt", encoding="utf-8", newline="") as archive:
+        written = sum(1 for _ in csv.reader(archive)) - 1
+    if written != rows:
+        raise RuntimeError(f"{partial} has {written} rows, {name} has {rows}; left {name} in place")
+
+    digest = hashlib.sha256(partial.read_bytes()).hexdigest()
+    with open(partial, "rb") as archive:
+        os.fsync(archive.fileno())
+    partial.replace(target)
+    (directory / f"{name}.json").write_text(json.dumps({
+        "table": TABLE,
+        "partition": name,
+        "database": connection.alias,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "rows": rows,
+        "columns": columns,
+        "sha256": digest,
+        "archived_at": now().isoformat(),
+    }, indent=2) + "\n")
+
+    if drop:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE {quote(name)}")
+    logger.info("Archived %s (%s rows) to %s", name, rows, target)
+    return {"partition": name, "rows": rows, "file": str(target)}
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.text import slugify
+
+from .http_cache import structure_stamp
+from .models import ChecklistInstance
+from .pdf_render import render_instance_pdf
+from .snapshots import instance_detail_payload, instance_response_queryset, snapshot_detail_payload
+
+
+# (PDF Export)
+# Checklist history PDFs are rendered on the server, one PDF per instance. They are spread
+# over a process pool because reportlab is pure Python and would otherwise use one core.
+# Every PDF is cached on disk under a name made from the instance id and a digest of everything
+# the PDF shows, so downloading history that hasn't changed just reads the file again.
+# Several instances are sent as a ZIP that is streamed to the browser while it is written.
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def export_cache_dir():
+    path = Path(settings.EXPORT_CACHE_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+# (Render Pool)
+# One pool per web or worker process, started the first time it's needed.
+# I use "spawn" so the children don't inherit the parent's threads or database connections.
+def render_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.PDF_RENDER_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+# (Export Entry)
+# The cache key is worked out without building the grid, so a cache hit never does. For an
+# open instance it is the response it shows (id and version, a new response starts again at 1)
+# with the same structure stamp as the grid's ETag (items, fields), for a closed one the
+# snapshot. Both PDFs also show the checklist title and the deli name, which can change later.
+class ExportEntry:
+    def __init__(self, instance, structure=()):
+        self.instance = instance
+        self.response = None
+        if instance.is_locked and instance.snapshot is not None:
+            parts = ("closed", instance.snapshot.get("version", 0), instance.closed_at)
+        else:
+            self.response = instance_response_queryset(instance).first()
+            response = (self.response.pk, self.response.version) if self.response else None
+            parts = ("open", response, *structure)
+        parts += (instance.checklist.title, instance.checklist.template.name, instance.deli.deli_name)
+
+        digest = hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+        self.cache_name = f"instance-{instance.id}-{digest}.pdf"
+        self.path = export_cache_dir() / self.cache_name
+        self.filename = f"{instance.date:%Y-%m-%d}_{slugify(instance.checklist.title) or 'checklist'}_{instance.id}.pdf"
+
+    def document(self):
+        instance = self.instance
+        if instance.is_locked and instance.snapshot is not None:
+            export = snapshot_detail_payload(instance.snapshot)
+        else:
+            export = instance_detail_payload(instance, self.response)
+
+        # A JSON round trip turns decimals and dates into the same text the grid shows,
+        # and leaves only plain values to send to the render process
+        return json.loads(json.dumps({
+            "title": instance.checklist.title or "Checklist",
+            "deli": instance.deli.deli_name,
+            "date": instance.date,
+            "export": export,
+        }, cls=DjangoJSONEncoder))
+
+
+def _store(entry, pdf_bytes):
+    # Write to a temporary name first, so a half-written file is never served from the cache
+    temporary = entry.path.with_suffix(f".{os.getpid()}.tmp")
+    temporary.write_bytes(pdf_bytes)
+    os.replace(temporary, entry.path)
+
+    # Older versions of this instance can't be asked for any more
+    for old in entry.path.parent.glob(f"instance-{entry.instance.id}-*.pdf"):
+        if old != entry.path:
+            old.unlink(missing_ok=True)
+
+
+# (Render Instances)
+# Makes sure every instance has an up to date PDF in the cache and returns the entries
+# in the order given. `on_progress(done, total)` is called as PDFs finish.
+def _structures(instances):
+    return {
+        row[0]: row[1:]
+        for row in ChecklistInstance.objects.filter(pk__in=[instance.pk for instance in instances])
+        .annotate(**structure_stamp("checklist_id", "checklist__template_id"))
+        .values_list("pk", "item_count", "items_changed_at", "field_count", "last_field_id")
+    }
+
+
+def render_instances(instances, on_progress=None):
+    instances = list(instances)
+    structures = _structures(instances)
+    entries = [ExportEntry(instance, structures.get(instance.pk, ())) for instance in instances]
+    missing = [entry for entry in entries if not entry.path.exists()]
+
+    done = len(entries) - len(missing)
+    if on_progress:
+        on_progress(done, len(entries))
+
+    if len(missing) == 1 or settings.PDF_RENDER_PROCESSES <= 1:
+        # Not worth the trip to another process
+        for entry in missing:
+            _store(entry, render_instance_pdf(entry.document()))
+            done += 1
+            if on_progress:
+                on_progress(done, len(entries))
+    elif missing:
+        pool = render_pool()
+        futures = {pool.submit(render_instance_pdf, entry.document()): entry for entry in missing}
+        for future in as_completed(futures):
+            _store(futures[future], future.result())
+            done += 1
+            if on_progress:
+                on_progress(done, len(entries))
+
+    return entries
+
+
+# (Streaming ZIP)
+# zipfile can write to a stream it can't seek, so I give it a sink that collects what it
+# writes and hand those bytes to the response as soon as each file is added.
+class _ZipSink:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(entries, chunk_size=64 * 1024):
+    sink = _ZipSink()
+    # PDFs are already compressed, so storing them as they are is just as small and much faster
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+        for entry in entries:
+            with archive.open(entry.filename, "w") as target, open(entry.path, "rb") as source:
+                while chunk := source.read(chunk_size):
+                    target.write(chunk)
+                    yield sink.drain()
+    yield sink.drain()
+
+
+def write_zip(entries, path):
+    temporary = path.with_suffix(".tmp")
+    with open(temporary, "wb") as output:
+        for chunk in stream_zip(entries):
+            output.write(chunk)
+    os.replace(temporary, path)
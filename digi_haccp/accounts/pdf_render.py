@@ -0,0 +1,79 @@
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import mm
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+
+# (PDF Rendering)
+# Turns one checklist instance's grid into a PDF page (or pages). This file only uses
+# reportlab and plain dicts, with no Django or database, so it can run inside the
+# process pool in pdf_export.py.
+# Reference: https://docs.reportlab.com/reportlab/userguide/ch7_tables/
+
+HEADER_GREEN = colors.Color(38 / 255, 107 / 255, 48 / 255)
+
+
+# Paragraph reads its text as markup, so &, < and > have to be escaped
+def cell_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "Yes" if value else "No"
+    return escape(str(value))
+
+
+# `document` is {"title", "deli", "date", "export": <detail payload>} (see pdf_export.py)
+def render_instance_pdf(document):
+    styles = getSampleStyleSheet()
+    body_style = styles["BodyText"]
+    body_style.fontSize = 9
+    body_style.leading = 11
+
+    data = document["export"]
+    story = [
+        Paragraph(f"{cell_text(document['title'])} - {document['date']}", styles["Title"]),
+        Paragraph(f"Deli: {cell_text(document['deli']) or 'N/A'}", styles["Normal"]),
+        Paragraph(f"Last Updated: {data.get('filled_time') or 'No response timestamp'}", styles["Normal"]),
+    ]
+    if data.get("staff_involved"):
+        story.append(Paragraph(f"Staff involved: {cell_text(', '.join(data['staff_involved']))}", styles["Normal"]))
+    if data.get("closed_at"):
+        story.append(Paragraph(f"Closed: {data['closed_at']}", styles["Normal"]))
+    story.append(Spacer(1, 6 * mm))
+
+    columns = data.get("columnDefs") or []
+    # Rows are lists in the order of data["fields"] (see grid.py)
+    rows = [dict(zip(data.get("fields") or [], row)) for row in data.get("rows") or []]
+    if not columns or not rows:
+        story.append(Paragraph("No responses recorded for this checklist instance.", styles["Heading3"]))
+    else:
+        # Paragraphs let long text wrap inside its cell instead of running off the page
+        table_rows = [[Paragraph(f"<b>{cell_text(column.get('headerName') or column['field'])}</b>", body_style) for column in columns]]
+        for row in rows:
+            table_rows.append([Paragraph(cell_text(row.get(column["field"])), body_style) for column in columns])
+
+        table = Table(table_rows, repeatRows=1)
+        table.setStyle(TableStyle([
+            ("BACKGROUND", (0, 0), (-1, 0), HEADER_GREEN),
+            ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+            ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
+            ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.Color(0.95, 0.98, 0.94)]),
+            ("VALIGN", (0, 0), (-1, -1), "TOP"),
+        ]))
+        story.append(table)
+
+    buffer = BytesIO()
+    SimpleDocTemplate(
+        buffer,
+        pagesize=landscape(A4),
+        leftMargin=14 * mm,
+        rightMargin=14 * mm,
+        topMargin=14 * mm,
+        bottomMargin=14 * mm,
+        title=document["title"],
+    ).build(story)
+    return buffer.getvalue()
@@ -0,0 +1,225 @@
+import atexit
+import csv
+import hashlib
+import io
+import logging
+import math
+import secrets
+import threading
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections, router
+from django.utils.timezone import now
+
+from .grid import ANSWER_COLUMNS, CellValidationError, apply_cell_value
+from .models import Probe, ProbeGateway, ProbeReading, ResponseItem
+from .offline import parse_edited_at
+from .sharding import ShardMoveInProgress, each_deli_shard, shard_atomic
+
+logger = logging.getLogger(__name__)
+
+
+# (Probe Ingest)
+# Wireless probes report every minute, far too often to go through api_save_field one cell at
+# a time. A deli's gateway posts batches of readings with a token instead:
+#   1. the token and every probe in the batch are looked up in two queries,
+#   2. each reading is checked with the grid's own rules (apply_cell_value), so a probe can't
+#      store anything staff couldn't type,
+#   3. good readings go into an in-process buffer and the request is answered straight away,
+#   4. a background thread writes the buffer every PROBE_FLUSH_SECONDS (or sooner once it
+#      holds PROBE_FLUSH_ROWS) with one COPY per shard on PostgreSQL, bulk_create elsewhere.
+# With PROBE_FLUSH_SECONDS = 0 readings are written during the request instead, for when an
+# acknowledged reading must already be in the database. A full buffer answers 503 with
+# Retry-After, so a burst slows the gateways down instead of growing the worker's memory.
+# Reference: https://www.postgresql.org/docs/current/sql-copy.html
+
+
+# (Tokens)
+def hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def new_gateway(deli, name):
+    """Creates a gateway and returns it with its token, which isn't stored anywhere."""
+    token = secrets.token_urlsafe(32)
+    gateway = ProbeGateway.objects.create(deli=deli, name=name, token_hash=hash_token(token))
+    return gateway, token
+
+
+def gateway_for_request(request):
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    return ProbeGateway.objects.filter(
+        token_hash=hash_token(token.strip()), is_active=True, deli__deleted_at__isnull=True,
+    ).first()
+
+
+# (Validate Readings)
+# Each reading is {"probe": serial, "at": ISO 8601 time, "value": number}. Returns the
+# ProbeReading rows to write and a list of {"index", "error"} for the ones that were refused.
+MAX_PROBE_VALUE = Decimal("99999999.99")
+
+
+def validate_readings(gateway, readings):
+    serials = {str(reading.get("probe")) for reading in readings if isinstance(reading, dict)}
+    probes = {
+        probe.serial: probe
+        for probe in Probe.objects.filter(deli_id=gateway.deli_id, serial__in=serials, is_active=True)
+        .select_related("template_field")
+    }
+
+    received_at = now()
+    rows, rejected = [], []
+    for index, reading in enumerate(readings):
+        if not isinstance(reading, dict):
+            rejected.append({"index": index, "error": "Each reading must be an object."})
+            continue
+        probe = probes.get(str(reading.get("probe")))
+        if probe is None:
+            rejected.append({"index": index, "error": "Unknown probe."})
+            continue
+        taken_at = parse_edited_at(reading.get("at"))
+        if taken_at is None:
+            rejected.append({"index": index, "error": "at must be an ISO 8601 time."})
+            continue
+
+        # Probes send JSON numbers. NaN and infinity never reach the grid's checks, which
+        # can't compare them with the core temperature range.
+        raw = reading.get("value")
+        if isinstance(raw, bool) or not isinstance(raw, (int, float)) or not math.isfinite(raw):
+            rejected.append({"index": index, "error": "Please enter a valid number."})
+            continue
+
+        # The same checks as a value typed into the grid, on a cell that is never saved
+        field = probe.template_field
+        cell = ResponseItem()
+        try:
+            apply_cell_value(cell, field, str(raw))
+        except CellValidationError as error:
+            rejected.append({"index": index, "error": str(error)})
+            continue
+        value = Decimal(getattr(cell, ANSWER_COLUMNS[field.field_type]))
+        if abs(value) > MAX_PROBE_VALUE:
+            rejected.append({"index": index, "error": "Please enter a valid number."})
+            continue
+
+        rows.append(ProbeReading(
+            deli_id=gateway.deli_id,
+            probe_id=probe.pk,
+            checklist_item_id=probe.checklist_item_id,
+            template_field_id=field.pk,
+            # A probe clock can run ahead, so a reading is never later than its arrival
+            taken_at=min(taken_at, received_at),
+            value=value.quantize(Decimal("0.01")),
+            received_at=received_at,
+        ))
+    return rows, rejected
+
+
+# (Write Readings)
+# One COPY (or bulk_create) per shard. A shard whose deli is being moved refuses writes for a
+# minute, so its rows are handed back to be tried again instead of failing the others.
+COPY_COLUMNS = ["deli", "probe", "checklist_item", "template_field", "taken_at", "value", "received_at"]
+
+
+def _copy_readings(connection, rows):
+    quote = connection.ops.quote_name
+    columns = ", ".join(quote(ProbeReading._meta.get_field(name).column) for name in COPY_COLUMNS)
+    data = io.StringIO()
+    writer = csv.writer(data)
+    for row in rows:
+        writer.writerow([
+            row.deli_id, row.probe_id, row.checklist_item_id, row.template_field_id,
+            row.taken_at.isoformat(), row.value, row.received_at.isoformat(),
+        ])
+    data.seek(0)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {quote(ProbeReading._meta.db_table)} ({columns}) FROM STDIN WITH (FORMAT csv)", data)
+
+
+def write_readings(rows):
+    """Writes rows and returns the ones that have to be tried again later."""
+    waiting = []
+    for shard_deli_ids in each_deli_shard({row.deli_id for row in rows}):
+        shard_deli_ids = set(shard_deli_ids)
+        shard_rows = [row for row in rows if row.deli_id in shard_deli_ids]
+        try:
+            alias = router.db_for_write(ProbeReading) or DEFAULT_DB_ALIAS
+            with shard_atomic():
+                if connections[alias].vendor == "postgresql":
+                    _copy_readings(connections[alias], shard_rows)
+                else:
+                    ProbeReading.objects.bulk_create(shard_rows, batch_size=1000)
+        except ShardMoveInProgress:
+            waiting.extend(shard_rows)
+    return waiting
+
+
+# (Reading Buffer)
+# One per process. add() only appends under a lock, so a request never waits for the database.
+class ReadingBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._rows = []
+        self._thread = None
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, rows):
+        """Queues rows to be written, or returns False when the buffer is full."""
+        with self._lock:
+            if len(self._rows) + len(rows) > settings.PROBE_BUFFER_MAX_ROWS:
+                return False
+            self._rows.extend(rows)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="probe-ingest", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+            if len(self._rows) >= settings.PROBE_FLUSH_ROWS:
+                self._wake.set()
+        return True
+
+    def flush(self):
+        """Writes everything buffered so far and returns how many rows were written."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+
+            try:
+                waiting = write_readings(rows)
+            except Exception:
+                logger.exception("Couldn't write %s probe readings, keeping them for the next flush", len(rows))
+                waiting = rows
+            if waiting:
+                with self._lock:
+                    self._rows[:0] = waiting
+            return len(rows) - len(waiting)
+
+    def _run(self):
+        while True:
+            self._wake.wait(settings.PROBE_FLUSH_SECONDS)
+            self._wake.clear()
+            # This thread keeps its own connection, so drop it if the database went away
+            close_old_connections()
+            self.flush()
+
+
+reading_buffer = ReadingBuffer()
+
+
+def accept_readings(rows):
+    """Buffers (or writes) validated rows. Returns False when they can't be taken right now."""
+    if not rows:
+        return True
+    if settings.PROBE_FLUSH_SECONDS <= 0:
+        if write_readings(rows):
+            raise ShardMoveInProgress("This deli's checklists are being moved, please try again in a minute.")
+        return True
+    return reading_buffer.add(rows)
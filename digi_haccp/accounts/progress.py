@@ -0,0 +1,52 @@
+from django.db.models import Count, Max, OuterRef, Q, Subquery
+
+from .grid import READ_ONLY_FIELDS, filled_cells_q
+from .models import ChecklistInstance, ChecklistResponse, ResponseItem
+
+
+# (Progress Rebuild)
+# The counters on ChecklistResponse are moved by save_cell one cell at a time. Things like
+# deleting an item or changing a field's "required" flag don't go through there, so this
+# recounts them from the answers. The rebuild_progress command runs it in batches.
+
+
+def recount_responses(response_ids):
+    filled = filled_cells_q()
+    counts = {
+        row["response_id"]: row
+        for row in ResponseItem.objects.filter(response_id__in=response_ids)
+        .exclude(template_field__name__in=READ_ONLY_FIELDS)
+        .values("response_id")
+        .annotate(
+            total=Count("id"),
+            filled=Count("id", filter=filled),
+            required_missing=Count("id", filter=Q(template_field__required=True) & ~filled),
+            last_activity=Max("last_edited_at"),
+        )
+    }
+
+    responses = list(ChecklistResponse.objects.filter(pk__in=response_ids).only("pk"))
+    for response in responses:
+        row = counts.get(response.pk, {})
+        response.total_cells = row.get("total", 0)
+        response.filled_cells = row.get("filled", 0)
+        response.required_missing = row.get("required_missing", 0)
+        response.last_activity_at = row.get("last_activity")
+
+    ChecklistResponse.objects.bulk_update(
+        responses, ["total_cells", "filled_cells", "required_missing", "last_activity_at"]
+    )
+    return len(responses)
+
+
+# (Link Instances)
+# Instances created before the response link existed get the same response the manager
+# detail view shows for them: the latest one completed on that day. One UPDATE for all of them.
+def link_instance_responses():
+    day_response = ChecklistResponse.objects.filter(
+        checklist_id=OuterRef("checklist_id"),
+        deli_id=OuterRef("deli_id"),
+        completed_at__date=OuterRef("date"),
+    ).order_by("-updated_at", "-completed_at").values("pk")[:1]
+
+    return ChecklistInstance.objects.filter(response__isnull=True).update(response=Subquery(day_response))
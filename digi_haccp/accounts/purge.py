@@ -0,0 +1,208 @@
+import logging
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Q
+from django.utils.timezone import now
+
+from .models import (
+    Checklist,
+    ChecklistInstance,
+    ChecklistInstanceItem,
+    ChecklistItem,
+    ChecklistResponse,
+    ComplianceRollup,
+    Deli,
+    DeliJoinRequest,
+    Probe,
+    ProbeGateway,
+    ProbeReading,
+    ProcessedEdit,
+    ReadingAnomaly,
+    ResponseItem,
+    User,
+)
+from .sharding import is_sharded, shard_aliases, sharding_enabled
+
+logger = logging.getLogger(__name__)
+
+
+# (Purge)
+# Deleting a deli, user or checklist used to be one ORM delete in the request, which loads every
+# related instance, response and answer into memory before removing them.
+# Now a delete is two steps:
+#   1. soft_delete_*() hides the row straight away (deleted_at, plus unlinking it from users),
+#   2. the "purge" job removes its history bottom-up, a bounded batch of ids at a time.
+# Each batch is its own transaction and only rows that still exist are picked, so a purge that
+# stops half way (worker restart, failed attempt) just carries on from where it was.
+
+
+# (Soft Delete)
+# Hidden from every page at once: the SoftDeleteManager leaves deleted delis and checklists out,
+# and unlinking the users takes the deli off every user-scoped query.
+def soft_delete_delis(deli_ids):
+    with transaction.atomic():
+        deli_ids = list(Deli.objects.filter(pk__in=deli_ids).values_list("pk", flat=True))
+        Deli.objects.filter(pk__in=deli_ids).update(deleted_at=now())
+        User.delis.through.objects.filter(deli_id__in=deli_ids).delete()
+    return deli_ids
+
+
+def soft_delete_checklists(queryset):
+    with transaction.atomic():
+        checklist_ids = list(queryset.values_list("pk", flat=True))
+        Checklist.objects.filter(pk__in=checklist_ids).update(deleted_at=now(), is_active=False)
+    return checklist_ids
+
+
+# A deleted user can't log in any more (is_active) and drops off every deli's user list
+def soft_delete_users(user_ids):
+    with transaction.atomic():
+        user_ids = list(User.objects.filter(pk__in=user_ids, deleted_at__isnull=True).values_list("pk", flat=True))
+        User.objects.filter(pk__in=user_ids).update(deleted_at=now(), is_active=False)
+        User.delis.through.objects.filter(user_id__in=user_ids).delete()
+    return user_ids
+
+
+# (Purge Steps)
+# What has to go, children first, as (model, filter) pairs. This is the same set of rows the
+# ORM cascade would remove, so deleting the parent at the end has nothing left to collect.
+def _checklist_steps(checklists):
+    return [
+        (ProcessedEdit, {"response__checklist__in": checklists}),
+        (ResponseItem, {"response__checklist__in": checklists}),
+        (ResponseItem, {"checklist_item__checklist__in": checklists}),
+        (ChecklistInstanceItem, {"instance__checklist__in": checklists}),
+        (ChecklistInstanceItem, {"checklist_item__checklist__in": checklists}),
+        (ChecklistInstance, {"checklist__in": checklists}),
+        (ChecklistResponse, {"checklist__in": checklists}),
+        (ReadingAnomaly, {"checklist_item__checklist__in": checklists}),
+        (ProbeReading, {"checklist_item__checklist__in": checklists}),
+        (ProbeReading, {"probe__checklist_item__checklist__in": checklists}),
+        (Probe, {"checklist_item__checklist__in": checklists}),
+        (ChecklistItem, {"checklist__in": checklists}),
+    ]
+
+
+def _response_steps(responses):
+    return [
+        (ProcessedEdit, {"response__in": responses}),
+        (ResponseItem, {"response__in": responses}),
+    ]
+
+
+def purge_steps(kind, ids):
+    if kind == "checklist":
+        checklists = Checklist.all_objects.filter(pk__in=ids)
+        return _checklist_steps(checklists) + [(Checklist, {"pk__in": ids})]
+
+    if kind == "deli":
+        checklists = Checklist.all_objects.filter(deli_id__in=ids)
+        responses = ChecklistResponse.objects.filter(deli_id__in=ids)
+        return (
+            _checklist_steps(checklists)
+            + _response_steps(responses)
+            + [
+                (ChecklistInstanceItem, {"instance__deli_id__in": ids}),
+                (ChecklistInstance, {"deli_id__in": ids}),
+                (ChecklistResponse, {"deli_id__in": ids}),
+                (Checklist, {"deli_id__in": ids}),
+                (ComplianceRollup, {"deli_id__in": ids}),
+                (ReadingAnomaly, {"deli_id__in": ids}),
+                (ProbeReading, {"deli_id__in": ids}),
+                (Probe, {"deli_id__in": ids}),
+                (ProbeGateway, {"deli_id__in": ids}),
+                (DeliJoinRequest, {"deli_id__in": ids}),
+                (Deli, {"pk__in": ids}),
+            ]
+        )
+
+    if kind == "user":
+        # Responses a user started and checklists they created go with them, as the cascade always did
+        checklists = Checklist.all_objects.filter(created_by_id__in=ids)
+        responses = ChecklistResponse.objects.filter(completed_by_id__in=ids)
+        return (
+            _checklist_steps(checklists)
+            + _response_steps(responses)
+            + [
+                (ProcessedEdit, {"user_id__in": ids}),
+                (ChecklistResponse, {"completed_by_id__in": ids}),
+                (Checklist, {"created_by_id__in": ids}),
+                (DeliJoinRequest, {"invited_user_id__in": ids}),
+                (DeliJoinRequest, {"invited_by_id__in": ids}),
+                (User, {"pk__in": ids}),
+            ]
+        )
+
+    raise ValueError(f"Nothing can be purged as {kind!r}")
+
+
+# Several steps can reach the same table (answers by response and by item, say). They are
+# merged into one OR'd filter per table, kept in the order the table first appears, so each
+# row is counted and deleted once.
+def _merged_steps(steps):
+    merged = {}
+    for model, filters in steps:
+        condition = Q(**filters)
+        merged[model] = merged[model] | condition if model in merged else condition
+    return list(merged.items())
+
+
+def _base_queryset(alias, model, condition):
+    # Soft-deleted rows are exactly the ones being purged, so the plain manager is used here
+    return model._base_manager.using(alias).filter(condition)
+
+
+# (Shard Steps)
+# With sharding, history can be on any shard (a deli that moved leaves nothing behind, but a
+# user's responses are spread over every deli they worked at). The other shards are cleared
+# first: the checklists, delis and users their rows point at are replicated from the primary
+# and have to outlive them there.
+def _planned_steps(steps):
+    plan = []
+    if sharding_enabled():
+        for alias in shard_aliases():
+            if alias != DEFAULT_DB_ALIAS:
+                plan.extend((alias, model, condition) for model, condition in steps if is_sharded(model))
+    plan.extend((DEFAULT_DB_ALIAS, model, condition) for model, condition in steps)
+    return plan
+
+
+# (Run Purge)
+# Deletes every step in batches of `batch_size` ids. Each batch only loads that many rows
+# (and, because the children are already gone, nothing else), so memory stays flat however
+# much history there is. `on_progress(done, total)` is called after each batch.
+def purge(kind, ids, batch_size=None, on_progress=None):
+    batch_size = batch_size or settings.PURGE_BATCH_SIZE
+    steps = _planned_steps(_merged_steps(purge_steps(kind, ids)))
+
+    total = sum(_base_queryset(alias, model, condition).count() for alias, model, condition in steps)
+    done = 0
+    if on_progress:
+        on_progress(done, total)
+
+    for alias, model, condition in steps:
+        while True:
+            batch = list(
+                _base_queryset(alias, model, condition).order_by("pk").values_list("pk", flat=True)[:batch_size]
+            )
+            if not batch:
+                break
+            with transaction.atomic(using=alias):
+                model._base_manager.using(alias).filter(pk__in=batch).delete()
+            done += len(batch)
+            if on_progress:
+                on_progress(done, total)
+
+    logger.info("Purged %s %s %s(s), %s rows", len(ids), kind, ids[:20], done)
+    return {"kind": kind, "purged": len(ids), "rows": done}
+
+
+# (Waiting Purges)
+# Everything still soft-deleted, so an interrupted or failed purge can be picked up again.
+def pending_purges():
+    return {
+        "checklist": list(Checklist.all_objects.filter(deleted_at__isnull=False).values_list("pk", flat=True)),
+        "deli": list(Deli.all_objects.filter(deleted_at__isnull=False).values_list("pk", flat=True)),
+        "user": list(User.objects.filter(deleted_at__isnull=False).values_list("pk", flat=True)),
+    }
@@ -0,0 +1,397 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+from django.db.models import Count, Q
+
+from .models import (
+    Checklist,
+    ChecklistInstance,
+    ChecklistInstanceItem,
+    ChecklistItem,
+    ChecklistResponse,
+    ChecklistTemplate,
+    ComplianceRollup,
+    Deli,
+    Probe,
+    ProbeReading,
+    ProcessedEdit,
+    ReadingAnomaly,
+    ResponseItem,
+    TemplateField,
+    User,
+)
+from .sharding import SHARD_ID_SPAN, shard_aliases
+
+logger = logging.getLogger(__name__)
+
+
+# (Shard Moves)
+# Moves one deli's checklist history from its shard to another, in batches:
+#   1. the deli is marked as moving, so saves get "try again" (503) instead of landing on the
+#      old shard, and I wait a moment for saves that started before that to finish,
+#   2. every history row is copied parents first, a batch per transaction, keeping its id,
+#   3. once the counts match, Deli.shard points at the new shard and saves work again,
+#   4. the old copies are deleted in batches.
+# Copying skips rows that are already there, so a move that stops half way is just run again.
+
+# The deli's global rows (users, delis, templates, checklists, probes) are on every shard already.
+GLOBAL_MODELS = (Deli, User, User.delis.through, ChecklistTemplate, TemplateField, Checklist, ChecklistItem,
+                 Probe)
+
+
+class ShardMoveError(Exception):
+    """A move can't start or didn't copy everything."""
+
+
+# What belongs to a deli, parents first
+def deli_rows(deli_id):
+    return [
+        (ChecklistResponse, Q(deli_id=deli_id)),
+        (ChecklistInstance, Q(deli_id=deli_id)),
+        (ChecklistInstanceItem, Q(instance__deli_id=deli_id)),
+        (ResponseItem, Q(response__deli_id=deli_id)),
+        (ProcessedEdit, Q(response__deli_id=deli_id)),
+        (ComplianceRollup, Q(deli_id=deli_id)),
+        (ReadingAnomaly, Q(deli_id=deli_id)),
+        (ProbeReading, Q(deli_id=deli_id)),
+    ]
+
+
+def _rows(alias, model, condition):
+    return model._base_manager.using(alias).filter(condition)
+
+
+def _copy_rows(model, condition, source, target, batch_size, on_batch):
+    last_pk = 0
+    while True:
+        rows = list(_rows(source, model, condition).filter(pk__gt=last_pk).order_by("pk")[:batch_size])
+        if not rows:
+            return
+        with transaction.atomic(using=target):
+            model._base_manager.using(target).bulk_create(rows, ignore_conflicts=True)
+        last_pk = rows[-1].pk
+        on_batch(len(rows))
+
+
+def _delete_rows(model, condition, alias, batch_size):
+    deleted = 0
+    while True:
+        batch = list(_rows(alias, model, condition).order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        with transaction.atomic(using=alias):
+            model._base_manager.using(alias).filter(pk__in=batch).delete()
+        deleted += len(batch)
+
+
+# (Leftovers)
+# Deletes a deli's rows from every shard except the one it's on now, children first.
+# Also what a move does at the end, and what --cleanup runs if that part was interrupted.
+def remove_leftovers(deli_id, batch_size=None):
+    batch_size = batch_size or settings.SHARD_MOVE_BATCH_SIZE
+    shard = Deli.all_objects.using(DEFAULT_DB_ALIAS).values_list("shard", flat=True).get(pk=deli_id)
+    deleted = 0
+    for alias in shard_aliases():
+        if alias == shard:
+            continue
+        for model, condition in reversed(deli_rows(deli_id)):
+            deleted += _delete_rows(model, condition, alias, batch_size)
+    return deleted
+
+
+# (Move Deli)
+# `on_progress(done, total)` is called after each copied batch. Returns a summary.
+def move_deli(deli_id, target, batch_size=None, wait_seconds=5, on_progress=None):
+    batch_size = batch_size or settings.SHARD_MOVE_BATCH_SIZE
+    if target not in shard_aliases():
+        raise ShardMoveError(f"{target!r} isn't a shard, the shards are {', '.join(shard_aliases())}.")
+
+    deli = Deli.all_objects.using(DEFAULT_DB_ALIAS).get(pk=deli_id)
+    source = deli.shard
+    if deli.shard_moving_to and deli.shard_moving_to != target:
+        raise ShardMoveError(f"Deli {deli_id} is already being moved to {deli.shard_moving_to}.")
+    if source == target:
+        return {"deli": deli_id, "from": source, "to": target, "rows": 0}
+
+    if not deli.shard_moving_to:
+        Deli.all_objects.filter(pk=deli_id).update(shard_moving_to=target)
+        # Saves that looked up the shard just before the flag was set finish in this time
+        time.sleep(wait_seconds)
+
+    tables = deli_rows(deli_id)
+    total = sum(_rows(source, model, condition).count() for model, condition in tables)
+    done = 0
+    if on_progress:
+        on_progress(done, total)
+
+    def copied(count):
+        nonlocal done
+        done += count
+        if on_progress:
+            on_progress(done, total)
+
+    for model, condition in tables:
+        _copy_rows(model, condition, source, target, batch_size, copied)
+
+    for model, condition in tables:
+        expected = _rows(source, model, condition).count()
+        found = _rows(target, model, condition).count()
+        if found < expected:
+            raise ShardMoveError(
+                f"Only {found} of {expected} {model.__name__} rows reached {target}, run the move again."
+            )
+
+    Deli.all_objects.filter(pk=deli_id).update(shard=target, shard_moving_to="")
+    logger.info("Deli %s moved from %s to %s (%s rows)", deli_id, source, target, total)
+
+    remove_leftovers(deli_id, batch_size)
+    return {"deli": deli_id, "from": source, "to": target, "rows": total}
+
+
+# (Shard Sizes)
+# Answer rows per deli on each shard, the number rebalancing tries to even out.
+def deli_sizes():
+    sizes = {}
+    for alias in shard_aliases():
+        deli_ids = list(
+            Deli.all_objects.using(DEFAULT_DB_ALIAS)
+            .filter(shard=alias, deleted_at__isnull=True).values_list("pk", flat=True)
+        )
+        counts = dict(
+            ResponseItem.objects.using(alias)
+            .filter(response__deli_id__in=deli_ids)
+            .values_list("response__deli_id").annotate(rows=Count("pk")).values_list("response__deli_id", "rows")
+        )
+        sizes[alias] = {deli_id: counts.get(deli_id, 0) for deli_id in deli_ids}
+    return sizes
+
+
+# (Rebalance Plan)
+# Greedy: while the fullest shard is more than `tolerance` of the average above the emptiest,
+# move the biggest deli that fits in half the gap from the fullest to the emptiest.
+def rebalance_plan(sizes, tolerance=0.1):
+    totals = {alias: sum(delis.values()) for alias, delis in sizes.items()}
+    delis = {alias: dict(shard_delis) for alias, shard_delis in sizes.items()}
+    average = sum(totals.values()) / max(len(totals), 1)
+
+    moves = []
+    while len(totals) > 1:
+        fullest = max(totals, key=totals.get)
+        emptiest = min(totals, key=totals.get)
+        gap = totals[fullest] - totals[emptiest]
+        if gap <= tolerance * average:
+            break
+
+        fits = [(rows, deli_id) for deli_id, rows in delis[fullest].items() if 0 < rows <= gap / 2]
+        if not fits:
+            break
+        rows, deli_id = max(fits)
+
+        moves.append((deli_id, fullest, emptiest, rows))
+        del delis[fullest][deli_id]
+        delis[emptiest][deli_id] = rows
+        totals[fullest] -= rows
+        totals[emptiest] += rows
+    return moves
+
+
+# (Shard Ids)
+# Shard n hands out ids from n * SHARD_ID_SPAN, so rows keep their ids when they move and an id
+# is never used on two shards. The primary keeps counting from 1.
+def prepare_shard_sequences(alias):
+    offset = shard_aliases().index(alias) * SHARD_ID_SPAN
+    if offset == 0:
+        return
+
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        for model in (ChecklistResponse, ChecklistInstance, ChecklistInstanceItem, ResponseItem,
+                      ProcessedEdit, ComplianceRollup, ReadingAnomaly, ProbeReading):
+            table = model._meta.db_table
+            column = model._meta.pk.column
+            if connection.vendor == "postgresql":
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence(%s, %s), "
+                    f"GREATEST((SELECT COALESCE(MAX({connection.ops.quote_name(column)}), 0) "
+                    f"FROM {connection.ops.quote_name(table)}), %s))",
+                    [table, column, offset],
+                )
+            elif connection.vendor == "sqlite":
+                cursor.execute("INSERT INTO sqlite_sequence (name, seq) SELECT %s, 0 "
+                               "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)", [table, table])
+                cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s", [offset, table])
+            else:
+                raise ShardMoveError(f"Don't know how to set the id range on {connection.vendor}.")
+
+
+# (Global Table Replication)
+# Shard rows point at the global rows (an instance at its checklist, an answer at its item),
+# so every shard needs the primary's global tables, and needs them current: a checklist
+# created a minute ago must be there when its first instance is. PostgreSQL logical
+# replication keeps them in sync. setup_shards publishes GLOBAL_MODELS on the primary and
+# subscribes every shard to them, and the database system check (`check --database default`)
+# warns about any shard that isn't subscribed or is still copying.
+# Reference: https://www.postgresql.org/docs/current/logical-replication.html
+PUBLICATION = "digihaccp_global"
+
+
+def subscription_name(alias):
+    return f"{PUBLICATION}_{alias}"
+
+
+def global_tables():
+    return sorted(model._meta.db_table for model in GLOBAL_MODELS)
+
+
+def _conninfo_value(value):
+    return "'" + str(value).replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+# How a shard's server connects to the primary (SHARD_PUBLISHER_HOST when that isn't DB_HOST)
+def publisher_conninfo():
+    primary = settings.DATABASES[DEFAULT_DB_ALIAS]
+    parts = {
+        "host": settings.SHARD_PUBLISHER_HOST or primary.get("HOST"),
+        "port": primary.get("PORT"),
+        "dbname": primary.get("NAME"),
+        "user": primary.get("USER"),
+        "password": primary.get("PASSWORD"),
+    }
+    return " ".join(f"{key}={_conninfo_value(value)}" for key, value in parts.items() if value)
+
+
+def _require_postgresql(alias):
+    if connections[alias].vendor != "postgresql":
+        raise ShardMoveError(f"{alias} isn't PostgreSQL, shards need logical replication for the global tables.")
+
+
+def replicate_global_tables(alias):
+    """Publishes the global tables on the primary and subscribes the shard. Safe to run again."""
+    _require_postgresql(DEFAULT_DB_ALIAS)
+    _require_postgresql(alias)
+    primary, shard = connections[DEFAULT_DB_ALIAS], connections[alias]
+    name = subscription_name(alias)
+    tables = ", ".join(primary.ops.quote_name(table) for table in global_tables())
+
+    with primary.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_publication WHERE pubname = %s", [PUBLICATION])
+        if cursor.fetchone():
+            cursor.execute(f"ALTER PUBLICATION {PUBLICATION} SET TABLE {tables}")
+        else:
+            cursor.execute(f"CREATE PUBLICATION {PUBLICATION} FOR TABLE {tables}")
+        # The slot is made here because CREATE SUBSCRIPTION can't make it when the shard is a
+        # database on the primary's own server
+        cursor.execute(
+            "SELECT pg_create_logical_replication_slot(%s, 'pgoutput') "
+            "WHERE NOT EXISTS (SELECT 1 FROM pg_replication_slots WHERE slot_name = %s)",
+            [name, name],
+        )
+
+    with shard.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_subscription WHERE subname = %s "
+            "AND subdbid = (SELECT oid FROM pg_database WHERE datname = current_database())",
+            [name],
+        )
+        if cursor.fetchone():
+            # Picks up tables added to the publication since
+            cursor.execute(f"ALTER SUBSCRIPTION {name} REFRESH PUBLICATION")
+            return
+
+        # A shard that already holds global rows can't take the initial copy (the ids clash),
+        # so it subscribes to changes only and is brought up to date once by hand below
+        prefilled = any(model._base_manager.using(alias).exists() for model in GLOBAL_MODELS)
+        cursor.execute(
+            f"CREATE SUBSCRIPTION {name} CONNECTION %s PUBLICATION {PUBLICATION} "
+            f"WITH (create_slot = false, slot_name = %s, copy_data = {'false' if prefilled else 'true'})",
+            [publisher_conninfo(), name],
+        )
+    if prefilled:
+        _upsert_global_rows(alias)
+
+
+# Inserts or updates every global row on a shard, a table per transaction so rows pointing at
+# later rows of the same table (copies of a master checklist) are fine once the table is in
+def _upsert_global_rows(alias, batch_size=None):
+    batch_size = batch_size or settings.SHARD_MOVE_BATCH_SIZE
+    for model in GLOBAL_MODELS:
+        pk = model._meta.pk
+        update_fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+        with transaction.atomic(using=alias):
+            last_pk = None
+            while True:
+                rows = model._base_manager.using(DEFAULT_DB_ALIAS).order_by("pk")
+                if last_pk is not None:
+                    rows = rows.filter(pk__gt=last_pk)
+                rows = list(rows[:batch_size])
+                if not rows:
+                    break
+                model._base_manager.using(alias).bulk_create(
+                    rows, update_conflicts=True, unique_fields=[pk.name], update_fields=update_fields,
+                )
+                last_pk = rows[-1].pk
+
+
+# (Replication Check)
+# What is wrong with the global table replication, as sentences (empty when it's all fine)
+def replication_problems():
+    if connections[DEFAULT_DB_ALIAS].vendor != "postgresql":
+        return ["Shards need PostgreSQL, the global tables are kept on them with logical replication."]
+
+    problems = []
+    with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+        cursor.execute(
+            "SELECT tablename FROM pg_publication_tables WHERE pubname = %s AND schemaname = current_schema()",
+            [PUBLICATION],
+        )
+        published = {row[0] for row in cursor.fetchall()}
+    missing = [table for table in global_tables() if table not in published]
+    if missing:
+        problems.append(f"The primary doesn't publish {', '.join(missing)}.")
+
+    for alias in shard_aliases():
+        if alias == DEFAULT_DB_ALIAS:
+            continue
+        if connections[alias].vendor != "postgresql":
+            problems.append(f"{alias} isn't PostgreSQL.")
+            continue
+        state = subscription_state(alias)
+        if state is None:
+            problems.append(f"{alias} isn't subscribed to the global tables ({subscription_name(alias)}).")
+        elif not state[0]:
+            problems.append(f"{alias}'s subscription {subscription_name(alias)} is disabled.")
+        elif state[1]:
+            problems.append(f"{alias} is still copying {state[1]} global tables.")
+    return problems
+
+
+# (enabled, tables still being copied) for the shard's subscription, or None without one
+def subscription_state(alias):
+    with connections[alias].cursor() as cursor:
+        cursor.execute(
+            "SELECT subenabled, (SELECT count(*) FROM pg_subscription_rel "
+            "WHERE srsubid = pg_subscription.oid AND srsubstate <> 'r') "
+            "FROM pg_subscription WHERE subname = %s "
+            "AND subdbid = (SELECT oid FROM pg_database WHERE datname = current_database())",
+            [subscription_name(alias)],
+        )
+        return cursor.fetchone()
+
+
+# Registered as a database check (see apps.py), so `check --database default` and migrate
+# report shards whose global tables aren't kept in sync
+def check_global_replication(app_configs=None, databases=None, **kwargs):
+    from django.core import checks
+
+    if not databases or DEFAULT_DB_ALIAS not in databases or len(shard_aliases()) < 2:
+        return []
+    try:
+        problems = replication_problems()
+    except DatabaseError as error:
+        problems = [f"Couldn't check the global table replication: {error}"]
+    return [
+        checks.Warning(problem, hint="Run python manage.py setup_shards.", id="accounts.W001")
+        for problem in problems
+    ]
@@ -0,0 +1,316 @@
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from inspect import iscoroutinefunction
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count
+from django.http import JsonResponse
+
+logger = logging.getLogger(__name__)
+
+
+# (Sharding)
+# Optional: with DB_SHARD_NAMES set, each deli's checklist history (instances, responses,
+# answers, edit keys, rollups and anomalies) lives on one database, picked by Deli.shard. Users, delis,
+# templates and checklists stay global on the primary and are replicated to every shard, so
+# the usual joins (instance -> checklist -> template) still run on the shard in one query.
+#   - views say which deli they work on (@deli_shard_view, @row_shard_view, using_deli_shard),
+#   - ShardRouter then sends the history tables to that deli's database,
+#   - code that spans delis (overview, heatmap, close job) runs once per shard (each_deli_shard).
+# With no shards configured everything stays on "default" and none of this costs a query.
+# Reference: https://docs.djangoproject.com/en/5.2/topics/db/multi-db/
+
+# The models whose rows belong to one deli, parents first
+SHARDED_MODELS = (
+    "ChecklistResponse",
+    "ChecklistInstance",
+    "ChecklistInstanceItem",
+    "ResponseItem",
+    "ProcessedEdit",
+    "ComplianceRollup",
+    "ReadingAnomaly",
+    "ProbeReading",
+)
+
+# Every shard hands out ids from its own range, so a row keeps its id when its deli moves
+# and an id in a URL is never on two shards (see prepare_shard_sequences)
+SHARD_ID_SPAN = 2 ** 40
+
+# (alias, writable) for the deli the current request or job is working on
+_shard = ContextVar("deli_shard", default=None)
+
+
+class ShardMoveInProgress(Exception):
+    """The deli's history is being copied to another shard, writes have to wait until it's done."""
+
+
+def shard_aliases():
+    return settings.SHARD_DATABASES
+
+
+def sharding_enabled():
+    return len(settings.SHARD_DATABASES) > 1
+
+
+def is_sharded(model):
+    return model._meta.app_label == "accounts" and model._meta.object_name in SHARDED_MODELS
+
+
+def current_shard():
+    state = _shard.get()
+    return state[0] if state else DEFAULT_DB_ALIAS
+
+
+# (Shard Transactions)
+# transaction.atomic() on its own only covers the primary. Code that writes history uses
+# these so its transaction (and on_commit callbacks) are on the deli's database.
+def shard_atomic():
+    return transaction.atomic(using=current_shard())
+
+
+def on_shard_commit(callback):
+    transaction.on_commit(callback, using=current_shard())
+
+
+# (Deli -> Shard)
+# Always read from the primary: the map must be current, a replica could still show a deli
+# on the shard it just left.
+def _deli_model():
+    from .models import Deli
+    return Deli
+
+
+def deli_shard_state(deli):
+    deli_id = getattr(deli, "pk", deli)
+    row = (
+        _deli_model().all_objects.using(DEFAULT_DB_ALIAS)
+        .filter(pk=deli_id).values_list("shard", "shard_moving_to").first()
+    )
+    if row is None:
+        return DEFAULT_DB_ALIAS, True
+    shard, moving_to = row
+    return shard, not moving_to
+
+
+def delis_by_shard(deli_ids):
+    groups = {}
+    rows = (
+        _deli_model().all_objects.using(DEFAULT_DB_ALIAS)
+        .filter(pk__in=list(deli_ids)).values_list("pk", "shard", "shard_moving_to")
+    )
+    for deli_id, shard, moving_to in rows:
+        groups.setdefault((shard, not moving_to), []).append(deli_id)
+    return groups
+
+
+@contextmanager
+def using_shard(alias, writable=True):
+    token = _shard.set((alias, writable))
+    try:
+        yield alias
+    finally:
+        _shard.reset(token)
+
+
+@contextmanager
+def using_deli_shard(deli):
+    if not sharding_enabled():
+        yield DEFAULT_DB_ALIAS
+        return
+    with using_shard(*deli_shard_state(deli)) as alias:
+        yield alias
+
+
+# New delis go to the shard with the fewest delis. rebalance_shards evens out the rows later.
+def shard_for_new_deli():
+    if not sharding_enabled():
+        return DEFAULT_DB_ALIAS
+    counts = dict(
+        _deli_model().all_objects.using(DEFAULT_DB_ALIAS)
+        .values_list("shard").annotate(count=Count("pk")).values_list("shard", "count")
+    )
+    return min(shard_aliases(), key=lambda alias: counts.get(alias, 0))
+
+
+# (Per Shard Loops)
+# For code that spans delis: yields the deli ids on each shard, with that shard selected.
+def each_deli_shard(deli_ids):
+    if not sharding_enabled():
+        yield list(deli_ids)
+        return
+    for (alias, writable), shard_deli_ids in delis_by_shard(deli_ids).items():
+        with using_shard(alias, writable):
+            yield shard_deli_ids
+
+
+# For jobs that go over every deli's history (close job, purge, edit key cleanup)
+def each_shard():
+    if not sharding_enabled():
+        yield DEFAULT_DB_ALIAS
+        return
+    for alias in shard_aliases():
+        with using_shard(alias):
+            yield alias
+
+
+# Rows of delis that currently live on the selected shard. A shard can still hold rows of a
+# deli that is being moved away (or was just moved), and jobs going over a shard leave those alone.
+def owned_by_shard(queryset, deli_field="deli"):
+    if not sharding_enabled():
+        return queryset
+    return queryset.filter(**{f"{deli_field}__shard": current_shard(), f"{deli_field}__shard_moving_to": ""})
+
+
+# (Row -> Deli)
+# URLs carry instance and response ids rather than deli ids. Ids are unique across shards,
+# so I look for the row on each shard and remember its deli (a row never changes deli).
+def row_deli_id(model, pk):
+    try:
+        pk = int(pk)
+    except (TypeError, ValueError):
+        return None
+
+    key = f"shard-row:{model._meta.model_name}:{pk}"
+    deli_id = cache.get(key)
+    if deli_id is not None:
+        return deli_id
+
+    for alias in shard_aliases():
+        deli_id = model._base_manager.using(alias).filter(pk=pk).values_list("deli_id", flat=True).first()
+        if deli_id is not None:
+            cache.set(key, deli_id, 24 * 60 * 60)
+            return deli_id
+    return None
+
+
+# (Shard Views)
+# @deli_shard_view reads the deli from the deli_id URL argument, @row_shard_view(Model, "name")
+# from an instance or response id in the URL or the POST body. A deli that can't be found runs
+# on the primary, where the view's own lookup gives its usual 404.
+def _shard_view(find_deli):
+    def decorator(view):
+        def state_for(request, kwargs):
+            if not sharding_enabled():
+                return None
+            deli_id = find_deli(request, kwargs)
+            return deli_shard_state(deli_id) if deli_id is not None else None
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                state = await sync_to_async(state_for)(request, kwargs)
+                if state is None:
+                    return await view(request, *args, **kwargs)
+                with using_shard(*state):
+                    return await view(request, *args, **kwargs)
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            state = state_for(request, kwargs)
+            if state is None:
+                return view(request, *args, **kwargs)
+            with using_shard(*state):
+                return view(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+deli_shard_view = _shard_view(lambda request, kwargs: kwargs.get("deli_id"))
+
+
+def row_shard_view(model, argument):
+    def find_deli(request, kwargs):
+        return row_deli_id(model, kwargs.get(argument) or request.POST.get(argument))
+    return _shard_view(find_deli)
+
+
+# (Streams)
+# A streaming response is read after the view has returned, so the shard the view picked
+# is put back around every step of the stream.
+def keep_shard(stream):
+    state = _shard.get()
+
+    if hasattr(stream, "__aiter__"):
+        async def async_bound():
+            previous = _shard.get()
+            _shard.set(state)
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                _shard.set(previous)
+
+        return async_bound()
+
+    def bound():
+        previous = _shard.get()
+        _shard.set(state)
+        try:
+            yield from stream
+        finally:
+            _shard.set(previous)
+
+    return bound()
+
+
+# (Router)
+# First in DATABASE_ROUTERS. History tables go to the selected deli's shard, or to the shard a
+# row was loaded from when nothing is selected (saving an answer loaded earlier, say).
+# Reads on the primary's own delis return None so the replica router can still take them.
+class ShardRouter:
+    def _state(self, hints):
+        state = _shard.get()
+        if state is not None:
+            return state
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db in shard_aliases():
+            return instance._state.db, True
+        return DEFAULT_DB_ALIAS, True
+
+    def db_for_read(self, model, **hints):
+        if not sharding_enabled() or not is_sharded(model):
+            return None
+        alias, _ = self._state(hints)
+        return None if alias == DEFAULT_DB_ALIAS else alias
+
+    def db_for_write(self, model, **hints):
+        if not sharding_enabled() or not is_sharded(model):
+            return None
+        alias, writable = self._state(hints)
+        if not writable:
+            raise ShardMoveInProgress("This deli's checklists are being moved, please try again in a minute.")
+        return alias
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Shards get every table: the global ones are filled by replication from the primary
+        if db != DEFAULT_DB_ALIAS and db in shard_aliases():
+            return True
+        return None
+
+
+# (Move In Progress)
+# While rebalance_shards copies a deli, its history is read-only. Saves get a 503 with
+# Retry-After, which the offline queue on the tablets already retries.
+class ShardMoveMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, ShardMoveInProgress):
+            return None
+        logger.info("Refused a write during a shard move: %s", request.path)
+        response = JsonResponse({"error": str(exception)}, status=503)
+        response["Retry-After"] = "30"
+        return response
@@ -0,0 +1,132 @@
+from django.utils.timezone import now
+
+from .compliance import record_closed_instance
+from .grid import answers_by_cell, detail_column_defs, detail_rows, row_fields
+from .models import ChecklistInstance, ChecklistResponse, ResponseItem
+from .sharding import each_shard, owned_by_shard, shard_atomic
+
+
+# (Instance Snapshots)
+# When a checklist's day is over the close job locks its instance and stores the final
+# manager grid on the instance itself. From then on history pages and PDF exports read
+# that one row instead of re-pivoting every ResponseItem against the current template,
+# and the record stays exactly as it was even if items or fields are edited later.
+
+
+def instance_response_queryset(instance):
+    # For now I just take the latest response for that day (assuming one per checklist per day)
+    return ChecklistResponse.objects.filter(
+        checklist_id=instance.checklist_id,
+        deli_id=instance.deli_id,
+        completed_at__date=instance.date,
+    ).select_related("completed_by").order_by("-updated_at", "-completed_at")
+
+
+# (Live Detail Payload)
+# The manager detail grid built from the live ResponseItem rows.
+def instance_detail_payload(instance, response):
+    if response is None:
+        return {"columnDefs": [], "fields": [], "rows": []}
+
+    checklist = instance.checklist
+    fields = list(checklist.template.fields.order_by("order"))
+    items = list(checklist.items.order_by("order"))
+
+    # I load every answer for the response in one query instead of one query per cell
+    answers = answers_by_cell(
+        ResponseItem.objects.filter(response=response).select_related("last_edited_by")
+    )
+
+    # staff involved: starter + anyone who edited any cell
+    staff_emails = {response.completed_by.email}
+    staff_emails.update(
+        answer.last_edited_by.email for answer in answers.values() if answer.last_edited_by_id
+    )
+
+    # Reference: https://docs.python.org/3/library/datetime.html#datetime.date.strftime
+    return {
+        "columnDefs": detail_column_defs(fields),
+        "fields": row_fields(fields),
+        "rows": detail_rows(fields, items, answers),
+        "responseId": response.id,
+        "version": response.version,
+        "filled_by": response.completed_by.email,
+        "filled_time": response.completed_at.strftime("%d %b %Y, %H:%M"),
+        "staff_involved": sorted(staff_emails),
+    }
+
+
+# (Compact Snapshot)
+# The detail payload's rows are already lists in field order (item_id first), so the snapshot
+# keeps them as they are and the field names aren't repeated on every row.
+def compact_snapshot(payload, closed_at):
+    snapshot = {key: value for key, value in payload.items() if key not in ("columnDefs", "fields", "rows")}
+    snapshot.update(
+        columns=payload["columnDefs"],
+        rows=payload["rows"],
+        closed_at=closed_at.isoformat(),
+    )
+    return snapshot
+
+
+# (Snapshot Payload)
+# Turns a stored snapshot back into the same JSON the live detail endpoint returns.
+# The rows go out as stored, only the field names are added back from the columns.
+def snapshot_detail_payload(snapshot):
+    payload = {key: value for key, value in snapshot.items() if key not in ("columns", "rows")}
+    payload.update(
+        columnDefs=snapshot["columns"],
+        fields=["item_id"] + [column["field"] for column in snapshot["columns"]],
+        rows=snapshot["rows"],
+        locked=True,
+    )
+    return payload
+
+
+# (Close Instance)
+# Locks one instance and stores its snapshot. Returns False if it was already closed.
+# I lock the instance and the response rows first, so a save that is still running
+# either lands before the snapshot is taken or is refused afterwards (see save_cell).
+# Callers pick the instance's shard first (see each_shard).
+def close_instance(instance_id):
+    with shard_atomic():
+        instance = ChecklistInstance.objects.select_for_update(of=("self",)).select_related(
+            "checklist__template"
+        ).filter(pk=instance_id, is_locked=False).first()
+        if instance is None:
+            return False
+
+        response = instance_response_queryset(instance).select_for_update(of=("self",)).first()
+
+        closed_at = now()
+        instance.snapshot = compact_snapshot(instance_detail_payload(instance, response), closed_at)
+        instance.is_locked = True
+        instance.closed_at = closed_at
+        instance.response = response  # from now on the instance points at the response it was closed with
+        instance.save(update_fields=["snapshot", "is_locked", "closed_at", "response"])
+
+        # The compliance rollups count the instance in the same transaction
+        record_closed_instance(instance, response)
+
+    return True
+
+
+# (Due Instances)
+# An instance is due once its day is over. I only return ids so the close job
+# never holds a big list of instances in memory. With sharding this is per shard,
+# see due_instances_by_shard.
+def due_instance_ids(before):
+    return owned_by_shard(ChecklistInstance.objects.filter(
+        is_locked=False,
+        date__lt=before,
+        checklist__deleted_at__isnull=True,
+    )).order_by("date", "id").values_list("id", flat=True)
+
+
+# [(shard, [instance ids])], at most `limit` ids in total
+def due_instances_by_shard(before, limit=None):
+    due = []
+    for alias in each_shard():
+        remaining = None if limit is None else limit - sum(len(ids) for _, ids in due)
+        due.append((alias, list(due_instance_ids(before)[:remaining])))
+    return due
@@ -0,0 +1,120 @@
+from datetime import date
+from itertools import chain
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .anomalies import LOOKBACK_DAYS, scan_delis
+from .db_router import replica_reads_block
+from .fan_out import create_copies
+from .item_import import ItemImportError, create_items, file_rows, pasted_rows, validate_rows
+from .jobs import register_task, set_progress
+from .purge import purge
+from .models import Checklist, ChecklistInstance, Deli
+from .pdf_export import export_cache_dir, render_instances, write_zip
+from .sharding import using_deli_shard, using_shard
+from .snapshots import close_instance, due_instances_by_shard
+
+
+# (Tasks)
+# Everything the background worker can run. Each task takes the Job first and its payload
+# as keyword arguments, and returns a small JSON-friendly result.
+
+
+# The close job from close_checklists, for queuing at a set time instead of cron
+@register_task("close_checklists")
+def close_checklists(job, before=None):
+    before = date.fromisoformat(before) if before else date.today()
+    due = due_instances_by_shard(before)
+    total = sum(len(instance_ids) for _, instance_ids in due)
+    set_progress(job, 0, total)
+
+    closed = 0
+    done = 0
+    for alias, instance_ids in due:
+        with using_shard(alias):
+            for instance_id in instance_ids:
+                if close_instance(instance_id):
+                    closed += 1
+                done += 1
+                if done % 50 == 0:
+                    set_progress(job, done)
+
+    set_progress(job, total)
+    return {"closed": closed}
+
+
+# Big PDF packs: every instance is rendered (or read from the cache) and zipped into one file
+# that the manager downloads from manager_export_download when the job is done.
+@register_task("export_pdf_pack")
+def export_pdf_pack(job, deli_id, instance_ids):
+    # Only reads history, so it can come from the read replica when there is one
+    with using_deli_shard(deli_id), replica_reads_block():
+        instances = list(
+            ChecklistInstance.objects.filter(deli_id=deli_id, pk__in=instance_ids, checklist__deleted_at__isnull=True)
+            .select_related("checklist__template", "deli")
+            .order_by("date", "checklist__title", "id")
+        )
+        entries = render_instances(instances, on_progress=lambda done, total: set_progress(job, done, total))
+
+    filename = f"pack-{job.pk}.zip"
+    write_zip(entries, export_cache_dir() / filename)
+    return {"file": filename, "instances": len(entries)}
+
+
+# Big checklist uploads from create_checklist. Same checks as the page: if any row is wrong
+# nothing is created and the errors are returned for the success page to list.
+@register_task("import_checklist", max_attempts=1)
+def import_checklist(job, checklist, upload, pasted="", copy_deli_ids=(), link_copies=False):
+    # The row count isn't known until the file has been read, so progress is just rows read so far
+    def rows_read(count):
+        if count % 500 == 0:
+            set_progress(job, count)
+
+    try:
+        with default_storage.open(upload, "rb") as stored:
+            rows = chain(pasted_rows(pasted), file_rows(stored, upload))
+            items, errors = validate_rows(rows, on_row=rows_read)
+    except ItemImportError as error:
+        return {"created": False, "errors": [str(error)]}
+    finally:
+        default_storage.delete(upload)
+
+    if errors:
+        return {"created": False, "errors": errors}
+
+    with transaction.atomic():
+        new_checklist = Checklist.objects.create(created_by=job.created_by, **checklist)
+        create_items(new_checklist, items)
+        copies = create_copies(
+            new_checklist,
+            Deli.objects.filter(pk__in=copy_deli_ids),
+            job.created_by,
+            link=link_copies,
+        )
+
+    set_progress(job, len(items), len(items))
+    return {
+        "created": True,
+        "checklist_id": new_checklist.pk,
+        "items": len(items),
+        "copies": len(copies),
+        "errors": [],
+    }
+
+
+# Removes soft-deleted delis, users or checklists and all of their history in batches
+# (see purge.py). A failed attempt is retried and carries on with whatever is left.
+@register_task("purge", max_attempts=5)
+def purge_deleted(job, kind, ids):
+    return purge(kind, ids, on_progress=lambda done, total: set_progress(job, done, total))
+
+
+# Scores new numeric readings for anomalies (see anomalies.py), for queuing after the close
+# job instead of running score_anomalies from cron
+@register_task("score_anomalies")
+def score_anomalies(job, deli_ids=None, rescan=False, lookback_days=LOOKBACK_DAYS):
+    return scan_delis(
+        deli_ids, rescan=rescan, lookback_days=lookback_days,
+        on_progress=lambda done, total: set_progress(job, done, total),
+    )
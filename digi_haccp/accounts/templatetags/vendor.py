@@ -0,0 +1,14 @@
+from django import template
+from django.templatetags.static import static
+
+from accounts.vendor import VENDOR_ASSETS, vendored_paths
+
+register = template.Library()
+
+
+# {% vendor_asset 'daisyui/full.css' %}: our own copy when it is vendored, else the pinned CDN URL
+@register.simple_tag
+def vendor_asset(path):
+    if path in vendored_paths():
+        return static(f"vendor/{path}")
+    return VENDOR_ASSETS[path]
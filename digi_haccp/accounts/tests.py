@@ -1,3 +1,2357 @@
-from django.test import TestCase
+import csv
+import gzip
+import importlib.util
+import json
+import math
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, router, transaction
+from django.db.models import F
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template import Context, Template
+from django.test import (
+    AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import http_date
+from django.utils.timezone import localdate, now
+
+from . import analytics, async_views, broker, db_router, fast_json, vendor, views
+from .grid import (
+    SAVE_DUPLICATE, SAVE_SAVED, SAVE_STALE, CellValidationError, ensure_response_items, response_is_locked, save_cell,
+)
+from .live_sync import event_stream, response_channel
+from .http_cache import CompressionMiddleware
+from .instances import shared_response_for, todays_instances
+from .models import (
+    ChecklistTemplate, Checklist, ChecklistInstance, ChecklistItem, ChecklistResponse, ComplianceRollup, Deli, Job,
+    Probe, ProbeGateway, ProbeReading, ProcessedEdit, ReadingAnomaly, ResponseItem, TemplateField, User,
+)
+from .analytics import daily_temperature_stats
+from .anomalies import GAP_DAYS, scan_deli, score_readings
+from .compliance import heatmap_periods, instance_outcome, rebuild_delis, record_closed_instance
+from .management.commands import vendor_assets
+from .fan_out import create_copies, propagate_master_items
+from .item_import import MAX_IMPORT_ERRORS, ItemImportError, file_rows, pasted_rows, validate_rows
+from .jobs import claim_job, enqueue, keep_alive, register_task, requeue_stale_jobs, run_job, set_progress
+from .overview import overview_payload
+from .pdf_render import render_instance_pdf
+from .partitions import (
+    add_months, archive_partition, convert_to_partitioned, convert_to_plain, default_partition_rows,
+    detached_partitions, ensure_partitions, expired_partitions, is_partitioned, month_start, partition_name, partitions,
+)
+from .probes import ReadingBuffer, new_gateway
+from .purge import pending_purges, purge, soft_delete_checklists, soft_delete_delis, soft_delete_users
+from .shard_moves import ShardMoveError, _upsert_global_rows, move_deli, prepare_shard_sequences, rebalance_plan
+from .sharding import (
+    SHARD_ID_SPAN, ShardMoveInProgress, ShardRouter, deli_shard_state, row_deli_id, shard_for_new_deli, using_deli_shard,
+    using_shard,
+)
+from .snapshots import close_instance
+from .throttle import LoadMonitor, check_rate_limit, client_ip, parse_rates, queue_ms
+
+
+# (Test Data)
+# Every test builds its own small deli: one manager, one staff member and a checklist on a
+# test template with a decimal core temperature, a text, a yes/no and the read-only chemical column.
+TEST_FIELDS = [
+    ("food_name", "Food Name", "text", True),
+    ("core_temp", "Core Temp", "decimal", True),
+    ("checked", "Checked", "boolean", False),
+    ("chemical_used", "Chemical Used", "text", False),
+]
+
+# The pages are rendered without collectstatic, so the tests don't use the manifest
+PLAIN_STATIC = {
+    **settings.STORAGES,
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+
+def make_deli(name="Main Street", **fields):
+    return Deli.objects.create(deli_name=name, address="1 Main Street", phone_number=123456, **fields)
+
+
+def make_user(email, role="staff", delis=()):
+    user = User.objects.create_user(email, password="secret-pw", role=role)
+    user.delis.set(delis)
+    return user
+
+
+def make_template(code="TEST_FOOD"):
+    template = ChecklistTemplate.objects.create(code=code, name="Test Food Safety")
+    TemplateField.objects.bulk_create([
+        TemplateField(template=template, name=name, label=label, field_type=field_type, required=required, order=order)
+        for order, (name, label, field_type, required) in enumerate(TEST_FIELDS)
+    ])
+    return template
+
+
+def make_checklist(deli, manager, template, items=("Chicken", "Rice"), frequency="daily", title="Hot Food"):
+    checklist = Checklist.objects.create(
+        template=template, deli=deli, created_by=manager, frequency=frequency, title=title,
+    )
+    ChecklistItem.objects.bulk_create([
+        ChecklistItem(checklist=checklist, name=name, chemical_used="Sanitiser", order=order)
+        for order, name in enumerate(items)
+    ])
+    return checklist
+
+
+# Today's instance of the staff member's first checklist and its shared response, with every
+# cell ready to save, the way the fill page leaves them
+def start_today(staff):
+    instance = todays_instances(staff)[0]
+    response = shared_response_for(instance, staff)
+    fields = list(instance.checklist.template.fields.order_by("order"))
+    items = list(instance.checklist.items.order_by("order"))
+    answers = ensure_response_items(response, items, fields)
+    return instance, response, answers
+
+
+def cell(response, item_name, field_name):
+    return ResponseItem.objects.get(response=response, checklist_item__name=item_name, template_field__name=field_name)
+
+
+# Moves an instance and its response back by `days`, so the close job sees its day as over
+def move_back(instance, response, days=1):
+    ChecklistInstance.objects.filter(pk=instance.pk).update(date=instance.date - timedelta(days=days))
+    ChecklistResponse.objects.filter(pk=response.pk).update(completed_at=response.completed_at - timedelta(days=days))
+    ResponseItem.objects.filter(response=response).update(created_on=F("created_on") - timedelta(days=days))
+    instance.refresh_from_db()
+    response.refresh_from_db()
+
+
+# With DB_REPLICA_NAME or DB_SHARD_NAMES set, the views check the replica's lag and the shard
+# router looks the deli up on every shard, so the deli tests are allowed to reach them too.
+# The runner checks every database a test class lists, even a skipped one, hence the conditions.
+HAS_REPLICA = "replica" in settings.DATABASES
+HAS_SHARDS = len(settings.SHARD_DATABASES) > 1
+TEST_DATABASES = {"default", *settings.SHARD_DATABASES} | ({"replica"} if HAS_REPLICA else set())
+
+
+# A weekly checklist whose one response is shared by an instance for each of the last `days`
+# days, the way todays_instances leaves it after a week of opening the same checklist
+def start_weekly(deli, manager, staff, template, item="Soup", days=7):
+    weekly = make_checklist(deli, manager, template, items=(item,), frequency="weekly", title="Weekly")
+    instance = ChecklistInstance.objects.create(checklist=weekly, deli=deli, date=date.today())
+    response = shared_response_for(instance, staff)
+    ensure_response_items(response, list(weekly.items.all()), list(template.fields.order_by("order")))
+    ChecklistInstance.objects.bulk_create([
+        ChecklistInstance(checklist=weekly, deli=deli, date=date.today() - timedelta(days=day), response=response)
+        for day in range(1, days)
+    ])
+    return weekly, response
+
+
+class DeliTestCase(TestCase):
+    databases = TEST_DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.deli = make_deli()
+        cls.manager = make_user("manager@example.com", role="manager", delis=[cls.deli])
+        cls.staff = make_user("staff@example.com", delis=[cls.deli])
+        cls.template = make_template()
+        cls.checklist = make_checklist(cls.deli, cls.manager, cls.template)
+
+
+# (Gunicorn Hooks)
+# gunicorn.conf.py isn't a package module, so I load it from its path and call the hooks with
+# a stand-in worker and request.
+def load_gunicorn_conf():
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", settings.BASE_DIR / "gunicorn.conf.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def fake_worker():
+    return SimpleNamespace(pid=1234, alive=True, log=mock.Mock())
+
+
+def finished_request(conf, worker, rss_kb, duration_ms=5):
+    request = SimpleNamespace(method="GET", path="/dashboard/")
+    with mock.patch.object(conf, "current_rss_kb", return_value=rss_kb):
+        conf.pre_request(worker, request)
+    request.started_at -= duration_ms / 1000
+    with mock.patch.object(conf, "current_rss_kb", return_value=rss_kb):
+        conf.post_request(worker, request, {}, SimpleNamespace(status_code=200))
+
+
+class GunicornHookTests(SimpleTestCase):
+    def setUp(self):
+        self.conf = load_gunicorn_conf()
+        self.conf.max_worker_rss_mb = 100
+        self.conf.slow_request_ms = 1000
+
+    def test_current_rss_is_measured(self):
+        self.assertGreater(self.conf.current_rss_kb(), 0)
+
+    def test_a_worker_over_the_memory_watermark_is_recycled(self):
+        worker = fake_worker()
+        finished_request(self.conf, worker, rss_kb=101 * 1024)
+        self.assertFalse(worker.alive)
+
+    def test_a_worker_under_the_watermark_keeps_running(self):
+        worker = fake_worker()
+        finished_request(self.conf, worker, rss_kb=99 * 1024)
+        self.assertTrue(worker.alive)
+
+    def test_a_zero_watermark_turns_recycling_off(self):
+        self.conf.max_worker_rss_mb = 0
+        worker = fake_worker()
+        finished_request(self.conf, worker, rss_kb=10 * 1024 * 1024)
+        self.assertTrue(worker.alive)
+
+    def test_slow_requests_are_logged_as_warnings(self):
+        worker = fake_worker()
+        finished_request(self.conf, worker, rss_kb=1024, duration_ms=5)
+        worker.log.info.assert_called_once()
+        finished_request(self.conf, worker, rss_kb=1024, duration_ms=1500)
+        worker.log.warning.assert_called_once()
+        self.assertIn("path=%s", worker.log.warning.call_args.args[0])
+
+    def test_warm_up_runs_every_phase(self):
+        from digi_haccp.warmup import WARM_PHASES, warm_up
+
+        # The database phase closes the connection, which a test can't have
+        timings, errors = warm_up(skip=("database",))
+        self.assertEqual(errors, {})
+        self.assertEqual(set(timings), {name for name, _ in WARM_PHASES} - {"database"})
+
+
+# (Async Views)
+# In ASGI mode urls.py serves the async versions of the grid endpoints. They have to answer
+# exactly like the sync ones, ETag included, so I call both with the same request.
+def as_user(request, user):
+    async def auser():
+        return user
+
+    request.user = user
+    request.auser = auser
+    return request
+
+
+class AsyncGridViewTests(DeliTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.async_factory = AsyncRequestFactory()
+        self.instance, self.response, _ = start_today(self.staff)
+
+    async def both(self, view_name, path, user, **kwargs):
+        sync = await sync_to_async(getattr(views, view_name))(as_user(self.factory.get(path), user), **kwargs)
+        async_response = await getattr(async_views, view_name)(as_user(self.async_factory.get(path), user), **kwargs)
+        return sync, async_response
+
+    async def test_checklist_preview_matches_the_sync_view(self):
+        sync, async_response = await self.both("api_get_checklist_data", "/", self.manager, pk=self.checklist.pk)
+        self.assertEqual(async_response.status_code, 200)
+        self.assertEqual(async_response.content, sync.content)
+        self.assertEqual(async_response["ETag"], sync["ETag"])
+
+    async def test_instance_detail_matches_the_sync_view(self):
+        sync, async_response = await self.both(
+            "api_manager_instance_detail", "/", self.manager, instance_id=self.instance.pk,
+        )
+        self.assertEqual(async_response.status_code, 200)
+        self.assertEqual(async_response.content, sync.content)
+        self.assertEqual(async_response["ETag"], sync["ETag"])
+
+    async def test_instance_detail_answers_304_for_its_etag(self):
+        _, first = await self.both("api_manager_instance_detail", "/", self.manager, instance_id=self.instance.pk)
+        request = as_user(self.async_factory.get("/", headers={"if-none-match": first["ETag"]}), self.manager)
+        again = await async_views.api_manager_instance_detail(request, instance_id=self.instance.pk)
+        self.assertEqual(again.status_code, 304)
+
+    async def test_save_field_saves_the_cell(self):
+        request = self.async_factory.post("/", {
+            "response_id": self.response.pk,
+            "item_id": (await self.checklist.items.aget(name="Rice")).pk,
+            "field": "core_temp",
+            "value": "82.5",
+        })
+        result = await async_views.api_save_field(as_user(request, self.staff))
+        self.assertEqual(result.status_code, 200)
+
+        answer = await ResponseItem.objects.aget(
+            response=self.response, checklist_item__name="Rice", template_field__name="core_temp",
+        )
+        self.assertEqual(str(answer.answer_decimal), "82.50")
+        self.assertEqual(answer.version, 1)
+
+    async def test_save_field_refuses_a_bad_value(self):
+        request = self.async_factory.post("/", {
+            "response_id": self.response.pk,
+            "item_id": (await self.checklist.items.aget(name="Rice")).pk,
+            "field": "core_temp",
+            "value": "20",
+        })
+        result = await async_views.api_save_field(as_user(request, self.staff))
+        self.assertEqual(result.status_code, 400)
+        self.assertIn("between 75 and 100", json.loads(result.content)["error"])
+
+
+# (Live Sync)
+def save(response, item_name, field_name, value, user, **kwargs):
+    answer = cell(response, item_name, field_name)
+    return save_cell(answer, answer.template_field, response, user, value, **kwargs)
+
+
+class LiveSyncTests(DeliTestCase):
+    def setUp(self):
+        self.instance, self.response, _ = start_today(self.staff)
+        self.subscription = broker.get_broker().subscribe(response_channel(self.response.pk))
+        self.addCleanup(self.subscription.close)
+
+    def test_a_saved_cell_is_published_once_it_commits(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            save(self.response, "Rice", "core_temp", "80", self.staff)
+            # Nothing goes out before the save has committed
+            self.assertIsNone(self.subscription.get(timeout=0))
+
+        message = self.subscription.get(timeout=1)
+        self.assertEqual(message["field"], "core_temp")
+        self.assertEqual(message["value"], 80.0)
+        self.assertEqual(message["editor"], "staff@example.com")
+        self.assertEqual(message["version"], 1)
+
+    def test_the_stream_replays_what_a_reconnecting_grid_missed(self):
+        save(self.response, "Rice", "core_temp", "80", self.staff)
+        save(self.response, "Chicken", "food_name", "Curry", self.staff)
+
+        stream = event_stream(self.response.pk, since_version=0)
+        self.addCleanup(stream.close)
+        self.assertTrue(next(stream).startswith("retry:"))
+        self.assertTrue(next(stream).startswith("id: 1\nevent: cell\n"))
+        self.assertIn('"value": "Curry"', next(stream))
+
+    @override_settings(LIVE_SYNC_HEARTBEAT_SECONDS=0.01)
+    def test_a_gap_in_the_messages_is_filled_from_the_database(self):
+        stream = event_stream(self.response.pk, since_version=0)
+        self.addCleanup(stream.close)
+        self.assertTrue(next(stream).startswith("retry:"))
+        self.assertEqual(next(stream), ": keepalive\n\n")
+
+        # Two saves, but only the second one's message arrives
+        save(self.response, "Rice", "core_temp", "80", self.staff)
+        save(self.response, "Chicken", "food_name", "Curry", self.staff)
+        broker.get_broker().publish(response_channel(self.response.pk), {"version": 2, "value": "Curry"})
+
+        self.assertTrue(next(stream).startswith("id: 1\n"))
+        self.assertTrue(next(stream).startswith("id: 2\n"))
+
+    def test_postgres_broker_drops_values_too_big_for_notify(self):
+        with mock.patch.object(broker, "connection") as connection:
+            broker.PostgresBroker().publish("channel", {"version": 3, "value": "x" * 10000})
+        cursor = connection.cursor.return_value.__enter__.return_value
+        payload = json.loads(cursor.execute.call_args.args[1][1])
+        self.assertEqual(payload["message"], {"version": 3})
+
+    def test_only_staff_of_the_deli_can_listen(self):
+        outsider = make_user("outsider@example.com", delis=[make_deli("Other Deli")])
+        self.client.force_login(outsider)
+        result = self.client.get(f"/api/checklist/response/{self.response.pk}/events/")
+        self.assertEqual(result.status_code, 403)
+
+
+# (Delta Sync)
+class ResponseChangesTests(DeliTestCase):
+    def setUp(self):
+        self.instance, self.response, _ = start_today(self.staff)
+        self.url = f"/api/checklist/response/{self.response.pk}/changes/"
+        self.client.force_login(self.staff)
+
+    def test_only_cells_changed_after_the_version_are_sent(self):
+        save(self.response, "Rice", "core_temp", "80", self.staff)
+        save(self.response, "Chicken", "food_name", "Curry", self.staff)
+
+        result = self.client.get(self.url, {"since": 1})
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.json()["version"], 2)
+        self.assertEqual(
+            [(change["field"], change["value"], change["version"]) for change in result.json()["changes"]],
+            [("food_name", "Curry", 2)],
+        )
+
+    def test_a_grid_that_is_up_to_date_gets_304(self):
+        save(self.response, "Rice", "core_temp", "80", self.staff)
+        self.assertEqual(self.client.get(self.url, {"since": 1}).status_code, 304)
+        self.assertEqual(self.client.get(self.url, {"since": 0}).status_code, 200)
+
+    def test_the_version_can_come_from_last_event_id(self):
+        save(self.response, "Rice", "core_temp", "80", self.staff)
+        self.assertEqual(self.client.get(self.url, headers={"last-event-id": "1"}).status_code, 304)
+
+    def test_the_detail_grid_gets_its_own_formatting(self):
+        save(self.response, "Rice", "core_temp", "80.5", self.staff)
+        fill = self.client.get(self.url, {"since": 0}).json()["changes"][0]
+        detail = self.client.get(self.url, {"since": 0, "grid": "detail"}).json()["changes"][0]
+        self.assertEqual(fill["value"], 80.5)
+        self.assertEqual(detail["value"], "80.50")
+
+    def test_a_missing_version_is_refused(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"since": "abc"}).status_code, 400)
+
+    def test_staff_of_other_delis_are_refused(self):
+        self.client.force_login(make_user("outsider@example.com", delis=[make_deli("Other Deli")]))
+        self.assertEqual(self.client.get(self.url, {"since": 0}).status_code, 403)
+
+
+# (Offline Edits)
+class OfflineEditTests(DeliTestCase):
+    def setUp(self):
+        self.instance, self.response, _ = start_today(self.staff)
+        self.rice = self.checklist.items.get(name="Rice")
+
+    def version(self):
+        return ChecklistResponse.objects.values_list("version", flat=True).get(pk=self.response.pk)
+
+    def test_an_edit_key_is_only_applied_once(self):
+        self.assertEqual(save(self.response, "Rice", "core_temp", "80", self.staff, idempotency_key="k1"), SAVE_SAVED)
+        self.assertEqual(save(self.response, "Rice", "core_temp", "90", self.staff, idempotency_key="k1"), SAVE_DUPLICATE)
+        self.assertEqual(self.version(), 1)
+        self.assertEqual(str(cell(self.response, "Rice", "core_temp").answer_decimal), "80.00")
+
+    def test_an_older_edit_loses_to_a_newer_one(self):
+        earlier = now() - timedelta(minutes=10)
+        save(self.response, "Rice", "core_temp", "80", self.staff, edited_at=earlier + timedelta(minutes=5))
+        # Queued offline before the edit above, replayed after it
+        self.assertEqual(save(self.response, "Rice", "core_temp", "90", self.staff, edited_at=earlier), SAVE_STALE)
+        self.assertEqual(str(cell(self.response, "Rice", "core_temp").answer_decimal), "80.00")
+        self.assertEqual(self.version(), 1)
+
+    def test_an_edit_from_a_clock_that_runs_ahead_counts_as_now(self):
+        save(self.response, "Rice", "core_temp", "80", self.staff, edited_at=now() + timedelta(hours=1))
+        self.assertLessEqual(cell(self.response, "Rice", "core_temp").last_edited_at, now())
+        self.assertEqual(save(self.response, "Rice", "core_temp", "90", self.staff), SAVE_SAVED)
+
+    def post_batch(self, edits):
+        self.client.force_login(self.staff)
+        return self.client.post("/api/checklist/save/batch/", {"edits": edits}, content_type="application/json")
+
+    def edit(self, key, value, field="core_temp", **extra):
+        return {"key": key, "response_id": self.response.pk, "item_id": self.rice.pk, "field": field, "value": value, **extra}
+
+    def test_a_batch_reports_each_edit(self):
+        result = self.post_batch([
+            self.edit("a", "80"),
+            self.edit("a", "85"),  # the same edit again
+            self.edit("b", "20"),  # out of range
+            self.edit("c", "Soup", field="food_name"),
+            self.edit("d", "70", response_id=999999),
+        ])
+        self.assertEqual(result.status_code, 200)
+        body = result.json()
+        rows = [dict(zip(body["fields"], row)) for row in body["results"]]
+        self.assertEqual([row["status"] for row in rows], ["saved", "duplicate", "error", "saved", "error"])
+        self.assertEqual(rows[1]["value"], 80.0)
+        self.assertIn("between", rows[2]["error"])
+        self.assertEqual(rows[4]["error"], "Checklist not found.")
+        self.assertEqual(self.version(), 2)
+
+    def test_a_replayed_batch_changes_nothing(self):
+        edits = [self.edit("a", "80"), self.edit("b", "Soup", field="food_name")]
+        self.post_batch(edits)
+        rows = self.post_batch(edits).json()["results"]
+        self.assertEqual([row[3] for row in rows], ["duplicate", "duplicate"])
+        self.assertEqual(self.version(), 2)
+
+    def test_edits_on_another_delis_checklist_are_refused(self):
+        other_staff = make_user("other@example.com", delis=[make_deli("Other Deli")])
+        self.client.force_login(other_staff)
+        result = self.client.post(
+            "/api/checklist/save/batch/", {"edits": [self.edit("a", "80")]}, content_type="application/json",
+        )
+        self.assertEqual(result.json()["results"][0][3], "error")
+        self.assertEqual(self.version(), 0)
+
+    def test_edits_of_the_wrong_shape_are_refused_one_by_one(self):
+        result = self.post_batch([
+            self.edit("a", "80", response_id=[self.response.pk]),
+            self.edit(["x"], "80"),
+            self.edit("b", "80", item_id={"a": 1}),
+            self.edit("c", "80", field=["core_temp"]),
+            self.edit("d", ["80"]),
+            self.edit("e", "80", edited_at=12),
+            self.edit("f", "80", response_id=str(self.response.pk)),
+        ])
+        self.assertEqual(result.status_code, 200)
+        rows = [dict(zip(result.json()["fields"], row)) for row in result.json()["results"]]
+        self.assertEqual([row["status"] for row in rows], ["error"] * 6 + ["saved"])
+        self.assertEqual(rows[0]["error"], "response_id must be a whole number.")
+        # Nothing the client sent is echoed back unless it was the right type
+        self.assertEqual([(row["key"], row["item"], row["field"]) for row in rows[:6]], [(None, None, None)] * 6)
+        self.assertEqual((rows[6]["key"], rows[6]["item"]), ("f", self.rice.pk))
+        self.assertEqual(self.version(), 1)
+
+    def test_bad_batches_are_refused(self):
+        self.assertEqual(self.post_batch("nope").status_code, 400)
+        too_many = [self.edit(f"k{number}", "80") for number in range(201)]
+        self.assertEqual(self.post_batch(too_many).status_code, 400)
+
+    def test_todays_work_has_every_grid(self):
+        self.client.force_login(self.staff)
+        work = self.client.get("/api/staff/today/").json()
+        self.assertEqual(len(work["instances"]), 1)
+        grid = work["instances"][0]
+        self.assertEqual(grid["response_id"], self.response.pk)
+        self.assertEqual([row[1] for row in grid["rows"]], ["Chicken", "Rice"])
+
+    def test_old_edit_keys_are_pruned(self):
+        save(self.response, "Rice", "core_temp", "80", self.staff, idempotency_key="old")
+        save(self.response, "Rice", "core_temp", "81", self.staff, idempotency_key="new")
+        ProcessedEdit.objects.filter(key="old").update(created_at=now() - timedelta(days=8))
+        call_command("prune_edit_keys", stdout=mock.Mock())
+        self.assertEqual(list(ProcessedEdit.objects.values_list("key", flat=True)), ["new"])
+
+
+# (Close Snapshots)
+class CloseSnapshotTests(DeliTestCase):
+    def setUp(self):
+        self.instance, self.response, _ = start_today(self.staff)
+        save(self.response, "Rice", "core_temp", "80", self.staff)
+        save(self.response, "Chicken", "food_name", "Curry", self.staff)
+        move_back(self.instance, self.response)
+
+    def detail(self):
+        self.client.force_login(self.manager)
+        return self.client.get(f"/manager/checklist/instance/{self.instance.pk}/data/")
+
+    def test_closing_stores_the_final_grid(self):
+        live = self.detail().json()
+        self.assertTrue(close_instance(self.instance.pk))
+        self.instance.refresh_from_db()
+        self.assertTrue(self.instance.is_locked)
+        self.assertEqual(self.instance.response_id, self.response.pk)
+
+        closed = self.detail().json()
+        self.assertTrue(closed.pop("locked"))
+        closed.pop("closed_at")
+        self.assertEqual(closed, live)
+
+    def test_a_closed_instance_never_reads_the_answers(self):
+        close_instance(self.instance.pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.detail().status_code, 200)
+        self.assertFalse([query for query in queries if ResponseItem._meta.db_table in query["sql"]])
+
+    def test_the_snapshot_keeps_the_record_as_it_was(self):
+        close_instance(self.instance.pk)
+        self.checklist.items.filter(name="Rice").update(name="Brown Rice")
+        rows = self.detail().json()["rows"]
+        self.assertEqual([row[1] for row in rows], ["Chicken", "Rice"])
+
+    def test_an_instance_is_only_closed_once(self):
+        self.assertTrue(close_instance(self.instance.pk))
+        self.assertFalse(close_instance(self.instance.pk))
+
+    def test_a_closed_checklist_refuses_saves(self):
+        self.assertFalse(response_is_locked(self.response))
+        close_instance(self.instance.pk)
+        self.assertTrue(response_is_locked(self.response))
+        with self.assertRaises(CellValidationError):
+            save(self.response, "Rice", "core_temp", "90", self.staff)
+        self.assertEqual(str(cell(self.response, "Rice", "core_temp").answer_decimal), "80.00")
+        self.assertEqual(ChecklistResponse.objects.get(pk=self.response.pk).version, 2)
+
+    def test_the_close_command_only_closes_days_that_are_over(self):
+        today = todays_instances(make_user("late@example.com", delis=[self.deli]))[0]
+        call_command("close_checklists", stdout=mock.Mock())
+        self.assertTrue(ChecklistInstance.objects.get(pk=self.instance.pk).is_locked)
+        self.assertFalse(ChecklistInstance.objects.get(pk=today.pk).is_locked)
+
+
+# (Progress Counters)
+class ProgressCounterTests(DeliTestCase):
+    def setUp(self):
+        self.instance, self.response, _ = start_today(self.staff)
+
+    def counters(self):
+        return ChecklistResponse.objects.values_list("total_cells", "filled_cells", "required_missing").get(
+            pk=self.response.pk
+        )
+
+    def test_new_cells_are_counted_without_the_read_only_column(self):
+        # 2 items x (food name, core temp, checked), of which food name and core temp are required
+        self.assertEqual(self.counters(), (6, 0, 4))
+
+    def test_saves_move_the_counters(self):
+        save(self.response, "Rice", "food_name", "Rice", self.staff)
+        self.assertEqual(self.counters(), (6, 1, 3))
+        save(self.response, "Rice", "food_name", "Brown rice", self.staff)
+        self.assertEqual(self.counters(), (6, 1, 3))
+        # An unticked checkbox is an answer too, but not a required one
+        save(self.response, "Rice", "checked", "false", self.staff)
+        self.assertEqual(self.counters(), (6, 2, 3))
+        save(self.response, "Rice", "food_name", "", self.staff)
+        self.assertEqual(self.counters(), (6, 1, 4))
+
+    def test_a_new_item_adds_its_cells(self):
+        self.checklist.items.create(name="Soup", order=5)
+        start_today(self.staff)
+        self.assertEqual(self.counters(), (9, 0, 6))
+
+    def test_rebuild_progress_fixes_drifted_counters(self):
+        save(self.response, "Rice", "food_name", "Rice", self.staff)
+        save(self.response, "Chicken", "core_temp", "80", self.staff)
+        expected = self.counters()
+        ChecklistResponse.objects.filter(pk=self.response.pk).update(total_cells=99, filled_cells=0, required_missing=50)
+        ChecklistInstance.objects.filter(pk=self.instance.pk).update(response=None)
+
+        call_command("rebuild_progress", stdout=mock.Mock())
+        self.assertEqual(self.counters(), expected)
+        self.assertEqual(ChecklistInstance.objects.get(pk=self.instance.pk).response_id, self.response.pk)
+
+
+# (Compliance Rollups)
+class ComplianceRollupTests(DeliTestCase):
+    def setUp(self):
+        self.instance, self.response, _ = start_today(self.staff)
+
+    def fill_required(self, core_temp="80"):
+        for item in ("Chicken", "Rice"):
+            save(self.response, item, "food_name", item, self.staff)
+            save(self.response, item, "core_temp", core_temp, self.staff)
+
+    def close(self, on_time=True):
+        move_back(self.instance, self.response)
+        if on_time:
+            ChecklistResponse.objects.filter(pk=self.response.pk).update(last_activity_at=self.response.completed_at)
+        close_instance(self.instance.pk)
+
+    def rollups(self):
+        return {
+            rollup.period: (rollup.period_start, rollup.due, rollup.completed, rollup.late, rollup.out_of_range)
+            for rollup in ComplianceRollup.objects.filter(deli=self.deli)
+        }
+
+    def test_outcome(self):
+        day = date(2026, 3, 2)
+        self.assertEqual(instance_outcome(day, 6, 0, None), (True, False))
+        self.assertEqual(instance_outcome(day, 6, 1, None), (False, False))
+        self.assertEqual(instance_outcome(day, 0, 0, None), (False, False))
+        self.assertEqual(instance_outcome(day, 6, 0, now().replace(year=2026, month=3, day=9)), (True, True))
+
+    def test_closing_adds_the_instance_to_its_week_and_month(self):
+        self.fill_required()
+        self.close()
+        rollups = self.rollups()
+        self.assertEqual(rollups["week"][1:], (1, 1, 0, 0))
+        self.assertEqual(rollups["week"][0].weekday(), 0)
+        self.assertEqual(rollups["month"], (self.instance.date.replace(day=1), 1, 1, 0, 0))
+
+    def test_an_unfinished_instance_is_due_but_not_completed(self):
+        save(self.response, "Rice", "food_name", "Rice", self.staff)
+        self.close()
+        self.assertEqual(self.rollups()["month"][1:], (1, 0, 0, 0))
+
+    def test_a_checklist_finished_after_its_day_is_late(self):
+        self.fill_required()
+        self.close(on_time=False)
+        self.assertEqual(self.rollups()["month"][1:], (1, 1, 1, 0))
+
+    def test_out_of_range_readings_are_counted(self):
+        self.fill_required()
+        # Saved some other way than the grid, which refuses them
+        ResponseItem.objects.filter(response=self.response, template_field__name="core_temp").update(answer_decimal=50)
+        self.close()
+        self.assertEqual(self.rollups()["month"][4], 2)
+
+    def test_a_shared_response_is_out_of_range_once_per_period(self):
+        # A weekly checklist whose one response (with a cold reading) two closed days point at
+        weekly = make_checklist(self.deli, self.manager, self.template, items=("Soup",), frequency="weekly")
+        response = ChecklistResponse.objects.create(checklist=weekly, deli=self.deli, completed_by=self.staff)
+        ensure_response_items(response, list(weekly.items.all()), list(self.template.fields.all()))
+        ResponseItem.objects.filter(response=response, template_field__name="core_temp").update(answer_decimal=50)
+        for day in (date(2026, 3, 3), date(2026, 3, 4)):
+            instance = ChecklistInstance.objects.create(
+                checklist=weekly, deli=self.deli, date=day, response=response, is_locked=True,
+            )
+            record_closed_instance(instance, response)
+
+        recorded = self.rollups()
+        self.assertEqual(recorded["week"][1:], (2, 0, 0, 1))
+        self.assertEqual(recorded["month"][1:], (2, 0, 0, 1))
+        rebuild_delis([self.deli.pk])
+        self.assertEqual(self.rollups(), recorded)
+
+    def test_a_rebuild_matches_the_close_job(self):
+        self.fill_required()
+        self.close()
+        recorded = self.rollups()
+        ComplianceRollup.objects.all().update(due=0, completed=0)
+        ComplianceRollup.objects.create(
+            deli=self.deli, template=self.template, period="week", period_start=date(2020, 1, 6), due=3,
+        )
+        rebuild_delis([self.deli.pk])
+        self.assertEqual(self.rollups(), recorded)
+        self.assertEqual(ComplianceRollup.objects.filter(deli=self.deli).count(), 2)
+
+    def test_heatmap(self):
+        self.fill_required()
+        self.close()
+        self.client.force_login(self.manager)
+        heatmap = self.client.get("/api/manager/compliance/heatmap/", {"period": "month", "months": 2}).json()
+        self.assertEqual(len(heatmap["periods"]), 2)
+        [row] = heatmap["rows"]
+        self.assertEqual(row["deli"], "Main Street")
+        cells = [cell for cell in row["cells"] if cell]
+        self.assertEqual(cells, [{"due": 1, "completed": 1, "late": 0, "out_of_range": 0, "rate": 1.0}])
+
+    def test_heatmap_checks_its_arguments(self):
+        self.client.force_login(self.manager)
+        self.assertEqual(self.client.get("/api/manager/compliance/heatmap/", {"period": "day"}).status_code, 400)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get("/api/manager/compliance/heatmap/").status_code, 403)
+
+    def test_heatmap_periods(self):
+        today = date(2026, 3, 18)
+        self.assertEqual(
+            heatmap_periods("month", 3, today), [date(2026, 1, 1), date(2026, 2, 1), date(2026, 3, 1)],
+        )
+        weeks = heatmap_periods("week", 1, today)
+        self.assertEqual((weeks[0], weeks[-1]), (date(2026, 2, 23), date(2026, 3, 16)))
+
+
+# (Manager Overview)
+class ManagerOverviewTests(DeliTestCase):
+    def setUp(self):
+        cache.clear()
+        self.instance, self.response, _ = start_today(self.staff)
+        save(self.response, "Rice", "food_name", "Rice", self.staff)
+        ResponseItem.objects.filter(
+            response=self.response, checklist_item__name="Chicken", template_field__name="core_temp",
+        ).update(answer_decimal=40)
+
+    def add_deli(self, name):
+        deli = make_deli(name)
+        self.manager.delis.add(deli)
+        make_checklist(deli, self.manager, self.template)
+        start_today(make_user(f"{name.lower()}@example.com", delis=[deli]))
+        return deli
+
+    def test_each_deli_gets_todays_numbers(self):
+        quiet = make_deli("Quiet Deli")
+        make_checklist(quiet, self.manager, self.template)
+        rows = {row["deli"]: row for row in overview_payload([self.deli.pk, quiet.pk])["delis"]}
+
+        self.assertEqual(rows["Main Street"]["due"], 1)
+        self.assertEqual(rows["Main Street"]["started"], 1)
+        self.assertEqual(rows["Main Street"]["filled_cells"], 1)
+        self.assertEqual(rows["Main Street"]["total_cells"], 6)
+        self.assertEqual(rows["Main Street"]["out_of_range"], 1)
+        self.assertFalse(rows["Main Street"]["all_done"])
+        self.assertEqual((rows["Quiet Deli"]["due"], rows["Quiet Deli"]["not_started"]), (1, 1))
+
+    def test_the_number_of_queries_does_not_grow_with_the_delis(self):
+        with CaptureQueriesContext(connection) as one_deli:
+            overview_payload([self.deli.pk])
+        more = [self.deli.pk] + [self.add_deli(f"Deli {number}").pk for number in range(3)]
+        with CaptureQueriesContext(connection) as four_delis:
+            payload = overview_payload(more)
+        self.assertEqual(len(payload["delis"]), 4)
+        self.assertEqual(len(four_delis), len(one_deli))
+
+    @override_settings(MANAGER_OVERVIEW_CACHE_SECONDS=60)
+    def test_the_api_is_for_managers_and_cached(self):
+        self.client.force_login(self.manager)
+        first = self.client.get("/api/manager/overview/")
+        self.assertEqual(first.status_code, 200)
+        self.assertIn("max-age=60", first["Cache-Control"])
+
+        save(self.response, "Chicken", "food_name", "Chicken", self.staff)
+        self.assertEqual(self.client.get("/api/manager/overview/").json(), first.json())
+
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get("/api/manager/overview/").status_code, 403)
+
+    @override_settings(STORAGES=PLAIN_STATIC)
+    def test_the_page_renders(self):
+        self.client.force_login(self.manager)
+        self.assertContains(self.client.get("/manager/overview/"), "ag-grid")
+
+
+# (Background Jobs)
+# Two tasks of my own: one that adds its numbers and one that always fails
+@register_task("test_add")
+def add_task(job, a, b):
+    return {"sum": a + b}
+
+
+@register_task("test_fail", max_attempts=2)
+def fail_task(job):
+    raise RuntimeError("the fridge is on fire")
+
+
+class JobQueueTests(TestCase):
+    def test_unknown_jobs_are_refused(self):
+        with self.assertRaises(ValueError):
+            enqueue("no_such_job")
+
+    def test_jobs_are_claimed_by_priority_then_age(self):
+        first = enqueue("test_add", {"a": 1, "b": 1}, run_at=now() - timedelta(minutes=5))
+        urgent = enqueue("test_add", {"a": 1, "b": 2}, priority=5)
+        enqueue("test_add", {"a": 1, "b": 3}, run_at=now() + timedelta(hours=1))
+        second = enqueue("test_add", {"a": 1, "b": 4})
+
+        claimed = [claim_job("worker-1") for _ in range(4)]
+        self.assertEqual(claimed[:3], [urgent, first, second])
+        self.assertIsNone(claimed[3])
+
+        urgent.refresh_from_db()
+        self.assertEqual((urgent.status, urgent.attempts, urgent.locked_by), (Job.STATUS_RUNNING, 1, "worker-1"))
+
+    def test_a_finished_job_keeps_its_result(self):
+        job = enqueue("test_add", {"a": 2, "b": 3})
+        self.assertTrue(run_job(claim_job("worker-1")))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), (Job.STATUS_SUCCEEDED, {"sum": 5}))
+
+    def test_a_failed_job_is_retried_later_then_dead_lettered(self):
+        job = enqueue("test_fail")
+        with self.assertLogs("accounts.jobs", "ERROR"):
+            self.assertFalse(run_job(claim_job("worker-1")))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_QUEUED)
+        self.assertGreater(job.run_at, now())
+        self.assertIn("the fridge is on fire", job.last_error)
+
+        # Not due yet, then due
+        self.assertIsNone(claim_job("worker-1"))
+        Job.objects.filter(pk=job.pk).update(run_at=now())
+        with self.assertLogs("accounts.jobs", "ERROR"):
+            run_job(claim_job("worker-1"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_FAILED, 2))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_jobs_left_running_by_a_dead_worker_are_requeued(self):
+        retry = enqueue("test_add", {"a": 1, "b": 1})
+        give_up = enqueue("test_add", {"a": 1, "b": 1}, max_attempts=1)
+        claim_job("worker-1")
+        claim_job("worker-1")
+        Job.objects.update(started_at=now() - timedelta(hours=1), heartbeat_at=now() - timedelta(minutes=10))
+
+        self.assertEqual(requeue_stale_jobs(timedelta(minutes=5)), 1)
+        self.assertEqual(Job.objects.get(pk=retry.pk).status, Job.STATUS_QUEUED)
+        self.assertEqual(Job.objects.get(pk=give_up.pk).status, Job.STATUS_FAILED)
+
+    def test_a_long_job_that_still_beats_is_left_running(self):
+        enqueue("test_add", {"a": 1, "b": 1})
+        job = claim_job("worker-1")
+        Job.objects.update(started_at=now() - timedelta(hours=1), heartbeat_at=now() - timedelta(minutes=10))
+        set_progress(job, 5, 10)
+
+        self.assertEqual(requeue_stale_jobs(timedelta(minutes=5)), 0)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.STATUS_RUNNING)
+
+    def test_users_only_see_their_own_jobs(self):
+        owner = make_user("owner@example.com", role="manager")
+        job = enqueue("test_add", {"a": 1, "b": 1}, user=owner)
+        self.client.force_login(owner)
+        status = self.client.get(f"/api/jobs/{job.pk}/").json()
+        self.assertEqual((status["status"], status["done"]), ("queued", False))
+
+        self.client.force_login(make_user("someone@example.com", role="manager"))
+        self.assertEqual(self.client.get(f"/api/jobs/{job.pk}/").status_code, 404)
+
+
+# The heartbeat timer and the worker's own threads need their own connections to see the jobs
+class JobHeartbeatTests(TransactionTestCase):
+    def test_keep_alive_beats_while_the_job_runs(self):
+        enqueue("test_add", {"a": 1, "b": 1})
+        job = claim_job("worker-1")
+        old = now() - timedelta(minutes=10)
+        Job.objects.update(heartbeat_at=old)
+
+        with keep_alive(job, 0.05):
+            time.sleep(0.5)
+        self.assertGreater(Job.objects.get(pk=job.pk).heartbeat_at, old)
+
+    def test_the_worker_requeues_and_runs_a_job_whose_worker_died(self):
+        enqueue("test_add", {"a": 2, "b": 2})
+        job = claim_job("dead-worker")
+        Job.objects.update(heartbeat_at=now() - timedelta(minutes=10))
+
+        with self.assertLogs("accounts.management.commands.run_worker", "WARNING"):
+            call_command("run_worker", "--burst", "--stale-after", "60", "--heartbeat-interval", "1", stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.result), (Job.STATUS_SUCCEEDED, 2, {"sum": 4}))
+
+    def test_stale_after_has_to_outlast_a_few_heartbeats(self):
+        with self.assertRaises(CommandError):
+            call_command("run_worker", "--burst", "--stale-after", "60", "--heartbeat-interval", "30")
+
+
+# Two workers claiming at the same moment: the second one skips the row the first has locked
+@skipUnless(connection.features.has_select_for_update_skip_locked, "needs SKIP LOCKED")
+class JobClaimLockingTests(TransactionTestCase):
+    def test_a_locked_job_is_skipped_not_waited_for(self):
+        busy = enqueue("test_add", {"a": 1, "b": 1}, priority=1)
+        free = enqueue("test_add", {"a": 1, "b": 2})
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            try:
+                with transaction.atomic():
+                    Job.objects.select_for_update().get(pk=busy.pk)
+                    locked.set()
+                    release.wait(5)
+            finally:
+                connections.close_all()
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        try:
+            locked.wait(5)
+            self.assertEqual(claim_job("worker-2"), free)
+        finally:
+            release.set()
+            holder.join()
+        self.assertEqual(claim_job("worker-2"), busy)
+
+
+# (PDF Export)
+# Every test gets its own empty export cache, and renders in this process
+class PdfExportTests(DeliTestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        settings_override = override_settings(EXPORT_CACHE_DIR=cache_dir.name, PDF_RENDER_PROCESSES=1)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.cache_dir = cache_dir.name
+
+        # Two days of the same checklist
+        self.old, old_response, _ = start_today(self.staff)
+        save(old_response, "Rice", "core_temp", "80", self.staff)
+        move_back(self.old, old_response)
+        self.instance, self.response, _ = start_today(self.staff)
+        save(self.response, "Chicken", "food_name", "Curry <hot> & spicy", self.staff)
+        self.client.force_login(self.manager)
+
+    def export(self, *instances):
+        return self.client.post(
+            f"/manager/deli/{self.deli.pk}/checklists/export/",
+            json.dumps({"instance_ids": [instance.pk for instance in instances]}),
+            content_type="application/json",
+        )
+
+    def cached(self):
+        return sorted(path.name for path in Path(self.cache_dir).iterdir())
+
+    def test_the_renderer_makes_a_pdf_from_plain_values(self):
+        pdf = render_instance_pdf({
+            "title": "Hot <Food>", "deli": "Main & Co", "date": "2026-01-01",
+            "export": {"columnDefs": [{"field": "food_name", "headerName": "Food"}], "fields": ["food_name"],
+                       "rows": [["Curry <hot>"]]},
+        })
+        self.assertTrue(pdf.startswith(b"%PDF"))
+
+    def test_one_checklist_comes_back_as_a_pdf_and_is_cached(self):
+        with mock.patch("accounts.pdf_export.render_instance_pdf", wraps=render_instance_pdf) as render:
+            response = self.export(self.instance)
+            self.assertEqual(response["Content-Type"], "application/pdf")
+            self.assertTrue(b"".join(response.streaming_content).startswith(b"%PDF"))
+            self.assertEqual(len(self.cached()), 1)
+            self.assertTrue(self.cached()[0].startswith(f"instance-{self.instance.pk}-"))
+
+            b"".join(self.export(self.instance).streaming_content)
+            self.assertEqual(render.call_count, 1)
+
+    def test_a_new_answer_replaces_the_cached_pdf(self):
+        b"".join(self.export(self.instance).streaming_content)
+        before = self.cached()
+        save(self.response, "Rice", "core_temp", "75", self.staff)
+        b"".join(self.export(self.instance).streaming_content)
+        self.assertEqual(len(self.cached()), 1)
+        self.assertNotEqual(self.cached(), before)
+
+    def test_anything_the_pdf_shows_makes_a_new_one(self):
+        def changes():
+            with mock.patch("accounts.pdf_export.render_instance_pdf", wraps=render_instance_pdf) as render:
+                b"".join(self.export(self.instance).streaming_content)
+                return render.call_count
+
+        changes()
+        Checklist.objects.filter(pk=self.checklist.pk).update(title="Hot Food Counter")
+        self.assertEqual(changes(), 1)
+        Deli.objects.filter(pk=self.deli.pk).update(deli_name="High Street")
+        self.assertEqual(changes(), 1)
+        ChecklistItem.objects.filter(checklist=self.checklist, name="Rice").update(name="Pilau", updated_at=now())
+        self.assertEqual(changes(), 1)
+        self.assertEqual(changes(), 0)
+
+        # A newer response counts its versions from the start again, so it can be on the same one
+        ChecklistResponse.objects.create(checklist=self.checklist, deli=self.deli, completed_by=self.manager, version=1)
+        self.assertEqual(changes(), 1)
+
+    def test_a_few_checklists_come_back_as_a_zip(self):
+        response = self.export(self.old, self.instance)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        with zipfile.ZipFile(BytesIO(b"".join(response.streaming_content))) as archive:
+            names = archive.namelist()
+            self.assertEqual(names, [
+                f"{self.old.date:%Y-%m-%d}_hot-food_{self.old.pk}.pdf",
+                f"{self.instance.date:%Y-%m-%d}_hot-food_{self.instance.pk}.pdf",
+            ])
+            self.assertTrue(archive.read(names[0]).startswith(b"%PDF"))
+
+    @override_settings(PDF_PACK_SYNC_LIMIT=1)
+    def test_big_selections_are_built_by_the_worker(self):
+        response = self.export(self.old, self.instance)
+        self.assertEqual(response.status_code, 202)
+        download_url = response.json()["download_url"]
+        self.assertEqual(self.client.get(download_url).status_code, 409)
+
+        self.assertTrue(run_job(claim_job("worker-1")))
+        download = self.client.get(download_url)
+        self.assertEqual(download.status_code, 200)
+        with zipfile.ZipFile(BytesIO(b"".join(download.streaming_content))) as archive:
+            self.assertEqual(len(archive.namelist()), 2)
+
+    def test_only_this_delis_checklists_are_exported(self):
+        other = make_deli("Other Street")
+        make_checklist(other, self.manager, self.template)
+        other_instance, _, _ = start_today(make_user("other@example.com", delis=[other]))
+        self.assertEqual(self.export(other_instance).status_code, 400)
+
+
+# (Item Import)
+def upload(name, text):
+    return SimpleUploadedFile(name, text.encode("utf-8-sig"), content_type="text/csv")
+
+
+def imported(rows):
+    items, errors = validate_rows(rows)
+    return [(item.name, item.chemical_used, item.order) for item in items], errors
+
+
+class ItemImportTests(DeliTestCase):
+    def test_pasted_lines_keep_their_order(self):
+        items, errors = imported(pasted_rows("Chicken\n\n  Rice | Sanitiser  \nBeef"))
+        self.assertEqual(items, [("Chicken", "", 1), ("Rice", "Sanitiser", 2), ("Beef", "", 3)])
+        self.assertEqual(errors, [])
+
+    def test_csv_columns_are_found_by_their_heading(self):
+        rows = file_rows(upload("items.csv", "Order,Chemical Used,Name\n10,Sanitiser,Chicken\n3.0,,Rice\n,,Beef\n"))
+        items, errors = imported(rows)
+        self.assertEqual(items, [("Chicken", "Sanitiser", 10), ("Rice", "", 3), ("Beef", "", 4)])
+        self.assertEqual(errors, [])
+
+    def test_a_csv_without_headings_is_name_chemical_order(self):
+        items, _ = imported(file_rows(upload("items.csv", "Chicken,Sanitiser,2\n")))
+        self.assertEqual(items, [("Chicken", "Sanitiser", 2)])
+
+    def test_xlsx_rows_are_read_like_csv_rows(self):
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        workbook.active.append(["name", "order"])
+        workbook.active.append(["Chicken", 4])
+        content = BytesIO()
+        workbook.save(content)
+        content.seek(0)
+        items, _ = imported(file_rows(content, "items.xlsx"))
+        self.assertEqual(items, [("Chicken", "", 4)])
+
+    def test_bad_rows_are_listed_by_row(self):
+        rows = file_rows(upload("items.csv", "name,order\n,1\nRice,first\n" + "x" * 300 + ",\n"))
+        items, errors = imported(rows)
+        self.assertEqual(items, [])
+        self.assertEqual(errors, [
+            "Row 2: the name is missing.",
+            "Row 3: the order \"first\" isn't a whole number.",
+            "Row 4: the name is longer than 255 characters.",
+        ])
+
+    def test_a_file_full_of_bad_rows_stops_listing_them(self):
+        _, errors = imported(pasted_rows("|x\n" * (MAX_IMPORT_ERRORS + 10)))
+        self.assertEqual(len(errors), MAX_IMPORT_ERRORS + 1)
+        self.assertEqual(errors[-1], "…and 10 more rows with problems.")
+
+    def test_other_files_are_refused(self):
+        with self.assertRaises(ItemImportError):
+            file_rows(upload("items.txt", "Chicken"))
+        with self.assertRaises(ItemImportError):
+            imported(file_rows(SimpleUploadedFile("items.csv", b"\xff\xfe\x00bad")))
+
+
+class ChecklistImportViewTests(DeliTestCase):
+    def setUp(self):
+        self.client.force_login(self.manager)
+
+    def create(self, csv_text, pasted=""):
+        return self.client.post("/checklists/create/", {
+            "template": self.template.pk, "deli": self.deli.pk, "frequency": "daily", "title": "Imported",
+            "items_bulk": pasted, "items_file": upload("items.csv", csv_text), "link_copies": "on",
+        })
+
+    def test_items_are_saved_in_batches_not_one_by_one(self):
+        csv_text = "name\n" + "".join(f"Item {number}\n" for number in range(300))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertRedirects(self.create(csv_text, pasted="Chicken"), "/checklists/success/",
+                                 fetch_redirect_response=False)
+        item_inserts = [query for query in queries if query["sql"].startswith(f'INSERT INTO "{ChecklistItem._meta.db_table}"')]
+        # One per batch of 500, or of fewer where the backend caps the parameters per query (SQLite)
+        fields = [field for field in ChecklistItem._meta.concrete_fields if not field.primary_key]
+        batch_size = min(500, connection.ops.bulk_batch_size(fields, [None] * 301))
+        self.assertTrue(1 <= len(item_inserts) <= math.ceil(301 / batch_size))
+
+        checklist = Checklist.objects.get(title="Imported")
+        self.assertEqual(checklist.items.count(), 301)
+        self.assertEqual(checklist.items.order_by("order").first().name, "Chicken")
+
+    def test_one_bad_row_means_nothing_is_created(self):
+        response = self.create("name,order\nChicken,1\nRice,soon\n")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Row 3: the order")
+        self.assertFalse(Checklist.objects.filter(title="Imported").exists())
+
+    def test_big_uploads_are_imported_by_the_worker(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        with override_settings(ITEM_IMPORT_SYNC_BYTES=10, MEDIA_ROOT=media.name):
+            self.create("name\nChicken\nRice\n")
+            self.assertFalse(Checklist.objects.filter(title="Imported").exists())
+            job = Job.objects.get(name="import_checklist")
+            self.assertTrue(run_job(claim_job("worker-1")))
+
+        job.refresh_from_db()
+        self.assertEqual(job.result["items"], 2)
+        self.assertEqual(Checklist.objects.get(pk=job.result["checklist_id"]).items.count(), 2)
+        self.assertEqual(list(Path(media.name, "imports").iterdir()), [])
+
+
+# (Checklist Fan Out)
+class FanOutTests(DeliTestCase):
+    def setUp(self):
+        self.others = [make_deli(f"Branch {number}") for number in range(3)]
+        self.manager.delis.add(*self.others)
+
+    def items(self, checklist):
+        return list(checklist.items.order_by("order").values_list("name", "chemical_used", "order"))
+
+    def test_copies_are_made_with_two_inserts(self):
+        with CaptureQueriesContext(connection) as queries:
+            copies = create_copies(self.checklist, self.others, self.manager)
+        inserts = [query for query in queries if query["sql"].startswith("INSERT")]
+        self.assertEqual(len(inserts), 2)
+
+        self.assertEqual(sorted(copy.deli_id for copy in copies), sorted(deli.pk for deli in self.others))
+        for copy in copies:
+            self.assertEqual(copy.master, self.checklist)
+            self.assertEqual(self.items(copy), self.items(self.checklist))
+
+    def test_a_repeat_copy_skips_delis_that_already_have_one(self):
+        create_copies(self.checklist, self.others[:1], self.manager)
+        copies = create_copies(self.checklist, [self.deli, *self.others], self.manager)
+        self.assertEqual(len(copies), 2)
+        self.assertEqual(self.checklist.copies.count(), 3)
+
+    def test_unlinked_copies_dont_point_back(self):
+        copy, = create_copies(self.checklist, self.others[:1], self.manager, link=False)
+        self.assertIsNone(copy.master)
+        self.assertFalse(copy.items.filter(master_item__isnull=False).exists())
+        self.assertEqual(propagate_master_items(self.checklist)["copies"], 0)
+
+    def test_item_edits_reach_every_linked_copy(self):
+        copies = create_copies(self.checklist, self.others, self.manager)
+        self.checklist.items.filter(name="Rice").update(name="Brown Rice", chemical_used="Bleach")
+        ChecklistItem.objects.create(checklist=self.checklist, name="Beans", order=5)
+
+        self.assertEqual(propagate_master_items(self.checklist), {"copies": 3, "updated": 6, "added": 3})
+        for copy in copies:
+            self.assertEqual(self.items(copy), self.items(self.checklist))
+
+        # Nothing left to add the second time
+        self.assertEqual(propagate_master_items(self.checklist)["added"], 0)
+
+    def test_the_clone_page_copies_to_all_my_delis(self):
+        self.client.force_login(self.manager)
+        response = self.client.post(
+            f"/manager/checklists/{self.checklist.pk}/clone/", {"all_delis": "on", "link_copies": "on"},
+        )
+        self.assertRedirects(response, "/manager/checklists/", fetch_redirect_response=False)
+        self.assertEqual(self.checklist.copies.count(), 3)
+
+
+# (Bulk Checklist Actions)
+class BulkChecklistTests(DeliTestCase):
+    def setUp(self):
+        self.second = make_checklist(self.deli, self.manager, self.template, title="Cold Food")
+        self.foreign = make_checklist(make_deli("Other Street"), self.manager, self.template, title="Not Mine")
+        self.client.force_login(self.manager)
+
+    def bulk(self, action, checklists):
+        return self.client.post(
+            "/manager/checklists/bulk/",
+            json.dumps({"action": action, "ids": [checklist.pk for checklist in checklists]}),
+            content_type="application/json",
+        )
+
+    def active(self):
+        return dict(Checklist.objects.values_list("title", "is_active"))
+
+    def test_unassigning_is_one_update_on_my_delis_only(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.bulk("unassign", [self.checklist, self.second, self.foreign])
+        self.assertEqual(response.json(), {"action": "unassign", "updated": 2})
+        self.assertEqual(len([query for query in queries if query["sql"].startswith("UPDATE")]), 1)
+        self.assertEqual(self.active(), {"Hot Food": False, "Cold Food": False, "Not Mine": True})
+
+        # Already active ones aren't counted
+        self.second.is_active = True
+        self.second.save()
+        self.assertEqual(self.bulk("assign", [self.checklist, self.second]).json()["updated"], 1)
+
+    def test_deleting_hides_them_and_queues_the_purge(self):
+        response = self.bulk("delete", [self.second, self.foreign])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["deleted"], 1)
+        job = Job.objects.get(pk=response.json()["job_id"])
+        self.assertEqual(job.payload, {"kind": "checklist", "ids": [self.second.pk]})
+        self.assertIsNotNone(Checklist.all_objects.get(pk=self.second.pk).deleted_at)
+        self.assertIsNone(Checklist.all_objects.get(pk=self.foreign.pk).deleted_at)
+
+    def test_bad_requests_are_refused(self):
+        self.assertEqual(self.bulk("archive", [self.checklist]).status_code, 400)
+        self.assertEqual(self.bulk("assign", []).status_code, 400)
+        self.assertEqual(self.client.post(
+            "/manager/checklists/bulk/", "not json", content_type="application/json",
+        ).status_code, 400)
+
+        self.client.force_login(self.staff)
+        self.assertEqual(self.bulk("unassign", [self.checklist]).status_code, 403)
+
+
+# (Purge)
+class PurgeTests(DeliTestCase):
+    def setUp(self):
+        self.instance, self.response, _ = start_today(self.staff)
+        save(self.response, "Rice", "core_temp", "80", self.staff, idempotency_key="edit-1")
+
+        # A second deli with its own history that must survive every purge below
+        self.other = make_deli("Other Street")
+        other_manager = make_user("other-manager@example.com", role="manager", delis=[self.other])
+        self.kept = make_checklist(self.other, other_manager, self.template, title="Kept")
+        self.other_staff = make_user("other@example.com", delis=[self.other])
+        _, kept_response, _ = start_today(self.other_staff)
+        save(kept_response, "Rice", "core_temp", "78", self.other_staff)
+
+    def history(self, **filters):
+        return [
+            ChecklistInstance.objects.filter(**filters).count(),
+            ChecklistResponse.objects.filter(**filters).count(),
+            ResponseItem.objects.filter(**{f"response__{name}": value for name, value in filters.items()}).count(),
+        ]
+
+    def test_a_deleted_checklist_is_hidden_at_once(self):
+        soft_delete_checklists(Checklist.objects.filter(pk=self.checklist.pk))
+        self.assertFalse(Checklist.objects.filter(pk=self.checklist.pk).exists())
+        self.assertEqual(pending_purges()["checklist"], [self.checklist.pk])
+        self.assertEqual(todays_instances(self.staff), [])
+
+    def test_purging_a_checklist_removes_its_history_in_batches(self):
+        soft_delete_checklists(Checklist.objects.filter(pk=self.checklist.pk))
+        progress = []
+        result = purge("checklist", [self.checklist.pk], batch_size=2, on_progress=lambda *done: progress.append(done))
+
+        total = progress[0][1]
+        self.assertEqual(result, {"kind": "checklist", "purged": 1, "rows": total})
+        self.assertEqual(progress[-1], (total, total))
+        self.assertGreater(len(progress), total // 2)
+        self.assertFalse(Checklist.all_objects.filter(pk=self.checklist.pk).exists())
+        self.assertEqual(self.history(checklist=self.checklist), [0, 0, 0])
+        self.assertFalse(ProcessedEdit.objects.exists())
+        self.assertEqual(self.history(checklist=self.kept), [1, 1, 8])
+
+    def test_an_interrupted_purge_carries_on_where_it_stopped(self):
+        def stop_after_first_batch(done, total):
+            if done:
+                raise RuntimeError("worker restarted")
+
+        with self.assertRaises(RuntimeError):
+            purge("checklist", [self.checklist.pk], batch_size=1, on_progress=stop_after_first_batch)
+        self.assertTrue(Checklist.all_objects.filter(pk=self.checklist.pk).exists())
+
+        purge("checklist", [self.checklist.pk])
+        self.assertFalse(Checklist.all_objects.filter(pk=self.checklist.pk).exists())
+
+    def test_a_deleted_deli_loses_its_users_then_its_history(self):
+        soft_delete_delis([self.deli.pk])
+        self.assertFalse(self.staff.delis.exists())
+        self.assertFalse(Deli.objects.filter(pk=self.deli.pk).exists())
+
+        purge("deli", [self.deli.pk])
+        self.assertFalse(Deli.all_objects.filter(pk=self.deli.pk).exists())
+        self.assertEqual(self.history(deli=self.deli), [0, 0, 0])
+        self.assertEqual(self.history(deli=self.other), [1, 1, 8])
+
+    def test_a_deleted_user_cant_log_in_and_their_responses_go(self):
+        soft_delete_users([self.staff.pk])
+        self.assertFalse(self.client.login(email="staff@example.com", password="secret-pw"))
+
+        purge("user", [self.staff.pk])
+        self.assertFalse(User.objects.filter(pk=self.staff.pk).exists())
+        self.assertFalse(ChecklistResponse.objects.filter(pk=self.response.pk).exists())
+        self.assertEqual(self.history(deli=self.other), [1, 1, 8])
+        # Their deli and its checklist stay
+        self.assertTrue(Checklist.objects.filter(pk=self.checklist.pk).exists())
+
+    def test_only_known_kinds_can_be_purged(self):
+        with self.assertRaises(ValueError):
+            purge("template", [self.template.pk])
+
+
+# (Read Replica)
+# The routing tests don't need a real replica: I pretend one is configured and fake its lag,
+# then check which database a read on a global table would use. A view answers with that alias.
+@db_router.replica_reads
+def read_alias_view(request):
+    return HttpResponse(router.db_for_read(Deli))
+
+
+@db_router.replica_reads
+def read_alias_in_atomic_view(request):
+    with transaction.atomic():
+        return HttpResponse(router.db_for_read(Deli))
+
+
+@override_settings(REPLICA_PIN_SECONDS=5, REPLICA_MAX_LAG_SECONDS=10, REPLICA_HEALTH_SECONDS=5)
+class ReplicaRoutingTests(TransactionTestCase):
+    # A transaction test, because every read inside TestCase's own transaction stays on the primary
+    databases = {"default"}
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        db_router._health.update(checked_at=0.0, ok=False)
+        self.addCleanup(db_router._health.update, checked_at=0.0, ok=False)
+        patcher = mock.patch.object(db_router, "replica_configured", return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, view=read_alias_view, cookies=None, lag=0.0):
+        request = self.factory.get("/manager/overview/")
+        request.COOKIES.update(cookies or {})
+        with mock.patch.object(db_router, "replica_lag_seconds", return_value=lag):
+            return db_router.ReplicaPinMiddleware(view)(request)
+
+    def test_reads_use_the_replica_when_it_is_healthy(self):
+        self.assertEqual(self.get().content, b"replica")
+
+    def test_reads_outside_replica_views_stay_on_the_primary(self):
+        self.assertEqual(router.db_for_read(Deli), "default")
+        self.assertEqual(router.db_for_write(Deli), "default")
+
+    def test_a_write_pins_reads_to_the_primary_until_the_cookie_expires(self):
+        response = db_router.ReplicaPinMiddleware(lambda request: HttpResponse())(self.factory.post("/x/"))
+        cookie = response.cookies[db_router.PIN_COOKIE]
+        self.assertEqual(cookie["max-age"], 5)
+        self.assertTrue(cookie["httponly"])
+
+        # While the browser still sends it, reads go to the primary; once it expires they don't
+        self.assertEqual(self.get(cookies={db_router.PIN_COOKIE: cookie.value}).content, b"default")
+        self.assertEqual(self.get().content, b"replica")
+
+    def test_reads_do_not_set_the_pin_cookie(self):
+        self.assertNotIn(db_router.PIN_COOKIE, self.get().cookies)
+
+    def test_no_pin_cookie_without_a_replica(self):
+        with mock.patch.object(db_router, "replica_configured", return_value=False):
+            response = db_router.ReplicaPinMiddleware(lambda request: HttpResponse())(self.factory.post("/x/"))
+        self.assertNotIn(db_router.PIN_COOKIE, response.cookies)
+
+    def test_reads_inside_an_atomic_block_stay_on_the_primary(self):
+        self.assertEqual(self.get(view=read_alias_in_atomic_view).content, b"default")
+
+    def test_a_lagging_replica_is_skipped(self):
+        with self.assertLogs("accounts.db_router", "WARNING"):
+            self.assertEqual(self.get(lag=11).content, b"default")
+
+    def test_the_health_check_is_cached(self):
+        with self.assertLogs("accounts.db_router", "WARNING"):
+            self.assertEqual(self.get(lag=11).content, b"default")
+        # Caught up, but the last answer is kept for REPLICA_HEALTH_SECONDS
+        self.assertEqual(self.get(lag=0).content, b"default")
+        db_router._health["checked_at"] = 0.0
+        self.assertEqual(self.get(lag=0).content, b"replica")
+
+    def test_a_replica_that_is_down_is_skipped(self):
+        replica = mock.Mock()
+        with (
+            mock.patch.object(db_router, "connections", {"replica": replica}),
+            mock.patch.object(db_router, "replica_lag_seconds", side_effect=OperationalError("gone")),
+            self.assertLogs("accounts.db_router", "WARNING"),
+        ):
+            self.assertFalse(db_router.replica_healthy())
+        replica.close.assert_called_once()
+        self.assertEqual(self.get().content, b"default")
+
+    def test_a_view_that_loses_the_replica_runs_again_on_the_primary(self):
+        calls = []
+
+        @db_router.replica_reads
+        def flaky_view(request):
+            alias = router.db_for_read(Deli)
+            calls.append(alias)
+            if alias == "replica":
+                raise OperationalError("replica went away")
+            return HttpResponse(alias)
+
+        with self.assertLogs("accounts.db_router", "WARNING"):
+            self.assertEqual(self.get(view=flaky_view).content, b"default")
+        self.assertEqual(calls, ["replica", "default"])
+        self.assertFalse(db_router._health["ok"])
+
+
+# With DB_REPLICA_NAME set, the test run gets its own replica database (a copy of nothing,
+# migrations only run on the primary) and I check the real health query against it.
+@skipUnless(HAS_REPLICA, "no replica configured")
+class ReplicaHealthTests(TransactionTestCase):
+    databases = {"default", "replica"} if HAS_REPLICA else {"default"}
+
+    def test_a_database_that_is_not_in_recovery_has_no_lag(self):
+        self.assertEqual(db_router.replica_lag_seconds(), 0)
+        self.assertTrue(db_router.check_replica())
+
+
+# (Sharding)
+# The router only hands out aliases, so these tests pretend a second shard exists without
+# ever connecting to it: every deli stays on "default" unless a test moves it.
+@override_settings(SHARD_DATABASES=["default", "shard_1"])
+class ShardRoutingTests(DeliTestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = ShardRouter()
+
+    @override_settings(SHARD_DATABASES=["default"])
+    def test_without_shards_the_router_stays_out_of_the_way(self):
+        with using_shard("shard_1"):
+            self.assertIsNone(self.router.db_for_write(ResponseItem))
+        with using_deli_shard(self.deli) as alias:
+            self.assertEqual(alias, "default")
+        self.assertEqual(shard_for_new_deli(), "default")
+
+    def test_history_goes_to_the_selected_shard(self):
+        with using_shard("shard_1"):
+            self.assertEqual(self.router.db_for_read(ChecklistResponse), "shard_1")
+            self.assertEqual(self.router.db_for_write(ResponseItem), "shard_1")
+            # Global tables are never routed here
+            self.assertIsNone(self.router.db_for_read(Checklist))
+            self.assertIsNone(self.router.db_for_write(Deli))
+
+    def test_reads_on_the_primary_are_left_to_the_replica_router(self):
+        with using_shard("default"):
+            self.assertIsNone(self.router.db_for_read(ResponseItem))
+            self.assertEqual(self.router.db_for_write(ResponseItem), "default")
+
+    def test_a_loaded_row_is_saved_where_it_came_from(self):
+        answer = ResponseItem()
+        answer._state.db = "shard_1"
+        self.assertEqual(self.router.db_for_write(ResponseItem, instance=answer), "shard_1")
+
+    def test_a_moving_deli_is_read_only(self):
+        Deli.objects.filter(pk=self.deli.pk).update(shard_moving_to="shard_1")
+        self.assertEqual(deli_shard_state(self.deli), ("default", False))
+        with using_deli_shard(self.deli):
+            self.assertEqual(self.router.db_for_read(ResponseItem), None)
+            with self.assertRaises(ShardMoveInProgress):
+                self.router.db_for_write(ResponseItem)
+
+    def test_a_save_during_a_move_is_asked_to_retry(self):
+        _, response, _ = start_today(self.staff)
+        rice = self.checklist.items.get(name="Rice")
+        Deli.objects.filter(pk=self.deli.pk).update(shard_moving_to="shard_1")
+
+        self.client.force_login(self.staff)
+        with self.assertLogs("accounts.sharding", "INFO"):
+            result = self.client.post("/api/checklist/save/", {
+                "response_id": response.pk, "item_id": rice.pk, "field": "core_temp", "value": "80",
+            })
+        self.assertEqual(result.status_code, 503)
+        self.assertEqual(result["Retry-After"], "30")
+        self.assertIsNone(cell(response, "Rice", "core_temp").answer_decimal)
+
+    def test_rows_are_found_by_id_and_remembered(self):
+        instance, _, _ = start_today(self.staff)
+        self.assertEqual(row_deli_id(ChecklistInstance, instance.pk), self.deli.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(row_deli_id(ChecklistInstance, str(instance.pk)), self.deli.pk)
+        self.assertIsNone(row_deli_id(ChecklistInstance, "nope"))
+
+    def test_new_delis_go_to_the_emptiest_shard(self):
+        self.assertEqual(shard_for_new_deli(), "shard_1")
+        make_deli("Branch", shard="shard_1")
+        make_deli("Branch 2", shard="shard_1")
+        self.assertEqual(shard_for_new_deli(), "default")
+
+
+class RebalancePlanTests(SimpleTestCase):
+    def test_the_biggest_delis_that_fit_half_the_gap_move(self):
+        sizes = {"default": {1: 600, 2: 300, 3: 100}, "shard_1": {4: 200}}
+        self.assertEqual(rebalance_plan(sizes), [(2, "default", "shard_1", 300), (3, "default", "shard_1", 100)])
+
+    def test_even_shards_are_left_alone(self):
+        self.assertEqual(rebalance_plan({"default": {1: 100}, "shard_1": {2: 95}}), [])
+        self.assertEqual(rebalance_plan({"default": {1: 1000}, "shard_1": {}}), [])
+
+
+# With DB_SHARD_NAMES set, the test run gets an empty database per shard. Replication isn't set up
+# on them, so each test copies the global rows across itself, the same way setup_shards brings a
+# prefilled shard up to date.
+@skipUnless(HAS_SHARDS, "no shards configured")
+class ShardMoveTests(TransactionTestCase):
+    databases = {"default", *settings.SHARD_DATABASES}
+
+    def setUp(self):
+        cache.clear()
+        self.target = settings.SHARD_DATABASES[1]
+        self.deli = make_deli()
+        self.manager = make_user("manager@example.com", role="manager", delis=[self.deli])
+        self.staff = make_user("staff@example.com", delis=[self.deli])
+        self.checklist = make_checklist(self.deli, self.manager, make_template())
+        _upsert_global_rows(self.target)
+
+        self.instance, self.response, _ = start_today(self.staff)
+        save(self.response, "Rice", "core_temp", "80", self.staff)
+
+    def rows(self, alias):
+        return [
+            model._base_manager.using(alias).count()
+            for model in (ChecklistInstance, ChecklistResponse, ResponseItem)
+        ]
+
+    def test_a_move_copies_the_history_and_clears_the_old_shard(self):
+        before = self.rows("default")
+        progress = []
+        result = move_deli(self.deli.pk, self.target, batch_size=3, wait_seconds=0,
+                           on_progress=lambda *done: progress.append(done))
+
+        self.assertEqual(progress[-1], (result["rows"], result["rows"]))
+        self.assertEqual(self.rows(self.target), before)
+        self.assertEqual(self.rows("default"), [0, 0, 0])
+        self.assertEqual(deli_shard_state(self.deli), (self.target, True))
+
+    def test_the_pages_follow_the_deli_to_its_new_shard(self):
+        move_deli(self.deli.pk, self.target, wait_seconds=0)
+        rice = self.checklist.items.get(name="Rice")
+
+        self.client.force_login(self.staff)
+        result = self.client.post("/api/checklist/save/", {
+            "response_id": self.response.pk, "item_id": rice.pk, "field": "core_temp", "value": "85",
+        })
+        self.assertEqual(result.status_code, 200)
+        saved = ResponseItem.objects.using(self.target).get(
+            response_id=self.response.pk, checklist_item=rice, template_field__name="core_temp",
+        )
+        self.assertEqual(str(saved.answer_decimal), "85.00")
+
+        self.client.force_login(self.manager)
+        detail = self.client.get(f"/manager/checklist/instance/{self.instance.pk}/data/")
+        self.assertEqual(detail.status_code, 200)
+
+    def test_a_deli_can_move_back(self):
+        before = self.rows("default")
+        move_deli(self.deli.pk, self.target, wait_seconds=0)
+        move_deli(self.deli.pk, "default", wait_seconds=0)
+        self.assertEqual(self.rows("default"), before)
+        self.assertEqual(self.rows(self.target), [0, 0, 0])
+
+    def test_only_known_shards_can_be_moved_to(self):
+        with self.assertRaises(ShardMoveError):
+            move_deli(self.deli.pk, "shard_99", wait_seconds=0)
+
+    def test_new_rows_on_a_shard_get_ids_from_its_own_range(self):
+        move_deli(self.deli.pk, self.target, wait_seconds=0)
+        prepare_shard_sequences(self.target)
+        cold = make_checklist(self.deli, self.manager, self.checklist.template, title="Cold Food")
+        _upsert_global_rows(self.target)
+
+        instance = next(instance for instance in todays_instances(self.staff) if instance.checklist_id == cold.pk)
+        self.assertGreaterEqual(instance.pk, SHARD_ID_SPAN)
+        self.assertLess(self.instance.pk, SHARD_ID_SPAN)
+
+
+# (Grid Caching)
+class ConditionalGridTests(DeliTestCase):
+    def setUp(self):
+        self.instance, self.response, _ = start_today(self.staff)
+        self.client.force_login(self.manager)
+        self.url = f"/manager/checklist/instance/{self.instance.pk}/data/"
+
+    def get(self, url=None, **headers):
+        return self.client.get(url or self.url, headers=headers)
+
+    def test_an_unchanged_grid_is_not_sent_again(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        self.assertIn("private", first["Cache-Control"])
+        self.assertIn("no-cache", first["Cache-Control"])
+
+        with CaptureQueriesContext(connection) as queries:
+            again = self.get(if_none_match=first["ETag"])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b"")
+        self.assertEqual(again["ETag"], first["ETag"])
+        self.assertFalse([query for query in queries if ResponseItem._meta.db_table in query["sql"]])
+
+    def test_a_save_or_an_item_edit_changes_the_etag(self):
+        etag = self.get()["ETag"]
+        save(self.response, "Rice", "core_temp", "80", self.staff)
+        saved = self.get(if_none_match=etag)
+        self.assertEqual(saved.status_code, 200)
+
+        rice = self.checklist.items.get(name="Rice")
+        rice.name = "Brown Rice"
+        rice.save()
+        self.assertEqual(self.get(if_none_match=saved["ETag"]).status_code, 200)
+
+    def test_a_closed_grid_is_modified_when_it_was_closed(self):
+        move_back(self.instance, self.response)
+        close_instance(self.instance.pk)
+        closed = self.get()
+        self.instance.refresh_from_db()
+        self.assertEqual(closed["Last-Modified"], http_date(self.instance.closed_at.timestamp()))
+        self.assertEqual(self.get(if_modified_since=closed["Last-Modified"]).status_code, 304)
+
+    def test_the_empty_grid_changes_when_an_item_is_added(self):
+        url = f"/api/checklists/{self.checklist.pk}/"
+        etag = self.get(url)["ETag"]
+        self.assertEqual(self.get(url, if_none_match=etag).status_code, 304)
+        ChecklistItem.objects.create(checklist=self.checklist, name="Beans", order=5)
+        self.assertEqual(self.get(url, if_none_match=etag).status_code, 200)
+
+    @override_settings(STORAGES=PLAIN_STATIC)
+    def test_the_fill_page_is_cached_per_user(self):
+        self.client.force_login(self.staff)
+        url = f"/checklist/fill/{self.instance.pk}/"
+        # The first visit hands out the CSRF cookie, which is part of the page
+        self.get(url)
+        etag = self.get(url)["ETag"]
+        self.assertEqual(self.get(url, if_none_match=etag).status_code, 304)
+
+        self.client.force_login(make_user("colleague@example.com", delis=[self.deli]))
+        self.assertEqual(self.get(url, if_none_match=etag).status_code, 200)
+
+
+@override_settings(COMPRESS_MIN_BYTES=100)
+class CompressionTests(SimpleTestCase):
+    def compressed(self, response):
+        request = RequestFactory().get("/", headers={"accept-encoding": "gzip"})
+        return CompressionMiddleware(lambda request: response)(request).get("Content-Encoding") == "gzip"
+
+    def test_json_and_pages_are_gzipped(self):
+        self.assertTrue(self.compressed(HttpResponse("x" * 200, content_type="application/json")))
+        self.assertTrue(self.compressed(HttpResponse("x" * 200, content_type="text/html")))
+
+    def test_small_bodies_are_left_alone(self):
+        self.assertFalse(self.compressed(HttpResponse("x" * 50, content_type="application/json")))
+
+    def test_events_and_compressed_files_are_left_alone(self):
+        self.assertFalse(self.compressed(StreamingHttpResponse(iter(["data: 1\n\n"]), content_type="text/event-stream")))
+        for content_type in ("application/pdf", "application/zip", "image/png"):
+            self.assertFalse(self.compressed(HttpResponse(b"x" * 200, content_type=content_type)))
+
+
+# (Fast JSON)
+JSON_SAMPLE = {
+    "decimal": Decimal("78.50"),
+    "date": date(2026, 3, 1),
+    "time": datetime(2026, 3, 1, 9, 30, 15, 123456).time(),
+    "moment": datetime(2026, 3, 1, 9, 30, 15, 123456, tzinfo=timezone.utc),
+    "text": "Chicken \"hot\" & <cold>",
+    "rows": [[1, "Rice", None, True, 2.5]],
+}
+
+
+class FastJsonTests(SimpleTestCase):
+    @skipUnless(fast_json.orjson, "orjson isn't installed")
+    def test_orjson_writes_what_the_standard_encoder_writes(self):
+        with override_settings(JSON_ENCODER="json"):
+            expected = fast_json.dumps(JSON_SAMPLE)
+        with override_settings(JSON_ENCODER="orjson"):
+            self.assertTrue(fast_json.fast_json_enabled())
+            self.assertEqual(fast_json.dumps(JSON_SAMPLE), expected)
+
+            # Non-ASCII text is written as UTF-8 instead of \u escapes, which reads back the same
+            self.assertEqual(json.loads(fast_json.dumps({"text": "Crème brûlée"})), {"text": "Crème brûlée"})
+
+    def test_bad_bodies_raise_value_error_with_either_encoder(self):
+        for encoder in ("json", "orjson"):
+            with override_settings(JSON_ENCODER=encoder), self.assertRaises(ValueError):
+                fast_json.loads(b"{nope")
+
+    def test_script_json_cannot_close_its_script_block(self):
+        data = {"name": "</script><script>alert(1)</script> & more"}
+        written = fast_json.script_json(data)
+        self.assertNotIn("<", written)
+        self.assertNotIn("&", written)
+        self.assertEqual(json.loads(written), data)
+
+
+class ColumnarGridTests(DeliTestCase):
+    def setUp(self):
+        self.instance, self.response, _ = start_today(self.staff)
+        save(self.response, "Rice", "core_temp", "80", self.staff)
+
+    def test_rows_follow_the_field_list(self):
+        self.client.force_login(self.manager)
+        for url in (f"/manager/checklist/instance/{self.instance.pk}/data/", f"/api/checklists/{self.checklist.pk}/"):
+            grid = self.client.get(url).json()
+            self.assertEqual(grid["fields"], ["item_id", "item_name", *(name for name, *_ in TEST_FIELDS)])
+            rows = [dict(zip(grid["fields"], row)) for row in grid["rows"]]
+            self.assertEqual([row["item_name"] for row in rows], ["Chicken", "Rice"])
+            self.assertEqual(rows[1]["chemical_used"], "Sanitiser")
+
+        detail = self.client.get(f"/manager/checklist/instance/{self.instance.pk}/data/").json()
+        self.assertEqual(dict(zip(detail["fields"], detail["rows"][1]))["core_temp"], "80.00")
+
+    @override_settings(STORAGES=PLAIN_STATIC)
+    def test_item_names_cant_break_out_of_the_fill_page(self):
+        self.checklist.items.filter(name="Rice").update(name="</script><b>Rice</b>")
+        self.client.force_login(self.staff)
+        page = self.client.get(f"/checklist/fill/{self.instance.pk}/")
+        self.assertNotContains(page, "</script><b>")
+        self.assertContains(page, "\\u003C/script\\u003E")
+
+
+# (Vendored Assets)
+# Each test gets its own empty static/vendor/ to fill
+@override_settings(STORAGES=PLAIN_STATIC)
+class VendorAssetTests(SimpleTestCase):
+    path = "daisyui/full.css"
+
+    def setUp(self):
+        vendor_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(vendor_dir.cleanup)
+        self.vendor_dir = Path(vendor_dir.name)
+        lock_file = self.vendor_dir / "vendor.lock.json"
+        for module in (vendor, vendor_assets):
+            for name, value in (("VENDOR_DIR", self.vendor_dir), ("LOCK_FILE", lock_file)):
+                patcher = mock.patch.object(module, name, value)
+                patcher.start()
+                self.addCleanup(patcher.stop)
+        vendor.vendored_paths.cache_clear()
+        self.addCleanup(vendor.vendored_paths.cache_clear)
+
+    def vendor_file(self, content=b"/* daisy */", locked_url=None):
+        target = self.vendor_dir / self.path
+        target.parent.mkdir(parents=True)
+        target.write_bytes(content)
+        (self.vendor_dir / "vendor.lock.json").write_text(json.dumps({self.path: {
+            "url": locked_url or vendor.VENDOR_ASSETS[self.path],
+            "sha256": vendor_assets._sha256(b"/* daisy */"),
+        }}))
+
+    def asset(self):
+        vendor.vendored_paths.cache_clear()
+        return Template("{% load vendor %}{% vendor_asset path %}").render(Context({"path": self.path}))
+
+    def check(self):
+        output = StringIO()
+        call_command("vendor_assets", "--check", stdout=output)
+        return output.getvalue()
+
+    def test_files_that_arent_vendored_come_from_the_pinned_cdn_url(self):
+        self.assertEqual(self.asset(), f"https://cdn.jsdelivr.net/npm/daisyui@{vendor.DAISYUI_VERSION}/dist/full.css")
+        self.assertIn("0 of 4 pinned files are vendored", self.check())
+
+    def test_locked_files_are_served_from_static(self):
+        self.vendor_file()
+        self.assertEqual(self.asset(), "/static/vendor/daisyui/full.css")
+        self.assertIn("1 of 4 pinned files are vendored", self.check())
+
+    def test_a_file_locked_to_another_version_isnt_used(self):
+        self.vendor_file(locked_url="https://cdn.jsdelivr.net/npm/daisyui@3.0.0/dist/full.css")
+        self.assertTrue(self.asset().startswith("https://"))
+        with self.assertRaisesMessage(CommandError, "run with --update"):
+            self.check()
+
+    def test_the_check_fails_on_a_changed_or_missing_file(self):
+        self.vendor_file(content=b"/* changed */")
+        with self.assertRaisesMessage(CommandError, "contents don't match the lock file"):
+            self.check()
+
+        (self.vendor_dir / self.path).unlink()
+        with self.assertRaisesMessage(CommandError, "in the lock file but missing"):
+            self.check()
+
+    def test_a_strict_check_fails_while_anything_comes_from_the_cdn(self):
+        self.vendor_file()
+        with self.assertRaisesMessage(CommandError, "ag-grid/ag-grid.css: not vendored"):
+            call_command("vendor_assets", "--check", "--strict", stdout=StringIO())
+
+    def test_vendoring_downloads_and_locks_every_pinned_file(self):
+        def download(url, timeout):
+            return mock.MagicMock(**{"__enter__.return_value.read.return_value": f"/* {url} */".encode()})
+
+        with mock.patch("urllib.request.urlopen", side_effect=download):
+            call_command("vendor_assets", stdout=StringIO())
+        self.assertEqual(self.asset(), "/static/vendor/daisyui/full.css")
+        self.assertEqual(set(json.loads((self.vendor_dir / "vendor.lock.json").read_text())), set(vendor.VENDOR_ASSETS))
+        call_command("vendor_assets", "--check", "--strict", stdout=StringIO())
+
+
+# (Temperature Analytics)
+class DailyTemperatureStatsTests(SimpleTestCase):
+    start = date(2026, 3, 1)
+    end = date(2026, 3, 10)
+
+    def test_the_vectorised_numbers_match_a_day_by_day_loop(self):
+        generator = np.random.default_rng(7)
+        days = generator.integers(0, 10, 500)
+        days = days[days != 4]  # a day without readings
+        values = generator.normal(80, 8, len(days)).round(1)
+
+        summary, rows = daily_temperature_stats(days, values, self.start, self.end, window=3)
+        self.assertEqual(summary["count"], len(values))
+        self.assertEqual(summary["p50"], round(float(np.percentile(values, 50)), 2))
+
+        for day, row in enumerate(rows):
+            row = dict(zip(analytics.DAILY_FIELDS, row))
+            self.assertEqual(row["date"], str(self.start + timedelta(days=day)))
+            today = values[days == day]
+            window = values[(days <= day) & (days > day - 3)]
+            self.assertAlmostEqual(row["rolling_mean"], window.mean(), places=2)
+            if not len(today):
+                self.assertEqual((row["count"], row["min"], row["p95"]), (0, None, None))
+                continue
+            self.assertEqual(row["count"], len(today))
+            self.assertAlmostEqual(row["min"], today.min(), places=2)
+            self.assertAlmostEqual(row["max"], today.max(), places=2)
+            self.assertAlmostEqual(row["mean"], today.mean(), places=2)
+            self.assertAlmostEqual(row["p50"], np.percentile(today, 50), places=2)
+            self.assertAlmostEqual(row["p95"], np.percentile(today, 95), places=2)
+            self.assertEqual(row["out_of_range"], int(((today < 75) | (today > 100)).sum()))
+
+    def test_no_readings_at_all(self):
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        summary, rows = daily_temperature_stats(*empty, self.start, self.end, window=7)
+        self.assertEqual(summary, {"count": 0, "out_of_range": 0})
+        self.assertEqual(len(rows), 10)
+        self.assertTrue(all(row[2] is None and row[-1] is None for row in rows))
+
+
+@override_settings(TEMPERATURE_ANALYTICS_CACHE_SECONDS=60)
+class TemperatureAnalyticsTests(DeliTestCase):
+    def setUp(self):
+        cache.clear()
+        instance, response, _ = start_today(self.staff)
+        save(response, "Rice", "core_temp", "80", self.staff)
+        save(response, "Chicken", "core_temp", "90", self.staff)
+        move_back(instance, response)
+        _, self.response, _ = start_today(self.staff)
+        save(self.response, "Rice", "core_temp", "76", self.staff)
+        self.client.force_login(self.manager)
+
+    def analytics(self, **params):
+        return self.client.get("/api/manager/analytics/temperature/", params)
+
+    def by_date(self, payload):
+        return {row[0]: dict(zip(payload["fields"], row)) for row in payload["rows"] if row[1]}
+
+    def test_daily_numbers_for_my_delis(self):
+        payload = self.analytics().json()
+        self.assertEqual(payload["summary"]["count"], 3)
+        days = self.by_date(payload)
+        yesterday = days[str(date.today() - timedelta(days=1))]
+        self.assertEqual((yesterday["min"], yesterday["max"], yesterday["mean"]), (80.0, 90.0, 85.0))
+        self.assertEqual(days[str(date.today())]["rolling_mean"], 82.0)
+
+        other = make_deli("Other Street")
+        self.assertEqual(self.analytics(deli=other.pk).json()["summary"]["count"], 0)
+
+    def test_results_are_cached_until_a_reading_changes(self):
+        build_payload = analytics.temperature_analytics_payload
+        with mock.patch("accounts.analytics.temperature_analytics_payload", wraps=build_payload) as build:
+            self.analytics()
+            self.analytics()
+            self.assertEqual(build.call_count, 1)
+
+            save(self.response, "Chicken", "core_temp", "95", self.staff)
+            self.assertEqual(self.analytics().json()["summary"]["count"], 4)
+            self.assertEqual(build.call_count, 2)
+
+    def test_a_weekly_reading_counts_once(self):
+        _, weekly = start_weekly(self.deli, self.manager, self.staff, self.template)
+        save(weekly, "Soup", "core_temp", "85", self.staff)
+
+        days = self.by_date(self.analytics().json())
+        self.assertEqual(days[str(date.today())]["count"], 2)
+        self.assertEqual(sum(day["count"] for day in days.values()), 4)
+
+    def test_bad_filters_are_refused(self):
+        self.assertEqual(self.analytics(start="yesterday").status_code, 400)
+        self.assertEqual(self.analytics(start="2026-02-01", end="2026-01-01").status_code, 400)
+        self.assertEqual(self.analytics(window=0).status_code, 400)
+
+        self.client.force_login(self.staff)
+        self.assertEqual(self.analytics().status_code, 403)
+
+
+# (Reading Anomalies)
+# Series are built by hand as (item, field, day, value) readings, days counted from DAY_ZERO
+DAY_ZERO = date(2026, 3, 1).toordinal()
+STEADY = [80.0, 80.6, 79.4, 80.2, 79.8, 80.4, 79.6, 80.0, 80.6, 79.4, 80.2, 79.8, 80.4, 79.6, 80.0]
+
+
+def score(series, score_from=0, yesterday=None, active_items=(1, 2)):
+    readings = sorted((item, 1, DAY_ZERO + day, value) for item, values in series.items() for day, value in values)
+    items, fields, days, values = (np.array(column) for column in zip(*readings))
+    last_day = max(day for values in series.values() for day, _ in values)
+    return score_readings(
+        items, fields, days, values.astype(float), DAY_ZERO + score_from,
+        DAY_ZERO + (last_day if yesterday is None else yesterday), np.array(active_items),
+    )
+
+
+def kinds(found):
+    return [(anomaly["checklist_item_id"], anomaly["kind"], anomaly["date"].toordinal() - DAY_ZERO) for anomaly in found]
+
+
+class ScoreReadingsTests(SimpleTestCase):
+    def test_a_steady_series_is_quiet(self):
+        self.assertEqual(score({1: list(enumerate(STEADY))}), [])
+
+    def test_one_odd_reading_is_a_spike(self):
+        found = score({1: list(enumerate(STEADY + [92.0] + STEADY[:3]))})
+        self.assertEqual(kinds(found), [(1, ReadingAnomaly.KIND_SPIKE, 15)])
+        self.assertEqual(found[0]["value"], 92.0)
+        self.assertAlmostEqual(found[0]["expected"], 80, delta=0.5)
+
+    def test_a_small_lasting_shift_is_a_drift(self):
+        found = score({1: list(enumerate(STEADY + [value + 1.0 for value in STEADY[:8]]))})
+        self.assertTrue(found)
+        self.assertEqual({kind for _, kind, _ in kinds(found)}, {ReadingAnomaly.KIND_DRIFT})
+        self.assertGreaterEqual(min(day for *_, day in kinds(found)), 15)
+
+    def test_series_dont_spill_into_each_other(self):
+        fridge = [(day, value - 76) for day, value in enumerate(STEADY)]
+        self.assertEqual(score({1: list(enumerate(STEADY)), 2: fridge}), [])
+
+    def test_missing_days_are_a_gap_unless_the_item_is_retired(self):
+        readings = [(day, value) for day, value in enumerate(STEADY) if day not in (6, 7, 8)]
+        self.assertEqual(kinds(score({1: readings})), [(1, ReadingAnomaly.KIND_GAP, 5 + GAP_DAYS)])
+
+        stopped = list(enumerate(STEADY[:10]))
+        self.assertEqual(kinds(score({1: stopped}, yesterday=14)), [(1, ReadingAnomaly.KIND_GAP, 9 + GAP_DAYS)])
+        self.assertEqual(score({1: stopped}, yesterday=14, active_items=()), [])
+
+    def test_only_days_from_score_from_are_reported(self):
+        self.assertEqual(score({1: list(enumerate(STEADY + [92.0]))}, score_from=16), [])
+
+
+class ScanDeliTests(DeliTestCase):
+    def setUp(self):
+        # A reading a day for the last 16 days, the one 3 days ago way off
+        values = STEADY[:13] + [95.0] + STEADY[:2]
+        for days_ago in range(len(values), 0, -1):
+            instance, response, _ = start_today(self.staff)
+            save(response, "Rice", "core_temp", str(values[-days_ago]), self.staff)
+            save(response, "Chicken", "core_temp", "80", self.staff)
+            move_back(instance, response, days_ago)
+        ChecklistInstance.objects.update(is_locked=True)
+
+    def anomalies(self):
+        return list(ReadingAnomaly.objects.values_list("checklist_item__name", "kind", "date"))
+
+    def test_scanning_stores_the_anomalies_and_moves_the_watermark(self):
+        self.assertEqual(scan_deli(self.deli.pk), 1)
+        self.assertEqual(self.anomalies(), [("Rice", ReadingAnomaly.KIND_SPIKE, date.today() - timedelta(days=3))])
+        self.deli.refresh_from_db()
+        self.assertEqual(self.deli.anomalies_scanned_through, date.today() - timedelta(days=1))
+
+        # Nothing new to score
+        self.assertEqual(scan_deli(self.deli.pk), 0)
+        self.assertEqual(len(self.anomalies()), 1)
+
+    def test_open_days_are_scored_again_next_time(self):
+        ChecklistInstance.objects.filter(date=date.today() - timedelta(days=2)).update(is_locked=False)
+        scan_deli(self.deli.pk)
+        self.deli.refresh_from_db()
+        self.assertEqual(self.deli.anomalies_scanned_through, date.today() - timedelta(days=3))
+
+        # Rescoring replaces rather than adds
+        Deli.objects.filter(pk=self.deli.pk).update(anomalies_scanned_through=date.today() - timedelta(days=5))
+        scan_deli(self.deli.pk)
+        self.assertEqual(len(self.anomalies()), 1)
+
+    def test_a_weekly_answer_is_one_reading(self):
+        # Started 6 days ago and shared by every day's instance since, only today's still open
+        _, response = start_weekly(self.deli, self.manager, self.staff, self.template)
+        save(response, "Soup", "core_temp", "80", self.staff)
+        ChecklistResponse.objects.filter(pk=response.pk).update(completed_at=response.completed_at - timedelta(days=6))
+        ResponseItem.objects.filter(response=response).update(created_on=date.today() - timedelta(days=6))
+        ChecklistInstance.objects.exclude(date=date.today()).update(is_locked=True)
+
+        scan_deli(self.deli.pk)
+        soup = [(kind, day) for name, kind, day in self.anomalies() if name == "Soup"]
+        self.assertEqual(soup, [(ReadingAnomaly.KIND_GAP, date.today() - timedelta(days=6 - GAP_DAYS))])
+
+        # Today's instance can still change that answer, so the day it is dated isn't final yet
+        self.deli.refresh_from_db()
+        self.assertEqual(self.deli.anomalies_scanned_through, date.today() - timedelta(days=7))
+
+
+# (Temperature Probes)
+class ProbeTestCase(DeliTestCase):
+    def setUp(self):
+        self.gateway, self.token = new_gateway(self.deli, "Kitchen")
+        Probe.objects.create(
+            deli=self.deli, serial="P-1",
+            checklist_item=self.checklist.items.get(name="Rice"),
+            template_field=self.template.fields.get(name="core_temp"),
+        )
+        self.at = now().replace(microsecond=0).isoformat()
+
+    def post(self, body, token=None):
+        return self.client.post(
+            "/api/probes/readings/", body, content_type="application/json",
+            headers={"authorization": f"Bearer {token or self.token}"},
+        )
+
+    def readings(self, *readings):
+        return self.post({"readings": list(readings)})
+
+
+@override_settings(PROBE_FLUSH_SECONDS=0)
+class ProbeIngestTests(ProbeTestCase):
+    def test_only_active_gateways_are_let_in(self):
+        self.assertEqual(self.post({"readings": []}, token="wrong").status_code, 401)
+        self.assertEqual(self.client.post("/api/probes/readings/", {}, content_type="application/json").status_code, 401)
+
+        ProbeGateway.objects.filter(pk=self.gateway.pk).update(is_active=False)
+        self.assertEqual(self.readings().status_code, 401)
+
+    def test_good_readings_are_written_during_the_request(self):
+        result = self.readings({"probe": "P-1", "at": self.at, "value": 80.456})
+        self.assertEqual(result.status_code, 201)
+        self.assertEqual(result.json(), {"accepted": 1, "rejected": []})
+        reading = ProbeReading.objects.get()
+        self.assertEqual(str(reading.value), "80.46")
+        self.assertEqual(reading.checklist_item.name, "Rice")
+
+    def test_each_bad_reading_is_refused_with_its_reason(self):
+        future = (now() + timedelta(hours=1)).isoformat()
+        result = self.readings(
+            "not a reading",
+            {"probe": "P-2", "at": self.at, "value": 80},
+            {"probe": "P-1", "at": "yesterday", "value": 80},
+            {"probe": "P-1", "at": self.at, "value": "80"},
+            {"probe": "P-1", "at": self.at, "value": True},
+            {"probe": "P-1", "at": self.at, "value": 20},
+            {"probe": "P-1", "at": future, "value": 80},
+        ).json()
+        self.assertEqual(result["accepted"], 1)
+        self.assertEqual([(rejected["index"], rejected["error"]) for rejected in result["rejected"]], [
+            (0, "Each reading must be an object."),
+            (1, "Unknown probe."),
+            (2, "at must be an ISO 8601 time."),
+            (3, "Please enter a valid number."),
+            (4, "Please enter a valid number."),
+            (5, "Core temperature must be between 75 and 100."),
+        ])
+        # A probe clock running ahead doesn't date a reading in the future
+        self.assertLessEqual(ProbeReading.objects.get().taken_at, now())
+
+    def test_bad_batches_are_refused(self):
+        self.assertEqual(self.post("nope").status_code, 400)
+        self.assertEqual(self.post({"readings": {"probe": "P-1"}}).status_code, 400)
+        with override_settings(PROBE_MAX_BATCH=2):
+            self.assertEqual(self.readings(*[{"probe": "P-1", "at": self.at, "value": 80}] * 3).status_code, 413)
+
+    @override_settings(TEMPERATURE_ANALYTICS_CACHE_SECONDS=60)
+    def test_readings_count_in_the_temperature_analytics(self):
+        cache.clear()
+        self.readings({"probe": "P-1", "at": self.at, "value": 80}, {"probe": "P-1", "at": self.at, "value": 90})
+        self.client.force_login(self.manager)
+        summary = self.client.get("/api/manager/analytics/temperature/").json()["summary"]
+        self.assertEqual((summary["count"], summary["mean"]), (2, 85.0))
+
+        # A new reading is seen straight away, not after the cache times out
+        self.readings({"probe": "P-1", "at": self.at, "value": 100})
+        self.assertEqual(self.client.get("/api/manager/analytics/temperature/").json()["summary"]["count"], 3)
+
+    def test_a_probe_series_is_scored_by_its_daily_mean(self):
+        # Three readings a day for the last 16 days, the day 3 days ago way off
+        values = STEADY[:13] + [95.0] + STEADY[:2]
+        for days_ago in range(len(values), 0, -1):
+            at = now() - timedelta(days=days_ago)
+            self.readings(*[
+                {"probe": "P-1", "at": (at + timedelta(minutes=minute)).isoformat(), "value": values[-days_ago] + offset}
+                for minute, offset in ((0, -0.5), (1, 0), (2, 0.5))
+            ])
+
+        scan_deli(self.deli.pk)
+        anomalies = list(ReadingAnomaly.objects.values_list("checklist_item__name", "kind", "date", "value"))
+        self.assertEqual(anomalies, [("Rice", ReadingAnomaly.KIND_SPIKE, localdate() - timedelta(days=3), 95.0)])
+
+    @override_settings(SHARD_DATABASES=["default", "shard_1"])
+    def test_readings_wait_while_the_deli_moves(self):
+        Deli.objects.filter(pk=self.deli.pk).update(shard_moving_to="shard_1")
+        with self.assertLogs("accounts.sharding", "INFO"):
+            result = self.readings({"probe": "P-1", "at": self.at, "value": 80})
+        self.assertEqual(result.status_code, 503)
+        self.assertFalse(ProbeReading.objects.exists())
+
+
+# The buffer's own thread is kept from starting, the tests flush it by hand
+@override_settings(PROBE_FLUSH_SECONDS=60, PROBE_BUFFER_MAX_ROWS=2)
+class ProbeBufferTests(ProbeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.buffer = ReadingBuffer()
+        self.buffer._thread = mock.Mock()
+        patcher = mock.patch("accounts.probes.reading_buffer", self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_readings_are_acknowledged_before_they_are_written(self):
+        result = self.readings({"probe": "P-1", "at": self.at, "value": 80})
+        self.assertEqual(result.status_code, 202)
+        self.assertFalse(ProbeReading.objects.exists())
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(ProbeReading.objects.count(), 1)
+
+    def test_a_full_buffer_asks_the_gateway_to_wait(self):
+        reading = {"probe": "P-1", "at": self.at, "value": 80}
+        self.assertEqual(self.readings(reading, reading).status_code, 202)
+        full = self.readings(reading)
+        self.assertEqual(full.status_code, 503)
+        self.assertEqual(full["Retry-After"], "60")
+
+        self.buffer.flush()
+        self.assertEqual(self.readings(reading).status_code, 202)
+
+    def test_rows_that_cant_be_written_are_kept_for_the_next_flush(self):
+        self.readings({"probe": "P-1", "at": self.at, "value": 80})
+        with mock.patch("accounts.probes.write_readings", side_effect=OperationalError("gone")), \
+                self.assertLogs("accounts.probes", "ERROR"):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(len(self.buffer), 1)
+        self.assertEqual(self.buffer.flush(), 1)
+
+
+# (Rate Limits)
+@override_settings(RATE_LIMITS={"login": "ip=10/m,user=3/m", "save": "user=2/s"}, RATE_LIMITS_ENABLED=True)
+class RateLimitTests(DeliTestCase):
+    def setUp(self):
+        caches[settings.RATE_LIMIT_CACHE].clear()
+
+    def sign_in(self, email="manager@example.com", password="wrong", ip="10.0.0.1"):
+        return self.client.post("/login/", {"email": email, "password": password}, REMOTE_ADDR=ip)
+
+    def test_rates_are_read_from_settings_text(self):
+        self.assertEqual(parse_rates("ip=20/m, user=5/s"), {"ip": (20, 60), "user": (5, 1)})
+        for bad in ("ip=20/day", "device=5/m", "ip=lots/m"):
+            with self.assertRaises(ValueError):
+                parse_rates(bad)
+
+    def test_the_client_ip_comes_from_the_trusted_proxy_hop(self):
+        request = RequestFactory().get("/", REMOTE_ADDR="10.0.0.9", HTTP_X_FORWARDED_FOR="6.6.6.6, 1.2.3.4, 10.0.0.5")
+        self.assertEqual(client_ip(request), "10.0.0.9")
+        with override_settings(RATE_LIMIT_PROXY_COUNT=2):
+            self.assertEqual(client_ip(request), "1.2.3.4")
+
+    def test_one_account_gets_a_few_tries_then_waits(self):
+        for _ in range(3):
+            self.assertEqual(self.sign_in().status_code, 200)
+        limited = self.sign_in(password="secret-pw")
+        self.assertEqual(limited.status_code, 429)
+        self.assertGreaterEqual(int(limited["Retry-After"]), 1)
+        self.assertContains(limited, "Too many sign-in attempts", status_code=429)
+
+        # Another account from the same address, and the login page itself, still work
+        self.assertEqual(self.sign_in(email="staff@example.com").status_code, 200)
+        self.assertEqual(self.client.get("/login/").status_code, 200)
+
+    def test_one_address_is_limited_across_accounts(self):
+        for number in range(10):
+            self.sign_in(email=f"guess{number}@example.com")
+        self.assertEqual(self.sign_in(email="staff@example.com").status_code, 429)
+        self.assertEqual(self.sign_in(email="staff@example.com", ip="10.0.0.2").status_code, 200)
+
+    def test_buckets_refill_over_time(self):
+        # Only throttle's clock is stopped, the cache's expiry times still use the real one
+        clock = SimpleNamespace(time=lambda: 1000.0)
+        with mock.patch("accounts.throttle.time", clock):
+            self.assertEqual(check_rate_limit("save", {"user": "7"}), 0)
+            self.assertEqual(check_rate_limit("save", {"user": "7"}), 0)
+            self.assertAlmostEqual(check_rate_limit("save", {"user": "7"}), 0.5)
+            clock.time = lambda: 1000.5
+            self.assertEqual(check_rate_limit("save", {"user": "7"}), 0)
+
+    def test_a_refused_request_takes_no_tokens(self):
+        for number in range(3):
+            check_rate_limit("login", {"ip": "10.0.0.1", "user": "a@example.com"})
+        # The user bucket is empty, so the address keeps its tokens
+        self.assertGreater(check_rate_limit("login", {"ip": "10.0.0.1", "user": "a@example.com"}), 0)
+        for number in range(7):
+            self.assertEqual(check_rate_limit("login", {"ip": "10.0.0.1", "user": f"{number}@example.com"}), 0)
+
+    def test_a_broken_cache_lets_requests_through(self):
+        with mock.patch.object(caches[settings.RATE_LIMIT_CACHE], "get_many", side_effect=OperationalError("down")), \
+                self.assertLogs("accounts.throttle", "WARNING"):
+            self.assertEqual(check_rate_limit("login", {"ip": "10.0.0.1"}), 0)
+
+
+# (Load Shedding)
+# Each test gets a fresh monitor, so the queries of earlier tests don't count
+@override_settings(
+    LOAD_SHED_ENABLED=True, LOAD_SHED_QUEUE_MS=500, LOAD_SHED_DB_LATENCY_MS=100, LOAD_SHED_MAX_IN_FLIGHT=0,
+    LOAD_SHED_RETRY_AFTER=15,
+)
+class LoadSheddingTests(DeliTestCase):
+    def setUp(self):
+        self.monitor = LoadMonitor()
+        patcher = mock.patch("accounts.throttle.load_monitor", self.monitor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_login(self.manager)
+
+    def waited(self, url, seconds):
+        return self.client.get(url, headers={"x-request-start": f"t={(time.time() - seconds) * 1000:.0f}"})
+
+    def test_the_queue_time_header_is_read_in_any_unit(self):
+        started = time.time() - 2
+        for header in (f"t={started:.3f}", f"t={started * 1000:.0f}", f"{started * 1_000_000:.0f}"):
+            request = RequestFactory().get("/", HTTP_X_REQUEST_START=header)
+            self.assertAlmostEqual(queue_ms(request), 2000, delta=200)
+        self.assertEqual(queue_ms(RequestFactory().get("/")), 0)
+
+    def test_reports_are_shed_when_requests_queue(self):
+        with self.assertLogs("accounts.throttle", "WARNING"):
+            shed = self.waited("/api/manager/analytics/temperature/", 3)
+        self.assertEqual(shed.status_code, 503)
+        self.assertEqual(shed["Retry-After"], "15")
+        self.assertEqual(shed.json(), {"error": "The server is busy, please try again shortly"})
+
+        # Staff saving checklists are never shed
+        self.client.force_login(self.staff)
+        self.assertEqual(self.waited("/api/staff/today/", 3).status_code, 200)
+
+    def test_reports_are_shed_while_queries_are_slow(self):
+        self.monitor.record_query(1000)
+        with self.assertLogs("accounts.throttle", "WARNING"):
+            self.assertEqual(self.client.get("/api/manager/analytics/temperature/").status_code, 503)
+
+        later = SimpleNamespace(time=time.time, perf_counter=time.perf_counter, monotonic=lambda: time.monotonic() + 60)
+        with mock.patch("accounts.throttle.time", later):
+            self.assertEqual(self.client.get("/api/manager/analytics/temperature/").status_code, 200)
+
+    @override_settings(LOAD_SHED_MAX_IN_FLIGHT=1)
+    def test_reports_are_shed_when_the_worker_is_busy(self):
+        self.monitor.started()
+        with self.assertLogs("accounts.throttle", "WARNING"):
+            self.assertEqual(self.client.get("/api/manager/analytics/temperature/").status_code, 503)
+        self.monitor.finished()
+        self.assertEqual(self.client.get("/api/manager/analytics/temperature/").status_code, 200)
+        self.assertEqual(self.monitor.in_flight, 0)
+
+    @override_settings(LOAD_SHED_ENABLED=False)
+    def test_shedding_can_be_turned_off(self):
+        self.assertEqual(self.waited("/api/manager/analytics/temperature/", 3).status_code, 200)
+
+
+# (Answer Partitions)
+class PartitionHelperTests(SimpleTestCase):
+    def test_months_are_counted_across_years(self):
+        self.assertEqual(month_start(date(2026, 3, 31)), date(2026, 3, 1))
+        self.assertEqual(add_months(date(2026, 11, 1), 3), date(2027, 2, 1))
+        self.assertEqual(add_months(date(2026, 1, 1), -13), date(2024, 12, 1))
+        self.assertEqual(partition_name(date(2026, 3, 1)), "accounts_responseitem_p2026_03")
+
+
+# The answers table is converted in each test and put back afterwards, so the other tests
+# keep running on the plain table they were migrated with
+@skipUnless(connection.vendor == "postgresql", "partitions need PostgreSQL")
+class ResponseItemPartitionTests(TransactionTestCase):
+    def setUp(self):
+        self.deli = make_deli()
+        self.staff = make_user("staff@example.com", delis=[self.deli])
+        make_checklist(self.deli, make_user("manager@example.com", role="manager", delis=[self.deli]), make_template())
+        _, self.response, _ = start_today(self.staff)
+        save(self.response, "Rice", "core_temp", "80", self.staff)
+
+        # One answer from over a year ago
+        self.this_month = month_start(date.today())
+        self.old_month = add_months(self.this_month, -14)
+        self.old = cell(self.response, "Chicken", "food_name")
+        ResponseItem.objects.filter(pk=self.old.pk).update(created_on=self.old_month + timedelta(days=3))
+
+        self.answers = ResponseItem.objects.count()
+        with self.assertLogs("accounts.partitions", "INFO"):
+            convert_to_partitioned(connection, months_ahead=0)
+        self.addCleanup(self.make_plain)
+
+    def make_plain(self):
+        with self.assertLogs("accounts.partitions", "INFO"):
+            convert_to_plain(connection)
+
+    def months(self):
+        return [start for _, start, _ in partitions(connection)]
+
+    def test_converting_keeps_every_answer(self):
+        self.assertTrue(is_partitioned(connection))
+        self.assertEqual(self.months()[0], self.old_month)
+        self.assertEqual(self.months()[-1], self.this_month)
+        self.assertEqual(ResponseItem.objects.count(), self.answers)
+
+        # Saves and new rows carry on as before
+        save(self.response, "Rice", "core_temp", "85", self.staff)
+        self.assertEqual(str(cell(self.response, "Rice", "core_temp").answer_decimal), "85.00")
+        self.assertGreater(ResponseItem.objects.create(
+            response=self.response, checklist_item=self.old.checklist_item, template_field=self.old.template_field,
+        ).pk, self.old.pk)
+
+    def test_upcoming_months_pick_up_rows_from_the_default_partition(self):
+        ahead = add_months(self.this_month, 2)
+        ResponseItem.objects.filter(pk=self.old.pk).update(created_on=ahead)
+        self.assertEqual(default_partition_rows(connection), 1)
+
+        self.assertEqual(ensure_partitions(connection, months_ahead=2), [
+            partition_name(add_months(self.this_month, 1)), partition_name(ahead),
+        ])
+        self.assertEqual(default_partition_rows(connection), 0)
+        self.assertEqual(ResponseItem.objects.filter(created_on=ahead).count(), 1)
+        self.assertEqual(ensure_partitions(connection, months_ahead=2), [])
+
+    def test_old_months_are_archived_to_a_file_and_dropped(self):
+        # This month and the 12 before it are kept
+        expired = expired_partitions(connection, retention_months=12)
+        self.assertEqual([start for _, start, _ in expired], self.months()[:-13])
+        name = partition_name(self.old_month)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with self.assertLogs("accounts.partitions", "INFO"):
+            archived = archive_partition(connection, name, directory.name)
+        self.assertEqual(archived["rows"], 1)
+        self.assertFalse(ResponseItem.objects.filter(pk=self.old.pk).exists())
+        self.assertEqual(ResponseItem.objects.count(), self.answers - 1)
+        self.assertNotIn(self.old_month, self.months())
+        self.assertEqual(detached_partitions(connection), [])
+
+        manifest = json.loads(Path(directory.name, f"{name}.json").read_text())
+        self.assertEqual((manifest["rows"], manifest["from"]), (1, self.old_month.isoformat()))
+        with gzip.open(archived["file"], "rt") as archive:
+            rows = list(csv.DictReader(archive))
+        self.assertEqual([int(row["id"]) for row in rows], [self.old.pk])
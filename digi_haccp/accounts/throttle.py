@@ -0,0 +1,247 @@
+import logging
+import threading
+import time
+from functools import partial, wraps
+from inspect import iscoroutinefunction
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import HttpResponse, JsonResponse
+
+logger = logging.getLogger(__name__)
+
+
+# (Rate Limits)
+# Every login POST runs a full PBKDF2 check and every save hits the primary, so a
+# credential-stuffing burst or a tablet stuck in a retry loop can tie up every worker.
+# @rate_limit("login") gives each endpoint token buckets keyed by client IP and by user (the
+# account being signed in to, or the signed-in user). A bucket holds `count` tokens and refills
+# at `count` per period. A request takes one token from each of its buckets, and a bucket that
+# is empty answers 429 with Retry-After. The buckets are kept in the "shared" cache (see
+# CACHES in settings.py), so every worker and server sees the same numbers.
+# Reading and writing a bucket aren't one atomic step. Two workers can both take the last
+# token, so a burst can get a few extra requests through, but never more than one per worker.
+# Reference: https://en.wikipedia.org/wiki/Token_bucket
+
+PERIODS = {"s": 1, "m": 60, "h": 60 * 60}
+
+
+# "ip=20/m,user=5/m" -> {"ip": (20, 60), "user": (5, 60)}
+def parse_rates(text):
+    rates = {}
+    for part in filter(None, (part.strip() for part in text.split(","))):
+        key, _, rate = part.partition("=")
+        count, _, period = rate.partition("/")
+        if key.strip() not in ("ip", "user") or period.strip() not in PERIODS:
+            raise ValueError(f"Can't read the rate limit {part!r}, use something like ip=20/m")
+        rates[key.strip()] = (int(count), PERIODS[period.strip()])
+    return rates
+
+
+def client_ip(request):
+    # Behind RATE_LIMIT_PROXY_COUNT proxies the client is that many entries from the end of
+    # X-Forwarded-For. Anything further left was sent by the client and can't be trusted.
+    hops = settings.RATE_LIMIT_PROXY_COUNT
+    forwarded = [part.strip() for part in request.META.get("HTTP_X_FORWARDED_FOR", "").split(",") if part.strip()]
+    if hops and len(forwarded) >= hops:
+        return forwarded[-hops]
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def signed_in_user(request):
+    user = getattr(request, "user", None)
+    return str(user.pk) if user is not None and user.is_authenticated else None
+
+
+def _take(name, keys):
+    rates = parse_rates(settings.RATE_LIMITS.get(name, ""))
+    buckets = {
+        f"rate-limit:{name}:{kind}:{value}": rates[kind]
+        for kind, value in keys.items() if value and kind in rates
+    }
+    if not buckets:
+        return 0
+
+    cache = caches[settings.RATE_LIMIT_CACHE]
+    stored = cache.get_many(list(buckets))
+    now = time.time()
+    updated, retry_after = {}, 0
+    for key, (count, period) in buckets.items():
+        tokens, last = stored.get(key, (count, now))
+        tokens = min(count, tokens + (now - last) * count / period)
+        if tokens < 1:
+            retry_after = max(retry_after, (1 - tokens) * period / count)
+        updated[key] = (tokens - 1, now)
+
+    # Only a request that every bucket lets through takes its tokens
+    if retry_after:
+        return retry_after
+    cache.set_many(updated, timeout=max(period for _, period in buckets.values()) * 2)
+    return 0
+
+
+def check_rate_limit(name, keys):
+    """Takes a token for each key, or returns how many seconds to wait when one is empty."""
+    if not settings.RATE_LIMITS_ENABLED:
+        return 0
+    try:
+        return _take(name, keys)
+    except Exception as error:
+        # A cache that's down mustn't lock everyone out
+        logger.warning("Rate limit cache unavailable, letting %s through: %s", name, error)
+        return 0
+
+
+def too_many_requests(request, retry_after):
+    response = JsonResponse({"error": "Too many requests, please try again shortly"}, status=429)
+    response["Retry-After"] = str(int(retry_after) + 1)
+    return response
+
+
+# user_key(request) names the account the request is for (None for no user bucket).
+# limited(request, retry_after) builds the response when a bucket is empty.
+# Only POSTs are counted, loading a page or the login form never is.
+def rate_limit(name, user_key=signed_in_user, limited=too_many_requests):
+    def decorator(view):
+        def wait_for(request):
+            if request.method != "POST":
+                return 0
+            return check_rate_limit(name, {"ip": client_ip(request), "user": user_key(request)})
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                retry_after = await sync_to_async(wait_for)(request)
+                if retry_after:
+                    logger.info("Rate limited %s from %s", name, client_ip(request))
+                    return limited(request, retry_after)
+                return await view(request, *args, **kwargs)
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            retry_after = wait_for(request)
+            if retry_after:
+                logger.info("Rate limited %s from %s", name, client_ip(request))
+                return limited(request, retry_after)
+            return view(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# (Load Shedding)
+# When the app is falling behind, the routes in LOAD_SHED_ROUTES (manager reports, exports,
+# analytics) get 503 with Retry-After, so the time that's left goes to staff filling in and
+# saving checklists. Any one of these means the app is falling behind:
+#   - the request waited in the proxy's queue longer than LOAD_SHED_QUEUE_MS (from the
+#     X-Request-Start header the proxy adds),
+#   - queries on the primary have recently averaged more than LOAD_SHED_DB_LATENCY_MS,
+#   - this worker already has LOAD_SHED_MAX_IN_FLIGHT requests running (for ASGI mode, where
+#     one worker takes many requests at once).
+# Each worker keeps its own numbers, so there is no extra round trip per request.
+
+# How fast the query time average follows new queries, and how long it counts for without them
+LATENCY_ALPHA = 0.2
+LATENCY_STALE_SECONDS = 10
+
+
+class LoadMonitor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.db_latency_ms = 0.0
+        self._measured_at = 0.0
+
+    def record_query(self, duration_ms):
+        with self._lock:
+            self.db_latency_ms += LATENCY_ALPHA * (duration_ms - self.db_latency_ms)
+            self._measured_at = time.monotonic()
+
+    def recent_db_latency_ms(self):
+        if time.monotonic() - self._measured_at > LATENCY_STALE_SECONDS:
+            return 0.0
+        return self.db_latency_ms
+
+    def started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finished(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+load_monitor = LoadMonitor()
+
+
+def queue_ms(request):
+    # Proxies write "t=<time>" in seconds, milliseconds or microseconds since the epoch
+    header = request.META.get("HTTP_X_REQUEST_START", "").strip().removeprefix("t=")
+    try:
+        started = float(header)
+    except ValueError:
+        return 0.0
+    while started > 1e11:
+        started /= 1000
+    return max(0.0, (time.time() - started) * 1000)
+
+
+def overload_reason(request):
+    """Why the app counts as overloaded right now, or None."""
+    waited = queue_ms(request)
+    if settings.LOAD_SHED_QUEUE_MS and waited > settings.LOAD_SHED_QUEUE_MS:
+        return f"queued {waited:.0f}ms"
+    latency = load_monitor.recent_db_latency_ms()
+    if settings.LOAD_SHED_DB_LATENCY_MS and latency > settings.LOAD_SHED_DB_LATENCY_MS:
+        return f"queries averaging {latency:.0f}ms"
+    # The request being checked is counted too
+    if settings.LOAD_SHED_MAX_IN_FLIGHT and load_monitor.in_flight > settings.LOAD_SHED_MAX_IN_FLIGHT:
+        return f"{load_monitor.in_flight} requests in flight"
+    return None
+
+
+class LoadShedMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.LOAD_SHED_ENABLED:
+            return self.get_response(request)
+
+        load_monitor.started()
+        try:
+            with connections[DEFAULT_DB_ALIAS].execute_wrapper(partial(self._time_query, request)):
+                return self.get_response(request)
+        finally:
+            load_monitor.finished()
+
+    def _time_query(self, request, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            # Reports are slow by design, only the other routes' queries say how busy the database is
+            if not getattr(request, "sheddable", False):
+                load_monitor.record_query((time.perf_counter() - started) * 1000)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not settings.LOAD_SHED_ENABLED or request.resolver_match.url_name not in settings.LOAD_SHED_ROUTES:
+            return None
+        request.sheddable = True
+        reason = overload_reason(request)
+        if reason is None:
+            return None
+
+        logger.warning("Shedding %s: %s", request.path, reason)
+        message = "The server is busy, please try again shortly"
+        if request.path.startswith("/api/"):
+            response = JsonResponse({"error": message}, status=503)
+        else:
+            response = HttpResponse(message, content_type="text/plain", status=503)
+        response["Retry-After"] = str(settings.LOAD_SHED_RETRY_AFTER)
+        return response
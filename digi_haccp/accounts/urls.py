@@ -1,6 +1,14 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# In ASGI mode the hot JSON endpoints are served by their async versions.
+# The URL names stay the same so templates and {% url %} tags don't change.
+if settings.ASGI_MODE:
+    from . import async_views as grid_api
+else:
+    grid_api = views
+
 # This file connects each webpage URL to the correct view function.
 # It basically tells Django which part of the website to load when a user visits a specific link.
 
@@ -10,6 +18,8 @@ urlpatterns = [
     path('dashboard/', views.dashboard_view, name='dashboard'),
     path('logout/', views.logout_view, name='logout'),
     path('manager-dashboard/', views.manager_dashboard_view, name='manager_dashboard'),
+    path('manager/overview/', views.manager_overview_view, name='manager_overview'),
+    path('api/manager/overview/', views.api_manager_overview, name='api_manager_overview'),
     path('manage-users/', views.manage_users_view, name='manage_users'),
     path('delete-user/<int:user_id>/', views.delete_user_view, name='delete_user'),
     path('manage-delis/', views.manage_delis_view, name='manage_delis'),
@@ -22,14 +32,27 @@ urlpatterns = [
     path("checklists/create/", views.create_checklist, name="create_checklist"),
     path("checklists/success/", views.checklist_success, name="checklist_success"),
     path("manager/checklists/", views.manager_checklists_combined, name="manager_checklists_combined"),
+    path("manager/checklists/bulk/", views.manager_checklists_bulk, name="manager_checklists_bulk"),
     path("manager/checklists/<int:checklist_id>/assign/", views.manager_assign_checklist, name="manager_assign_checklist"),
     path("manager/checklists/<int:checklist_id>/unassign/", views.manager_unassign_checklist, name="manager_unassign_checklist"),
     path("manager/checklists/<int:checklist_id>/delete/", views.manager_delete_checklist, name="manager_delete_checklist"),
-    path("api/checklists/<int:pk>/", views.api_get_checklist_data, name="api_get_checklist_data"),
+    path("manager/checklists/<int:checklist_id>/clone/", views.manager_clone_checklist, name="manager_clone_checklist"),
+    path("manager/checklists/<int:checklist_id>/items/", views.manager_edit_checklist_items, name="manager_edit_checklist_items"),
+    path("api/checklists/<int:pk>/", grid_api.api_get_checklist_data, name="api_get_checklist_data"),
     path("staff/checklists/", views.staff_view_checklists, name="staff_checklists"),
     path("checklist/fill/<int:instance_id>/", views.fill_checklist_view, name="fill_checklist"),
-    path("api/checklist/save/", views.api_save_field, name="api_save_field"),
+    path("api/checklist/save/", grid_api.api_save_field, name="api_save_field"),
+    path("api/checklist/save/batch/", views.api_save_batch, name="api_save_batch"),
+    path("api/staff/today/", views.api_staff_today, name="api_staff_today"),
+    path("api/checklist/response/<int:response_id>/events/", grid_api.api_response_events, name="api_response_events"),
+    path("api/checklist/response/<int:response_id>/changes/", grid_api.api_response_changes, name="api_response_changes"),
     path("manager/deli/<int:deli_id>/checklists/", views.deli_checklist_history, name="deli_checklist_history"),
-    path("manager/checklist/instance/<int:instance_id>/data/", views.api_manager_instance_detail, name="api_manager_instance_detail"),
+    path("manager/checklist/instance/<int:instance_id>/data/", grid_api.api_manager_instance_detail, name="api_manager_instance_detail"),
+    path("api/manager/compliance/heatmap/", views.api_compliance_heatmap, name="api_compliance_heatmap"),
+    path("api/manager/analytics/temperature/", views.api_temperature_analytics, name="api_temperature_analytics"),
+    path("api/jobs/<int:job_id>/", views.api_job_status, name="api_job_status"),
+    path("api/probes/readings/", views.api_probe_readings, name="api_probe_readings"),
+    path("manager/deli/<int:deli_id>/checklists/export/", views.manager_export_pdf, name="manager_export_pdf"),
+    path("manager/exports/<int:job_id>/download/", views.manager_export_download, name="manager_export_download"),
 
 ]
@@ -0,0 +1,48 @@
+import json
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+
+
+# (Vendored Assets)
+# The pages used to load daisyUI and AG Grid straight from cdn.jsdelivr.net, and AG Grid without
+# a version, so a new major release could change the grids under us overnight. Now every file
+# is pinned here. `python manage.py vendor_assets` downloads them into static/vendor/ and records
+# them in vendor.lock.json, and once they are committed (the build also runs it, so a deploy
+# never goes out without them) collectstatic fingerprints and precompresses them like our own
+# files (see STORAGES in settings.py).
+# A file that isn't in the lock file yet is loaded from its pinned CDN URL instead (see
+# templatetags/vendor.py), so the pages never ask the manifest for a file it doesn't have.
+# That is only a safety net for development checkouts.
+# To upgrade one, change its version, run vendor_assets --update and check the pages still work.
+VENDOR_DIR = Path(settings.BASE_DIR) / "static" / "vendor"
+LOCK_FILE = VENDOR_DIR / "vendor.lock.json"
+
+JSDELIVR = "https://cdn.jsdelivr.net/npm"
+DAISYUI_VERSION = "4.12.10"
+# 32.3 is the last release with the CSS files and the noStyle bundle our pages use
+AG_GRID_VERSION = "32.3.3"
+
+VENDOR_ASSETS = {
+    "daisyui/full.css": f"{JSDELIVR}/daisyui@{DAISYUI_VERSION}/dist/full.css",
+    "ag-grid/ag-grid.css": f"{JSDELIVR}/ag-grid-community@{AG_GRID_VERSION}/styles/ag-grid.css",
+    "ag-grid/ag-theme-alpine.css": f"{JSDELIVR}/ag-grid-community@{AG_GRID_VERSION}/styles/ag-theme-alpine.css",
+    "ag-grid/ag-grid-community.min.noStyle.js": (
+        f"{JSDELIVR}/ag-grid-community@{AG_GRID_VERSION}/dist/ag-grid-community.min.noStyle.js"
+    ),
+}
+
+
+def read_lock():
+    return json.loads(LOCK_FILE.read_text()) if LOCK_FILE.exists() else {}
+
+
+# The files that are committed under static/vendor/ with their pinned URL. Read once per
+# process: the lock only changes with a deploy.
+@lru_cache(maxsize=1)
+def vendored_paths():
+    return frozenset(
+        path for path, pinned in read_lock().items()
+        if VENDOR_ASSETS.get(path) == pinned["url"] and (VENDOR_DIR / path).exists()
+    )
@@ -3,29 +3,87 @@ from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from .newuser import SignUpForm
-from .forms import DeliForm, AssignDeliForm, ChecklistForm, ChecklistItem, InviteUserToDeliForm
-from datetime import date, datetime
+from .forms import DeliForm, AssignDeliForm, ChecklistForm, ChecklistItem, ChecklistItemFormSet, CloneChecklistForm, InviteUserToDeliForm
+from datetime import date, timedelta
 
 from .models import (
     Deli,
     User,
     Checklist,
     ChecklistInstance,
-    ChecklistInstanceItem,
     ChecklistResponse,
     ResponseItem,
     TemplateField,
     DeliJoinRequest,
+    ComplianceRollup,
+    Job,
 )
+from .analytics import MAX_RANGE_DAYS, MAX_WINDOW_DAYS, cached_temperature_analytics
+from .compliance import heatmap_payload
+from .overview import cached_overview_payload
+from .grid import (
+    CellValidationError,
+    checklist_preview_payload,
+    ensure_response_items,
+    fill_column_defs,
+    fill_rows,
+    row_fields,
+    save_cell,
+)
+from .bulk_actions import scoped_checklists, set_checklists_active
+from .db_router import replica_reads
+from .fan_out import create_copies, propagate_master_items
+from .fast_json import FastJsonResponse, loads as fast_json_loads, script_json
+from .http_cache import checklist_preview_stamp, conditional_grid, fill_page_stamp, instance_detail_stamp
+from .item_import import ItemImportError, create_items, file_rows, pasted_rows, validate_rows
+from .jobs import enqueue, job_status_payload
+from .purge import soft_delete_checklists, soft_delete_delis, soft_delete_users
+from .probes import accept_readings, gateway_for_request, validate_readings
+from .pdf_export import export_cache_dir, render_instances, stream_zip
+from .instances import shared_response_for, todays_instances
+from .offline import (
+    MAX_BATCH_EDITS,
+    apply_edit_batch,
+    batch_results_payload,
+    parse_edited_at,
+    save_field_result,
+    todays_work_payload,
+)
+from .sharding import deli_shard_view, keep_shard, row_shard_view, shard_for_new_deli
+from .throttle import rate_limit
+from .snapshots import instance_detail_payload, instance_response_queryset, snapshot_detail_payload
+from .live_sync import changes_since, event_stream, last_event_version
+from django.conf import settings
 from django.contrib.auth.decorators import user_passes_test
-from django.http import JsonResponse, HttpResponseNotAllowed
-from django.utils.timezone import now, localdate
-from django.db.models import Q
-from decimal import Decimal, InvalidOperation
+from django.http import FileResponse, Http404, JsonResponse, HttpResponseNotAllowed, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.timezone import now
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, Q
+from django.urls import reverse
+from django.utils.text import slugify
 import json
+import uuid
+from itertools import chain
+from pathlib import Path
+
+
+# A login is limited per IP and per email tried (see throttle.py), before the password is hashed
+def login_email(request):
+    return request.POST.get("email", "").strip().lower() or None
+
+
+def login_limited(request, retry_after):
+    messages.error(request, f"Too many sign-in attempts. Please wait {int(retry_after) + 1} seconds and try again.")
+    response = render(request, 'accounts/login.html', status=429)
+    response["Retry-After"] = str(int(retry_after) + 1)
+    return response
 
 
 # I wrote this view to handle the entire login process using Django's built-in authentication system. Reference:https://docs.djangoproject.com/en/5.0/topics/auth/default/#django.contrib.auth.authenticate
+@rate_limit("login", user_key=login_email, limited=login_limited)
 def login_view(request):
     if request.method == "POST":
         # I grab the email and password directly from the POST data that the user submitted
@@ -83,6 +141,35 @@ def manager_dashboard_view(request):
     })
 
 
+# This page shows today's status for every deli the manager has on one screen,
+# so they don't have to open each deli's history one by one.
+@login_required
+@replica_reads
+def manager_overview_view(request):
+    if request.user.role != 'manager':
+        return redirect('dashboard')
+
+    return render(request, 'accounts/manager_overview.html', {
+        'refresh_seconds': max(settings.MANAGER_OVERVIEW_CACHE_SECONDS, 30),
+    })
+
+
+# This API view returns the data for the overview page. It is built from a few grouped
+# queries (see overview.py) and cached for MANAGER_OVERVIEW_CACHE_SECONDS.
+@login_required
+@replica_reads
+def api_manager_overview(request):
+    if request.user.role != 'manager':
+        return JsonResponse({"error": "Not allowed"}, status=403)
+
+    deli_ids = list(request.user.delis.values_list("pk", flat=True))
+    response = JsonResponse(cached_overview_payload(deli_ids))
+
+    # The browser can reuse it for as long as the server would serve it from cache anyway
+    patch_cache_control(response, private=True, max_age=max(settings.MANAGER_OVERVIEW_CACHE_SECONDS, 0))
+    return response
+
+
 # I made this view to handle logging users out of the system.
 def logout_view(request):
     logout(request)
@@ -257,8 +344,10 @@ def delete_user_view(request, user_id):
         if user.role == 'manager':
             messages.error(request, "You cannot delete another manager.")
         else:
-            # If the user is not a manager you can delete them
-            user.delete()
+            # If the user is not a manager you can delete them. They are hidden and locked out
+            # straight away, their history is purged by the background worker (see purge.py)
+            soft_delete_users([user.pk])
+            enqueue("purge", {"kind": "user", "ids": [user.pk]}, user=request.user)
             messages.success(request, f"{user.email} has been deleted successfully.")
     except User.DoesNotExist:
         # If the user ID isn't found I show an error
@@ -294,7 +383,11 @@ def deli_form_view(request, deli_id=None):
     if request.method == "POST":
         form = DeliForm(request.POST, instance=deli)
         if form.is_valid():
-            saved_deli = form.save()
+            saved_deli = form.save(commit=False)
+            if not deli_id:
+                # Its checklist history goes on the emptiest shard (the primary unless sharding is set up)
+                saved_deli.shard = shard_for_new_deli()
+            saved_deli.save()
             if deli_id:
                 messages.success(request, "Deli updated successfully.")
             else:
@@ -312,7 +405,9 @@ def deli_form_view(request, deli_id=None):
 def delete_deli_view(request, deli_id):
     try:
         deli = Deli.objects.get(pk=deli_id, users=request.user)
-        deli.delete()
+        # The deli disappears at once, its checklists and history are purged in the background
+        soft_delete_delis([deli.pk])
+        enqueue("purge", {"kind": "deli", "ids": [deli.pk]}, user=request.user)
         messages.success(request, "Deli deleted successfully.")
     except Deli.DoesNotExist:
         messages.error(request, "Deli not found or not assigned to you.")
@@ -384,6 +479,10 @@ def assign_delis_view(request, user_id):
 
 
 # This view lets a manager create a checklist and its items in bulk. I built this using a custom ChecklistForm and a "pasted items" textarea.
+# Items can also come from an uploaded CSV/XLSX (see item_import.py). Every row is checked first and
+# the items go in with one bulk insert in the same transaction as the checklist, so a bad row
+# means nothing is created and the manager sees which rows to fix.
+# Big uploads are handed to the background worker, the success page then follows the job.
 # Reference: https://developer.mozilla.org/en-US/docs/Learn_web_development/Extensions/Server-side/Django/Forms
 @login_required
 def create_checklist(request):
@@ -391,41 +490,67 @@ def create_checklist(request):
         return redirect("dashboard")
 
     if request.method == "POST":
-        form = ChecklistForm(request.POST, user=request.user)
+        form = ChecklistForm(request.POST, request.FILES, user=request.user)
 
         if form.is_valid():
-            # I first save the checklist itself without committing related items yet
-            checklist = form.save(commit=False)
-            checklist.created_by = request.user
-            checklist.save()
-
-            # I convert each line from the "items_bulk" textarea into a ChecklistItem. I strip empty lines so only real item names are used
-            # I use an order counter so items appear in the same order they were pasted
-
             pasted_items = form.cleaned_data.get("items_bulk", "")
-            lines = [line.strip() for line in pasted_items.split("\n") if line.strip()]
-            order = 1
-            for line in lines:
-                name = line
-                chemical_used = ""
-                if "|" in line:
-                    name_part, chemical_part = line.split("|", 1)
-                    name = name_part.strip()
-                    chemical_used = chemical_part.strip()
-
-                ChecklistItem.objects.create(
-                    checklist=checklist,
-                    name=name,
-                    chemical_used=chemical_used,
-                    order=order,
+            upload = form.cleaned_data.get("items_file")
+            checklist_label = form.cleaned_data["title"] or form.cleaned_data["template"].name
+
+            if upload and upload.size > settings.ITEM_IMPORT_SYNC_BYTES:
+                # The worker may run on another machine, so the file goes through the default storage
+                stored_name = default_storage.save(f"imports/{uuid.uuid4().hex}{Path(upload.name).suffix.lower()}", upload)
+                job = enqueue(
+                    "import_checklist",
+                    {
+                        "checklist": {
+                            "template_id": form.cleaned_data["template"].pk,
+                            "deli_id": form.cleaned_data["deli"].pk,
+                            "frequency": form.cleaned_data["frequency"],
+                            "title": form.cleaned_data["title"],
+                        },
+                        "upload": stored_name,
+                        "pasted": pasted_items,
+                        "copy_deli_ids": [deli.pk for deli in form.fan_out_delis()],
+                        "link_copies": form.cleaned_data["link_copies"],
+                    },
+                    priority=5,
+                    user=request.user,
                 )
-                order += 1
+                request.session["created_checklist_label"] = checklist_label
+                request.session["import_job_id"] = job.pk
+                return redirect("checklist_success")
+
+            rows = pasted_rows(pasted_items)
+            try:
+                if upload:
+                    rows = chain(rows, file_rows(upload))
+                items, errors = validate_rows(rows)
+            except ItemImportError as error:
+                form.add_error("items_file", str(error))
+            else:
+                for error in errors:
+                    form.add_error(None, error)
+
+            if form.is_valid():
+                with transaction.atomic():
+                    checklist = form.save(commit=False)
+                    checklist.created_by = request.user
+                    checklist.save()
+                    create_items(checklist, items)
+                    copies = create_copies(
+                        checklist,
+                        form.fan_out_delis(),
+                        request.user,
+                        link=form.cleaned_data["link_copies"],
+                    )
+
+                # After creating the checklist, show an explicit confirmation page with a button
+                if copies:
+                    checklist_label = f"{checklist_label} (and copies for {len(copies)} more delis)"
+                request.session["created_checklist_label"] = checklist_label
+                return redirect("checklist_success")
 
-            # After creating the checklist, show an explicit confirmation page with a button
-            checklist_label = checklist.title or checklist.template.name
-            request.session["created_checklist_label"] = checklist_label
-            return redirect("checklist_success")
-        
     else:
         form = ChecklistForm(user=request.user)
 
@@ -438,51 +563,25 @@ def checklist_success(request):
         return redirect("dashboard")
 
     checklist_label = request.session.pop("created_checklist_label", None)
+    import_job_id = request.session.pop("import_job_id", None)
     return render(request, "accounts/checklist_success.html", {
         "checklist_label": checklist_label,
+        "import_job_id": import_job_id,
     })
 
 
 # This view returns JSON data for a specific checklist, so the frontend can render column definitions and row data.
 # Reference: https://www.youtube.com/watch?v=t8cGU5mS3m4
+@conditional_grid(checklist_preview_stamp)
 def api_get_checklist_data(request, pk):
     # I fetch the checklist or show a 404 if it doesn't exist
-    checklist = get_object_or_404(Checklist, pk=pk)
-    template_fields = checklist.template.fields.order_by("order")
+    checklist = get_object_or_404(Checklist.objects.select_related("template", "deli"), pk=pk)
+    template_fields = list(checklist.template.fields.order_by("order"))
     items = checklist.items.order_by("order")
 
-    # I start with a base column for the item name
-    column_defs = [{"headerName": "Item Name", "field": "item_name"}]
-
-    # Then I add a column for each template field.
-    for field in template_fields:
-        column_defs.append({
-            "headerName": field.label,
-            "field": field.name,
-        })
-
-    # Now I build the row data, with one row per checklist item
-    row_data = []
-    for i in items:
-        # Each row starts with the item name
-        row = {"item_name": i.name}
-        # For each template field, I start with an empty value to be filled later
-        for field in template_fields:
-            if field.name == "chemical_used":
-                row[field.name] = i.chemical_used
-            else:
-                row[field.name] = ""
-        row_data.append(row)
-
-    # Finally, I return all this as JSON so the frontend can render a dynamic grid.
-    return JsonResponse({
-        "title": checklist.title,
-        "template": checklist.template.name,
-        "deli": checklist.deli.deli_name,
-        "frequency": checklist.frequency,
-        "columnDefs": column_defs,
-        "rowData": row_data
-    })
+    # I build the columns and one empty row per checklist item, then return it as JSON
+    # so the frontend can render a dynamic grid.
+    return FastJsonResponse(checklist_preview_payload(checklist, template_fields, items))
 
 
 # This view lets managers see all checklists across the delis they are assigned to.
@@ -495,7 +594,13 @@ def manager_checklists_combined(request):
     delis = request.user.delis.all()
 
     # Then I find all checklists for those delis, newest first
-    checklists = Checklist.objects.filter(deli__in=delis).order_by("-created_at")
+    # The copy count is part of the same query so the "Linked" column costs nothing extra
+    checklists = (
+        Checklist.objects.filter(deli__in=delis)
+        .select_related("deli", "template")
+        .annotate(copy_count=Count("copies"))
+        .order_by("-created_at")
+    )
 
     return render(request, "accounts/manager_checklists_combined.html", {
         "checklists": checklists,
@@ -565,64 +670,147 @@ def manager_delete_checklist(request, checklist_id):
         return redirect("manager_checklists_combined")
 
     checklist_label = checklist.title or checklist.template.name
-    checklist.delete()
+    soft_delete_checklists(Checklist.objects.filter(pk=checklist.pk))
+    enqueue("purge", {"kind": "checklist", "ids": [checklist.pk]}, user=request.user)
     messages.success(request, f"Checklist '{checklist_label}' has been deleted.")
     return redirect("manager_checklists_combined")
 
 
-# This view is for staff users to see the checklists they need to fill in.
-# It also auto-creates daily instances of checklists if they don't exist for today.
+# This view handles the "selected checklists" buttons on the combined page.
+# The body is JSON: {"action": "assign" | "unassign" | "delete", "ids": [...]}.
+# Assign/unassign are one UPDATE scoped to the manager's delis. Deleting hides the checklists at once
+# and hands their history to the purge job, the page follows the job's progress.
 @login_required
-def staff_view_checklists(request):
-    # I only want staff to access this; managers shouldn't fill staff checklists here
-    if request.user.role != "staff":
+def manager_checklists_bulk(request):
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    if request.user.role != "manager":
+        return JsonResponse({"error": "Not allowed"}, status=403)
+
+    try:
+        body = json.loads(request.body)
+        action = body.get("action")
+        ids = [int(pk) for pk in body.get("ids", [])]
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({"error": "Send {\"action\": ..., \"ids\": [...]}"}, status=400)
+
+    if not ids:
+        return JsonResponse({"error": "No checklists selected"}, status=400)
+
+    if action in ("assign", "unassign"):
+        updated = set_checklists_active(request.user, ids, is_active=(action == "assign"))
+        return JsonResponse({"action": action, "updated": updated})
+
+    if action == "delete":
+        # Hidden straight away, the worker then purges their history in batches
+        deleted_ids = soft_delete_checklists(scoped_checklists(request.user, ids))
+        if not deleted_ids:
+            return JsonResponse({"action": action, "deleted": 0})
+        job = enqueue("purge", {"kind": "checklist", "ids": deleted_ids}, user=request.user)
+        return JsonResponse({
+            "action": action,
+            "deleted": len(deleted_ids),
+            "job_id": job.pk,
+            "status_url": reverse("api_job_status", args=[job.pk]),
+        }, status=202)
+
+    return JsonResponse({"error": f"Unknown action {action!r}"}, status=400)
+
+
+# This view copies a checklist and its items to more of the manager's delis in one go.
+# The copies can stay linked to this checklist, then item edits here reach all of them.
+@login_required
+def manager_clone_checklist(request, checklist_id):
+    if request.user.role != "manager":
         return redirect("dashboard")
 
-    # I get all delis assigned to the current staff user
-    delis = request.user.delis.all()
+    checklist = get_object_or_404(
+        Checklist.objects.select_related("template", "deli").filter(deli__in=request.user.delis.all()),
+        id=checklist_id,
+    )
+
+    if request.method == "POST":
+        form = CloneChecklistForm(request.POST, user=request.user)
+        if form.is_valid():
+            copies = create_copies(
+                checklist,
+                form.fan_out_delis(),
+                request.user,
+                link=form.cleaned_data["link_copies"],
+            )
+            messages.success(
+                request,
+                f"Checklist '{checklist.title or checklist.template.name}' was copied to {len(copies)} deli(s).",
+            )
+            return redirect("manager_checklists_combined")
+    else:
+        form = CloneChecklistForm(user=request.user)
+
+    return render(request, "accounts/clone_checklist.html", {
+        "form": form,
+        "checklist": checklist,
+        "item_count": checklist.items.count(),
+    })
 
-    # I use Python's date.today() to know which day's instance to use
-    today = date.today()
 
-    # I find all active checklists assigned to any of the user's delis
-    checklists = Checklist.objects.filter(
-        deli__in=delis,
-        is_active=True
+# This view edits a checklist's items with the ChecklistItemFormSet. If other delis have
+# linked copies of this checklist, the changes are pushed to all of them in bulk on save.
+@login_required
+def manager_edit_checklist_items(request, checklist_id):
+    if request.user.role != "manager":
+        return redirect("dashboard")
+
+    checklist = get_object_or_404(
+        Checklist.objects.select_related("template", "deli", "master__deli").filter(deli__in=request.user.delis.all()),
+        id=checklist_id,
     )
+    queryset = checklist.items.order_by("order", "id")
 
-    instances = []
-
-    # For each checklist, I either find or create a ChecklistInstance for today
-    # I used get_or_create here to avoid duplicates:
-    # Reference: https://docs.djangoproject.com/en/5.2/ref/models/querysets/#get-or-create
-    for checklist in checklists:
-        instance, created = ChecklistInstance.objects.get_or_create(
-            checklist=checklist,
-            deli=checklist.deli,
-            date=today,
-            defaults={"is_locked": False}
-        )
+    if request.method == "POST":
+        formset = ChecklistItemFormSet(request.POST, instance=checklist, queryset=queryset)
+        if formset.is_valid():
+            with transaction.atomic():
+                formset.save()
+                synced = propagate_master_items(checklist)
+
+            message = f"Items for '{checklist.title or checklist.template.name}' have been saved."
+            if synced["copies"]:
+                message += f" {synced['copies']} linked copies were updated too."
+            messages.success(request, message)
+            return redirect("manager_checklists_combined")
+    else:
+        formset = ChecklistItemFormSet(instance=checklist, queryset=queryset)
 
-        # If I just created this instance today I also create the row items
-        if created:
-            for item in checklist.items.all():
-                ChecklistInstanceItem.objects.create(
-                    instance=instance,
-                    checklist_item=item
-                )
+    return render(request, "accounts/edit_checklist_items.html", {
+        "formset": formset,
+        "checklist": checklist,
+        "copy_count": checklist.copies.count(),
+    })
 
-        instances.append(instance)
+
+# This view is for staff users to see the checklists they need to fill in.
+# It also auto-creates daily instances of checklists if they don't exist for today.
+@login_required
+def staff_view_checklists(request):
+    # I only want staff to access this; managers shouldn't fill staff checklists here
+    if request.user.role != "staff":
+        return redirect("dashboard")
+
+    # For each active checklist on the user's delis I find or create today's ChecklistInstance
+    instances = todays_instances(request.user)
 
     # I render a template that shows all today's instances for the staff user
     return render(request, "accounts/staff_checklists.html", {
         "instances": instances,
-        "today": today
+        "today": date.today()
     })
 
 
 # This view renders the actual "fill checklist" page building up a JSON structure
 # for columns and rows that the frontend can use.
 @login_required
+@row_shard_view(ChecklistInstance, "instance_id")
+@conditional_grid(fill_page_stamp)
 def fill_checklist_view(request, instance_id):
     # I get the checklist instance or return 404 if it's missing
     instance = get_object_or_404(ChecklistInstance, pk=instance_id)
@@ -634,107 +822,42 @@ def fill_checklist_view(request, instance_id):
     locked = instance.is_locked
 
     # GET OR CREATE SHARED RESPONSE (latest / last updated)
-    response_qs = ChecklistResponse.objects.filter(
-        checklist=instance.checklist,
-        deli=instance.deli,
-    )
-
-    # For daily checklists only use today's response set
-    if instance.checklist.frequency == "daily":
-        response_qs = response_qs.filter(completed_at__date=localdate())
-
-    # Pick the most recently updated response
-    response = response_qs.order_by("-updated_at", "-completed_at").first()
-
-    # If nothing exists yet create the first shared response
-    if not response:
-        response = ChecklistResponse.objects.create(
-            checklist=instance.checklist,
-            deli=instance.deli,
-            completed_by=request.user,  # “created by” the first staff who opens it
-        )
+    response = shared_response_for(instance, request.user)
 
     # BUILD GRID DATA
     # I fetch all fields for the checklist template and items for the checklist itself
-    fields = instance.checklist.template.fields.order_by("order")
-    items = instance.checklist.items.order_by("order")
-
-    # row_data will become a list of dicts, each representing a row in the grid
-    row_data = []
-    for item in items:
-        row = {
-            "item_id": item.id,
-            "item_name": item.name,
-        }
-
-        # For each template field, I either get or create a ResponseItem
-        # This pattern lets me ensure there is always a ResponseItem row ready for saving.
-        for field in fields:
-            answer, _ = ResponseItem.objects.get_or_create(
-                response=response,
-                checklist_item=item,
-                template_field=field
-            )
+    fields = list(instance.checklist.template.fields.order_by("order"))
+    items = list(instance.checklist.items.order_by("order"))
 
-            # I convert the answer into a basic value that can be safely JSON-encoded
-            value = None
-            if field.field_type == "text":
-                value = answer.answer_text
-            elif field.field_type == "date":
-                value = answer.answer_date.isoformat() if answer.answer_date else ""
-            elif field.field_type == "time":
-                value = answer.answer_time.strftime("%H:%M") if answer.answer_time else ""
-            elif field.field_type == "datetime":
-                value = answer.answer_datetime.isoformat() if answer.answer_datetime else ""
-            elif field.field_type == "decimal":
-                value = float(answer.answer_decimal) if answer.answer_decimal else ""
-            elif field.field_type == "number":
-                value = answer.answer_number if answer.answer_number is not None else ""
-            elif field.field_type == "boolean":
-                value = bool(answer.answer_boolean)
-
-            if field.name == "chemical_used":
-                value = item.chemical_used
-
-            row[field.name] = value
-
-        row_data.append(row)
-
-    # COLUMN DEFINITIONS
-    # I start with a non-editable "Item" column that shows the name of the checklist item
-    col_defs = [{
-        "headerName": "Item",
-        "field": "item_name",
-        "editable": False,
-    }]
-
-    # For each template field, I create a column that is editable unless the instance is locked
-    for field in fields:
-        is_editable = not locked
-        if field.name == "chemical_used":
-            is_editable = False
-
-        col_defs.append({
-            "headerName": field.label,
-            "field": field.name,
-            "editable": is_editable,
-            "fieldType": field.field_type,
-        })
+    # This makes sure there is always a ResponseItem row ready for saving for every cell
+    answers = ensure_response_items(response, items, fields)
+
+    # The columns are editable unless the instance is locked. Rows are lists in the
+    # order of row_fields (see grid.py), the page turns them back into row objects.
+    grid = {
+        "columnDefs": fill_column_defs(fields, locked),
+        "fields": row_fields(fields),
+        "rows": fill_rows(fields, items, answers),
+    }
 
     # RETURN JSON SAFELY TO TEMPLATE
-    # I pass the column and row definitions as JSON strings so the JS on the template can read them.
-    # Reference: https://docs.djangoproject.com/en/5.2/topics/serialization/#id2
+    # I pass the grid as one JSON object, escaped so it can sit inside the page's <script> block.
+    # Reference: https://docs.djangoproject.com/en/5.2/ref/templates/builtins/#json-script
     return render(request, "accounts/fill_checklist.html", {
         "instance": instance,
-        "column_defs_json": json.dumps(col_defs),
-        "row_data_json": json.dumps(row_data),
+        "grid_json": script_json(grid),
         "locked": locked,
         "response_id": response.id,
+        "response_version": response.version,
+        "live_sync_enabled": settings.LIVE_SYNC_ENABLED,
+        "grid_poll_seconds": settings.GRID_POLL_SECONDS,
     })
 
 
 # This view is used by the frontend to save a single field value when the user edits a cell in the grid.
 @login_required
+@rate_limit("save")
+@row_shard_view(ChecklistResponse, "response_id")
 def api_save_field(request):
     if request.method != "POST":
         # I only accept POST here; other methods get a 405 error
@@ -747,11 +870,11 @@ def api_save_field(request):
     value = request.POST.get("value")
 
     # I use get_object_or_404 to ensure these related objects exist or return a 404
-    response = get_object_or_404(ChecklistResponse, id=response_id)
+    response = get_object_or_404(ChecklistResponse.objects.select_related("checklist"), id=response_id)
     item = get_object_or_404(ChecklistItem, id=item_id)
     template_field = get_object_or_404(
         TemplateField,
-        template=response.checklist.template,
+        template_id=response.checklist.template_id,
         name=field_name
     )
 
@@ -762,89 +885,104 @@ def api_save_field(request):
         template_field=template_field
     )
 
-    # Prevent edits to read-only fields
-    if template_field.name == "chemical_used":
-        return JsonResponse({"error": "Chemical Used is read-only."}, status=400)
+    # The shared grid helper validates the value for the field type, then saves it.
+    # Offline tablets also send the edit's key and when it was made (see offline.py)
+    try:
+        status = save_cell(
+            answer,
+            template_field,
+            response,
+            request.user,
+            value,
+            edited_at=parse_edited_at(request.POST.get("edited_at")),
+            idempotency_key=request.POST.get("idempotency_key") or None,
+        )
+    except CellValidationError as error:
+        return JsonResponse({"error": str(error)}, status=400)
 
-    # I now update the correct field on the ResponseItem based on the field type.
-    # This is a common pattern when handling dynamic form-like data.
-    if template_field.field_type == "text":
-        answer.answer_text = value
-    elif template_field.field_type == "date":
-        if value:
-            try:
-                parsed_date = datetime.strptime(value, "%Y-%m-%d").date()
-            except ValueError:
-                return JsonResponse({"error": "Invalid date format. Use YYYY-MM-DD"}, status=400)
+    # I return the outcome, and the current value when this edit was not the one kept
+    return JsonResponse(save_field_result(status, template_field, answer))
 
-            if template_field.name == "use_by_date" and parsed_date < localdate():
-                return JsonResponse({"error": "Use-by date cannot be in the past."}, status=400)
 
-            answer.answer_date = parsed_date
-        else:
-            answer.answer_date = None
-    elif template_field.field_type == "datetime":
-        answer.answer_datetime = value or None
-    elif template_field.field_type == "time":
-        # Expect "HH:MM" Reference: https://www.geeksforgeeks.org/python/convert-datetime-string-to-yyyy-mm-dd-hhmmss-format-in-python/
-        if value:
-            try:
-                answer.answer_time = datetime.strptime(value, "%H:%M").time()
-            except ValueError:
-                return JsonResponse({"error": "Invalid time format. Use HH:MM"}, status=400)
-        else:
-            answer.answer_time = None
-    elif template_field.field_type == "decimal":
-        if value:
-            try:
-                decimal_value = Decimal(value)
-            except InvalidOperation:
-                return JsonResponse({"error": "Please enter a valid number."}, status=400)
-
-            if template_field.name == "core_temp":
-                if decimal_value < Decimal("75") or decimal_value > Decimal("100"):
-                    return JsonResponse(
-                        {"error": "Core temperature must be between 75 and 100."},
-                        status=400
-                    )
+# This view replays a batch of edits a tablet queued while it was offline.
+# The body is JSON: {"edits": [{key, response_id, item_id, field, value, edited_at}, ...]}
+@login_required
+@rate_limit("save_batch")
+def api_save_batch(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid method"}, status=405)
 
-            answer.answer_decimal = decimal_value
-        else:
-            answer.answer_decimal = None
-    elif template_field.field_type == "number":
-        if value:
-            try:
-                number_value = int(value)
-            except ValueError:
-                return JsonResponse({"error": "Please enter a whole number."}, status=400)
-
-            if template_field.name == "core_temp":
-                if number_value < 75 or number_value > 100:
-                    return JsonResponse(
-                        {"error": "Core temperature must be between 75 and 100."},
-                        status=400
-                    )
+    try:
+        edits = json.loads(request.body).get("edits")
+    except (ValueError, AttributeError):
+        edits = None
+    if not isinstance(edits, list) or not all(isinstance(edit, dict) for edit in edits):
+        return JsonResponse({"error": "Send the queued edits as {\"edits\": [...]}"}, status=400)
 
-            answer.answer_number = number_value
-        else:
-            answer.answer_number = None
-    elif template_field.field_type == "boolean":
-        answer.answer_boolean = (value.lower() == "true")
+    if len(edits) > MAX_BATCH_EDITS:
+        return JsonResponse({"error": f"Send at most {MAX_BATCH_EDITS} edits per batch"}, status=400)
 
-    answer.last_edited_by = request.user
-    answer.last_edited_at = now()
+    return FastJsonResponse(batch_results_payload(apply_edit_batch(request.user, edits)))
 
-    # After updating I save the object to persist the changes
-    answer.save()
-    response.save(update_fields=["updated_at"])  # the "latest" timestamp
 
+# This view gives a staff member all of today's checklists with their grids in one payload,
+# so a tablet can download the day's work while it is online and keep working without Wi-Fi.
+@login_required
+def api_staff_today(request):
+    if request.user.role != "staff":
+        return JsonResponse({"error": "Not allowed"}, status=403)
 
-    # I return a simple JSON success response
-    return JsonResponse({"success": True})
+    return FastJsonResponse(todays_work_payload(request.user))
+
+
+# This view keeps a server-sent events stream open for one shared response,
+# so every open fill grid sees the cells other staff save without reloading the page.
+@login_required
+@row_shard_view(ChecklistResponse, "response_id")
+def api_response_events(request, response_id):
+    response = get_object_or_404(ChecklistResponse, id=response_id)
+
+    # Only staff assigned to this deli can listen to its checklist
+    if not request.user.delis.filter(pk=response.deli_id).exists():
+        return JsonResponse({"error": "Not allowed"}, status=403)
+
+    stream = StreamingHttpResponse(
+        keep_shard(event_stream(response.id, last_event_version(request))),
+        content_type="text/event-stream",
+    )
+    stream["Cache-Control"] = "no-cache"
+    stream["X-Accel-Buffering"] = "no"  # stops proxies from holding events back
+    return stream
+
+
+# This view returns only the cells changed since a version the grid already has (?since=N).
+# If nothing changed it returns 304 Not Modified, so polling tablets cost one index lookup
+# instead of rebuilding the whole grid. ?grid=detail formats values for the manager detail grid.
+@login_required
+@row_shard_view(ChecklistResponse, "response_id")
+def api_response_changes(request, response_id):
+    response = get_object_or_404(ChecklistResponse, id=response_id)
+
+    if not request.user.delis.filter(pk=response.deli_id).exists():
+        return JsonResponse({"error": "Not allowed"}, status=403)
+
+    since = last_event_version(request)
+    if since is None:
+        return JsonResponse({"error": "Pass the version you already have as ?since=N"}, status=400)
+
+    if since >= response.version:
+        return HttpResponseNotModified()
+
+    return JsonResponse({
+        "version": response.version,
+        "changes": changes_since(response.id, since, detail=request.GET.get("grid") == "detail"),
+    })
 
 
 # This view lets a manager see the full checklist history for a specific deli.
 @login_required
+@replica_reads
+@deli_shard_view
 def deli_checklist_history(request, deli_id):
     if request.user.role != "manager":
         return redirect("dashboard")
@@ -857,112 +995,206 @@ def deli_checklist_history(request, deli_id):
         return redirect("manager_dashboard")
 
     # I fetch all instances for this deli ordered from newest date to oldest
+    # The snapshots can be big and this page only lists the instances, so I leave them out
+    # The checklist and response (for the progress counters) come in the same query
     instances = ChecklistInstance.objects.filter(
-        deli=deli
-    ).order_by("-date", "-created_at")
+        deli=deli, checklist__deleted_at__isnull=True
+    ).select_related("checklist", "response").defer("snapshot").order_by("-date", "-created_at")
 
     return render(request, "accounts/manager_deli_checklists.html", {
         "deli": deli,
-        "instances": instances
+        "instances": instances,
+        "grid_poll_seconds": settings.GRID_POLL_SECONDS,
     })
 
 
 # This API view returns the detailed grid data for a specific checklist instance,
 # so managers can see what staff filled in on that day.
+# Closed instances are served straight from their snapshot (see snapshots.py).
 @login_required
+@replica_reads
+@row_shard_view(ChecklistInstance, "instance_id")
+@conditional_grid(instance_detail_stamp)
 def api_manager_instance_detail(request, instance_id):
     # I get the instance or show 404 if it doesn't exist
-    instance = get_object_or_404(ChecklistInstance, id=instance_id)
+    instance = get_object_or_404(
+        ChecklistInstance.objects.select_related("checklist__template"),
+        id=instance_id,
+        checklist__deleted_at__isnull=True,
+    )
 
-    # I collect the checklist its fields and items to build the grid structure
-    checklist = instance.checklist
-    fields = checklist.template.fields.order_by("order")
-    items = checklist.items.order_by("order")
+    if instance.is_locked and instance.snapshot is not None:
+        return FastJsonResponse(snapshot_detail_payload(instance.snapshot))
 
-    # I find responses completed for this checklist in this deli on that specific date
-    responses = ChecklistResponse.objects.filter(
-        checklist=checklist,
-        deli=instance.deli,
-        completed_at__date=instance.date
-    )
+    # I find the response completed for this checklist in this deli on that specific date
+    response = instance_response_queryset(instance).first()
 
-    # For now I just take the first response (assuming one per checklist per day)
-    response = responses.order_by("-updated_at", "-completed_at").first()
+    # I return all the grid data plus extra info (who filled it and when)
+    return FastJsonResponse(instance_detail_payload(instance, response))
 
-    edited_users = User.objects.filter(
-        edited_response_items__response=response
-    ).distinct()
 
-    # collect staff involved: starter + anyone who edited any cell
-    staff_emails = set()
+# This API view returns the compliance heatmap for all of a manager's delis:
+# one row per deli and template, one cell per week or month (?period=week|month, ?months=12,
+# ?template=<id>). It only reads the rollup table, which the close job keeps up to date.
+@login_required
+@replica_reads
+def api_compliance_heatmap(request):
+    if request.user.role != "manager":
+        return JsonResponse({"error": "Not allowed"}, status=403)
 
-    # starter (who created the response)
-    if response.completed_by_id:
-        staff_emails.add(response.completed_by.email)
+    period = request.GET.get("period", ComplianceRollup.PERIOD_MONTH)
+    if period not in dict(ComplianceRollup.PERIOD_CHOICES):
+        return JsonResponse({"error": "period must be week or month"}, status=400)
 
-    # editors (who changed any cell)
-    edited_emails = ResponseItem.objects.filter(
-        response=response,
-        last_edited_by__isnull=False
-    ).values_list("last_edited_by__email", flat=True).distinct()
+    try:
+        months = min(max(int(request.GET.get("months", 12)), 1), 36)
+        template_id = int(request.GET["template"]) if request.GET.get("template") else None
+    except ValueError:
+        return JsonResponse({"error": "months and template must be numbers"}, status=400)
 
-    staff_emails.update(edited_emails)
+    deli_ids = list(request.user.delis.values_list("pk", flat=True))
+    return JsonResponse(heatmap_payload(deli_ids, period, months, template_id))
 
-    staff_list = sorted(staff_emails)
 
-    # If there is no response I just return empty structures
-    if not responses.exists():
-        return JsonResponse({"columnDefs": [], "rowData": []})
+# This API view returns daily core temperature numbers (min, max, mean, median, 95th percentile,
+# out-of-range rate and a rolling mean) for a manager's delis between ?start and ?end
+# (YYYY-MM-DD, the last 30 days by default). ?deli, ?item and ?template narrow it down and
+# ?window sets the rolling mean's length in days. See analytics.py.
+@login_required
+@replica_reads
+def api_temperature_analytics(request):
+    if request.user.role != "manager":
+        return JsonResponse({"error": "Not allowed"}, status=403)
 
-    # I now build the row data for the grid
-    row_data = []
-    for item in items:
-        row = {
-            "item_name": item.name
-        }
-        for field in fields:
-            try:
-                # I try to find the ResponseItem for this item plus field
-                answer = ResponseItem.objects.get(
-                    response=response,
-                    checklist_item=item,
-                    template_field=field
-                )
-                # I pick whichever of the answer fields is not None. This works because only one of them should be used depending on field_type.
-                value = (
-                    answer.answer_text or
-                    answer.answer_date or
-                    (answer.answer_time.strftime("%H:%M") if answer.answer_time else None) or
-                    answer.answer_datetime or
-                    answer.answer_decimal or
-                    answer.answer_number or
-                    answer.answer_boolean
-                )
-            except ResponseItem.DoesNotExist:
-                # If there is no response for that item/field I just leave it empty
-                value = ""
+    deli_ids = list(request.user.delis.values_list("pk", flat=True))
+    try:
+        end = date.fromisoformat(request.GET["end"]) if request.GET.get("end") else date.today()
+        start = date.fromisoformat(request.GET["start"]) if request.GET.get("start") else end - timedelta(days=29)
+        window = int(request.GET.get("window", 7))
+        deli_id = int(request.GET["deli"]) if request.GET.get("deli") else None
+        item_id = int(request.GET["item"]) if request.GET.get("item") else None
+        template_id = int(request.GET["template"]) if request.GET.get("template") else None
+    except ValueError:
+        return JsonResponse({"error": "start and end must be dates, window, deli, item and template numbers"}, status=400)
+
+    if start > end or (end - start).days >= MAX_RANGE_DAYS:
+        return JsonResponse({"error": f"start must be before end and at most {MAX_RANGE_DAYS} days apart"}, status=400)
+    if not 1 <= window <= MAX_WINDOW_DAYS:
+        return JsonResponse({"error": f"window must be between 1 and {MAX_WINDOW_DAYS}"}, status=400)
+
+    # I only ever look at the manager's own delis, a deli they don't have just gives nothing
+    if deli_id is not None:
+        deli_ids = [deli_id] if deli_id in deli_ids else []
+
+    payload = cached_temperature_analytics(deli_ids, start, end, item_id, template_id, window)
+    return FastJsonResponse(payload)
+
+
+# Wireless temperature probes post their readings here through their deli's gateway, with
+# "Authorization: Bearer <token>" instead of a session (see probes.py). The body is JSON:
+# {"readings": [{"probe": serial, "at": ISO 8601 time, "value": number}, ...]}.
+# Good readings are buffered and the gateway gets 202 straight away (201 when they were
+# written during the request), with the index and reason of every reading that was refused.
+@csrf_exempt
+def api_probe_readings(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid method"}, status=405)
 
-            if field.name == "chemical_used":
-                value = item.chemical_used
+    gateway = gateway_for_request(request)
+    if gateway is None:
+        return JsonResponse({"error": "Unknown or inactive gateway token"}, status=401)
 
-            row[field.name] = value
-        row_data.append(row)
+    try:
+        readings = fast_json_loads(request.body).get("readings")
+    except (ValueError, AttributeError):
+        readings = None
+    if not isinstance(readings, list):
+        return JsonResponse({"error": "Send the readings as {\"readings\": [...]}"}, status=400)
+    if len(readings) > settings.PROBE_MAX_BATCH:
+        return JsonResponse({"error": f"Send at most {settings.PROBE_MAX_BATCH} readings per batch"}, status=413)
+
+    rows, rejected = validate_readings(gateway, readings)
+    if not accept_readings(rows):
+        response = JsonResponse({"error": "Too many readings waiting to be saved, please try again shortly"}, status=503)
+        response["Retry-After"] = str(max(1, round(settings.PROBE_FLUSH_SECONDS)))
+        return response
+
+    status = 201 if settings.PROBE_FLUSH_SECONDS <= 0 else 202
+    return FastJsonResponse({"accepted": len(rows), "rejected": rejected}, status=status)
+
+
+# This API view returns the status of a background job, so pages that start slow work
+# (deletes, exports, imports) can poll it instead of keeping a request open.
+# Users only see their own jobs.
+@login_required
+def api_job_status(request, job_id):
+    job = get_object_or_404(Job, pk=job_id, created_by=request.user)
+    return JsonResponse(job_status_payload(job))
 
-    # I also build the column definitions: one for item name plus one for each template field
-    col_defs = [{"headerName": "Item", "field": "item_name"}]
-    for field in fields:
-        col_defs.append({
-            "headerName": field.label,
-            "field": field.name,
-            "editable": False,
-        })
 
-    # I return all the grid data plus extra info (who filled it and when)
-    # Reference: https://docs.python.org/3/library/datetime.html#datetime.date.strftime
-    return JsonResponse({
-        "columnDefs": col_defs,
-        "rowData": row_data,
-        "filled_by": response.completed_by.email,
-        "filled_time": response.completed_at.strftime("%d %b %Y, %H:%M"),
-        "staff_involved": staff_list,
-    })
+# This view builds the PDF for the checklists a manager ticked on the history page.
+# The body is JSON: {"instance_ids": [...]}. One checklist comes back as a PDF, a few as a
+# ZIP streamed while it's written, and big selections are handed to the background worker
+# (202 + job id) so the request never runs into the gunicorn timeout.
+@login_required
+@replica_reads
+@deli_shard_view
+def manager_export_pdf(request, deli_id):
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    if request.user.role != "manager":
+        return JsonResponse({"error": "Not allowed"}, status=403)
+
+    # I only look at instances from this deli, and only if the manager has the deli
+    deli = get_object_or_404(request.user.delis, deli_ID=deli_id)
+
+    try:
+        instance_ids = [int(pk) for pk in json.loads(request.body).get("instance_ids", [])]
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({"error": "Send the checklists as {\"instance_ids\": [...]}"}, status=400)
+
+    instances = list(
+        ChecklistInstance.objects.filter(deli=deli, pk__in=instance_ids, checklist__deleted_at__isnull=True)
+        .select_related("checklist__template", "deli")
+        .order_by("date", "checklist__title", "id")
+    )
+    if not instances:
+        return JsonResponse({"error": "No checklists selected"}, status=400)
+
+    if len(instances) > settings.PDF_PACK_SYNC_LIMIT:
+        job = enqueue(
+            "export_pdf_pack",
+            {"deli_id": deli.pk, "instance_ids": [instance.pk for instance in instances]},
+            priority=5,  # someone is waiting on the page for this
+            user=request.user,
+        )
+        return JsonResponse({
+            "job_id": job.pk,
+            "status_url": reverse("api_job_status", args=[job.pk]),
+            "download_url": reverse("manager_export_download", args=[job.pk]),
+        }, status=202)
+
+    entries = render_instances(instances)
+
+    if len(entries) == 1:
+        return FileResponse(open(entries[0].path, "rb"), as_attachment=True, filename=entries[0].filename)
+
+    response = StreamingHttpResponse(stream_zip(entries), content_type="application/zip")
+    response["Content-Disposition"] = (
+        f'attachment; filename="checklist_history_{slugify(deli.deli_name)}_{date.today():%Y%m%d}.zip"'
+    )
+    return response
+
+
+# This view downloads a PDF pack built by the background worker.
+@login_required
+def manager_export_download(request, job_id):
+    job = get_object_or_404(Job, pk=job_id, created_by=request.user, name="export_pdf_pack")
+    if job.status != Job.STATUS_SUCCEEDED:
+        return JsonResponse({"error": "This export isn't ready yet"}, status=409)
+
+    path = export_cache_dir() / job.result["file"]
+    if not path.exists():
+        raise Http404("This export has expired, please export it again.")
+
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=f"checklist_history_{job.pk}.zip")
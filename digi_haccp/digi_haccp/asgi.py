@@ -13,4 +13,7 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'digi_haccp.settings')
 
+# Serving through ASGI turns on the async grid endpoints (see accounts/async_views.py)
+os.environ.setdefault('ASGI_MODE', 'True')
+
 application = get_asgi_application()
@@ -47,10 +47,15 @@ INSTALLED_APPS = [
 # Middleware handles security, sessions, and requests between the browser and the server
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',                # Serves static files with far-future cache headers
+    'accounts.throttle.LoadShedMiddleware',                      # Turns away reports while the app is overloaded
+    'accounts.http_cache.CompressionMiddleware',                 # Gzips pages and grid JSON
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',  # Helps protect my forms from CSRF attacks
     'django.contrib.auth.middleware.AuthenticationMiddleware',  # Handles login sessions
+    'accounts.db_router.ReplicaPinMiddleware',                   # Keeps reads on the primary right after a save
+    'accounts.sharding.ShardMoveMiddleware',                     # Asks clients to retry while a deli changes shard
     'django.contrib.messages.middleware.MessageMiddleware',      # Displays feedback messages
     'django.middleware.clickjacking.XFrameOptionsMiddleware',    # Adds security headers
 ]
@@ -78,6 +83,129 @@ TEMPLATES = [
 # WSGI file is used when deploying my Django app to a live server
 WSGI_APPLICATION = 'digi_haccp.wsgi.application'
 
+# ASGI mode is used when gunicorn runs uvicorn workers (see DEPLOYMENT.md).
+# When it's on, the hot grid JSON endpoints are routed to their async versions in async_views.py
+ASGI_APPLICATION = 'digi_haccp.asgi.application'
+ASGI_MODE = os.getenv('ASGI_MODE') == 'True'
+
+# LIVE SYNC
+# Pushes cells saved by one staff member to every other open fill grid (server-sent events).
+# Each open grid keeps a connection open, so by default I only turn it on in ASGI mode.
+LIVE_SYNC_ENABLED = os.getenv('LIVE_SYNC_ENABLED', str(ASGI_MODE)) == 'True'
+# InProcessBroker only reaches grids served by the same process.
+# Use accounts.broker.PostgresBroker when running more than one worker.
+LIVE_SYNC_BROKER = os.getenv('LIVE_SYNC_BROKER', 'accounts.broker.InProcessBroker')
+LIVE_SYNC_STREAM_SECONDS = int(os.getenv('LIVE_SYNC_STREAM_SECONDS', '300'))  # browsers reconnect after this
+LIVE_SYNC_HEARTBEAT_SECONDS = 15
+LIVE_SYNC_RETRY_MS = 2000
+
+# When live sync is off, open grids ask for "changes since version N" this often instead
+GRID_POLL_SECONDS = int(os.getenv('GRID_POLL_SECONDS', '5'))
+
+# JSON ENCODER
+# "orjson" encodes the grid JSON with orjson when it is installed, "stdlib" always uses json
+# (see accounts/fast_json.py). Both write the same values.
+JSON_ENCODER = os.getenv('JSON_ENCODER', 'orjson')
+
+# COMPRESSION
+# Responses smaller than this are sent as they are (see accounts/http_cache.py)
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+
+# MANAGER OVERVIEW
+# Today's status across all of a manager's delis is cached this long (0 turns caching off).
+# A little staleness is fine here and it saves five grouped queries on every refresh.
+MANAGER_OVERVIEW_CACHE_SECONDS = int(os.getenv('MANAGER_OVERVIEW_CACHE_SECONDS', '30'))
+
+# TEMPERATURE ANALYTICS
+# Results are cached per filter and data version, so a new reading shows up straight away;
+# this is only how long an unused result stays in the cache (0 turns the cache off).
+TEMPERATURE_ANALYTICS_CACHE_SECONDS = int(os.getenv('TEMPERATURE_ANALYTICS_CACHE_SECONDS', '3600'))
+
+# TEMPERATURE PROBES
+# Probe readings are buffered in each worker and written every PROBE_FLUSH_SECONDS, or as soon
+# as PROBE_FLUSH_ROWS are waiting (0 seconds writes them during the request instead). Once
+# PROBE_BUFFER_MAX_ROWS are waiting the gateways get 503 until the buffer has drained.
+PROBE_FLUSH_SECONDS = float(os.getenv('PROBE_FLUSH_SECONDS', '1'))
+PROBE_FLUSH_ROWS = int(os.getenv('PROBE_FLUSH_ROWS', '5000'))
+PROBE_BUFFER_MAX_ROWS = int(os.getenv('PROBE_BUFFER_MAX_ROWS', '100000'))
+PROBE_MAX_BATCH = int(os.getenv('PROBE_MAX_BATCH', '5000'))
+
+# ANSWER PARTITIONS
+# With RESPONSE_ITEM_PARTITIONING=True, `migrate` turns the answers table on PostgreSQL into one
+# partition per month (see accounts/partitions.py). `response_item_partitions --archive` writes
+# months older than RESPONSE_ITEM_RETENTION_MONTHS to RESPONSE_ITEM_ARCHIVE_DIR and drops them,
+# so set the retention to at least what your food safety authority asks records to be kept for.
+RESPONSE_ITEM_PARTITIONING = os.getenv('RESPONSE_ITEM_PARTITIONING', 'False') == 'True'
+RESPONSE_ITEM_PARTITION_MONTHS_AHEAD = int(os.getenv('RESPONSE_ITEM_PARTITION_MONTHS_AHEAD', '3'))
+RESPONSE_ITEM_RETENTION_MONTHS = int(os.getenv('RESPONSE_ITEM_RETENTION_MONTHS', '24'))
+RESPONSE_ITEM_ARCHIVE_DIR = os.getenv('RESPONSE_ITEM_ARCHIVE_DIR', str(BASE_DIR / 'archive'))
+
+# CACHES
+# "default" is each worker's own memory, for things that are fine to work out once per worker.
+# "shared" is seen by every worker and server (rate limits): Redis when REDIS_URL is set
+# (needs the redis package), otherwise a table in the primary database, created with
+# `python manage.py createcachetable`.
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': (
+        {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': os.getenv('REDIS_URL')}
+        if os.getenv('REDIS_URL') else
+        {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'accounts_shared_cache'}
+    ),
+}
+
+# RATE LIMITS
+# Token buckets per endpoint, keyed by client IP and by user, as "key=count/period" with a
+# period of s, m or h (see accounts/throttle.py). A login's user is the email being tried, a
+# save's the signed-in staff member. The IP limits are loose because a shop's tablets share one.
+# RATE_LIMIT_PROXY_COUNT is how many proxies (Render's load balancer is one) sit in front of the
+# app, so the client IP is read from the right X-Forwarded-For entry.
+RATE_LIMITS_ENABLED = os.getenv('RATE_LIMITS_ENABLED', 'True') == 'True'
+RATE_LIMITS = {
+    'login': os.getenv('RATE_LIMIT_LOGIN', 'ip=30/m,user=5/m'),
+    'save': os.getenv('RATE_LIMIT_SAVE', 'ip=1200/m,user=300/m'),
+    'save_batch': os.getenv('RATE_LIMIT_SAVE_BATCH', 'ip=300/m,user=60/m'),
+}
+RATE_LIMIT_CACHE = 'shared'
+RATE_LIMIT_PROXY_COUNT = int(os.getenv('RATE_LIMIT_PROXY_COUNT', '0'))
+
+# LOAD SHEDDING
+# While requests wait in the proxy's queue longer than LOAD_SHED_QUEUE_MS, queries on the
+# primary average more than LOAD_SHED_DB_LATENCY_MS, or a worker has more than
+# LOAD_SHED_MAX_IN_FLIGHT requests running, the routes below get 503 + Retry-After so staff
+# saves keep the capacity that's left. 0 turns a check off.
+LOAD_SHED_ENABLED = os.getenv('LOAD_SHED_ENABLED', 'True') == 'True'
+LOAD_SHED_QUEUE_MS = int(os.getenv('LOAD_SHED_QUEUE_MS', '2000'))
+LOAD_SHED_DB_LATENCY_MS = int(os.getenv('LOAD_SHED_DB_LATENCY_MS', '250'))
+LOAD_SHED_MAX_IN_FLIGHT = int(os.getenv('LOAD_SHED_MAX_IN_FLIGHT', '0'))
+LOAD_SHED_RETRY_AFTER = int(os.getenv('LOAD_SHED_RETRY_AFTER', '15'))
+LOAD_SHED_ROUTES = [
+    'api_manager_overview',
+    'api_compliance_heatmap',
+    'api_temperature_analytics',
+    'deli_checklist_history',
+    'manager_export_pdf',
+    'manager_export_download',
+]
+
+# PDF EXPORTS
+# History PDFs are rendered on the server across this many processes and cached on disk.
+# Selections bigger than PDF_PACK_SYNC_LIMIT are built by the background worker instead.
+EXPORT_CACHE_DIR = os.getenv('EXPORT_CACHE_DIR', str(BASE_DIR / 'export_cache'))
+PDF_RENDER_PROCESSES = int(os.getenv('PDF_RENDER_PROCESSES', str(min(4, os.cpu_count() or 1))))
+PDF_PACK_SYNC_LIMIT = int(os.getenv('PDF_PACK_SYNC_LIMIT', '25'))
+
+# CHECKLIST IMPORTS
+# Item uploads bigger than this are imported by the background worker instead of in the request.
+# The upload is kept in MEDIA_ROOT (default storage) until the worker has read it.
+ITEM_IMPORT_SYNC_BYTES = int(os.getenv('ITEM_IMPORT_SYNC_BYTES', str(256 * 1024)))
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', str(BASE_DIR / 'media'))
+
+# PURGING DELETED DATA
+# Deleted delis, users and checklists are hidden at once and purged by the background worker,
+# this many rows per transaction.
+PURGE_BATCH_SIZE = int(os.getenv('PURGE_BATCH_SIZE', '1000'))
+
 # DATABASE SETTINGS
 # I connected my project to PostgreSQL using environment variables for better security
 DATABASES = {
@@ -91,6 +219,55 @@ DATABASES = {
     }
 }
 
+# READ REPLICA
+# Setting DB_REPLICA_HOST (and/or DB_REPLICA_NAME, DB_REPLICA_PORT, DB_REPLICA_USER, DB_REPLICA_PASSWORD)
+# adds a "replica" database. The manager history, detail, overview and export pages read from it
+# (see accounts/db_router.py); anything not given is taken from the primary's settings.
+# To try it locally, point DB_REPLICA_NAME at a second database on the same server.
+if os.getenv('DB_REPLICA_HOST') or os.getenv('DB_REPLICA_NAME'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+        'USER': os.getenv('DB_REPLICA_USER', DATABASES['default']['USER']),
+        'PASSWORD': os.getenv('DB_REPLICA_PASSWORD', DATABASES['default']['PASSWORD']),
+        'HOST': os.getenv('DB_REPLICA_HOST', DATABASES['default']['HOST']),
+        'PORT': os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+    }
+
+# SHARDS
+# Setting DB_SHARD_NAMES (comma separated database names) adds one database per name, called
+# "shard_1", "shard_2", ... Each deli's checklist history lives on one of them or on the primary
+# ("default"), see accounts/sharding.py. DB_SHARD_HOSTS lists their hosts in the same order
+# (the primary's host when left out). Users, delis, templates and checklists stay on the primary
+# and are replicated to every shard. Shards need PostgreSQL.
+SHARD_DATABASES = ['default']
+_shard_names = [name.strip() for name in os.getenv('DB_SHARD_NAMES', '').split(',') if name.strip()]
+_shard_hosts = [host.strip() for host in os.getenv('DB_SHARD_HOSTS', '').split(',')]
+for _number, _name in enumerate(_shard_names, start=1):
+    _host = _shard_hosts[_number - 1] if _number <= len(_shard_hosts) else ''
+    DATABASES[f'shard_{_number}'] = {
+        **DATABASES['default'],
+        'NAME': _name,
+        'HOST': _host or DATABASES['default']['HOST'],
+    }
+    SHARD_DATABASES.append(f'shard_{_number}')
+
+# The shards' servers keep the global tables in sync over logical replication from the primary,
+# connecting to it at DB_SHARD_PUBLISHER_HOST (DB_HOST when left out)
+SHARD_PUBLISHER_HOST = os.getenv('DB_SHARD_PUBLISHER_HOST', '')
+
+# Rows per batch when rebalance_shards copies a deli's history to another shard
+SHARD_MOVE_BATCH_SIZE = int(os.getenv('SHARD_MOVE_BATCH_SIZE', '500'))
+
+DATABASE_ROUTERS = ['accounts.sharding.ShardRouter', 'accounts.db_router.ReplicaRouter']
+
+# Reads stay on the primary this long after a user saves something (read-your-writes)
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '5'))
+# A replica further behind than this is skipped until it catches up
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '10'))
+# How often each process re-checks that the replica is up and how far behind it is
+REPLICA_HEALTH_SECONDS = float(os.getenv('REPLICA_HEALTH_SECONDS', '5'))
+
 # I override the SECRET_KEY and DEBUG settings from my .env file for safety
 SECRET_KEY = os.getenv('SECRET_KEY')
 DEBUG = os.getenv('DEBUG') == 'True'
@@ -117,6 +294,15 @@ STATIC_URL = 'static/'
 STATICFILES_DIRS = [
     BASE_DIR / "static",  # This makes Django look inside the static folder I created
 ]
+# collectstatic copies everything here with a content hash in each file name
+# (grid_rows.3f2a1c9e.js), plus .gz and .br copies that WhiteNoise sends to browsers that
+# accept them. Hashed files are cached by browsers for a year ("immutable"), since a changed
+# file gets a new name. Vendored CSS/JS lives in static/vendor/, see vendor_assets.
+STATIC_ROOT = os.getenv('STATIC_ROOT', str(BASE_DIR / 'staticfiles'))
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage"},
+}
 
 # DEFAULT CONFIGURATION
 # This is the default primary key type for all my database models
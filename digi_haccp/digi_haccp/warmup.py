@@ -0,0 +1,119 @@
+"""
+Worker warm-up for digi_haccp.
+
+Gunicorn calls warm_up() from the post_worker_init hook so the first real
+request a fresh worker receives doesn't pay for lazy imports, URL resolver
+population, template compilation and the first database round trip.
+The bench_startup management command calls the same function so the
+numbers it reports match what production workers actually do.
+"""
+
+import time
+from importlib import import_module
+from pathlib import Path
+
+# These are the modules Django only imports when the first request needs them.
+# Importing them here moves that cost to worker boot.
+WARM_MODULES = [
+    "accounts.views",
+    "accounts.forms",
+    "accounts.newuser",
+    "django.contrib.admin.sites",
+    "django.contrib.auth.views",
+    "django.template.defaulttags",
+    "django.template.loader_tags",
+    "widget_tweaks.templatetags.widget_tweaks",
+]
+
+
+def _warm_imports():
+    for module_name in WARM_MODULES:
+        import_module(module_name)
+
+
+def _warm_url_resolver():
+    from django.urls import get_resolver
+
+    # Touching reverse_dict forces the resolver to import every urls module
+    # and build its lookup tables once for this process.
+    get_resolver().reverse_dict
+
+
+def _warm_templates():
+    from django.template import engines
+    from django.template.loader import get_template
+
+    # I compile every app template once so the cached loader has them ready.
+    for engine in engines.all():
+        for loader in engine.engine.template_loaders:
+            for template_name in _template_names(loader):
+                get_template(template_name)
+
+
+def _template_names(loader):
+    # The cached loader wraps the real filesystem/app loaders
+    loaders = getattr(loader, "loaders", [loader])
+    names = set()
+    for inner in loaders:
+        for directory in inner.get_dirs():
+            directory = Path(directory)
+            if not directory.is_dir():
+                continue
+            for path in directory.rglob("*.html"):
+                names.add(path.relative_to(directory).as_posix())
+    # Admin templates are only needed by the admin site, so I skip them here
+    return sorted(name for name in names if name.startswith("accounts/"))
+
+
+def _warm_schema_caches():
+    from django.apps import apps
+
+    # get_fields() fills the per-model _meta caches that every queryset,
+    # form and serializer reads from.
+    for model in apps.get_models():
+        model._meta.get_fields()
+
+
+def _warm_database():
+    from django.apps import apps
+    from django.contrib.contenttypes.models import ContentType
+    from django.db import connection
+
+    # Django connections are per thread, so the connection opened here is not
+    # the one a gthread worker thread will use. What does carry over is the
+    # ContentType cache (process wide) and the early failure if the database
+    # is unreachable, which is better found at boot than on a staff tablet.
+    connection.ensure_connection()
+    ContentType.objects.clear_cache()
+    ContentType.objects.get_for_models(*apps.get_models())
+    connection.close()
+
+
+WARM_PHASES = [
+    ("imports", _warm_imports),
+    ("url_resolver", _warm_url_resolver),
+    ("templates", _warm_templates),
+    ("schema_caches", _warm_schema_caches),
+    ("database", _warm_database),
+]
+
+
+def warm_up(skip=()):
+    """
+    Runs every warm-up phase and returns (timings, errors).
+    timings maps phase name -> milliseconds. A failing phase is reported in
+    errors instead of stopping the worker boot, because a worker that serves
+    slowly is still better than a worker that never starts.
+    """
+    timings = {}
+    errors = {}
+    for name, phase in WARM_PHASES:
+        if name in skip:
+            continue
+        started = time.perf_counter()
+        try:
+            phase()
+        except Exception as exc:
+            errors[name] = repr(exc)
+        timings[name] = (time.perf_counter() - started) * 1000
+    return timings, errors
@@ -1,5 +1,8 @@
 import multiprocessing
 import os
+import resource
+import sys
+import time
 
 
 bind = "0.0.0.0:" + os.getenv("PORT", "8000")
@@ -8,4 +11,104 @@ threads = int(os.getenv("GUNICORN_THREADS", "2"))
 timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
 accesslog = "-"
 errorlog = "-"
-loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
\ No newline at end of file
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+# (Worker Class)
+# gthread is the normal WSGI mode. For ASGI mode I set this to "uvicorn_worker.UvicornWorker"
+# and point gunicorn at digi_haccp.asgi:application instead (see DEPLOYMENT.md).
+# Uvicorn workers don't use the threads setting and don't call the pre/post request hooks below.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+
+# (Worker Recycling)
+# Workers that build big grid JSON blobs slowly creep up in memory, so I recycle them.
+# max_requests restarts a worker after a number of requests and the jitter spreads those
+# restarts out so all workers don't restart at the same moment.
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+
+# On top of that, a worker whose resident memory goes over this watermark (in MB)
+# finishes its current request and is replaced. 0 turns the memory check off.
+max_worker_rss_mb = int(os.getenv("GUNICORN_MAX_WORKER_RSS_MB", "512"))
+
+# Requests slower than this (in ms) are logged as warnings instead of info.
+slow_request_ms = int(os.getenv("GUNICORN_SLOW_REQUEST_MS", "1000"))
+
+# I warm each worker up after boot unless this is switched off.
+warm_up_workers = os.getenv("GUNICORN_WARM_UP", "True") == "True"
+
+
+# (Memory Helper)
+# I read the current resident set size from /proc because getrusage only gives the peak.
+# On systems without /proc (macOS) I fall back to the peak value, which is still useful for the watermark.
+def current_rss_kb():
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS reports bytes, Linux reports kilobytes
+        return peak // 1024 if sys.platform == "darwin" else peak
+
+
+# (Server Hooks)
+# Reference: https://docs.gunicorn.org/en/stable/settings.html#server-hooks
+
+def post_worker_init(worker):
+    if not warm_up_workers:
+        return
+
+    from digi_haccp.warmup import warm_up
+
+    started = time.perf_counter()
+    timings, errors = warm_up()
+    total_ms = (time.perf_counter() - started) * 1000
+
+    phases = " ".join(f"{name}={ms:.0f}ms" for name, ms in timings.items())
+    worker.log.info("worker %s warmed up in %.0fms (%s) rss=%dKB", worker.pid, total_ms, phases, current_rss_kb())
+    for name, error in errors.items():
+        worker.log.warning("worker %s warm-up phase %s failed: %s", worker.pid, name, error)
+
+
+def pre_request(worker, req):
+    req.started_at = time.perf_counter()
+    req.rss_before_kb = current_rss_kb()
+
+
+def post_request(worker, req, environ, resp):
+    started_at = getattr(req, "started_at", None)
+    if started_at is None:
+        return
+
+    duration_ms = (time.perf_counter() - started_at) * 1000
+    rss_kb = current_rss_kb()
+    rss_delta_kb = rss_kb - req.rss_before_kb
+
+    # With more than one thread per worker the delta also includes whatever the other
+    # thread allocated meanwhile, so I treat it as a per-worker signal rather than exact per-request cost.
+    log = worker.log.warning if duration_ms >= slow_request_ms else worker.log.info
+    log(
+        "request worker=%s method=%s path=%s status=%s duration=%.1fms rss=%dKB rss_delta=%+dKB",
+        worker.pid, req.method, req.path, resp.status_code,
+        duration_ms, rss_kb, rss_delta_kb,
+    )
+
+    if max_worker_rss_mb and rss_kb > max_worker_rss_mb * 1024 and worker.alive:
+        # Setting alive to False lets the worker finish in-flight requests and exit
+        # cleanly; the arbiter then forks a fresh one in its place.
+        worker.log.warning(
+            "worker %s rss %dMB is over the %dMB watermark, recycling",
+            worker.pid, rss_kb // 1024, max_worker_rss_mb,
+        )
+        worker.alive = False
+
+
+# (Probe Buffer)
+# Probe readings waiting in this worker's buffer are written before it exits (recycled,
+# restarted or shut down), so a deploy doesn't lose the last second of readings.
+def worker_exit(server, worker):
+    from accounts.probes import reading_buffer
+
+    written = reading_buffer.flush()
+    if written or len(reading_buffer):
+        worker.log.info("worker %s wrote %s buffered probe readings, %s left", worker.pid, written, len(reading_buffer))
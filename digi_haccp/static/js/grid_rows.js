@@ -0,0 +1,13 @@
+/* (Columnar Rows)
+   Grid JSON from Django sends the row field names once ("fields") and every row as a
+   list of values in that order ("rows"), see grid.py. AG Grid wants one object per row,
+   so I zip each list back up with the names. */
+function gridRows(fields, rows) {
+    return (rows || []).map((row) => {
+        const data = {};
+        row.forEach((value, index) => {
+            data[fields[index]] = value;
+        });
+        return data;
+    });
+}